@@ -45,6 +45,16 @@ class DataFetchingTaskModel(BaseModel):
     Optional additional parameters for the task.
     """
 
+    priority: int
+    """
+    Tasks with higher priority are started first and fetch data before tasks with lower priority.
+    """
+
+    deadline: datetime | None
+    """
+    Optional time (in UTC) by which the task should be done. Among tasks with the same priority, tasks with nearer deadlines are preferred.
+    """
+
     created_at: datetime
     updated_at: datetime
 
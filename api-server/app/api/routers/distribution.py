@@ -0,0 +1,60 @@
+from fastapi import APIRouter, HTTPException, Response
+
+from app.api.dependencies.core import DBSessionDep
+from app.db.models import DataFetchingTask as DBTask
+from app.tasks.distribution import (
+    InputChunkLeaseModel,
+    InputChunkLeaseRequest,
+    InputChunkReport,
+    InputChunkReportResult,
+    lease_input_chunk,
+    release_input_chunk,
+    report_input_chunk_outcomes,
+)
+
+router = APIRouter(prefix="/distribution")
+"""
+Endpoints used by worker nodes to lease inputs of the tasks of this (coordinator) node and report their outcomes (see `task_distribution_mode` setting).
+"""
+
+
+@router.post(
+    "/leases",
+    response_model=InputChunkLeaseModel,
+    responses={204: {"description": "No inputs left to lease"}},
+)
+async def lease_inputs(payload: InputChunkLeaseRequest, session: DBSessionDep):
+    """
+    Lease a chunk of input items of the most urgent pending or running task.
+    """
+    lease = await lease_input_chunk(session, payload.holder, payload.size)
+    if lease is None:
+        return Response(status_code=204)
+    return lease
+
+
+@router.post(
+    "/tasks/{task_id}/leases/{lease_id}/outcomes",
+    response_model=InputChunkReportResult,
+)
+async def report_outcomes(
+    task_id: int, lease_id: str, payload: InputChunkReport, session: DBSessionDep
+) -> InputChunkReportResult:
+    """
+    Record the outcomes of leased input items and renew the lease (unless `renew` is false).
+    """
+    db_task = await session.get(DBTask, task_id)
+    if not db_task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return await report_input_chunk_outcomes(db_task, session, lease_id, payload)
+
+
+@router.delete("/tasks/{task_id}/leases/{lease_id}", status_code=204)
+async def release_lease(task_id: int, lease_id: str, session: DBSessionDep):
+    """
+    Release a lease, so that its input items that have no outcome yet can be leased again right away.
+    """
+    db_task = await session.get(DBTask, task_id)
+    if not db_task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    release_input_chunk(db_task, lease_id)
@@ -1,6 +1,8 @@
 import asyncio
 import os
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+from typing import Annotated
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from fastapi_pagination import Page
@@ -16,9 +18,13 @@ from app.api.models import DataFetchingTaskModel, S3FileUploadModel
 from app.tasks import create_new_task, get_task_processor, run_in_background
 from app.tasks.input_validation import InvalidTaskInputsError, parse_task_inputs
 from app.tasks.models import TaskExecutionMetaModel, TaskInputs
-from app.config import TASK_LOG_DIR, TASK_PROGRESS_DB_DIR, app_logger
-from app.tasks.progress import TaskProgressTracker
-from app.tasks.progress.public_models import TaskProgressModel
+from app.config import TASK_LOG_DIR, TASK_PROGRESS_DB_DIR, app_logger, settings
+from app.tasks.progress import progress_registry
+from app.tasks.progress.public_models import (
+    TaskOutputUploadModel,
+    TaskProgressModel,
+    TaskProgressWithIdModel,
+)
 from app.tasks.queue_item_management import (
     QueueItemRetrievalResult,
     QueueType,
@@ -36,15 +42,6 @@ def create_task_queue_item_manager(task_id: int) -> TaskQueueItemManager:
     return TaskQueueItemManager(task_id=task_id, db_dir=TASK_PROGRESS_DB_DIR)
 
 
-def create_task_progress_tracker(task_id: int) -> TaskProgressTracker:
-    """
-    Create a TaskProgressTracker instance with the proper database path, inferred from settings.
-    """
-    return TaskProgressTracker(
-        task_progress_db_dir=TASK_PROGRESS_DB_DIR, task_id=task_id
-    )
-
-
 def add_task_inputs_in_background(task_id: int, inputs: TaskInputs):
     q_mgr = create_task_queue_item_manager(task_id)
     loop = asyncio.get_running_loop()
@@ -64,6 +61,8 @@ async def convert_to_public_model(db_task: DBTask) -> DataFetchingTaskModel:
         ],
         task_type=db_task.task_type,
         params=db_task.params,
+        priority=db_task.priority,
+        deadline=db_task.deadline,
         created_at=db_task.created_at,
         updated_at=db_task.updated_at,
     )
@@ -99,6 +98,27 @@ async def get_tasks(session: DBSessionDep) -> Page[DataFetchingTaskModel]:
     return await paginate(session, query)
 
 
+@router.get("/progress", response_model=list[TaskProgressWithIdModel])
+async def get_progress_of_tasks(
+    session: DBSessionDep,
+    ids: Annotated[list[int] | None, Query()] = None,
+) -> list[TaskProgressWithIdModel]:
+    """
+    Get the progress of several tasks at once.
+
+    Args:
+        session (DBSessionDep): The database session dependency.
+        ids (list[int], optional): The IDs of the tasks (e.g. `?ids=1&ids=2`). IDs of tasks that do not exist are ignored. If not provided, the progress of all tasks that are not done yet is returned.
+    """
+    query = select(DBTask.id).order_by(DBTask.id)
+    if ids is not None:
+        query = query.where(DBTask.id.in_(ids))
+    else:
+        query = query.where(DBTask.status != "done")
+    task_ids = (await session.scalars(query)).all()
+    return await progress_registry.get_progress_of_tasks(task_ids)
+
+
 @router.get("/{task_id}", response_model=DataFetchingTaskModel)
 async def get_task(task_id: int, session: DBSessionDep) -> DataFetchingTaskModel:
     db_task = await session.scalar(
@@ -130,6 +150,11 @@ async def pause_task(task_id: int, session: DBSessionDep) -> DataFetchingTaskMod
             raise HTTPException(status_code=400, detail="Task is already pausing")
         if db_task.status == "paused":
             raise HTTPException(status_code=400, detail="Task is already paused")
+        if settings.task_distribution_mode == "coordinator":
+            # no inputs are leased to worker nodes while the task is paused (leased inputs are still processed)
+            db_task.status = "paused"
+            await session.commit()
+            return await convert_to_public_model(db_task)
         db_task.status = "pausing"
         await session.commit()
         processor = get_task_processor(db_task)
@@ -163,9 +188,12 @@ async def execute_task(
             raise HTTPException(status_code=400, detail="Task is already running")
         db_task.status = "pending"
         await session.commit()
+        if settings.task_distribution_mode == "coordinator":
+            # inputs are leased to worker nodes from now on
+            return await convert_to_public_model(db_task)
         processor = get_task_processor(db_task)
         app_logger.info(f"Resuming processor for task ID {task_id}...")
-        run_in_background(processor, background_tasks)
+        run_in_background(processor, db_task, background_tasks)
         return await convert_to_public_model(db_task)
     else:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -180,9 +208,45 @@ async def get_task_progress(task_id: int, session: DBSessionDep) -> TaskProgress
     )
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    progress_tracker = create_task_progress_tracker(task_id)
-    progress = await progress_tracker.get_progress()
-    return progress
+    return await progress_registry.get_progress(task_id)
+
+
+@router.get("/{task_id}/progress/stream")
+async def stream_task_progress(
+    task_id: int,
+    session: DBSessionDep,
+    interval_ms: Annotated[int | None, Query(ge=100)] = None,
+) -> StreamingResponse:
+    """
+    Stream the progress of a task as server-sent events.
+
+    `progress` events contain a snapshot of the task's progress (including throughput information while the task is processed). They are sent at most once per `interval_ms` (defaults to the `task_progress_stream_interval_ms` setting), and only if the progress changed.
+    `upload` events are sent for every output file of the task that is uploaded to S3.
+    """
+    task = await session.get(DBTask, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    # the session is not needed while streaming
+    await session.close()
+
+    interval_seconds = (
+        interval_ms or settings.task_progress_stream_interval_ms
+    ) / 1000
+
+    async def events():
+        async for event in progress_registry.stream_progress(
+            task_id, interval_seconds
+        ):
+            event_type = (
+                "upload" if isinstance(event, TaskOutputUploadModel) else "progress"
+            )
+            yield f"event: {event_type}\ndata: {event.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @router.get("/{task_id}/logs")
@@ -1,15 +1,37 @@
-from app.config import settings, setup_logger
+import os
+from app.config import DB_DIR, settings, setup_logger
 from app.utils.spotify_api import (
     SpotifyAPIClient,
 )
+from app.utils.spotify_api.request_meta import RequestMetaReporter
 from app.utils.dummy_api import DummyAPIClient
+from app.utils.http import HTTPSessionManager
 from app.utils.spotify_internal import SpotifyInternalAPIClient
 
 sp_api_logger = setup_logger("spotify-api", file_dir=settings.api_client_log_dir)
 
+sp_api_http_session_manager = HTTPSessionManager(
+    max_connections=settings.spotify_api_max_connections,
+    max_connections_per_host=settings.spotify_api_max_connections_per_host,
+    dns_cache_ttl_seconds=settings.spotify_api_dns_cache_ttl_seconds,
+    keepalive_timeout_seconds=settings.spotify_api_keepalive_timeout_seconds,
+)
+
 spotify_api_client = SpotifyAPIClient(
     credentials_api_url=settings.credentials_api_url,
     logger=sp_api_logger,
+    http_session_manager=sp_api_http_session_manager,
+    credential_pool_size=settings.spotify_api_credential_pool_size,
+    max_concurrent_pages=settings.spotify_api_max_concurrent_pages,
+    request_meta_reporter=RequestMetaReporter(
+        credentials_api_url=settings.credentials_api_url,
+        http_session_manager=sp_api_http_session_manager,
+        spool_path=os.path.join(DB_DIR, "spotify_request_meta_spool.db"),
+        batch_size=settings.spotify_request_meta_batch_size,
+        max_buffered=settings.spotify_request_meta_max_buffered,
+        flush_interval_seconds=settings.spotify_request_meta_flush_interval_ms / 1000,
+        logger=sp_api_logger,
+    ),
 )
 
 spotify_internal_logger = setup_logger(
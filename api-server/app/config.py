@@ -8,6 +8,7 @@ from pydantic_settings import (
 )
 
 from app.utils.misc import get_public_ip
+from app.utils.rate_limiting import RateLimit
 
 file_dir = Path(__file__).parent
 
@@ -74,7 +75,7 @@ class Settings(BaseSettings):
     task_output_dir: str = f"{file_dir.parent.resolve()}/data/task_outputs"
     """
     The directory where the output files for tasks are stored. During processing, each task will have its own JSONL file named after the task ID.
-    The JSONL files are compressed using zstd and uploaded to S3 once they reach a certain size or when all inputs have been processed.
+    The JSONL files are compressed using zstd while they are written and uploaded to S3 once enough output has been written to them or when all inputs have been processed.
 
     If `replica_id` is set, data will be stored in a subdirectory with the same name as the value of `replica_id`.
     """
@@ -88,6 +89,128 @@ class Settings(BaseSettings):
     If `replica_id` is set, data will be stored in a subdirectory with the same name as the value of `replica_id`.
     """
 
+    task_progress_max_open_dbs: int = 64
+    """
+    The maximum number of task progress databases the API keeps open for serving the progress of tasks that are not being processed (the least recently used ones are closed first).
+    """
+
+    task_progress_stream_interval_ms: int = 1000
+    """
+    The default interval (in milliseconds) at which the task progress stream (`/tasks/{task_id}/progress/stream`) sends updates. Changes within an interval are coalesced into a single update.
+    """
+
+    task_fetch_concurrency: dict[str, int] = {}
+    """
+    The number of fetches (of input items or batches) a task processor has in flight at the same time, by `{data_source}/{task_type}` (e.g. `{"spotify-api/tracks": 2}`). Task types not listed here use the default of their fetch function (see `create_fetch_fn`).
+
+    Fetches are still limited by `task_scheduler_max_concurrent_fetches` across all tasks of a data source.
+    """
+
+    task_commit_group_size: int = 500
+    """
+    The number of processed input items whose outcomes a task processor records in its task progress database at once (in a single transaction).
+
+    Outputs are always written to the output file first; if the server crashes before the outcomes of a group are recorded, they are recovered from a journal file next to the output file on restart.
+    """
+
+    task_commit_group_interval_ms: int = 1000
+    """
+    The maximum time (in milliseconds) a task processor waits for `task_commit_group_size` items to be processed before recording the outcomes collected so far anyway.
+    """
+
+    task_output_upload_concurrency: int = 2
+    """
+    The maximum number of output files uploaded to S3 at the same time (across all tasks). Output files are uploaded in the background, so task processors do not have to wait for uploads.
+    """
+
+    task_output_upload_max_retry_delay_seconds: float = 300
+    """
+    The maximum time (in seconds) to wait before retrying a failed output file upload. The delay doubles with every failed attempt until it reaches this value.
+    """
+
+    task_output_upload_max_attempts: int = 10
+    """
+    The number of failed attempts after which an output file upload is given up on, which makes the task the file belongs to fail. The file is kept and its upload is retried after the next restart.
+    """
+
+    task_scheduler_max_running_tasks: int = 4
+    """
+    The maximum number of tasks that are processed at the same time on this node. Tasks that are started while this many tasks are running stay 'pending' until one of them finishes or is paused.
+    """
+
+    task_scheduler_max_concurrent_fetches: dict[str, int] = {"spotify-api": 8}
+    """
+    The maximum number of fetches (of input items or batches) that are in flight at the same time across all running tasks of a data source (data sources not listed here are not limited).
+
+    While tasks of the same data source compete for these slots, each of them gets a share proportional to its weight (see `task_scheduler_task_weights`); slots not needed by one task are used by the others.
+    """
+
+    task_scheduler_task_weights: dict[str, float] = {}
+    """
+    The weights of tasks by `{data_source}/{task_type}` (e.g. `{"spotify-api/tracks": 2}`), which determine their share of the fetch budget of their data source and the order in which pending tasks are started. Defaults to 1.
+    """
+
+    task_worker_processes: int = 0
+    """
+    The number of worker processes task processors are run in (so that CPU-heavy work like serializing, compressing and validating outputs uses all cores of the node). With 0, tasks are processed in the API process.
+
+    Spotify API requests of the worker processes are made by the API process, so rate limits and API credentials are shared by all processes.
+    """
+
+    task_worker_progress_interval_ms: int = 500
+    """
+    The interval (in milliseconds) in which worker processes report the progress of the tasks they are processing to the API process.
+    """
+
+    task_distribution_mode: Literal["standalone", "coordinator", "worker"] = (
+        "standalone"
+    )
+    """
+    How the inputs of tasks are distributed across nodes:
+    - `standalone`: each node processes the inputs of its own tasks
+    - `coordinator`: tasks created on this node are not processed locally; instead, chunks of their inputs are leased to worker nodes, which report the outcomes back (see `/distribution` endpoints)
+    - `worker`: this node leases chunks of inputs from the coordinator at `task_distribution_coordinator_url` and processes them in local tasks (in addition to its own tasks)
+
+    To try this locally, run several instances of the API server with different `replica_id`s (and ports), one of them as coordinator.
+    """
+
+    task_distribution_coordinator_url: str | None = None
+    """
+    The base URL of the coordinator node (e.g. `http://localhost:8000`). Required if `task_distribution_mode` is `worker`.
+    """
+
+    task_distribution_chunk_size: int = 500
+    """
+    The number of input items a worker node leases from the coordinator at once. Worker nodes lease the next chunk once fewer than this many leased items are left to be processed.
+    """
+
+    task_distribution_lease_seconds: float = 300
+    """
+    For how long (in seconds) a chunk of input items is leased to a worker node. Worker nodes renew their leases whenever they report outcomes; items of leases that expire are handed out to other worker nodes.
+    """
+
+    task_distribution_report_interval_seconds: float = 10
+    """
+    The interval (in seconds) in which worker nodes report the outcomes of leased input items to the coordinator (and check whether they should lease more).
+    """
+
+    work_stealing_enabled: bool = False
+    """
+    Whether replicas on the same host share their work: each replica publishes its running tasks on the work stealing board (`work_stealing_board_path`), and replicas without tasks of their own lease chunks of input items from the tail of the input queues of those tasks (see `app.tasks.stealing`).
+
+    Requires `replica_id` to be set. Chunk size, lease duration and report interval are configured via the `task_distribution_*` settings.
+    """
+
+    work_stealing_board_path: str = f"{file_dir.parent.resolve()}/data/work_stealing.db"
+    """
+    The path of the SQLite DB shared by all replicas on the host for work stealing. Unlike the other paths, it is NOT suffixed with `replica_id`; replicas must be able to read each other's task progress DBs as well.
+    """
+
+    work_stealing_heartbeat_timeout_seconds: float = 60
+    """
+    Tasks of replicas that have not updated the work stealing board for longer than this (e.g. because they crashed) are not stolen from.
+    """
+
     s3_endpoint_url: str
     """
     The endpoint URL for the S3-compatible storage service where the output data of the tasks is stored.
@@ -108,6 +231,16 @@ class Settings(BaseSettings):
     The secret access key for the S3 bucket where the output data of the tasks is stored.
     """
 
+    s3_upload_part_size_bytes: int = 16 * 1024 * 1024
+    """
+    The size of the parts that files larger than this are uploaded to S3 in (at least 5 MiB). Parts that were uploaded completely do not have to be uploaded again if an upload is interrupted.
+    """
+
+    s3_upload_max_concurrent_parts: int = 4
+    """
+    The maximum number of parts of a single file that are uploaded to S3 at the same time. Each part that is being uploaded is held in memory.
+    """
+
     credentials_api_url: str
     """
     The URL of the API that provides credentials for API clients used throughout the application.
@@ -115,6 +248,97 @@ class Settings(BaseSettings):
     At the time of this writing, this only includes client ID + secret for the Spotify API client.
     """
 
+    spotify_api_max_connections: int = 100
+    """
+    The maximum number of connections the Spotify API client keeps open at the same time (to the Spotify API and the credentials API combined).
+    Connections are kept alive and reused across requests.
+    """
+
+    spotify_api_max_connections_per_host: int = 20
+    """
+    The maximum number of connections the Spotify API client keeps open to a single host at the same time.
+    """
+
+    spotify_api_dns_cache_ttl_seconds: int = 300
+    """
+    For how long (in seconds) the Spotify API client caches the IP addresses of the hosts it sends requests to.
+    """
+
+    spotify_api_keepalive_timeout_seconds: float = 30
+    """
+    For how long (in seconds) the Spotify API client keeps idle connections open so that they can be reused by subsequent requests.
+    """
+
+    spotify_api_credential_pool_size: int = 3
+    """
+    The number of sets of Spotify API credentials the Spotify API client fetches from the credentials API and uses at the same time.
+    Each set has its own rate budget, so the client can make (up to) this many times more requests than with a single set of credentials.
+    """
+
+    spotify_api_max_concurrent_pages: int = 8
+    """
+    The maximum number of pages of a paginated Spotify API response (e.g. the tracks of a playlist) the Spotify API client fetches at the same time.
+    Once the first page (and therefore the total number of items) is known, the remaining pages are requested concurrently (within the rate limits).
+    """
+
+    spotify_api_default_rate_limit: RateLimit = RateLimit(requests_per_minute=12)
+    """
+    The rate limit for requests to Spotify API endpoints that are not listed in `spotify_api_endpoint_rate_limits`. Limits apply per endpoint and set of credentials.
+    """
+
+    spotify_api_endpoint_rate_limits: dict[str, RateLimit] = {
+        "search": RateLimit(requests_per_minute=4),
+        "playlists": RateLimit(requests_per_minute=4),
+    }
+    """
+    Rate limits for requests to specific Spotify API endpoints (per set of credentials), keyed by endpoint name: the endpoint path without Spotify IDs, with "/" replaced by "." (e.g. `artists.albums` for `/artists/{id}/albums`).
+
+    Values here have been chosen based on experience with the respective API endpoints.
+    If `spotify_api_adaptive_rate_limits` is enabled, they are only used as the initial rates.
+    """
+
+    spotify_api_adaptive_rate_limits: bool = True
+    """
+    Whether the Spotify API client adapts the rate limit of each endpoint to the rate the API accepts: while requests succeed, the rate increases by `spotify_api_rate_increase_per_minute` requests per minute every minute; whenever a request is rejected with a 429 response, it is multiplied by `spotify_api_rate_decrease_factor`.
+
+    Learned rates are stored next to the database file and used after a restart.
+    """
+
+    spotify_api_min_requests_per_minute: float = 1
+    """
+    The lowest rate (per endpoint and set of credentials) adaptive rate limiting may decrease the rate of an endpoint to.
+    """
+
+    spotify_api_max_requests_per_minute: float = 60
+    """
+    The highest rate (per endpoint and set of credentials) adaptive rate limiting may increase the rate of an endpoint to.
+    """
+
+    spotify_api_rate_increase_per_minute: float = 1
+    """
+    By how many requests per minute adaptive rate limiting increases the rate of an endpoint for every minute its requests succeed.
+    """
+
+    spotify_api_rate_decrease_factor: float = 0.5
+    """
+    The factor adaptive rate limiting multiplies the rate of an endpoint with whenever a request is rejected with a 429 response.
+    """
+
+    spotify_request_meta_batch_size: int = 100
+    """
+    The maximum number of request meta items (metadata of requests to the Spotify API) the Spotify API client reports to the credentials API at once.
+    """
+
+    spotify_request_meta_max_buffered: int = 1000
+    """
+    The maximum number of request meta items the Spotify API client keeps in memory until they are reported. Any further items (as well as the metadata of all requests that did not succeed) are stored on disk until they are reported.
+    """
+
+    spotify_request_meta_flush_interval_ms: int = 1000
+    """
+    The maximum time (in milliseconds) the Spotify API client waits for `spotify_request_meta_batch_size` request meta items before reporting the items collected so far anyway.
+    """
+
 
 settings = Settings()  # type: ignore
 
@@ -101,6 +101,16 @@ class DataFetchingTask(Base):
     Optional additional parameters for the task.
     """
 
+    priority: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    """
+    Tasks with higher priority are started first and fetch data before tasks with lower priority (see `TaskScheduler`).
+    """
+
+    deadline: Mapped[datetime | None] = mapped_column(DateTime, default=None)
+    """
+    Optional time (in UTC) by which the task should be done. Among tasks with the same priority, tasks with nearer deadlines are preferred.
+    """
+
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=func.current_timestamp()
     )
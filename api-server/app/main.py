@@ -8,9 +8,17 @@ from fastapi_pagination import add_pagination
 from app.api.dependencies.core import DBSessionDep
 from app.api.routers.tasks import NewTaskPayload, create_task, router as tasks_router
 from app.api.routers.about import router as about_router
+from app.api.routers.distribution import router as distribution_router
+from app.api_clients import spotify_api_client
 from app.config import PUBLIC_IP, settings, app_logger
 from app.db.models import DataSource
 from app.tasks import correct_stuck_tasks_state_to_pending, resume_pending_tasks
+from app.tasks.distribution import input_chunk_worker
+from app.tasks.progress import progress_registry
+from app.tasks.stealing import work_stealer
+from app.tasks.uploads import output_uploader
+from app.tasks.workers import task_worker_pool
+from app.utils.s3 import s3_client_manager
 from app.db import sessionmanager
 
 
@@ -21,10 +29,30 @@ async def lifespan(app: FastAPI):
     To understand more, read https://fastapi.tiangolo.com/advanced/events/
     """
     app_logger.info(f"Running on public IP {PUBLIC_IP}")
+    # pending uploads must be loaded before task processors hand off new ones
+    output_uploader.start()
+    await spotify_api_client.start()
+    if task_worker_pool is not None:
+        task_worker_pool.start()
     async with sessionmanager.session() as session:
         await correct_stuck_tasks_state_to_pending(session)
         await resume_pending_tasks(session)
+    if input_chunk_worker is not None:
+        input_chunk_worker.start()
+    if work_stealer is not None:
+        work_stealer.start()
     yield
+    if work_stealer is not None:
+        await work_stealer.close()
+    if input_chunk_worker is not None:
+        await input_chunk_worker.close()
+    if task_worker_pool is not None:
+        # output files handed off by the workers before they stop must still be picked up by the uploader
+        await task_worker_pool.close()
+    await output_uploader.close()
+    await spotify_api_client.close()
+    await s3_client_manager.close()
+    progress_registry.close()
     if sessionmanager._engine is not None:
         # Close the DB connection
         await sessionmanager.close()
@@ -75,6 +103,8 @@ async def legacy_create_task(
 # Routers
 app.include_router(tasks_router)
 app.include_router(about_router)
+if settings.task_distribution_mode == "coordinator":
+    app.include_router(distribution_router)
 
 
 if __name__ == "__main__":
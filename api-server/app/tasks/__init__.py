@@ -1,14 +1,21 @@
 import asyncio
+import logging
+from datetime import timezone
 from fastapi import BackgroundTasks
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession as AsyncDBSession
 
 from app.db.models import DataFetchingTask
-from app.tasks.data_fetching import SingleItemFetchFunctionResult, create_fetch_fn
+from app.tasks.common import (
+    SingleItemFetchFunctionResult,
+    StreamingFetchFunctionResult,
+)
+from app.tasks.data_fetching import create_fetch_fn
 from app.tasks.models import TaskExecutionMeta, TaskExecutionMetaModel, TaskInputs
 from app.tasks.processing import (
     BatchTaskProcessor,
     SequentialTaskProcessor,
+    StreamingTaskProcessor,
     TaskProcessor,
 )
 from app.config import (
@@ -17,27 +24,48 @@ from app.config import (
     TASK_OUTPUT_DIR,
     TASK_PROGRESS_DB_DIR,
     app_logger,
+    settings,
     setup_logger,
 )
 from app.tasks.queue_item_management import TaskQueueItemManager
+from app.tasks.scheduling import (
+    TaskSchedulingParams,
+    get_scheduling_params,
+    task_scheduler,
+)
+from app.tasks.uploads import OutputUploader, output_uploader
+from app.tasks.workers import RemoteTaskProcessor, task_worker_pool
 
 
-task_processors: dict[int, TaskProcessor] = {}
-
-
-async def run_task(task_processor: TaskProcessor):
-    await task_processor.run()
-    del task_processors[task_processor.task_id]
+task_processors: dict[int, TaskProcessor | RemoteTaskProcessor] = {}
 
 
-def run_in_background(task_processor: TaskProcessor, background_tasks: BackgroundTasks):
+async def run_task(
+    task_processor: TaskProcessor | RemoteTaskProcessor, params: TaskSchedulingParams
+):
+    """
+    Runs the given task processor once the task scheduler admits it (see `TaskScheduler`), and closes it afterwards (even if it failed).
+    """
+    try:
+        await task_scheduler.run(task_processor, params)
+    finally:
+        task_processor.close()
+        if task_processors.get(task_processor.task_id) is task_processor:
+            del task_processors[task_processor.task_id]
+
+
+def run_in_background(
+    task_processor: TaskProcessor | RemoteTaskProcessor,
+    db_task: DataFetchingTask,
+    background_tasks: BackgroundTasks,
+):
     """
     Run the given task processor in the background using the provided FastAPI background tasks manager.
     """
     task_id = task_processor.task_id
     task_processors[task_id] = task_processor
 
-    background_tasks.add_task(run_task, task_processor)
+    background_tasks.add_task(run_task, task_processor, get_scheduling_params(db_task))
 
 
 async def correct_stuck_tasks_state_to_pending(db_session: AsyncDBSession):
@@ -75,11 +103,21 @@ async def resume_pending_tasks(db_session: AsyncDBSession):
 
     Should be called on server restart (after correcting the state of stuck tasks).
     """
+    if settings.task_distribution_mode == "coordinator":
+        # inputs of pending tasks are leased to worker nodes instead (see `lease_input_chunk`)
+        return
     app_logger.info("Checking for pending tasks...")
     tasks = (
         (
             await db_session.execute(
                 select(DataFetchingTask).where(DataFetchingTask.status == "pending")
+                # the scheduler admits waiting tasks by priority and deadline anyway, this makes the log easier to follow
+                .order_by(
+                    DataFetchingTask.priority.desc(),
+                    DataFetchingTask.deadline.is_(None),
+                    DataFetchingTask.deadline,
+                    DataFetchingTask.id,
+                )
             )
         )
         .scalars()
@@ -93,15 +131,28 @@ async def resume_pending_tasks(db_session: AsyncDBSession):
         processor = task_processors.get(task.id) or _create_and_add_processor(task)
         task_processors[task.id] = processor
         app_logger.info(f"Resuming task with ID {task.id}...")
-        asyncio.create_task(run_task(processor))
+        asyncio.create_task(run_task(processor, get_scheduling_params(task)))
+
 
+def _get_task_logger(task_id: int) -> logging.Logger:
+    logger = logging.getLogger(f"{task_id}")
+    if logger.handlers:
+        # a processor was created for the task before (e.g. before it was paused)
+        return logger
+    return setup_logger(f"{task_id}", file_dir=TASK_LOG_DIR, log_to_console=False)
 
-def _create_processor(db_task: DataFetchingTask) -> TaskProcessor:
+
+def _create_processor(
+    db_task: DataFetchingTask, output_uploader: OutputUploader = output_uploader
+) -> TaskProcessor:
     # task DB model stores data_source and task_type in separate fields/columns, but internal logic expects them to be part of params (makes validation logic easier)
     runtime_task = TaskExecutionMetaModel.model_validate(db_task.__dict__).root
     q_mgr = TaskQueueItemManager(task_id=db_task.id, db_dir=TASK_PROGRESS_DB_DIR)
-    logger = setup_logger(f"{db_task.id}", file_dir=TASK_LOG_DIR, log_to_console=False)
+    logger = _get_task_logger(db_task.id)
     fn_res = create_fetch_fn(runtime_task)
+    concurrency = settings.task_fetch_concurrency.get(
+        f"{db_task.data_source}/{db_task.task_type}", fn_res.concurrency
+    )
     if isinstance(fn_res, SingleItemFetchFunctionResult):
         return SequentialTaskProcessor(
             server_ip=PUBLIC_IP,
@@ -109,8 +160,26 @@ def _create_processor(db_task: DataFetchingTask) -> TaskProcessor:
             outputs_s3_prefix=runtime_task.get_s3_prefix(),
             outputs_local_storage_dir=TASK_OUTPUT_DIR,
             fetch_fn=fn_res.fn,
+            concurrency=concurrency,
             queue_item_manager=q_mgr,
+            output_uploader=output_uploader,
             logger=logger,
+            commit_group_size=settings.task_commit_group_size,
+            commit_group_interval_ms=settings.task_commit_group_interval_ms,
+        )
+    elif isinstance(fn_res, StreamingFetchFunctionResult):
+        return StreamingTaskProcessor(
+            server_ip=PUBLIC_IP,
+            task_id=db_task.id,
+            outputs_s3_prefix=runtime_task.get_s3_prefix(),
+            outputs_local_storage_dir=TASK_OUTPUT_DIR,
+            fetch_fn=fn_res.fn,
+            concurrency=concurrency,
+            queue_item_manager=q_mgr,
+            output_uploader=output_uploader,
+            logger=logger,
+            commit_group_size=settings.task_commit_group_size,
+            commit_group_interval_ms=settings.task_commit_group_interval_ms,
         )
     else:
         # fn_res.fn is a function that supports batch processing, fn_res.batch_size stores maximum supported batch size
@@ -121,20 +190,32 @@ def _create_processor(db_task: DataFetchingTask) -> TaskProcessor:
             outputs_local_storage_dir=TASK_OUTPUT_DIR,
             fetch_fn=fn_res.fn,
             queue_item_manager=q_mgr,
+            output_uploader=output_uploader,
             logger=logger,
             batch_size=fn_res.batch_size,
+            concurrency=concurrency,
+            commit_group_size=settings.task_commit_group_size,
+            commit_group_interval_ms=settings.task_commit_group_interval_ms,
         )
 
 
-def _create_and_add_processor(task: DataFetchingTask) -> TaskProcessor:
-    processor = _create_processor(task)
+def _create_and_add_processor(
+    task: DataFetchingTask,
+) -> TaskProcessor | RemoteTaskProcessor:
+    if task_worker_pool is not None:
+        # the actual task processor is created in the worker process the task is processed in
+        processor = RemoteTaskProcessor(task.id, task_worker_pool)
+    else:
+        processor = _create_processor(task)
     app_logger.info(f"Created processor for task ID {task.id}")
     task_processors[task.id] = processor
     app_logger.info(f"Added processor for task ID {task.id} to task processors")
     return processor
 
 
-def get_task_processor(task: DataFetchingTask) -> TaskProcessor:
+def get_task_processor(
+    task: DataFetchingTask,
+) -> TaskProcessor | RemoteTaskProcessor:
     return task_processors.get(task.id) or _create_and_add_processor(task)
 
 
@@ -153,6 +234,12 @@ async def create_new_task(
             if task.params
             else None
         ),
+        priority=task.priority,
+        deadline=(
+            task.deadline.astimezone(timezone.utc).replace(tzinfo=None)
+            if task.deadline is not None and task.deadline.tzinfo is not None
+            else task.deadline
+        ),
         # make task paused initially - user still has to start it
         # ('pending' state would cause it to be started and 'done' immediately in the case of a server restart if no inputs were added in the meantime)
         status="paused",
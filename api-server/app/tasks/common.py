@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Any, Awaitable, Callable, Sequence, TypedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Sequence, TypedDict
 
 
 type JSONValue = str | int | float | bool | None | list[JSONValue] | dict[
@@ -26,6 +26,11 @@ type BatchFetchFunction[T] = Callable[[Sequence[T]], Awaitable[Sequence[Any]]]
 A function that accepts a sequence of task inputs as its only parameter and returns an Awaitable (usually coroutine) which, when awaited, returns a sequence of results (should be one for each input).
 """
 
+type StreamingFetchFunction[T] = Callable[[T], AsyncIterator[Sequence[Any]]]
+"""
+A function that accepts a task input as its only parameter and returns an async iterator which yields the fetched records for this input page by page (e.g. the tracks of a playlist), as they arrive.
+"""
+
 
 @dataclass
 class SingleItemFetchFunctionResult[T]:
@@ -34,6 +39,10 @@ class SingleItemFetchFunctionResult[T]:
     """
 
     fn: SingleItemFetchFunction[T]
+    concurrency: int = 1
+    """
+    The maximum number of inputs that may be fetched concurrently.
+    """
 
 
 @dataclass
@@ -44,6 +53,23 @@ class BatchFetchFunctionResult[T]:
 
     fn: BatchFetchFunction[T]
     batch_size: int
+    concurrency: int = 1
+    """
+    The maximum number of batches that may be fetched concurrently.
+    """
+
+
+@dataclass
+class StreamingFetchFunctionResult[T]:
+    """
+    A wrapper for a streaming fetch function. Required because in Python, we cannot determine the exact type of a function (most importantly, the type of it's arguments) at runtime.
+    """
+
+    fn: StreamingFetchFunction[T]
+    concurrency: int = 1
+    """
+    The maximum number of inputs that may be fetched concurrently.
+    """
 
 
 class NonFatalProcessingError(Exception):
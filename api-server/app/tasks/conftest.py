@@ -0,0 +1,47 @@
+import os
+import tempfile
+import pytest
+import pytest_asyncio
+
+from app.db import DatabaseSessionManager
+from app.db.models import Base
+import app.tasks.distribution as distribution
+import app.tasks.stealing as stealing
+import app.tasks.workers as workers
+
+
+@pytest_asyncio.fixture
+async def db(monkeypatch):
+    """
+    A fresh app DB (and task progress DB directory) used by the distribution, stealing and workers modules instead of the configured ones.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        sessionmanager = DatabaseSessionManager(
+            f"sqlite+aiosqlite:///{os.path.join(tmp, 'app.db')}"
+        )
+        async with sessionmanager.connect() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        progress_db_dir = os.path.join(tmp, "progress")
+        os.makedirs(progress_db_dir)
+        for module in [distribution, stealing, workers]:
+            monkeypatch.setattr(module, "sessionmanager", sessionmanager)
+            monkeypatch.setattr(module, "TASK_PROGRESS_DB_DIR", progress_db_dir)
+        yield sessionmanager
+        # may have been closed already (e.g. by a worker process served in the test process)
+        if sessionmanager._engine is not None:
+            await sessionmanager.close()
+
+
+@pytest.fixture
+def started_local_task_ids(db, monkeypatch) -> list[int]:
+    """
+    The IDs of the local tasks started by an `InputChunkWorker` (which are not actually processed).
+    """
+    started: list[int] = []
+
+    async def run_task(task_id: int, params):
+        started.append(task_id)
+
+    monkeypatch.setattr(distribution, "get_task_processor", lambda db_task: db_task.id)
+    monkeypatch.setattr(distribution, "run_task", run_task)
+    return started
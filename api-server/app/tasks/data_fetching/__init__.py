@@ -1,4 +1,8 @@
-from app.tasks.common import BatchFetchFunctionResult, SingleItemFetchFunctionResult
+from app.tasks.common import (
+    BatchFetchFunctionResult,
+    SingleItemFetchFunctionResult,
+    StreamingFetchFunctionResult,
+)
 from app.tasks.models import TaskExecutionMeta
 from app.tasks.data_fetching.dummy_api import create_dummy_api_fetch_fn
 from app.tasks.data_fetching.spotify_api import create_spotify_api_fetch_fn
@@ -9,7 +13,11 @@ from app.tasks.data_fetching.spotify_internal import (
 
 def create_fetch_fn(
     task: TaskExecutionMeta,
-) -> SingleItemFetchFunctionResult | BatchFetchFunctionResult:
+) -> (
+    SingleItemFetchFunctionResult
+    | BatchFetchFunctionResult
+    | StreamingFetchFunctionResult
+):
     if task.data_source == "spotify-api":
         return create_spotify_api_fetch_fn(task)
     elif task.data_source == "spotify-internal":
@@ -19,6 +19,7 @@ def create_dummy_api_fetch_fn(task: DummyAPITask):
 
         return SingleItemFetchFunctionResult(
             fn=fetch_flaky,
+            concurrency=8,
         )
     elif task.task_type == "throw-above-threshold":
 
@@ -33,4 +34,5 @@ def create_dummy_api_fetch_fn(task: DummyAPITask):
 
         return SingleItemFetchFunctionResult(
             fn=fetch_throw_above_threshold,
+            concurrency=8,
         )
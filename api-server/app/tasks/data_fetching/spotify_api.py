@@ -1,4 +1,4 @@
-from typing import Any, Sequence
+from typing import Any, AsyncIterator, Sequence
 from app.api_clients import spotify_api_client
 from app.tasks.models.spotify_api import (
     SpotifyAPITask,
@@ -7,6 +7,7 @@ from app.tasks.common import (
     SingleItemFetchFunctionResult,
     BatchFetchFunctionResult,
     NonFatalProcessingError,
+    StreamingFetchFunctionResult,
 )
 from app.utils.spotify_api.client import NotFoundError
 
@@ -43,6 +44,25 @@ def create_spotify_api_fetch_fn(
                 ) from e
 
         return BatchFetchFunctionResult(fn=fetch_albums, batch_size=20)
+    elif task.task_type == "artist-albums" and task.params.stream_pages:
+
+        async def fetch_artist_album_pages(artist_id: str) -> AsyncIterator[Any]:
+            try:
+                async for page in spotify_api_client.artist_album_pages(
+                    artist_id,
+                    include_albums=task.params.release_types.albums,
+                    include_singles=task.params.release_types.singles,
+                    include_compilations=task.params.release_types.compilations,
+                    include_appears_on=task.params.release_types.appears_on,
+                    region=task.params.region,
+                ):
+                    yield page
+            except NotFoundError as e:
+                raise NonFatalProcessingError(
+                    f"No matching releases found for artist ID {artist_id} (region: {task.params.region}, release types: {task.params.release_types})"
+                ) from e
+
+        return StreamingFetchFunctionResult(fn=fetch_artist_album_pages, concurrency=4)
     elif task.task_type == "artist-albums":
 
         async def fetch_artist_albums(artist_id: str) -> Any:
@@ -60,8 +80,26 @@ def create_spotify_api_fetch_fn(
                     f"No matching releases found for artist ID {artist_id} (region: {task.params.region}, release types: {task.params.release_types})"
                 ) from e
 
-        return SingleItemFetchFunctionResult(fn=fetch_artist_albums)
+        return SingleItemFetchFunctionResult(fn=fetch_artist_albums, concurrency=4)
+
+    elif (
+        task.task_type == "playlists"
+        and task.params is not None
+        and task.params.stream_tracks
+    ):
+
+        async def fetch_playlist_track_pages(playlist_id: str) -> AsyncIterator[Any]:
+            try:
+                async for page in spotify_api_client.playlist_track_pages(playlist_id):
+                    yield page
+            except NotFoundError as e:
+                raise NonFatalProcessingError(
+                    f"No playlist found for ID {playlist_id}"
+                ) from e
 
+        return StreamingFetchFunctionResult(
+            fn=fetch_playlist_track_pages, concurrency=4
+        )
     elif task.task_type == "playlists":
 
         async def fetch_playlist(playlist_id: str) -> Any:
@@ -72,7 +110,7 @@ def create_spotify_api_fetch_fn(
                     f"No playlist found for ID {playlist_id}"
                 ) from e
 
-        return SingleItemFetchFunctionResult(fn=fetch_playlist)
+        return SingleItemFetchFunctionResult(fn=fetch_playlist, concurrency=4)
     elif task.task_type == "isrc-track-search":
 
         async def fetch_tracks_for_isrc(isrc: str) -> Any:
@@ -86,4 +124,4 @@ def create_spotify_api_fetch_fn(
                     f"No tracks found for ISRC {isrc} in region {task.params.region}"
                 ) from e
 
-        return SingleItemFetchFunctionResult(fn=fetch_tracks_for_isrc)
+        return SingleItemFetchFunctionResult(fn=fetch_tracks_for_isrc, concurrency=4)
@@ -0,0 +1,644 @@
+import asyncio
+from datetime import datetime, timezone
+import json
+from logging import Logger
+import sqlite3
+from typing import Callable, Literal, Protocol
+
+from aiohttp import ClientResponseError
+from pydantic import BaseModel, Field
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession as AsyncDBSession
+
+from app.config import DB_DIR, PUBLIC_IP, TASK_PROGRESS_DB_DIR, app_logger, settings
+from app.db import sessionmanager
+from app.db.models import DataFetchingTask, DataSource, JSONValue
+from app.tasks import create_new_task, get_task_processor, run_task, task_processors
+from app.tasks.models import TaskExecutionMetaModel
+from app.tasks.queue_item_management import TaskQueueItemManager
+from app.tasks.scheduling import get_scheduling_params
+from app.utils.http import HTTPSessionManager
+
+type InputChunkItemOutcome = Literal["successes", "failures", "inputs-without-output"]
+
+
+class DistributedTaskModel(BaseModel):
+    """
+    The information a worker node needs to process the inputs of a task of the coordinator node.
+    """
+
+    id: int
+    """
+    The ID of the task on the coordinator node.
+    """
+
+    data_source: DataSource
+    task_type: str
+    params: dict[str, JSONValue] | None
+    priority: int
+    deadline: datetime | None
+
+
+class InputChunkItemModel(BaseModel):
+    id: int
+    """
+    The ID of the item in the input queue of the task on the coordinator node.
+    """
+
+    data: JSONValue
+
+
+class InputChunkLeaseRequest(BaseModel):
+    holder: str
+    """
+    Identifies the worker node requesting the lease (only used for logging and debugging).
+    """
+
+    size: int = Field(gt=0)
+    """
+    The maximum number of input items to lease.
+    """
+
+
+class InputChunkLeaseModel(BaseModel):
+    """
+    A chunk of input items leased to a worker node.
+    """
+
+    lease_id: str
+    task: DistributedTaskModel
+    items: list[InputChunkItemModel]
+    expires_at: datetime
+    """
+    When the lease expires unless it is renewed (by reporting outcomes).
+    """
+
+
+class InputChunkItemOutcomeModel(BaseModel):
+    id: int
+    outcome: InputChunkItemOutcome
+
+
+class InputChunkReport(BaseModel):
+    outcomes: list[InputChunkItemOutcomeModel]
+
+    renew: bool = True
+    """
+    Whether the lease should be renewed.
+    """
+
+
+class InputChunkReportResult(BaseModel):
+    expires_at: datetime | None
+    """
+    When the (renewed) lease expires, or `None` if it does not hold any items anymore (all of them were reported, or it expired and its items were handed out again).
+    """
+
+
+class InputChunkTaskNotFoundError(Exception):
+    """
+    Raised by an `InputChunkSource` if the task a lease belongs to does not exist (anymore).
+    """
+
+
+def _to_datetime(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def to_distributed_task_model(db_task: DataFetchingTask) -> DistributedTaskModel:
+    return DistributedTaskModel(
+        id=db_task.id,
+        data_source=db_task.data_source,
+        task_type=db_task.task_type,
+        params=db_task.params,
+        priority=db_task.priority,
+        deadline=db_task.deadline,
+    )
+
+
+async def lease_input_chunk(
+    db_session: AsyncDBSession, holder: str, size: int
+) -> InputChunkLeaseModel | None:
+    """
+    Leases a chunk of input items of the most urgent task that has unleased inputs left (coordinator node only). Returns `None` if there are none.
+    """
+    db_tasks = (
+        await db_session.scalars(
+            select(DataFetchingTask)
+            .where(DataFetchingTask.status.in_(["pending", "running"]))
+            .order_by(
+                DataFetchingTask.priority.desc(),
+                DataFetchingTask.deadline.is_(None),
+                DataFetchingTask.deadline,
+                DataFetchingTask.id,
+            )
+        )
+    ).all()
+    for db_task in db_tasks:
+        with TaskQueueItemManager(task_id=db_task.id, db_dir=TASK_PROGRESS_DB_DIR) as q:
+            lease = q.lease_input_chunk(
+                holder, size, settings.task_distribution_lease_seconds
+            )
+            remaining_input_count = q.remaining_input_count
+        if lease is None:
+            if remaining_input_count == 0:
+                # e.g. a task without inputs, or the last outcomes were reported while the task was paused
+                db_task.status = "done"
+                await db_session.commit()
+            continue
+        if db_task.status == "pending":
+            db_task.status = "running"
+            await db_session.commit()
+        app_logger.info(
+            f"Leased {len(lease.items)} inputs of task {db_task.id} to {holder} (lease {lease.id})"
+        )
+        return InputChunkLeaseModel(
+            lease_id=lease.id,
+            task=to_distributed_task_model(db_task),
+            items=[
+                InputChunkItemModel(id=item.id, data=item.data) for item in lease.items
+            ],
+            expires_at=_to_datetime(lease.expires_at),
+        )
+    return None
+
+
+async def report_input_chunk_outcomes(
+    db_task: DataFetchingTask,
+    db_session: AsyncDBSession,
+    lease_id: str,
+    report: InputChunkReport,
+) -> InputChunkReportResult:
+    """
+    Records the outcomes reported by a worker node and renews its lease (coordinator node only). The task is done once all of its inputs have an outcome.
+    """
+    with TaskQueueItemManager(task_id=db_task.id, db_dir=TASK_PROGRESS_DB_DIR) as q:
+        q.record_input_chunk_outcomes(
+            [(outcome.id, outcome.outcome) for outcome in report.outcomes]
+        )
+        expires_at = (
+            q.renew_input_chunk_lease(
+                lease_id, settings.task_distribution_lease_seconds
+            )
+            if report.renew
+            else None
+        )
+        remaining_input_count = q.remaining_input_count
+    if remaining_input_count == 0 and db_task.status in ("pending", "running"):
+        db_task.status = "done"
+        await db_session.commit()
+        app_logger.info(f"All inputs of task {db_task.id} have been processed")
+    return InputChunkReportResult(
+        expires_at=_to_datetime(expires_at) if expires_at is not None else None
+    )
+
+
+def release_input_chunk(db_task: DataFetchingTask, lease_id: str):
+    """
+    Releases a lease (coordinator node only), so that its unreported items can be handed out again right away.
+    """
+    with TaskQueueItemManager(task_id=db_task.id, db_dir=TASK_PROGRESS_DB_DIR) as q:
+        q.release_input_chunk(lease_id)
+
+
+class InputChunkSource(Protocol):
+    """
+    Where an `InputChunkWorker` leases chunks of input items from and reports their outcomes to.
+    """
+
+    @property
+    def name(self) -> str:
+        """
+        Describes the source in log messages.
+        """
+        ...
+
+    async def lease(self, holder: str, size: int) -> InputChunkLeaseModel | None:
+        """
+        Leases a chunk of at most `size` input items (`None` if there are none).
+        """
+        ...
+
+    async def report(
+        self, task_id: int, lease_id: str, report: InputChunkReport
+    ) -> InputChunkReportResult:
+        """
+        Reports the outcomes of leased items (and renews the lease if requested). Raises `InputChunkTaskNotFoundError` if the task does not exist (anymore).
+        """
+        ...
+
+    async def release(self, task_id: int, lease_id: str):
+        """
+        Releases a lease. Raises `InputChunkTaskNotFoundError` if the task does not exist (anymore).
+        """
+        ...
+
+    async def close(self): ...
+
+
+class CoordinatorClient:
+    """
+    Leases input chunks from the coordinator node via its `/distribution` endpoints.
+    """
+
+    def __init__(self, coordinator_url: str, http_session_manager: HTTPSessionManager):
+        self._coordinator_url = coordinator_url.rstrip("/")
+        self._http_session_manager = http_session_manager
+
+    @property
+    def name(self) -> str:
+        return f"coordinator {self._coordinator_url}"
+
+    async def lease(self, holder: str, size: int) -> InputChunkLeaseModel | None:
+        result = await self._request(
+            "POST",
+            "/distribution/leases",
+            InputChunkLeaseRequest(holder=holder, size=size),
+        )
+        # no content if there are no inputs left to lease
+        return (
+            InputChunkLeaseModel.model_validate(result) if result is not None else None
+        )
+
+    async def report(
+        self, task_id: int, lease_id: str, report: InputChunkReport
+    ) -> InputChunkReportResult:
+        result = await self._request(
+            "POST", f"/distribution/tasks/{task_id}/leases/{lease_id}/outcomes", report
+        )
+        return InputChunkReportResult.model_validate(result)
+
+    async def release(self, task_id: int, lease_id: str):
+        await self._request(
+            "DELETE", f"/distribution/tasks/{task_id}/leases/{lease_id}"
+        )
+
+    async def close(self):
+        await self._http_session_manager.close()
+
+    async def _request(
+        self, method: str, path: str, payload: BaseModel | None = None
+    ) -> dict | None:
+        session = await self._http_session_manager.get_session()
+        async with session.request(
+            method,
+            f"{self._coordinator_url}{path}",
+            data=payload.model_dump_json() if payload is not None else None,
+            headers={"Content-Type": "application/json"},
+        ) as response:
+            try:
+                response.raise_for_status()
+            except ClientResponseError as e:
+                if e.status == 404:
+                    # only the endpoints of a task respond with 404 (if the task was deleted)
+                    raise InputChunkTaskNotFoundError(
+                        f"Task not found on {self.name} ({method} {path})"
+                    ) from e
+                raise
+            if response.status == 204:
+                return None
+            return await response.json()
+
+
+class InputChunkWorker:
+    """
+    Leases chunks of input items from an `InputChunkSource`, processes them in local tasks and reports their outcomes back.
+    Used by worker nodes to lease inputs from the coordinator node (see `task_distribution_mode` setting) and by idle replicas to steal inputs from other replicas on the same host (see `app.tasks.stealing`).
+
+    Each task of the source is mirrored by a local task with the same data source, task type and parameters. Leased items are added to the input queue of the local task, which is (re-)started whenever necessary.
+    Outputs are uploaded by this node like the outputs of any other task.
+
+    Every `report_interval_seconds`, the outcomes of leased items processed since the last report are sent to the source (which renews the lease), and a new chunk is leased once fewer than `chunk_size` leased items are left to be processed.
+    Held leases are stored in a small SQLite DB, so outcomes are also reported after a restart (as long as the leases have not expired in the meantime).
+    """
+
+    def __init__(
+        self,
+        source: InputChunkSource,
+        holder: str,
+        state_db_path: str,
+        chunk_size: int,
+        report_interval_seconds: float,
+        should_lease: Callable[[], bool] | None = None,
+        logger: Logger = app_logger,
+    ):
+        self._source = source
+        self._holder = holder
+        self._state_db_path = state_db_path
+        self._chunk_size = chunk_size
+        self._report_interval_seconds = report_interval_seconds
+
+        self._should_lease = should_lease
+        """
+        If set, new chunks are only leased while this returns `True` (e.g. while this node has no other work).
+        """
+
+        self._logger = logger
+
+        self._conn: sqlite3.Connection | None = None
+        """
+        The connection to the DB storing the held leases and the local tasks mirroring the source's tasks (opened on first use).
+        """
+
+        self._loop_task: asyncio.Task | None = None
+
+    @property
+    def local_task_ids(self) -> set[int]:
+        """
+        The IDs of the local tasks mirroring tasks of the source.
+        """
+        return {
+            row[0]
+            for row in self._get_conn().execute(
+                "SELECT local_task_id FROM mirrored_tasks"
+            )
+        }
+
+    def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        await self._source.close()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self._report_outcomes()
+            except Exception:
+                self._logger.exception(
+                    f"Failed to report outcomes of leased inputs to {self._source.name}"
+                )
+            try:
+                await self._lease_if_needed()
+            except Exception:
+                self._logger.exception(
+                    f"Failed to lease inputs from {self._source.name}"
+                )
+            await asyncio.sleep(self._report_interval_seconds)
+
+    async def _report_outcomes(self):
+        held_items: dict[tuple[int, str], list[tuple[int, str]]] = {}
+        for remote_task_id, lease_id, item_id, data in self._get_conn().execute(
+            "SELECT remote_task_id, lease_id, item_id, data FROM held_lease_items ORDER BY item_id"
+        ):
+            held_items.setdefault((remote_task_id, lease_id), []).append(
+                (item_id, data)
+            )
+
+        for (remote_task_id, lease_id), items in held_items.items():
+            # one lease that cannot be reported (e.g. because of an unexpected response) does not hold up the others
+            try:
+                await self._report_lease_outcomes(remote_task_id, lease_id, items)
+            except Exception:
+                self._logger.exception(
+                    f"Failed to report outcomes of lease {lease_id} of task {remote_task_id} to {self._source.name}"
+                )
+
+    async def _report_lease_outcomes(
+        self, remote_task_id: int, lease_id: str, items: list[tuple[int, str]]
+    ):
+        """
+        Reports the outcomes of the items of a held lease that were processed since the last report and renews the lease (or releases it if its items will not be processed).
+        """
+        local_task_id = self._get_local_task_id(remote_task_id)
+        if local_task_id is None:
+            self._logger.warning(
+                f"No local task mirrors task {remote_task_id}, releasing lease {lease_id}"
+            )
+            await self._drop_lease(remote_task_id, lease_id, None, [], release=True)
+            return
+
+        with TaskQueueItemManager(
+            task_id=local_task_id, db_dir=TASK_PROGRESS_DB_DIR
+        ) as q:
+            statuses = q.get_input_statuses([json.loads(data) for _, data in items])
+        outcomes = [
+            InputChunkItemOutcomeModel(id=item_id, outcome=status)
+            for (item_id, _), status in zip(items, statuses)
+            if status is not None and status != "inputs"
+        ]
+        unprocessed_inputs = [
+            json.loads(data)
+            for (_, data), status in zip(items, statuses)
+            if status == "inputs"
+        ]
+        # leases of items that will not be processed (anymore) are released, so they are handed out again
+        renew = bool(unprocessed_inputs) and await self._is_processable(local_task_id)
+        try:
+            result = await self._source.report(
+                remote_task_id,
+                lease_id,
+                InputChunkReport(outcomes=outcomes, renew=renew),
+            )
+        except InputChunkTaskNotFoundError:
+            self._logger.warning(
+                f"Task {remote_task_id} does not exist on {self._source.name} anymore, dropping lease {lease_id}"
+            )
+            await self._drop_lease(
+                remote_task_id, lease_id, local_task_id, unprocessed_inputs
+            )
+            return
+
+        if outcomes:
+            self._logger.info(
+                f"Reported outcomes of {len(outcomes)} inputs of task {remote_task_id} to {self._source.name}"
+            )
+        if result.expires_at is None:
+            if renew:
+                self._logger.warning(
+                    f"Lease {lease_id} of task {remote_task_id} expired, {len(unprocessed_inputs)} unprocessed inputs were handed out again"
+                )
+            await self._drop_lease(
+                remote_task_id,
+                lease_id,
+                local_task_id,
+                unprocessed_inputs,
+                release=bool(unprocessed_inputs) and not renew,
+            )
+            return
+
+        conn = self._get_conn()
+        with conn:
+            conn.executemany(
+                "DELETE FROM held_lease_items WHERE lease_id = ? AND item_id = ?",
+                [(lease_id, outcome.id) for outcome in outcomes],
+            )
+        # the local task may have finished (e.g. right before the inputs of the lease were added)
+        await self._start_local_task(local_task_id)
+
+    async def _drop_lease(
+        self,
+        remote_task_id: int,
+        lease_id: str,
+        local_task_id: int | None,
+        unprocessed_inputs: list[JSONValue],
+        release: bool = False,
+    ):
+        """
+        Stops holding the given lease (releasing it first if `release` is set).
+
+        Its unprocessed inputs are removed from the local task, as they are (or may be) handed out to someone else. Otherwise, they would still be processed, but their outcomes never reported.
+        """
+        if release:
+            try:
+                await self._source.release(remote_task_id, lease_id)
+            except InputChunkTaskNotFoundError:
+                # nothing left to release
+                pass
+        if local_task_id is not None and unprocessed_inputs:
+            with TaskQueueItemManager(
+                task_id=local_task_id, db_dir=TASK_PROGRESS_DB_DIR
+            ) as q:
+                q.remove_inputs(unprocessed_inputs)
+        conn = self._get_conn()
+        with conn:
+            conn.execute("DELETE FROM held_lease_items WHERE lease_id = ?", (lease_id,))
+
+    async def _lease_if_needed(self):
+        conn = self._get_conn()
+        held_count = conn.execute("SELECT COUNT(*) FROM held_lease_items").fetchone()[0]
+        if held_count >= self._chunk_size:
+            return
+        if self._should_lease is not None and not self._should_lease():
+            return
+
+        lease = await self._source.lease(self._holder, self._chunk_size)
+        if lease is None:
+            return
+        local_task_id = await self._get_or_create_local_task(lease.task)
+        if not await self._is_processable(local_task_id):
+            self._logger.info(
+                f"Local task {local_task_id} mirroring task {lease.task.id} is paused or failed, releasing lease {lease.lease_id}"
+            )
+            await self._source.release(lease.task.id, lease.lease_id)
+            # the items may still be in the input queue of the local task from an earlier lease, which would process them once it is resumed
+            with TaskQueueItemManager(
+                task_id=local_task_id, db_dir=TASK_PROGRESS_DB_DIR
+            ) as q:
+                q.remove_inputs([item.data for item in lease.items])
+            return
+
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO held_lease_items (lease_id, item_id, remote_task_id, data) VALUES (?, ?, ?, ?)",
+                [
+                    (lease.lease_id, item.id, lease.task.id, json.dumps(item.data))
+                    for item in lease.items
+                ],
+            )
+        with TaskQueueItemManager(
+            task_id=local_task_id, db_dir=TASK_PROGRESS_DB_DIR
+        ) as q:
+            q.add_inputs([item.data for item in lease.items])
+        self._logger.info(
+            f"Leased {len(lease.items)} inputs of task {lease.task.id} from {self._source.name}, processing them in local task {local_task_id}"
+        )
+        await self._start_local_task(local_task_id)
+
+    async def _get_or_create_local_task(self, remote_task: DistributedTaskModel) -> int:
+        conn = self._get_conn()
+        local_task_id = self._get_local_task_id(remote_task.id)
+        if local_task_id is not None:
+            return local_task_id
+        task = TaskExecutionMetaModel.model_validate(
+            remote_task.model_dump(exclude={"id"})
+        ).root
+        async with sessionmanager.session() as db_session:
+            db_task, _ = await create_new_task(task, db_session)
+            # started as soon as the leased inputs have been added
+            db_task.status = "pending"
+            await db_session.commit()
+        with conn:
+            conn.execute(
+                "INSERT INTO mirrored_tasks (remote_task_id, local_task_id) VALUES (?, ?)",
+                (remote_task.id, db_task.id),
+            )
+        return db_task.id
+
+    def _get_local_task_id(self, remote_task_id: int) -> int | None:
+        row = (
+            self._get_conn()
+            .execute(
+                "SELECT local_task_id FROM mirrored_tasks WHERE remote_task_id = ?",
+                (remote_task_id,),
+            )
+            .fetchone()
+        )
+        return row[0] if row is not None else None
+
+    async def _is_processable(self, local_task_id: int) -> bool:
+        """
+        Whether the local task processes its inputs (eventually), i.e. was not paused by the user or failed.
+        """
+        async with sessionmanager.session() as db_session:
+            db_task = await db_session.get(DataFetchingTask, local_task_id)
+            return db_task is not None and db_task.status not in (
+                "paused",
+                "pausing",
+                "error",
+            )
+
+    async def _start_local_task(self, local_task_id: int):
+        if local_task_id in task_processors:
+            # still running (or scheduled to run), picks up the new inputs by itself
+            return
+        async with sessionmanager.session() as db_session:
+            db_task = await db_session.get(DataFetchingTask, local_task_id)
+            if db_task is None:
+                return
+            db_task.status = "pending"
+            await db_session.commit()
+            processor = get_task_processor(db_task)
+            asyncio.create_task(run_task(processor, get_scheduling_params(db_task)))
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self._state_db_path)
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS mirrored_tasks (remote_task_id INTEGER PRIMARY KEY, local_task_id INTEGER NOT NULL)"
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS held_lease_items (
+                      lease_id TEXT NOT NULL,
+                      item_id INTEGER NOT NULL,
+                      remote_task_id INTEGER NOT NULL,
+                      data TEXT NOT NULL,
+                      PRIMARY KEY (lease_id, item_id)
+                    )
+                    """
+                )
+            self._conn = conn
+        return self._conn
+
+
+def _create_input_chunk_worker() -> InputChunkWorker | None:
+    if settings.task_distribution_mode != "worker":
+        return None
+    if settings.task_distribution_coordinator_url is None:
+        raise ValueError(
+            "task_distribution_coordinator_url must be set if task_distribution_mode is 'worker'"
+        )
+    return InputChunkWorker(
+        source=CoordinatorClient(
+            settings.task_distribution_coordinator_url, HTTPSessionManager()
+        ),
+        holder=settings.replica_id or PUBLIC_IP,
+        state_db_path=f"{DB_DIR}/input_chunk_leases.db",
+        chunk_size=settings.task_distribution_chunk_size,
+        report_interval_seconds=settings.task_distribution_report_interval_seconds,
+    )
+
+
+input_chunk_worker = _create_input_chunk_worker()
+"""
+Leases inputs from the coordinator node if this node is a worker node (`None` otherwise).
+"""
@@ -0,0 +1,18 @@
+from datetime import datetime
+from pydantic import BaseModel
+
+
+class TaskBase(BaseModel):
+    """
+    Base class for all tasks, containing the fields that determine how a task is scheduled (see `TaskScheduler`).
+    """
+
+    priority: int = 0
+    """
+    Tasks with higher priority are started first and fetch data before tasks with lower priority, e.g. for urgent refreshes that should not wait for background backfills.
+    """
+
+    deadline: datetime | None = None
+    """
+    Optional time by which the task should be done (assumed to be in UTC if no timezone is given). Among tasks with the same priority, tasks with nearer deadlines are preferred.
+    """
@@ -1,13 +1,15 @@
 from typing import Annotated, Literal
 from pydantic import BaseModel, Field
 
+from app.tasks.models.common import TaskBase
+
 DummyFlakyTaskType = Literal["flaky"]
 DummyThrowAboveThresholdTaskType = Literal["throw-above-threshold"]
 
 DummyTaskType = DummyFlakyTaskType | DummyThrowAboveThresholdTaskType
 
 
-class DummyAPITaskBase(BaseModel):
+class DummyAPITaskBase(TaskBase):
     """
     Base class for all dummy API tasks.
     """
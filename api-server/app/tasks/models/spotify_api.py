@@ -1,6 +1,8 @@
 from pydantic import BaseModel, Field, model_validator
 from typing import Annotated, Literal
 
+from app.tasks.models.common import TaskBase
+
 SpotifyTracksTaskType = Literal["tracks"]
 SpotifyArtistsTaskType = Literal["artists"]
 SpotifyAlbumsTaskType = Literal["albums"]
@@ -27,7 +29,7 @@ SPOTIFY_API_TASK_TYPES: list[SpotifyAPITaskType] = [
 ]
 
 
-class SpotifyTaskBase(BaseModel):
+class SpotifyTaskBase(TaskBase):
     """
     Base class for all Spotify API tasks.
     """
@@ -93,6 +95,11 @@ class SpotifyArtistAlbumsReleaseTypes(BaseModel):
 class SpotifyArtistAlbumsParams(BaseModel):
     region: DataFetchingRegion
     release_types: SpotifyArtistAlbumsReleaseTypes
+    stream_pages: bool = False
+    """
+    If set, the albums of each artist are written to the output page by page as they arrive (one output per album, referencing the artist ID as `parent_id`) instead of one output containing all albums of the artist.
+    Recommended for artists with thousands of albums/appearances, as it keeps memory usage low.
+    """
 
 
 class SpotifyArtistAlbumsTask(SpotifyTaskBase):
@@ -106,6 +113,8 @@ class SpotifyArtistAlbumsTask(SpotifyTaskBase):
     )
 
     def get_s3_prefix(self) -> str:
+        if self.params.stream_pages:
+            return f"spotify/artist_albums_streamed_{self.params.region}"
         return f"spotify/artist_albums_{self.params.region}"
 
 
@@ -122,12 +131,22 @@ class SpotifyISRCTrackSearchTask(SpotifyTaskBase):
         return f"spotify/tracks_{self.params.region}"
 
 
+class SpotifyPlaylistsParams(BaseModel):
+    stream_tracks: bool = False
+    """
+    If set, only the tracks of each playlist are fetched and written to the output page by page as they arrive (one output per track, referencing the playlist ID as `parent_id`) instead of one output containing the playlist with all of its tracks.
+    Recommended for huge playlists, as it keeps memory usage low.
+    """
+
+
 class SpotifyPlaylistsTask(SpotifyTaskBase):
     task_type: SpotifyPlaylistsTaskType = "playlists"
     inputs: list[SpotifyId] = []
-    params: None = None
+    params: SpotifyPlaylistsParams | None = None
 
     def get_s3_prefix(self) -> str:
+        if self.params is not None and self.params.stream_tracks:
+            return "spotify/playlists_streamed"
         return "spotify/playlists"
 
 
@@ -145,5 +164,6 @@ SpotifyAPITaskParams = (
     | SpotifyAlbumsParams
     | SpotifyArtistAlbumsParams
     | SpotifyISRCTrackSearchParams
+    | SpotifyPlaylistsParams
     | None
 )
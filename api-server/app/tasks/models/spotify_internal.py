@@ -1,6 +1,8 @@
 from typing import Annotated, Literal
 from pydantic import BaseModel, Field
 
+from app.tasks.models.common import TaskBase
+
 SpotifyInternalRelatedArtistsTaskType = Literal["related-artists"]
 
 SpotifyInternalTaskType = SpotifyInternalRelatedArtistsTaskType
@@ -12,7 +14,7 @@ SPOTIFY_INTERNAL_TASK_TYPES: list[SpotifyInternalTaskType] = [
 SpotifyId = Annotated[str, Field(min_length=22, max_length=22)]
 
 
-class SpotifyInternalTaskBase(BaseModel):
+class SpotifyInternalTaskBase(TaskBase):
     """
     Base class for all Spotify internal API tasks.
     """
@@ -1,10 +1,20 @@
 from logging import Logger
 import os
 import json
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
 from abc import ABC, abstractmethod
 import asyncio
-from typing import Any
+from collections import deque
+from contextlib import (
+    AbstractAsyncContextManager,
+    AsyncExitStack,
+    aclosing,
+    nullcontext,
+)
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Protocol
+import zstandard as zstd
 from sqlalchemy.ext.asyncio import AsyncSession as AsyncDBSession
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
@@ -12,21 +22,79 @@ from sqlalchemy.orm import joinedload
 from app.db import sessionmanager
 from app.tasks.common import (
     TaskProgressMeta,
+    NonFatalProcessingError,
     SingleItemFetchFunction,
     BatchFetchFunction,
+    StreamingFetchFunction,
+)
+from app.db.models import DataFetchingTask
+from app.tasks.queue_item_management import (
+    LeasedInputItem,
+    OutputCheckpoint,
+    QueueItemCounts,
+    QueueType,
+    TaskQueueItemManager,
+)
+from app.tasks.uploads import OutputUploader
+from app.utils.zstd import (
+    compress_file,
+    create_stream_writer,
+    decompress_available_bytes,
 )
-from app.db.models import DataFetchingTask, S3FileUpload
-from app.tasks.queue_item_management import TaskQueueItemManager
-from app.utils.zstd import compress_file
-from app.utils.s3 import upload_file
-from app.utils.files import is_file_empty
+
+
+class FetchSlots(Protocol):
+    """
+    Limits the number of concurrent fetches of a task processor, usually together with other tasks (see `FairShareSemaphore` and `TaskScheduler`).
+    """
+
+    def slot(self, consumer: int) -> AbstractAsyncContextManager[None]:
+        """
+        Holds one slot on behalf of the task with the given ID while the context is active.
+        """
+        ...
+
+
+@dataclass
+class FetchedItems:
+    """
+    The result of fetching data for one or more leased input items, passed from the fetch stage to the write stage of a `TaskProcessor`.
+    """
+
+    outcomes: list[tuple[LeasedInputItem, QueueType]]
+    """
+    The leased input items and the queue each of them should be moved to.
+    """
+
+    outputs: list[dict[str, Any]] = field(default_factory=list)
+    """
+    The outputs that should be written to the output file (already wrapped/annotated with `observed_at`).
+    """
+
+
+@dataclass
+class WrittenBatch:
+    """
+    A batch of fetch results whose outputs have been written to the output file, passed from the write stage to the commit stage of a `TaskProcessor`.
+    """
+
+    outcomes: list[tuple[LeasedInputItem, QueueType]]
+    """
+    The leased input items and the queue each of them should be moved to.
+    """
+
+    checkpoint: OutputCheckpoint | None = None
+    """
+    The output checkpoint right after the outputs of this batch were written, if the write stage ended the current zstd frame of the output file after this batch.
+    The commit stage records outcomes only once such a checkpoint is available, so each recorded group of outcomes corresponds to a complete frame.
+    """
 
 
 class TaskProcessor[T](ABC):
     """
     A utility class for processing data fetching tasks in a queue-based manner.
 
-    Output data is written to a JSONL file in the `TASK_OUTPUT_DIR` directory. Once the file reaches a certain size, it is compressed using zstd and uploaded to S3.
+    Output data is written to a JSONL file in the `TASK_OUTPUT_DIR` directory, which is compressed using zstd while it is written. Once a certain amount of output has been written to the file, it is closed and handed off to the `OutputUploader`, which uploads it to S3 in the background.
     """
 
     def __init__(
@@ -36,11 +104,19 @@ class TaskProcessor[T](ABC):
         outputs_s3_prefix: str,
         outputs_local_storage_dir: str,
         queue_item_manager: TaskQueueItemManager,
+        output_uploader: OutputUploader,
         logger: Logger,
+        concurrency: int = 1,
         compression_file_size_limit_bytes: int = (
             500 * 1024 * 1024
         ),  # assuming 3:1 compression ratio, this should result in 500 MB files
+        stage_queue_size: int = 16,
+        commit_group_size: int = 500,
+        commit_group_interval_ms: int = 1000,
     ):
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1.")
+
         self._server_ip = server_ip
         """
         The IP address of the server that the task processor is running on. This is used to create unique S3 keys for the uploaded output files (making it easier to understand where uploaded files came from, e.g. if there are multiple remote servers uploading to the same S3 prefix).
@@ -61,6 +137,11 @@ class TaskProcessor[T](ABC):
         An instance of the class that abstracts away managing the queues for the input items of the task.
         """
 
+        self._output_uploader = output_uploader
+        """
+        Uploads the output files of the task to S3 once they are complete.
+        """
+
         self._logger = logger
         """
         The logger instance that is used to log messages about this task processor's progress.
@@ -71,22 +152,92 @@ class TaskProcessor[T](ABC):
         The interval (in seconds) at which the task processor logs its progress.
         """
 
-        self._output_fp = f"{outputs_local_storage_dir}/{task_id}.jsonl"
+        self._outputs_local_storage_dir = outputs_local_storage_dir
+
+        self._output_fp = f"{outputs_local_storage_dir}/{task_id}.jsonl.zst.part"
+        """
+        The path to the (zstd-compressed) JSONL file where the outputs of the task will be written to.
+        """
+
+        self._legacy_output_fp = f"{outputs_local_storage_dir}/{task_id}.jsonl"
+        """
+        The path to the uncompressed output file that previous versions wrote to (see `_recover_legacy_output_file`).
+        """
+
+        self._legacy_output_fp_compressed = (
+            f"{outputs_local_storage_dir}/{task_id}.jsonl.zst"
+        )
+        """
+        The path previous versions moved (compressed) output files to before uploading them.
+        """
+
+        self._output_file = open(self._output_fp, "ab")
+
+        self._output_writer = create_stream_writer(self._output_file)
+        """
+        Compresses the outputs and writes them to the output file.
+
+        Outputs of each commit group (see `commit_group_size`) are written to a separate zstd frame. Within a frame, compressed data is flushed to the file after each batch of outputs, so it can be recovered after a crash even if the frame was not finished.
+        """
+
+        self._frame_has_data = False
         """
-        The path to the JSONL file where the outputs of the task will be written to.
+        Whether any outputs were written to the current zstd frame of the output file (ending a frame without data would add an empty frame to the file).
         """
 
-        self._output_fp_compressed = f"{outputs_local_storage_dir}/{task_id}.jsonl.zst"
+        self._output_uncompressed_size = 0
+        """
+        The number of uncompressed bytes of output written to the current output file.
         """
-        The path to the compressed JSONL file that will be uploaded to S3 once the task finishes or the current output file reaches a certain size.
+
+        self._journal_fp = f"{outputs_local_storage_dir}/{task_id}.jsonl.journal"
+        """
+        The path to the journal file that records (for each batch of outputs written to the output file) the outcomes of the respective input items.
+
+        Outcomes are recorded in the task's queue DB in groups (see `commit_group_size`), so after a crash the journal is used to record the outcomes for outputs that were already written.
         """
 
-        self._output_file = open(self._output_fp, "a")
+        self._journal_file = open(self._journal_fp, "ab")
+
+        self._output_seq = 0
+        """
+        The sequence number of the last batch of outputs written to the output file (see `OutputCheckpoint`).
+        """
+
+        self._concurrency = concurrency
+        """
+        The number of workers in the fetch stage that lease and fetch input items concurrently.
+        """
+
+        self._stage_queue_size = stage_queue_size
+        """
+        The maximum number of fetch results that may be buffered between two processing stages (fetch -> write -> commit) before the previous stage has to wait.
+        """
+
+        self._commit_group_size = commit_group_size
+        """
+        The (minimum) number of items whose outputs are written to the same zstd frame of the output file and whose outcomes are recorded in the task's queue DB together, in a single transaction.
+        """
+
+        self._commit_group_interval_ms = commit_group_interval_ms
+        """
+        The maximum time (in milliseconds) to wait for `commit_group_size` items before the current frame is ended and the outcomes collected so far are recorded anyway.
+        """
 
         self._compression_file_size_limit_bytes = compression_file_size_limit_bytes
         """
-        The maximum size (in bytes) the output file may reach before it is compressed using zstd and uploaded to S3.
-        After successful upload of the compressed file, a new output file is created and written to.
+        The maximum number of (uncompressed) bytes of output that may be written to the output file before it is handed off for upload to S3.
+        A new output file is created and written to right away.
+        """
+
+        self._last_handed_off_at: datetime | None = None
+        """
+        The time the last output file was handed off for upload (see `_hand_off_file`).
+        """
+
+        self._bytes_written = 0
+        """
+        The number of (uncompressed) bytes of output this processor has written to the output file.
         """
 
         self._pause_requested = False
@@ -95,6 +246,27 @@ class TaskProcessor[T](ABC):
         Once it is paused, the task's status should be updated in the DB accordingly.
         """
 
+        self._throughput_window_seconds = 60
+        """
+        The time span (in seconds) over which the throughput of the processor is measured (see `items_per_second`).
+        """
+
+        self._throughput_samples: deque[tuple[float, int]] = deque()
+        """
+        The number of processed input items at different points in time (monotonic clock), recorded whenever outcomes are committed.
+        Only the most recent sample before the start of the throughput window and the samples within it are kept.
+        """
+
+        self._chunk_lease_poll_interval_seconds = 5
+        """
+        How often (in seconds) to check whether input items held by other nodes (see `TaskQueueItemManager.lease_input_chunk`) have been processed once there are no other input items left.
+        """
+
+        self._fetch_slots: FetchSlots | None = None
+        """
+        If set, each fetch has to acquire one of these slots first, which are shared with the other tasks fetching from the same data source (see `TaskScheduler`).
+        """
+
         self._last_logged_at = datetime.now()
         """
         The timestamp of the last time the task processor logged its progress.
@@ -113,6 +285,7 @@ class TaskProcessor[T](ABC):
 
     def close(self):
         self._output_file.close()
+        self._journal_file.close()
         self._queue_item_manager.close()
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -125,17 +298,81 @@ class TaskProcessor[T](ABC):
     def task_id(self) -> int:
         return self._task_id
 
+    @property
+    def queue_item_counts(self) -> QueueItemCounts:
+        """
+        The current counts of the task's queue items (read from memory, so this is cheap).
+        """
+        return self._queue_item_manager.queue_item_counts
+
+    @property
+    def items_per_second(self) -> float | None:
+        """
+        The number of input items processed per second within the last `_throughput_window_seconds` (`None` if the processor has not been running yet).
+        """
+        if not self._throughput_samples:
+            return None
+        elapsed = time.monotonic() - self._throughput_samples[0][0]
+        if elapsed <= 0:
+            return None
+        processed = self._processed_count() - self._throughput_samples[0][1]
+        return processed / elapsed
+
+    @property
+    def estimated_completion_at(self) -> datetime | None:
+        """
+        When the remaining input items are expected to be processed, based on the measured throughput (`None` if no items have been processed recently).
+        """
+        items_per_second = self.items_per_second
+        if not items_per_second:
+            return None
+        remaining = self._queue_item_manager.queue_item_counts.remaining
+        return datetime.now(timezone.utc) + timedelta(
+            seconds=remaining / items_per_second
+        )
+
+    def _processed_count(self) -> int:
+        counts = self._queue_item_manager.queue_item_counts
+        return counts.successes + counts.failures + counts.inputs_without_output
+
+    def _record_throughput_sample(self):
+        now = time.monotonic()
+        self._throughput_samples.append((now, self._processed_count()))
+        window_start = now - self._throughput_window_seconds
+        while (
+            len(self._throughput_samples) > 1
+            and self._throughput_samples[1][0] <= window_start
+        ):
+            self._throughput_samples.popleft()
+
+    @property
+    def bytes_written(self) -> int:
+        """
+        The number of (uncompressed) bytes of output this processor has written so far.
+        """
+        return self._bytes_written
+
+    @property
+    def output_file_size_bytes(self) -> int:
+        """
+        The current size of the (compressed) output file.
+        """
+        if self._output_file.closed:
+            return 0
+        return os.fstat(self._output_file.fileno()).st_size
+
     @property
     def progress(self) -> TaskProgressMeta:
         return self._create_progress_meta()
 
     def _create_progress_meta(self) -> TaskProgressMeta:
+        counts = self._queue_item_manager.queue_item_counts
         return {
-            "successes": self._queue_item_manager.success_count,
-            "failures": self._queue_item_manager.failure_count,
-            "inputs_without_output": self._queue_item_manager.inputs_without_output_count,
-            "remaining": self._queue_item_manager.remaining_input_count,
-            "current_output_file_size_bytes": os.path.getsize(self._output_fp),
+            "successes": counts.successes,
+            "failures": counts.failures,
+            "inputs_without_output": counts.inputs_without_output,
+            "remaining": counts.remaining,
+            "current_output_file_size_bytes": self.output_file_size_bytes,
         }
 
     def log_progress(self):
@@ -163,31 +400,21 @@ class TaskProcessor[T](ABC):
             if db_task.status == "running":
                 raise ValueError(f"Task with ID {db_task.id} is already running!")
 
+            if os.path.exists(self._legacy_output_fp):
+                await self._recover_legacy_output_file()
+            self._recover_output_file()
+
             if self._queue_item_manager.remaining_input_count == 0:
                 try:
                     self._logger.info("No inputs to process. Task is already done.")
-                    db_task.status = "done"
-                    await db_session.commit()
-                    if os.path.exists(self._output_fp_compressed):
+                    if self.output_file_size_bytes > 0:
                         self._logger.info(
-                            f"Uploading leftover compressed output file {self._output_fp_compressed}"
-                        )
-                        await self._upload_compressed_output_file_delete_local(
-                            db_session
+                            f"Output file {self._output_fp} is not empty. Uploading..."
                         )
-                    if os.path.exists(self._output_fp):
-                        if is_file_empty(self._output_fp):
-                            self._logger.info(
-                                f"Output file {self._output_fp} is empty. Deleting..."
-                            )
-                            os.remove(self._output_fp)
-                        else:
-                            self._logger.info(
-                                f"Output file {self._output_fp} is not empty. Compressing and uploading..."
-                            )
-                            await self._compress_upload_and_delete_data_written_to_current_output_file(
-                                db_session
-                            )
+                    self._hand_off_output_file()
+                    await self._wait_for_uploads()
+                    db_task.status = "done"
+                    await db_session.commit()
                     return
 
                 except Exception as e:
@@ -202,12 +429,19 @@ class TaskProcessor[T](ABC):
             try:
                 self._logger.info(f"Processing remaining inputs")
                 await self._process_inputs(db_session)
-                await self._compress_upload_and_delete_data_written_to_current_output_file(
-                    db_session
-                )
+                while (
+                    not self._pause_requested
+                    and self._queue_item_manager.remaining_input_count > 0
+                ):
+                    # the remaining items are held by other nodes (e.g. replicas stealing work), their leases may expire though
+                    await asyncio.sleep(self._chunk_lease_poll_interval_seconds)
+                    await self._process_inputs(db_session)
+                self._hand_off_output_file()
                 if self._pause_requested:
                     return
 
+                await self._wait_for_uploads()
+
                 # otherwise, task completed regularly and we can mark it as done!
                 db_task.status = "done"
                 await db_session.commit()
@@ -216,21 +450,24 @@ class TaskProcessor[T](ABC):
                 db_task.status = "error"
                 await db_session.commit()
                 self._logger.exception(e)
-                if os.path.exists(self._output_fp) and not is_file_empty(
-                    self._output_fp
-                ):
+                self._recover_output_file()
+                if self.output_file_size_bytes > 0:
                     self._logger.info(
-                        f"Compressing and uploading stuff that was written to output file {self._output_fp} before the error occurred"
-                    )
-                    await self._compress_upload_and_delete_data_written_to_current_output_file(
-                        db_session
+                        f"Uploading stuff that was written to output file {self._output_fp} before the error occurred"
                     )
+                    self._hand_off_output_file()
                 raise e
 
     def pause(self):
         self._pause_requested = True
         self._logger.info("Pause requested")
 
+    def set_fetch_slots(self, fetch_slots: FetchSlots | None):
+        """
+        Makes the processor acquire a slot (with its task ID as consumer) for every fetch. If the slots are provided by a `FairShareSemaphore`, the task has to be registered with it.
+        """
+        self._fetch_slots = fetch_slots
+
     async def _persist_paused_state(self, db_session: AsyncDBSession):
         db_task = await db_session.get(DataFetchingTask, self._task_id)
         if db_task is None:
@@ -242,89 +479,517 @@ class TaskProcessor[T](ABC):
         self._logger.debug("Persisted paused state")
 
     @abstractmethod
-    async def _process_inputs(self, db_session: AsyncDBSession):
+    def _lease_input_items(self) -> list[LeasedInputItem]:
+        """
+        Leases the input items that should be fetched together in a single call of `_fetch`. Returns an empty list if there are none left.
         """
-        Processes the input items that have previously been added via add_inputs. Runs indefinitely until all input items have been processed.
+        pass
+
+    @abstractmethod
+    async def _fetch(self, items: list[LeasedInputItem]) -> FetchedItems:
+        """
+        Fetches the data for the given leased input items and determines their outcomes.
 
         This method should be overridden by subclasses to define the processing logic.
         """
         pass
 
-    async def _compress_upload_and_delete_data_written_to_current_output_file(
-        self, db_session: AsyncDBSession
-    ):
-        await self._compress_output_file_delete_uncompressed()
-        await self._upload_compressed_output_file_delete_local(db_session)
-
-    async def _compress_output_file_delete_uncompressed(self):
-        await asyncio.to_thread(
-            compress_file,
-            input_file_path=self._output_fp,
-            output_file_path=self._output_fp_compressed,
-            remove_input_file=True,
+    async def _fetch_stream(
+        self, items: list[LeasedInputItem]
+    ) -> AsyncIterator[FetchedItems]:
+        """
+        Like `_fetch`, but may yield the results in several parts, which are passed on to the write stage as soon as they are available.
+
+        By default, the result of `_fetch` is yielded as a whole.
+        """
+        yield await self._fetch(items)
+
+    def _create_fetched_items_collector(self):
+        """
+        Creates a `FetchedItems` instance and callbacks that fill it, which can be passed to the processing methods of `TaskQueueItemManager`.
+        """
+        fetched = FetchedItems(outcomes=[])
+
+        async def handle_success(input_item: T, output: Any):
+            fetched.outputs.append(self._annotate_output(output))
+
+        async def handle_failure(input_item: T, error: Exception):
+            self._handle_failure(input_item, error)
+
+        async def handle_input_without_output(input_item: T):
+            self._handle_input_without_output(input_item)
+
+        return fetched, handle_success, handle_failure, handle_input_without_output
+
+    async def _process_inputs(self, db_session: AsyncDBSession):
+        """
+        Processes the input items that have previously been added via add_inputs. Runs until all input items have been processed or a pause is requested.
+
+        Processing is split into three stages connected by bounded queues, so that waiting for the network overlaps with local I/O:
+        1. fetch: `concurrency` workers lease input items and fetch their data (waiting for a slot of the fetch budget shared with other tasks first, if set via `set_fetch_slots`)
+        2. write: outputs are serialized, compressed and appended to the output file (which is rotated if necessary); the outputs of `commit_group_size` items (or whatever was written within `commit_group_interval_ms`) form one zstd frame
+        3. commit: once a frame is complete, the outcomes of its items are recorded in the task's queue DB
+
+        An input item is only removed from the input queue once its output has been written, so items that were in flight when a fatal error occurred are processed again later.
+        Outputs that were written but whose outcomes have not been recorded yet are covered by the journal (see `_recover_output_file`).
+        """
+        fetched_q: asyncio.Queue[FetchedItems | None] = asyncio.Queue(
+            self._stage_queue_size
+        )
+        written_q: asyncio.Queue[WrittenBatch | None] = asyncio.Queue(
+            self._stage_queue_size
+        )
+
+        self._throughput_samples.clear()
+        self._record_throughput_sample()
+        fetch_stage = asyncio.create_task(self._run_fetch_stage(fetched_q))
+        write_stage = asyncio.create_task(
+            self._run_write_stage(fetched_q, written_q)
         )
-        self._logger.info(f"Compressed output file to {self._output_fp_compressed}")
+        commit_stage = asyncio.create_task(self._run_commit_stage(written_q))
+        stages = [fetch_stage, write_stage, commit_stage]
 
-    async def _upload_compressed_output_file_delete_local(
-        self, db_session: AsyncDBSession
+        try:
+            pending = set(stages)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for stage in done:
+                    # fatal errors during fetching still allow the other stages to finish writing and committing what was fetched before
+                    if stage is not fetch_stage and stage.exception():
+                        raise stage.exception()  # type: ignore
+        finally:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            # items still leased at this point were not committed and stay in the input queue
+            self._queue_item_manager.release_all_leases()
+
+        if fetch_stage.exception():
+            raise fetch_stage.exception()  # type: ignore
+
+        if self._pause_requested:
+            await self._persist_paused_state(db_session)
+            self._logger.info("Paused")
+
+    async def _run_fetch_stage(self, fetched_q: asyncio.Queue[FetchedItems | None]):
+        async def work():
+            while not self._pause_requested:
+                self._log_if_it_is_time()
+                async with AsyncExitStack() as slot:
+                    await slot.enter_async_context(self._fetch_slot())
+                    items = self._lease_input_items()
+                    if not items:
+                        # remaining items (if any) are leased by other workers
+                        return
+                    try:
+                        async with aclosing(self._fetch_stream(items)) as stream:
+                            async for fetched in stream:
+                                if not fetched_q.full():
+                                    fetched_q.put_nowait(fetched)
+                                    continue
+                                # the write stage is behind (e.g. because the disk is slow): the fetch slot is not held while waiting for it, so other tasks can use it in the meantime
+                                await slot.aclose()
+                                await fetched_q.put(fetched)
+                                await slot.enter_async_context(self._fetch_slot())
+                    except BaseException:
+                        self._queue_item_manager.release_leases(items)
+                        raise
+
+        workers = [asyncio.create_task(work()) for _ in range(self._concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException as e:
+            # a fatal error in one worker stops all others; their leased items stay in the input queue
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # if all stages are stopped (see `_process_inputs`), the write stage does not wait for the end of the fetched items (and the queue might stay full forever)
+            if not isinstance(e, asyncio.CancelledError):
+                await fetched_q.put(None)
+            raise
+        await fetched_q.put(None)
+
+    def _fetch_slot(self) -> AbstractAsyncContextManager:
+        if self._fetch_slots is None:
+            return nullcontext()
+        return self._fetch_slots.slot(self._task_id)
+
+    async def _run_write_stage(
+        self,
+        fetched_q: asyncio.Queue[FetchedItems | None],
+        written_q: asyncio.Queue[WrittenBatch | None],
     ):
-        db_task = await db_session.get(DataFetchingTask, self._task_id)
-        if db_task is None:
-            raise ValueError(
-                f"Could not upload compressed output file for task: No task with ID {self._task_id} exists!"
+        loop = asyncio.get_running_loop()
+        group_item_count = 0
+        group_deadline: float | None = None
+        done = False
+        while not done:
+            batch: list[FetchedItems] = []
+            timeout = (
+                None
+                if group_deadline is None
+                else max(0.0, group_deadline - loop.time())
+            )
+            try:
+                next_fetched = await asyncio.wait_for(fetched_q.get(), timeout)
+                # write everything that is available at once to reduce the number of writes/flushes
+                while True:
+                    if next_fetched is None:
+                        done = True
+                        break
+                    batch.append(next_fetched)
+                    if fetched_q.empty():
+                        break
+                    next_fetched = fetched_q.get_nowait()
+            except TimeoutError:
+                # nothing more was fetched within the commit group interval, the current frame is ended below
+                pass
+
+            outputs = [output for fetched in batch for output in fetched.outputs]
+            outcomes = [outcome for fetched in batch for outcome in fetched.outcomes]
+            if batch:
+                await self._run_output_file_operation(
+                    self._write_batch, outputs, outcomes
+                )
+                group_item_count += len(outcomes)
+                if group_deadline is None:
+                    group_deadline = loop.time() + self._commit_group_interval_ms / 1000
+            if group_deadline is None:
+                # nothing was written since the current frame was started
+                continue
+
+            rotate = (
+                self._output_uncompressed_size
+                >= self._compression_file_size_limit_bytes
+            )
+            checkpoint = None
+            if (
+                done
+                or rotate
+                or group_item_count >= self._commit_group_size
+                or loop.time() >= group_deadline
+            ):
+                checkpoint = await self._run_output_file_operation(
+                    self._end_output_frame
+                )
+                group_item_count, group_deadline = 0, None
+            await written_q.put(WrittenBatch(outcomes=outcomes, checkpoint=checkpoint))
+
+            if rotate:
+                # make sure the outcomes for all items in the file are recorded before the file is uploaded
+                await written_q.join()
+                self._rotate_output_file()
+
+        await written_q.put(None)
+
+    async def _run_commit_stage(self, written_q: asyncio.Queue[WrittenBatch | None]):
+        group: list[WrittenBatch] = []
+        while True:
+            written = await written_q.get()
+            if written is None:
+                # the write stage ends the current frame before it stops, so all written batches have been committed at this point
+                written_q.task_done()
+                return
+
+            group.append(written)
+            if written.checkpoint is not None:
+                await self._commit_group(group, written.checkpoint, written_q)
+                group = []
+
+    async def _commit_group(
+        self,
+        group: list[WrittenBatch],
+        checkpoint: OutputCheckpoint,
+        written_q: asyncio.Queue[WrittenBatch | None],
+    ):
+        # outputs must be on disk before their inputs are removed from the input queue
+        await asyncio.to_thread(os.fsync, self._output_file.fileno())
+        self._queue_item_manager.record_outcomes(
+            [outcome for written in group for outcome in written.outcomes],
+            output_checkpoint=checkpoint,
+        )
+        self._record_throughput_sample()
+        for _ in group:
+            written_q.task_done()
+
+    async def _run_output_file_operation[R](
+        self, operation_fn: Callable[..., R], *args: Any
+    ) -> R:
+        """
+        Runs the given blocking operation on the output file in a separate thread.
+        """
+        operation = asyncio.ensure_future(asyncio.to_thread(operation_fn, *args))
+        try:
+            return await asyncio.shield(operation)
+        except asyncio.CancelledError:
+            # the thread cannot be interrupted; wait for it so that nobody touches the files while it is still writing
+            await operation
+            raise
+
+    def _recover_output_file(self):
+        """
+        Brings the output file in line with the outcomes recorded in the task's queue DB, which may be out of sync after a crash or fatal error:
+        - outcomes for outputs that were written (according to the journal) but not recorded yet are recorded, so the respective inputs are not fetched again
+        - any data after the last journaled batch is truncated (the respective inputs are still in the input queue and will be fetched again)
+
+        Everything after the checkpoint is part of a frame that may not have been finished. It is decompressed (which only requires memory for the outputs of a single commit group) and the outputs of the journaled batches are written to a new frame in its place.
+        Afterwards, a new output writer is created (anything the previous writer still buffered is discarded).
+        """
+        self._output_file.close()
+        if os.path.exists(self._legacy_output_fp_compressed):
+            self._logger.info(
+                f"Uploading leftover compressed output file {self._legacy_output_fp_compressed}"
+            )
+            self._hand_off_file(self._legacy_output_fp_compressed)
+
+        checkpoint = self._queue_item_manager.output_checkpoint
+        size = (
+            os.path.getsize(self._output_fp) if os.path.exists(self._output_fp) else 0
+        )
+
+        if size < checkpoint.offset:
+            if size > 0:
+                # otherwise, the file was handed off for upload before the checkpoint could be reset
+                self._logger.error(
+                    f"Output file {self._output_fp} is smaller ({size} bytes) than expected ({checkpoint.offset} bytes); outputs of already processed inputs are missing!"
+                )
+            checkpoint = OutputCheckpoint(seq=checkpoint.seq, offset=size)
+            self._queue_item_manager.set_output_checkpoint(checkpoint)
+        elif size > checkpoint.offset:
+            with open(self._output_fp, "rb") as f:
+                f.seek(checkpoint.offset)
+                available = decompress_available_bytes(f.read())
+
+            pending: list[tuple[int, QueueType]] = []
+            pending_seq: int | None = None
+            pending_length = 0
+            with open(self._journal_fp, "rb") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # last line was not written completely
+                        break
+                    if entry["seq"] <= checkpoint.seq:
+                        continue
+                    if pending_length + entry["length"] > len(available):
+                        break
+                    pending.extend(
+                        (item_id, outcome) for item_id, outcome in entry["outcomes"]
+                    )
+                    pending_seq = entry["seq"]
+                    pending_length += entry["length"]
+
+            if len(available) > pending_length:
+                self._logger.warning(
+                    f"Discarding {len(available) - pending_length} bytes of unrecorded outputs from {self._output_fp} (respective inputs will be fetched again)"
+                )
+            os.truncate(self._output_fp, checkpoint.offset)
+            if pending_length > 0:
+                with open(self._output_fp, "ab") as f:
+                    with create_stream_writer(f) as writer:
+                        writer.write(available[:pending_length])
+                    f.flush()
+                    os.fsync(f.fileno())
+            if pending_seq is not None:
+                checkpoint = OutputCheckpoint(
+                    seq=pending_seq,
+                    offset=os.path.getsize(self._output_fp),
+                    uncompressed_offset=checkpoint.uncompressed_offset
+                    + pending_length,
+                )
+                self._record_journaled_outcomes(pending, checkpoint)
+
+        self._journal_file.truncate(0)
+        self._output_seq = checkpoint.seq
+        self._output_uncompressed_size = checkpoint.uncompressed_offset
+        self._open_output_file()
+
+    async def _recover_legacy_output_file(self):
+        """
+        Previous versions wrote outputs to an uncompressed file (journaling its size after each batch). If such a file is left over, the outcomes for the batches that were written to it completely are recorded, and the whole file is compressed (in a separate thread, as the file may be large) and handed off for upload.
+
+        Outputs written after the last journaled batch are kept as well, so a few inputs may end up with their outputs uploaded twice.
+        """
+        checkpoint = self._queue_item_manager.output_checkpoint
+        size = os.path.getsize(self._legacy_output_fp)
+
+        pending: list[tuple[int, QueueType]] = []
+        pending_seq: int | None = None
+        with open(self._journal_fp, "rb") as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if entry["seq"] <= checkpoint.seq:
+                    continue
+                if "offset" not in entry or entry["offset"] > size:
+                    break
+                pending.extend(
+                    (item_id, outcome) for item_id, outcome in entry["outcomes"]
+                )
+                pending_seq = entry["seq"]
+        if pending_seq is not None:
+            checkpoint = OutputCheckpoint(seq=pending_seq, offset=checkpoint.offset)
+            self._record_journaled_outcomes(pending, checkpoint)
+
+        if size > 0:
+            compressed_fp = await asyncio.to_thread(
+                compress_file,
+                input_file_path=self._legacy_output_fp,
+                output_file_path=f"{self._legacy_output_fp}.tmp.zst",
+                threads=-1,
             )
-        last_modified = datetime.fromtimestamp(
-            os.path.getmtime(self._output_fp_compressed), tz=timezone.utc
+            self._hand_off_file(compressed_fp)
+        os.remove(self._legacy_output_fp)
+        self._logger.info(
+            f"Compressed uncompressed output file {self._legacy_output_fp} for upload"
         )
-        s3_key = f"{self._output_s3_prefix}/{last_modified.strftime('%Y-%m-%d_%H-%M-%S')}_{self._server_ip}.jsonl.zst"
-        upload_size_bytes = os.path.getsize(self._output_fp_compressed)
-        upload_meta = await upload_file(
-            local_path=self._output_fp_compressed,
-            s3_key=s3_key,
-            remove_after_upload=True,
+
+        self._queue_item_manager.set_output_checkpoint(
+            OutputCheckpoint(seq=checkpoint.seq, offset=0)
         )
-        s3_bucket = upload_meta.s3_bucket
-        s3_endpoint_url = upload_meta.s3_endpoint_url
-        s3_key = upload_meta.s3_key
-        db_task.file_uploads.append(
-            S3FileUpload(
-                s3_key=s3_key,
-                s3_bucket=s3_bucket,
-                s3_endpoint_url=s3_endpoint_url,
-                size_bytes=upload_size_bytes,
+        self._journal_file.truncate(0)
+
+    def _record_journaled_outcomes(
+        self, outcomes: list[tuple[int, QueueType]], checkpoint: OutputCheckpoint
+    ):
+        items = {
+            item.id: item
+            for item in self._queue_item_manager.get_input_items(
+                [item_id for item_id, _ in outcomes]
             )
+        }
+        self._queue_item_manager.record_outcomes(
+            [
+                (items[item_id], outcome)
+                for item_id, outcome in outcomes
+                if item_id in items
+            ],
+            output_checkpoint=checkpoint,
         )
-        await db_session.commit()
         self._logger.info(
-            f"Uploaded compressed output file to S3. endpoint: {s3_endpoint_url}, bucket: {s3_bucket}, key: {s3_key})"
+            f"Recorded outcomes for {len(outcomes)} items whose outputs were written to {self._output_fp} before the last shutdown"
         )
 
-    async def _write_output(self, output: Any, db_session: AsyncDBSession):
-        if isinstance(output, dict):
-            output["observed_at"] = datetime.now(timezone.utc).isoformat()
+    def _open_output_file(self):
+        self._output_file = open(self._output_fp, "ab")
+        self._output_writer = create_stream_writer(self._output_file)
+        self._frame_has_data = False
+
+    def _hand_off_output_file(self) -> bool:
+        """
+        Closes the output file and hands it off to the output uploader. As outputs are compressed while they are written, this is cheap.
+
+        Returns `False` if nothing was written to the output file (it is deleted in that case).
+        """
+        self._output_file.close()
+        handed_off = os.path.getsize(self._output_fp) > 0
+        if handed_off:
+            self._hand_off_file(self._output_fp)
         else:
-            output = {
-                "data": output,
-                "observed_at": datetime.now(timezone.utc).isoformat(),
-            }
-        self._output_file.write(json.dumps(output) + "\n")
-        self._output_file.flush()
-        self._logger.debug(f"Wrote output to {self._output_fp}")
+            os.remove(self._output_fp)
+
+        # all outputs written so far have been handed off
+        self._queue_item_manager.set_output_checkpoint(
+            OutputCheckpoint(seq=self._output_seq, offset=0)
+        )
+        self._journal_file.truncate(0)
+        self._output_uncompressed_size = 0
+        return handed_off
 
+    def _hand_off_file(self, file_path: str):
+        """
+        Moves the given (compressed) output file to a new, unique path and adds it to the pending uploads of the output uploader.
+        """
+        handed_off_at = datetime.now(timezone.utc)
         if (
-            os.path.getsize(self._output_file.name)
-            >= self._compression_file_size_limit_bytes
+            self._last_handed_off_at is not None
+            and handed_off_at <= self._last_handed_off_at
         ):
-            self._output_file.close()
-            await self._compress_output_file_delete_uncompressed()
-            await self._upload_compressed_output_file_delete_local(db_session)
-            await db_session.commit()
+            # the timestamp identifies the file, so it must be unique
+            handed_off_at = self._last_handed_off_at + timedelta(microseconds=1)
+        self._last_handed_off_at = handed_off_at
 
-            self._output_file = open(self._output_fp, "a")
-            self._logger.info("Rotated output file")
+        file_id = f"{handed_off_at.strftime('%Y-%m-%d_%H-%M-%S-%f')}_{self._server_ip}_{self._task_id}"
+        s3_key = f"{self._output_s3_prefix}/{file_id}.jsonl.zst"
+        upload_fp = f"{self._outputs_local_storage_dir}/{file_id}.jsonl.zst"
+        # the upload is added to the manifest first, so the file is never moved without being uploaded eventually
+        self._output_uploader.add(
+            task_id=self._task_id, local_path=upload_fp, s3_key=s3_key
+        )
+        os.replace(file_path, upload_fp)
+        self._logger.info(f"Handed off output file {upload_fp} for upload to S3")
 
-    async def _handle_success(self, db_session: AsyncDBSession, input_item: T, output):
-        await self._write_output(output, db_session)
+    async def _wait_for_uploads(self):
+        pending = self._output_uploader.pending_uploads(self._task_id)
+        if pending:
+            self._logger.info(
+                f"Waiting for {len(pending)} output file(s) to be uploaded"
+            )
+            await self._output_uploader.wait_for_uploads(self._task_id)
+
+    def _annotate_output(self, output: Any) -> dict[str, Any]:
+        if isinstance(output, dict):
+            output["observed_at"] = datetime.now(timezone.utc).isoformat()
+            return output
+        return {
+            "data": output,
+            "observed_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def _write_batch(
+        self,
+        outputs: list[dict[str, Any]],
+        outcomes: list[tuple[LeasedInputItem, QueueType]],
+    ):
+        """
+        Appends the given outputs to the current frame of the output file and the outcomes of the respective input items to the journal.
+
+        The compressed outputs are flushed to the output file before the journal entry is written, so the outputs of every journaled batch can be recovered after a crash (see `_recover_output_file`).
+        """
+        length = 0
+        if outputs:
+            data = b"".join(
+                json.dumps(output).encode("utf-8") + b"\n" for output in outputs
+            )
+            self._output_writer.write(data)
+            # also flushes the output file
+            self._output_writer.flush(zstd.FLUSH_BLOCK)
+            length = len(data)
+            self._frame_has_data = True
+            self._bytes_written += length
+            self._output_uncompressed_size += length
+            self._logger.debug(f"Wrote {len(outputs)} outputs to {self._output_fp}")
+        self._output_seq += 1
+        entry = {
+            "seq": self._output_seq,
+            "length": length,
+            "outcomes": [[item.id, outcome] for item, outcome in outcomes],
+        }
+        self._journal_file.write(json.dumps(entry).encode("utf-8") + b"\n")
+        self._journal_file.flush()
+
+    def _end_output_frame(self) -> OutputCheckpoint:
+        """
+        Ends the current zstd frame of the output file (the next write starts a new one) and returns the output checkpoint for the end of the frame.
+        """
+        if self._frame_has_data:
+            self._output_writer.flush(zstd.FLUSH_FRAME)
+            self._frame_has_data = False
+        return OutputCheckpoint(
+            seq=self._output_seq,
+            offset=os.fstat(self._output_file.fileno()).st_size,
+            uncompressed_offset=self._output_uncompressed_size,
+        )
+
+    def _rotate_output_file(self):
+        self._hand_off_output_file()
+        self._open_output_file()
+        self._logger.info("Rotated output file")
 
     def _handle_failure(self, input_item: T, error: Exception):
         self._logger.error(f"Failed to process input {input_item}", exc_info=True)
@@ -334,6 +999,10 @@ class TaskProcessor[T](ABC):
 
 
 class SequentialTaskProcessor[T](TaskProcessor[T]):
+    """
+    Fetches input items one at a time, using `concurrency` workers that share the input queue.
+    """
+
     def __init__(
         self,
         server_ip: str,
@@ -341,11 +1010,15 @@ class SequentialTaskProcessor[T](TaskProcessor[T]):
         outputs_s3_prefix: str,
         outputs_local_storage_dir: str,
         queue_item_manager: TaskQueueItemManager,
+        output_uploader: OutputUploader,
         logger: Logger,
         fetch_fn: SingleItemFetchFunction[T],
+        concurrency: int = 1,
         compression_file_size_limit_bytes: int = (
             500 * 1024 * 1024
         ),  # assuming 3:1 compression ratio, this should result in 500 MB files
+        commit_group_size: int = 500,
+        commit_group_interval_ms: int = 1000,
     ):
         super().__init__(
             server_ip=server_ip,
@@ -353,37 +1026,99 @@ class SequentialTaskProcessor[T](TaskProcessor[T]):
             outputs_s3_prefix=outputs_s3_prefix,
             outputs_local_storage_dir=outputs_local_storage_dir,
             queue_item_manager=queue_item_manager,
+            output_uploader=output_uploader,
             logger=logger,
+            concurrency=concurrency,
             compression_file_size_limit_bytes=compression_file_size_limit_bytes,
+            commit_group_size=commit_group_size,
+            commit_group_interval_ms=commit_group_interval_ms,
         )
         self._fetch_fn = fetch_fn
 
-    async def _process_inputs(self, db_session: AsyncDBSession):
-        async def handle_success(input_item: T, output: Any):
-            await self._handle_success(db_session, input_item, output)
+    def _lease_input_items(self) -> list[LeasedInputItem]:
+        return self._queue_item_manager.lease_input_items(1)
 
-        async def handle_failure(input_item: T, error: Exception):
-            self._handle_failure(input_item, error)
+    async def _fetch(self, items: list[LeasedInputItem]) -> FetchedItems:
+        fetched, on_success, on_failure, on_no_data = (
+            self._create_fetched_items_collector()
+        )
+        fetched.outcomes = await self._queue_item_manager.process_leased_input_item(
+            processing_fn=self._fetch_fn,
+            item=items[0],
+            on_success=on_success,
+            on_no_data_returned=on_no_data,
+            on_non_fatal_error=on_failure,
+        )
+        return fetched
 
-        async def handle_input_without_output(input_item: T):
-            self._handle_input_without_output(input_item)
 
-        while self._queue_item_manager.remaining_input_count > 0:
-            self._log_if_it_is_time()
-            if self._pause_requested:
-                await self._persist_paused_state(db_session)
-                self._logger.info("Paused")
-                return
+class BatchTaskProcessor[T](TaskProcessor[T]):
+    def __init__(
+        self,
+        server_ip: str,
+        task_id: int,
+        outputs_s3_prefix: str,
+        outputs_local_storage_dir: str,
+        queue_item_manager: TaskQueueItemManager,
+        output_uploader: OutputUploader,
+        logger: Logger,
+        fetch_fn: BatchFetchFunction[T],
+        batch_size: int,
+        concurrency: int = 1,
+        compression_file_size_limit_bytes: int = (
+            500 * 1024 * 1024
+        ),  # assuming 3:1 compression ratio, this should result in 500 MB files
+        commit_group_size: int = 500,
+        commit_group_interval_ms: int = 1000,
+    ):
+        super().__init__(
+            server_ip=server_ip,
+            task_id=task_id,
+            outputs_s3_prefix=outputs_s3_prefix,
+            outputs_local_storage_dir=outputs_local_storage_dir,
+            queue_item_manager=queue_item_manager,
+            output_uploader=output_uploader,
+            logger=logger,
+            concurrency=concurrency,
+            compression_file_size_limit_bytes=compression_file_size_limit_bytes,
+            commit_group_size=commit_group_size,
+            commit_group_interval_ms=commit_group_interval_ms,
+        )
+        if batch_size < 2:
+            raise ValueError("Batch size must be greater than 1.")
+        self._fetch_fn = fetch_fn
+        self._batch_size = batch_size
 
-            await self._queue_item_manager.process_next_input_item(
+    def _lease_input_items(self) -> list[LeasedInputItem]:
+        return self._queue_item_manager.lease_input_items(self._batch_size)
+
+    async def _fetch(self, items: list[LeasedInputItem]) -> FetchedItems:
+        fetched, on_success, on_failure, on_no_data = (
+            self._create_fetched_items_collector()
+        )
+        fetched.outcomes = (
+            await self._queue_item_manager.process_leased_input_item_chunk(
                 processing_fn=self._fetch_fn,
-                on_success=handle_success,
-                on_no_data_returned=handle_input_without_output,
-                on_non_fatal_error=handle_failure,
+                items=items,
+                on_success=on_success,
+                on_no_data_returned=on_no_data,
+                on_non_fatal_error=on_failure,
             )
+        )
+        return fetched
 
 
-class BatchTaskProcessor[T](TaskProcessor[T]):
+class StreamingTaskProcessor[T](TaskProcessor[T]):
+    """
+    Fetches input items one at a time (using `concurrency` workers that share the input queue) with a fetch function that yields the records for each input page by page.
+
+    Each page is written to the output file as soon as it arrives, so that at most a few pages per input are held in memory, no matter how many records there are for the input.
+    Every record is written as a separate output that references its input as `parent_id` (`{"parent_id": ..., "data": ..., "observed_at": ...}`).
+
+    The outcome of an input is only recorded after its last page has been written. If processing is interrupted (or a non-fatal error occurs) after some of its pages were written,
+    those pages stay in the output file, so the records of inputs that are fetched again may appear more than once (they can be deduplicated via `parent_id`).
+    """
+
     def __init__(
         self,
         server_ip: str,
@@ -391,12 +1126,15 @@ class BatchTaskProcessor[T](TaskProcessor[T]):
         outputs_s3_prefix: str,
         outputs_local_storage_dir: str,
         queue_item_manager: TaskQueueItemManager,
+        output_uploader: OutputUploader,
         logger: Logger,
-        fetch_fn: BatchFetchFunction[T],
-        batch_size: int,
+        fetch_fn: StreamingFetchFunction[T],
+        concurrency: int = 1,
         compression_file_size_limit_bytes: int = (
             500 * 1024 * 1024
         ),  # assuming 3:1 compression ratio, this should result in 500 MB files
+        commit_group_size: int = 500,
+        commit_group_interval_ms: int = 1000,
     ):
         super().__init__(
             server_ip=server_ip,
@@ -404,33 +1142,53 @@ class BatchTaskProcessor[T](TaskProcessor[T]):
             outputs_s3_prefix=outputs_s3_prefix,
             outputs_local_storage_dir=outputs_local_storage_dir,
             queue_item_manager=queue_item_manager,
+            output_uploader=output_uploader,
             logger=logger,
+            concurrency=concurrency,
             compression_file_size_limit_bytes=compression_file_size_limit_bytes,
+            commit_group_size=commit_group_size,
+            commit_group_interval_ms=commit_group_interval_ms,
         )
         self._fetch_fn = fetch_fn
-        self._batch_size = batch_size
 
-    async def _process_inputs(self, db_session: AsyncDBSession):
-        async def handle_success(input_item: T, output: Any):
-            await self._handle_success(db_session, input_item, output)
+    def _lease_input_items(self) -> list[LeasedInputItem]:
+        return self._queue_item_manager.lease_input_items(1)
 
-        async def handle_failure(input_item: T, error: Exception):
-            self._handle_failure(input_item, error)
+    async def _fetch(self, items: list[LeasedInputItem]) -> FetchedItems:
+        fetched = FetchedItems(outcomes=[])
+        async for part in self._fetch_stream(items):
+            fetched.outputs.extend(part.outputs)
+            fetched.outcomes.extend(part.outcomes)
+        return fetched
 
-        async def handle_input_without_output(input_item: T):
-            self._handle_input_without_output(input_item)
+    async def _fetch_stream(
+        self, items: list[LeasedInputItem]
+    ) -> AsyncIterator[FetchedItems]:
+        item = items[0]
+        has_records = False
+        try:
+            async for records in self._fetch_fn(item.data):
+                if not records:
+                    continue
+                has_records = True
+                yield FetchedItems(
+                    outcomes=[],
+                    outputs=[self._annotate_record(item.data, r) for r in records],
+                )
+        except NonFatalProcessingError as e:
+            self._handle_failure(item.data, e)
+            yield FetchedItems(outcomes=[(item, "failures")])
+            return
 
-        while self._queue_item_manager.remaining_input_count > 0:
-            self._log_if_it_is_time()
-            if self._pause_requested:
-                await self._persist_paused_state(db_session)
-                self._logger.info("Paused")
-                return
+        if has_records:
+            yield FetchedItems(outcomes=[(item, "successes")])
+        else:
+            self._handle_input_without_output(item.data)
+            yield FetchedItems(outcomes=[(item, "inputs-without-output")])
 
-            await self._queue_item_manager.process_next_input_item_chunk(
-                processing_fn=self._fetch_fn,
-                on_success=handle_success,
-                on_no_data_returned=handle_input_without_output,
-                on_non_fatal_error=handle_failure,
-                chunk_size=self._batch_size,
-            )
+    def _annotate_record(self, input_item: T, record: Any) -> dict[str, Any]:
+        return {
+            "parent_id": input_item,
+            "data": record,
+            "observed_at": datetime.now(timezone.utc).isoformat(),
+        }
@@ -1,16 +1,27 @@
-from typing import Sequence
-from sqlalchemy import func, select
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+import os
+import sqlite3
+import time
+from typing import AsyncIterator, Sequence
 import json
 
-from app.db import DatabaseSessionManager
+from app.config import TASK_PROGRESS_DB_DIR, settings
 from app.db.models import JSONValue
-from app.tasks.progress.db_models import (
-    UniqueQueueInputs,
-    QueueSuccesses,
-    QueueFailures,
-    QueueInputsWithoutOutput,
+from app.tasks import task_processors
+from app.tasks.progress.public_models import (
+    TaskOutputUploadModel,
+    TaskProgressModel,
+    TaskProgressUpdateModel,
+    TaskProgressWithIdModel,
 )
-from app.tasks.progress.public_models import TaskProgressModel
+from app.tasks.queue_item_management import (
+    QueueItemCounts,
+    open_task_progress_db,
+    task_progress_db_needs_migration,
+)
+from app.tasks.uploads import OutputFileUpload, output_uploader
 
 
 def bytes_to_json(data: bytes) -> JSONValue:
@@ -21,30 +32,208 @@ def bytes_seq_to_json(data: Sequence[bytes]) -> list[JSONValue]:
     return [json.loads(d.decode("utf-8")) for d in data]
 
 
-class TaskProgressTracker:
-    def __init__(self, task_progress_db_dir: str, task_id: int):
-        self._session_manager = DatabaseSessionManager(
-            f"sqlite+aiosqlite:///{task_progress_db_dir}/{task_id}.db"
+class TaskProgressRegistry:
+    """
+    Provides the progress of tasks, reading from the task progress DBs as little as possible.
+
+    For tasks with a task processor (in `task_processors`), progress is taken from the in-memory counts of the processor's `TaskQueueItemManager`.
+    For all other tasks, progress is read from the task progress DB via a read-only connection. Connections are cached (up to `max_open_dbs`, least recently used ones are closed first), so repeatedly polling the same tasks does not open new connections.
+    """
+
+    def __init__(self, task_progress_db_dir: str, max_open_dbs: int = 64):
+        self._task_progress_db_dir = task_progress_db_dir
+
+        self._max_open_dbs = max_open_dbs
+        """
+        The maximum number of task progress DB connections kept open.
+        """
+
+        self._connections: OrderedDict[int, sqlite3.Connection] = OrderedDict()
+        """
+        The cached read-only connections, keyed by task ID. The least recently used connection comes first.
+        """
+
+        self._migrated_db_paths: set[str] = set()
+        """
+        The paths of the task progress DBs that are known to be migrated already (see `_connect_and_read_counts`).
+        """
+
+    async def get_progress(self, task_id: int) -> TaskProgressModel:
+        processor = task_processors.get(task_id)
+        if processor is not None:
+            progress = self._to_progress_model(processor.queue_item_counts)
+            progress.estimated_completion_at = processor.estimated_completion_at
+            return progress
+
+        counts = await self._read_counts(task_id)
+        if counts is None:
+            # no inputs were added to the task yet
+            counts = {}
+        return TaskProgressModel(
+            success_count=counts.get("successes", 0),
+            failure_count=counts.get("failures", 0),
+            inputs_without_output_count=counts.get("inputs-without-output", 0),
+            remaining_count=counts.get("inputs", 0),
         )
 
-    async def get_progress(self) -> TaskProgressModel:
-        async with self._session_manager.session() as session:
-            success_count = (
-                await session.execute(select(func.count(QueueSuccesses._id)))
-            ).scalar_one()
-            failure_count = (
-                await session.execute(select(func.count(QueueFailures._id)))
-            ).scalar_one()
-            inputs_without_output_count = (
-                await session.execute(select(func.count(QueueInputsWithoutOutput._id)))
-            ).scalar_one()
-            remaining_count = (
-                await session.execute(select(func.count(UniqueQueueInputs._id)))
-            ).scalar_one()
-
-            return TaskProgressModel(
-                success_count=success_count,
-                failure_count=failure_count,
-                inputs_without_output_count=inputs_without_output_count,
-                remaining_count=remaining_count,
+    async def get_progress_of_tasks(
+        self, task_ids: Sequence[int], max_concurrency: int = 8
+    ) -> list[TaskProgressWithIdModel]:
+        """
+        Returns the progress of the tasks with the given IDs (in the same order).
+
+        Task progress DBs that are not opened yet are opened concurrently, but at most `max_concurrency` at a time.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def get_progress_with_id(task_id: int) -> TaskProgressWithIdModel:
+            async with semaphore:
+                progress = await self.get_progress(task_id)
+            return TaskProgressWithIdModel(task_id=task_id, **progress.model_dump())
+
+        return list(
+            await asyncio.gather(
+                *[get_progress_with_id(task_id) for task_id in task_ids]
             )
+        )
+
+    async def stream_progress(
+        self,
+        task_id: int,
+        interval_seconds: float,
+        max_silence_seconds: float = 15,
+    ) -> AsyncIterator[TaskProgressUpdateModel | TaskOutputUploadModel]:
+        """
+        Yields a snapshot of the progress of the task every `interval_seconds` (if it changed since the previous one, or if nothing was yielded for `max_silence_seconds`) and any output files that were uploaded in the meantime.
+
+        While the task is being processed, snapshots come from the task's processor (including throughput information); otherwise, they are read from the task progress DB.
+        Runs until the consumer stops iterating.
+        """
+        uploads: asyncio.Queue[OutputFileUpload] = asyncio.Queue(100)
+        output_uploader.add_upload_listener(task_id, uploads)
+        previous: TaskProgressUpdateModel | None = None
+        previous_processed_count = 0
+        previous_time = 0.0
+        last_yielded_at = 0.0
+        try:
+            while True:
+                while not uploads.empty():
+                    upload = uploads.get_nowait()
+                    last_yielded_at = time.monotonic()
+                    yield TaskOutputUploadModel(
+                        task_id=task_id,
+                        s3_key=upload.s3_key,
+                        s3_bucket=upload.s3_bucket,
+                        s3_endpoint_url=upload.s3_endpoint_url,
+                        size_bytes=upload.size_bytes,
+                        uploaded_at=upload.uploaded_at,
+                    )
+
+                processor = task_processors.get(task_id)
+                progress = await self.get_progress(task_id)
+                processed_count = (
+                    progress.success_count
+                    + progress.failure_count
+                    + progress.inputs_without_output_count
+                )
+                now = time.monotonic()
+                items_per_second = None
+                if processor is not None and previous is not None:
+                    items_per_second = (processed_count - previous_processed_count) / (
+                        now - previous_time
+                    )
+                update = TaskProgressUpdateModel(
+                    task_id=task_id,
+                    **progress.model_dump(),
+                    observed_at=datetime.now(timezone.utc),
+                    is_processing=processor is not None,
+                    items_per_second=items_per_second,
+                    bytes_written=processor.bytes_written if processor else None,
+                    output_file_size_bytes=(
+                        processor.output_file_size_bytes if processor else None
+                    ),
+                )
+                if (
+                    previous is None
+                    or now - last_yielded_at >= max_silence_seconds
+                    # the estimated completion time shifts a little with every snapshot, which alone is not worth an update
+                    or update.model_dump(
+                        exclude={"observed_at", "estimated_completion_at"}
+                    )
+                    != previous.model_dump(
+                        exclude={"observed_at", "estimated_completion_at"}
+                    )
+                ):
+                    last_yielded_at = now
+                    yield update
+                previous = update
+                previous_processed_count = processed_count
+                previous_time = now
+
+                await asyncio.sleep(interval_seconds)
+        finally:
+            output_uploader.remove_upload_listener(task_id, uploads)
+
+    def close(self):
+        """
+        Closes all cached connections.
+        """
+        while self._connections:
+            _, conn = self._connections.popitem()
+            conn.close()
+
+    def _to_progress_model(self, counts: QueueItemCounts) -> TaskProgressModel:
+        return TaskProgressModel(
+            success_count=counts.successes,
+            failure_count=counts.failures,
+            inputs_without_output_count=counts.inputs_without_output,
+            remaining_count=counts.remaining,
+        )
+
+    async def _read_counts(self, task_id: int) -> dict[str, int] | None:
+        conn = self._connections.get(task_id)
+        if conn is not None:
+            self._connections.move_to_end(task_id)
+            return _read_counts(conn)
+
+        db_path = os.path.join(self._task_progress_db_dir, f"{task_id}.db")
+        if not os.path.exists(db_path):
+            return None
+        conn, counts = await asyncio.to_thread(self._connect_and_read_counts, db_path)
+        if task_id in self._connections:
+            # opened concurrently for another request
+            conn.close()
+            return counts
+        self._connections[task_id] = conn
+        while len(self._connections) > self._max_open_dbs:
+            _, evicted = self._connections.popitem(last=False)
+            evicted.close()
+        return counts
+
+    def _connect_and_read_counts(
+        self, db_path: str
+    ) -> tuple[sqlite3.Connection, dict[str, int]]:
+        conn = sqlite3.connect(
+            f"file:{db_path}?mode=ro", uri=True, check_same_thread=False
+        )
+        if db_path not in self._migrated_db_paths:
+            if task_progress_db_needs_migration(conn):
+                # task progress DBs created by older versions have to be migrated once (which requires a writable connection)
+                conn.close()
+                open_task_progress_db(db_path).close()
+                conn = sqlite3.connect(
+                    f"file:{db_path}?mode=ro", uri=True, check_same_thread=False
+                )
+            self._migrated_db_paths.add(db_path)
+        return conn, _read_counts(conn)
+
+
+def _read_counts(conn: sqlite3.Connection) -> dict[str, int]:
+    # the counts are maintained by the task processor, so this is a cheap lookup
+    return dict(conn.execute("SELECT status, count FROM task_item_counts").fetchall())
+
+
+progress_registry = TaskProgressRegistry(
+    task_progress_db_dir=TASK_PROGRESS_DB_DIR,
+    max_open_dbs=settings.task_progress_max_open_dbs,
+)
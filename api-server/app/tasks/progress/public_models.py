@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel, ConfigDict
 
 
@@ -32,3 +33,63 @@ class TaskProgressModel(BaseModel):
     """
     The number of items that are left to process.
     """
+
+    estimated_completion_at: datetime | None = None
+    """
+    When the task is expected to be done, based on the throughput measured over the last minute (only available while the task is being processed on this server).
+    """
+
+
+class TaskProgressWithIdModel(TaskProgressModel):
+    """
+    The progress of a specific data fetching task instance, including the task's ID (used for returning the progress of several tasks at once).
+    """
+
+    task_id: int
+    """
+    The ID of the task.
+    """
+
+
+class TaskProgressUpdateModel(TaskProgressWithIdModel):
+    """
+    A snapshot of the progress of a task, sent via the task progress stream whenever it changed.
+    """
+
+    observed_at: datetime
+    """
+    When the snapshot was taken.
+    """
+
+    is_processing: bool
+    """
+    Whether the task is currently being processed on this server. If not, the fields below are not available.
+    """
+
+    items_per_second: float | None
+    """
+    The number of input items processed per second since the previous snapshot.
+    """
+
+    bytes_written: int | None
+    """
+    The number of (uncompressed) bytes of output written by the task's current processor.
+    """
+
+    output_file_size_bytes: int | None
+    """
+    The current size of the task's (compressed) output file.
+    """
+
+
+class TaskOutputUploadModel(BaseModel):
+    """
+    Information about an output file of a task that was uploaded to S3, sent via the task progress stream.
+    """
+
+    task_id: int
+    s3_key: str
+    s3_bucket: str
+    s3_endpoint_url: str
+    size_bytes: int
+    uploaded_at: datetime
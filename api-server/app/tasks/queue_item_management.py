@@ -1,9 +1,10 @@
 import json
 import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
 from typing import Any, Awaitable, Callable, Literal, Sequence
 import os
-import persistqueue
-from persistqueue.serializers import json as json_serializer
 from pydantic import BaseModel
 
 from app.tasks.common import (
@@ -54,17 +55,229 @@ type QueueItemProcessingNonFatalErrorCallback = Callable[
     [Any, Exception], Awaitable[None]
 ]
 
-_table_names: dict[QueueType, str] = {
+_queue_types: tuple[QueueType, ...] = (
+    "inputs",
+    "successes",
+    "failures",
+    "inputs-without-output",
+)
+
+_legacy_table_names: dict[QueueType, str] = {
     "inputs": "unique_queue_inputs",
     "successes": "queue_successes",
     "failures": "queue_failures",
     "inputs-without-output": "queue_inputs_without_output",
 }
 """
-A dictionary mapping queue types to their corresponding SQLite table names.
+A dictionary mapping queue types to the SQLite table names used by older versions of this module (which stored each queue in a separate `persist-queue` table).
+
+Task progress DBs that still contain these tables are migrated to the `task_items` table when they are opened (see `open_task_progress_db`).
 """
 
 
+def _serialize(item: Any) -> bytes:
+    # keys are sorted so that equal inputs are detected as duplicates (same format as the one used by `persist-queue`, so migrated items are deduplicated as well)
+    return json.dumps(item, sort_keys=True).encode("utf-8")
+
+
+def _deserialize(data: bytes) -> Any:
+    return json.loads(data.decode("utf-8"))
+
+
+def open_task_progress_db(db_path: str) -> sqlite3.Connection:
+    """
+    Opens the task progress DB at the given path, creating the tables if they do not exist yet.
+
+    All items of a task are stored in a single `task_items` table; the `status` column holds the queue the item is currently in (see `QueueType`), so recording an outcome is a single `UPDATE` instead of copying the item to another table.
+    Each input is stored only once (there is a unique index on the serialized input).
+
+    The number of items in each queue is maintained in the `task_item_counts` table (updated in the same transaction as the items), so counts can be read in constant time.
+
+    Input items handed out to other nodes (see `TaskQueueItemManager.lease_input_chunk`) are tracked in the `input_chunk_leases` table.
+
+    Task progress DBs created by older versions (with one `persist-queue` table per queue) are migrated in place.
+    """
+    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS task_items (
+          _id INTEGER PRIMARY KEY AUTOINCREMENT,
+          data BLOB NOT NULL,
+          status TEXT NOT NULL,
+          timestamp FLOAT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_task_items_data ON task_items (data)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS ix_task_items_status ON task_items (status, _id)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS task_item_counts (status TEXT PRIMARY KEY, count INTEGER NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS task_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS input_chunk_leases (item_id INTEGER PRIMARY KEY, lease_id TEXT NOT NULL, holder TEXT NOT NULL, expires_at FLOAT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS ix_input_chunk_leases_lease_id ON input_chunk_leases (lease_id)"
+    )
+    _migrate(conn)
+    return conn
+
+
+def _get_legacy_queue_tables(conn: sqlite3.Connection) -> dict[QueueType, str]:
+    existing_tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    return {
+        queue_type: table_name
+        for queue_type, table_name in _legacy_table_names.items()
+        if table_name in existing_tables
+    }
+
+
+def _needs_migration(conn: sqlite3.Connection) -> bool:
+    if _get_legacy_queue_tables(conn):
+        return True
+    counted_queue_types = conn.execute(
+        "SELECT COUNT(*) FROM task_item_counts"
+    ).fetchone()[0]
+    return counted_queue_types < len(_queue_types)
+
+
+def task_progress_db_needs_migration(conn: sqlite3.Connection) -> bool:
+    """
+    Whether the task progress DB of the given connection (which may be read-only) was created by an older version and has to be migrated (see `open_task_progress_db`).
+    """
+    try:
+        return _needs_migration(conn)
+    except sqlite3.OperationalError:
+        # e.g. the counts table does not exist yet
+        return True
+
+
+def _migrate(conn: sqlite3.Connection):
+    if not _needs_migration(conn):
+        return
+    # take the write lock right away so that only one connection migrates the DB
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        if not _needs_migration(conn):
+            return
+
+        legacy_tables = _get_legacy_queue_tables(conn)
+        # pending inputs are migrated first, so they keep their order and an input that was (re-)added after it had been processed stays pending
+        for queue_type in _queue_types:
+            if queue_type not in legacy_tables:
+                continue
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO task_items (data, status, timestamp)
+                SELECT data, ?, timestamp FROM {legacy_tables[queue_type]} ORDER BY _id ASC
+                """,
+                (queue_type,),
+            )
+        for table_name in legacy_tables.values():
+            conn.execute(f"DROP TABLE {table_name}")
+
+        # counting is only necessary once, afterwards the counts are maintained together with the items
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO task_item_counts (status, count)
+            VALUES (?, (SELECT COUNT(*) FROM task_items WHERE status = ?))
+            """,
+            [(queue_type, queue_type) for queue_type in _queue_types],
+        )
+
+
+def _update_counts(conn: sqlite3.Connection, count_deltas: dict[QueueType, int]):
+    conn.executemany(
+        "UPDATE task_item_counts SET count = count + ? WHERE status = ?",
+        [
+            (delta, queue_type)
+            for queue_type, delta in count_deltas.items()
+            if delta != 0
+        ],
+    )
+
+
+@dataclass
+class LeasedInputItem:
+    """
+    An input item that has been leased from the input queue for processing.
+
+    Leased items stay in the input queue until their outcome is recorded. Until then, they are not handed out again by the same `TaskQueueItemManager`, which allows several workers to process inputs concurrently.
+    """
+
+    id: int
+    """
+    The ID of the item in the input queue.
+    """
+
+    data: Any
+    """
+    The (deserialized) input item.
+    """
+
+    serialized: bytes
+    """
+    The input item as it is stored in the queue DB.
+    """
+
+
+@dataclass
+class InputChunkLease:
+    """
+    A chunk of input items that has been leased to another node for processing (see `TaskQueueItemManager.lease_input_chunk`).
+    """
+
+    id: str
+    """
+    The ID of the lease.
+    """
+
+    holder: str
+    """
+    Identifies the node that holds the lease.
+    """
+
+    items: list[LeasedInputItem]
+
+    expires_at: float
+    """
+    The (UNIX) time at which the lease expires unless it is renewed. Afterwards, items of the chunk whose outcome has not been reported are handed out again.
+    """
+
+
+@dataclass
+class OutputCheckpoint:
+    """
+    Identifies the point up to which the outputs written to a task's (current) output file are covered by recorded outcomes.
+    """
+
+    seq: int
+    """
+    The sequence number of the last batch of outputs written to the output file whose outcomes have been recorded.
+    """
+
+    offset: int
+    """
+    The size of the (compressed) output file in bytes right after that batch was written.
+    """
+
+    uncompressed_offset: int = 0
+    """
+    The number of uncompressed bytes written to the output file up to that batch.
+    """
+
+
 class QueueItemData(BaseModel):
     """
     A simple dictionary for data + metadata about a queue item.
@@ -105,18 +318,22 @@ class QueueItemRetrievalResult(BaseModel):
 
 class TaskQueueItemManager:
     """
-    A class to manage items in the `persist-queue` SQLite queues for scraper task inputs (created by the TaskProcessor for a particular task, cf. processing.py)
+    A class to manage the input items of a scraper task and the outcomes of processing them (created by the TaskProcessor for a particular task, cf. processing.py)
+
+    The items are stored in a dedicated SQLite DB file for each task (see `open_task_progress_db`). Items are organized in "queues" (see `QueueType`): new items are added to the `inputs` queue and moved to one of the other queues once they have been processed.
     """
 
     def __init__(
         self,
         task_id: int,
         db_dir: str,
+        input_reservation_size: int = 100,
     ):
         """
         Args:
             task_id (int): The ID of the task for which the queue items are being managed.
             db_dir (str): The directory where the SQLite database file should be stored.
+            input_reservation_size (int, optional): How many input items beyond those leased via `lease_input_items` are reserved for this instance at once, so they are not handed out to other nodes via `lease_input_chunk`. Defaults to 100.
         """
 
         self._task_id = task_id
@@ -124,75 +341,48 @@ class TaskQueueItemManager:
         The ID of the task for which the queue items are being managed.
         """
 
-        self._successes_q = persistqueue.SQLiteQueue(
-            path=db_dir,
-            db_file_name=f"{task_id}.db",
-            serializer=json_serializer,
-            # if auto_commit is False, task_done() must be called to persist changes made via put() or get() calls
-            auto_commit=False,
-            name="successes",
-            multithreading=True,
-        )
+        self._db_path = os.path.join(db_dir, f"{task_id}.db")
         """
-        The items that have been processed successfully.
+        The path to the SQLite database file which stores the items of the task.
         """
 
-        self._input_q = persistqueue.UniqueQ(
-            path=db_dir,
-            db_file_name=f"{task_id}.db",
-            serializer=json_serializer,
-            # if auto_commit is False, task_done() must be called to persist changes made via put() or get() calls
-            auto_commit=False,
-            name="inputs",
-            multithreading=True,
-        )
+        self._conn = open_task_progress_db(self._db_path)
         """
-        The persistent queue for input items that have not been processed yet.
+        The connection to the task progress DB.
         """
 
-        def undo_input_queue_removals():
-            self._input_q = persistqueue.UniqueQ(
-                path=db_dir,
-                db_file_name=f"{task_id}.db",
-                serializer=json_serializer,
-                # if auto_commit is False, task_done() must be called to persist changes made via put() or get() calls
-                auto_commit=False,
-                name="inputs",
-                multithreading=True,
-            )
+        self._counts: dict[QueueType, int] = {}
+        """
+        In-memory mirror of the `task_item_counts` table. Updated together with the table by this instance and reloaded whenever another connection has written to the DB (see `_refresh_counts`).
+        """
 
-        self._undo_input_removals = undo_input_queue_removals
+        self._data_version = -1
         """
-        A hack to reset the input queue to the state it was in before any calls to get() after the last call to task_done() (i.e. the state before persisting queue item removals made via get() calls).
+        The value of SQLite's `data_version` pragma when `_counts` was last loaded. It changes whenever another connection commits changes to the DB.
         """
 
-        self._failure_q = persistqueue.SQLiteQueue(
-            path=db_dir,
-            db_file_name=f"{task_id}.db",
-            serializer=json_serializer,
-            auto_commit=True,
-            name="failures",
-            multithreading=True,
-        )
+        self._refresh_counts()
+
+        self._leased_ids: set[int] = set()
         """
-        The queue for items that could not be processed due to an error.
+        The IDs of the input items that are currently leased (i.e. being processed by some worker).
         """
 
-        self._in_without_out_q = persistqueue.SQLiteQueue(
-            path=db_dir,
-            db_file_name=f"{task_id}.db",
-            serializer=json_serializer,
-            auto_commit=True,
-            name="inputs_without_output",
-            multithreading=True,
-        )
+        self._lease_cursor = 0
         """
-        The queue for input items that haven't produced any output.
+        The highest ID of any input item leased so far. New leases are handed out from the rows after it, so leasing does not get slower the more items are leased at once.
         """
 
-        self._db_path = os.path.join(db_dir, f"{task_id}.db")
+        self._released_items: list[LeasedInputItem] = []
         """
-        The path to the SQLite database file which stores the `persist-queue` SQLite queues for scraper task inputs.
+        Items whose leases were released without recording an outcome (sorted by descending ID). They are leased again before any items after `_lease_cursor`.
+        """
+
+        self._input_reservation_size = input_reservation_size
+
+        self._reserved_until = 0
+        """
+        The highest ID of the input items reserved for `lease_input_items` (see `_reserve_input_items`). Mirrors the `reserved_until` entry in the `task_meta` table.
         """
 
     @property
@@ -201,11 +391,12 @@ class TaskQueueItemManager:
         Returns the current counts of items in the different queues.
         """
 
+        self._refresh_counts()
         return QueueItemCounts(
-            successes=self._successes_q.size,
-            failures=self._failure_q.size,
-            inputs_without_output=self._in_without_out_q.size,
-            remaining=self._input_q.size,
+            successes=self._counts["successes"],
+            failures=self._counts["failures"],
+            inputs_without_output=self._counts["inputs-without-output"],
+            remaining=self._counts["inputs"],
         )
 
     def get_queue_items(
@@ -231,52 +422,45 @@ class TaskQueueItemManager:
                 - "total": The total number of items in the queue.
         """
 
-        with sqlite3.connect(self._db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT
-                  _id AS id,
-                  CAST(data AS text) AS data,
-                  datetime(timestamp, 'unixepoch') AS added_at
-                FROM {_table_names[queue_type]}
-                {'WHERE _id >= ?' if cursor_id else ''} ORDER BY id ASC LIMIT ?
-                """,
-                (cursor_id, limit) if cursor_id else (limit,),
+        rows = self._conn.execute(
+            f"""
+            SELECT
+              _id AS id,
+              CAST(data AS text) AS data,
+              datetime(timestamp, 'unixepoch') AS added_at
+            FROM task_items
+            WHERE status = ? {'AND _id >= ?' if cursor_id else ''} ORDER BY id ASC LIMIT ?
+            """,
+            (queue_type, cursor_id, limit) if cursor_id else (queue_type, limit),
+        ).fetchall()
+
+        items: list[QueueItemData] = [
+            QueueItemData(
+                id=row[0],
+                data=json.loads(row[1]),
+                added_at=row[2],
             )
-            rows = cursor.fetchall()
-
-            items: list[QueueItemData] = [
-                QueueItemData(
-                    id=row[0],
-                    data=json.loads(row[1]),
-                    added_at=row[2],
-                )
-                for row in rows
-            ]
-
-            last_id = items[-1].id if items else None
-            if last_id:
-                next_id_tuple = cursor.execute(
-                    f"SELECT _id AS id FROM {_table_names[queue_type]} WHERE _id > ? ORDER BY id ASC LIMIT 1",
-                    (last_id,),
-                ).fetchone()
-                if next_id_tuple:
-                    next_id = next_id_tuple[0]
-                else:
-                    next_id = None
+            for row in rows
+        ]
+
+        last_id = items[-1].id if items else None
+        if last_id:
+            next_id_tuple = self._conn.execute(
+                "SELECT _id AS id FROM task_items WHERE status = ? AND _id > ? ORDER BY id ASC LIMIT 1",
+                (queue_type, last_id),
+            ).fetchone()
+            if next_id_tuple:
+                next_id = next_id_tuple[0]
             else:
                 next_id = None
+        else:
+            next_id = None
 
-            total = cursor.execute(
-                f"SELECT COUNT(*) FROM {_table_names[queue_type]}",
-            ).fetchone()[0]
-
-            return QueueItemRetrievalResult(
-                items=items,
-                next_cursor=next_id,
-                total=total,
-            )
+        return QueueItemRetrievalResult(
+            items=items,
+            next_cursor=next_id,
+            total=self._count(queue_type),
+        )
 
     def remove_queue_items(self, ids: Sequence[int], queue_type: QueueType):
         """Remove the items associated with the given ids from the specified queue type.
@@ -288,15 +472,386 @@ class TaskQueueItemManager:
         Returns:
             int: The number of items removed from the queue.
         """
-        with sqlite3.connect(self._db_path) as conn:
-            cursor = conn.cursor()
-            placeholders = ",".join("?" for _ in ids)
-            cursor.execute(
-                f"DELETE FROM {_table_names[queue_type]} WHERE _id IN ({placeholders})",
-                ids,
+        with self._conn:
+            cursor = self._conn.execute(
+                f"DELETE FROM task_items WHERE status = ? AND _id IN ({','.join('?' for _ in ids)})",
+                [queue_type, *ids],
+            )
+            count_deltas: dict[QueueType, int] = {queue_type: -cursor.rowcount}
+            _update_counts(self._conn, count_deltas)
+        self._apply_count_deltas(count_deltas)
+        return cursor.rowcount
+
+    def lease_input_items(self, limit: int) -> list[LeasedInputItem]:
+        """
+        Leases up to `limit` input items that are not currently leased, oldest first.
+        Items held by other nodes (see `lease_input_chunk`) are skipped, unless their chunk lease has expired.
+
+        Leased items remain in the input queue until `record_outcomes` is called for them. If processing fails fatally, `release_leases` should be called instead, leaving them in the input queue so they are picked up again later (e.g. after a restart).
+        """
+        leased: list[LeasedInputItem] = []
+        while self._released_items and len(leased) < limit:
+            leased.append(self._released_items.pop())
+        if len(leased) < limit:
+            rows = self._select_unleased_input_items(limit - len(leased))
+            if rows and rows[-1][0] > self._reserved_until:
+                rows = self._reserve_input_items(limit - len(leased))
+            for row_id, serialized in rows:
+                leased.append(
+                    LeasedInputItem(
+                        id=row_id,
+                        data=_deserialize(serialized),
+                        serialized=serialized,
+                    )
+                )
+                self._lease_cursor = row_id
+        self._leased_ids.update(item.id for item in leased)
+        return leased
+
+    def _select_unleased_input_items(self, limit: int) -> list[tuple[int, bytes]]:
+        """
+        Returns up to `limit` input items after `_lease_cursor` that are not held by other nodes, oldest first.
+        """
+        return self._conn.execute(
+            """
+            SELECT _id, data FROM task_items
+            WHERE status = 'inputs' AND _id > ? AND _id NOT IN (SELECT item_id FROM input_chunk_leases WHERE expires_at > ?)
+            ORDER BY _id ASC LIMIT ?
+            """,
+            (self._lease_cursor, time.time(), limit),
+        ).fetchall()
+
+    def _reserve_input_items(self, limit: int) -> list[tuple[int, bytes]]:
+        """
+        Like `_select_unleased_input_items`, but also reserves the returned items and the next `input_reservation_size` ones for this instance.
+
+        The reservation is stored in the task progress DB, so that `lease_input_chunk` (which takes the same write lock) does not hand out items this instance is processing or about to process to other nodes.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        with self._conn:
+            rows = self._select_unleased_input_items(
+                limit + self._input_reservation_size
+            )
+            reserved_until = rows[-1][0] if rows else self._lease_cursor
+            self._conn.execute(
+                "INSERT OR REPLACE INTO task_meta (key, value) VALUES ('reserved_until', ?)",
+                (reserved_until,),
+            )
+        self._reserved_until = reserved_until
+        return rows[:limit]
+
+    def release_leases(self, items: Sequence[LeasedInputItem]):
+        """
+        Releases the leases for the given items without recording an outcome (they stay in the input queue).
+        """
+        for item in items:
+            if item.id in self._leased_ids:
+                self._leased_ids.discard(item.id)
+                self._released_items.append(item)
+        self._released_items.sort(key=lambda item: item.id, reverse=True)
+
+    def release_all_leases(self):
+        """
+        Releases all currently held leases (e.g. after processing was aborted).
+        """
+        self._leased_ids.clear()
+        self._released_items.clear()
+        self._lease_cursor = 0
+        self._reserved_until = 0
+        with self._conn:
+            self._conn.execute("DELETE FROM task_meta WHERE key = 'reserved_until'")
+
+    def get_input_items(self, ids: Sequence[int]) -> list[LeasedInputItem]:
+        """
+        Returns the items with the given IDs that are (still) in the input queue, without leasing them.
+        """
+        items: list[LeasedInputItem] = []
+        # stay below SQLite's limit for the number of query parameters
+        for i in range(0, len(ids), 500):
+            ids_chunk = ids[i : i + 500]
+            for row_id, serialized in self._conn.execute(
+                f"SELECT _id, data FROM task_items WHERE status = 'inputs' AND _id IN ({','.join('?' for _ in ids_chunk)})",
+                ids_chunk,
+            ):
+                items.append(
+                    LeasedInputItem(
+                        id=row_id,
+                        data=_deserialize(serialized),
+                        serialized=serialized,
+                    )
+                )
+        return items
+
+    @property
+    def output_checkpoint(self) -> OutputCheckpoint:
+        """
+        The output checkpoint that was stored together with the most recently recorded outcomes (see `record_outcomes`).
+        """
+        values = dict(
+            self._conn.execute(
+                "SELECT key, value FROM task_meta WHERE key IN ('output_seq', 'output_offset', 'output_uncompressed_offset')"
+            ).fetchall()
+        )
+        return OutputCheckpoint(
+            seq=values.get("output_seq", 0),
+            offset=values.get("output_offset", 0),
+            uncompressed_offset=values.get("output_uncompressed_offset", 0),
+        )
+
+    def set_output_checkpoint(self, checkpoint: OutputCheckpoint):
+        with self._conn:
+            self._store_output_checkpoint(checkpoint)
+
+    def _store_output_checkpoint(self, checkpoint: OutputCheckpoint):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO task_meta (key, value) VALUES (?, ?)",
+            [
+                ("output_seq", checkpoint.seq),
+                ("output_offset", checkpoint.offset),
+                ("output_uncompressed_offset", checkpoint.uncompressed_offset),
+            ],
+        )
+
+    def record_outcomes(
+        self,
+        outcomes: Sequence[tuple[LeasedInputItem, QueueType]],
+        output_checkpoint: OutputCheckpoint | None = None,
+    ) -> None:
+        """
+        Moves the given leased input items from the input queue to the queue matching their outcome (`successes`, `failures` or `inputs-without-output`) in a single transaction and releases their leases.
+        Moving an item only updates its `status`, the item itself is not copied.
+
+        If an `output_checkpoint` is provided, it is stored in the same transaction. This allows callers to find out which outputs in the output file are covered by recorded outcomes after a crash.
+        """
+        with self._conn:
+            if output_checkpoint is not None:
+                self._store_output_checkpoint(output_checkpoint)
+            count_deltas = self._move_to_outcome_queues(
+                [(item.id, queue_type) for item, queue_type in outcomes]
+            )
+        self._apply_count_deltas(count_deltas)
+        self._leased_ids.difference_update(item.id for item, _ in outcomes)
+
+    def _move_to_outcome_queues(
+        self, outcomes: Sequence[tuple[int, QueueType]]
+    ) -> dict[QueueType, int]:
+        """
+        Moves the input items with the given IDs to the queues matching their outcomes (within the current transaction) and returns the resulting count deltas.
+        Items that are not in the input queue (anymore) are skipped.
+        """
+        if any(queue_type == "inputs" for _, queue_type in outcomes):
+            raise ValueError("Outcome queue must not be the input queue.")
+        ids_by_queue_type: dict[QueueType, list[int]] = {}
+        for item_id, queue_type in outcomes:
+            ids_by_queue_type.setdefault(queue_type, []).append(item_id)
+
+        now = time.time()
+        count_deltas: dict[QueueType, int] = {"inputs": 0}
+        for queue_type, ids in ids_by_queue_type.items():
+            moved_count = self._conn.executemany(
+                "UPDATE task_items SET status = ?, timestamp = ? WHERE _id = ? AND status = 'inputs'",
+                [(queue_type, now, item_id) for item_id in ids],
+            ).rowcount
+            count_deltas[queue_type] = moved_count
+            count_deltas["inputs"] -= moved_count
+        _update_counts(self._conn, count_deltas)
+        return count_deltas
+
+    def lease_input_chunk(
+        self,
+        holder: str,
+        limit: int,
+        lease_seconds: float,
+        newest_first: bool = False,
+    ) -> InputChunkLease | None:
+        """
+        Leases up to `limit` input items to another node (the `holder`), oldest first (or newest first if `newest_first` is set), or returns `None` if all remaining input items are leased.
+
+        Unlike leases from `lease_input_items`, chunk leases are stored in the task progress DB and expire after `lease_seconds` unless they are renewed (see `renew_input_chunk_lease`).
+        Items of expired leases whose outcome has not been reported are handed out again, so each input item is processed at least once even if a node fails.
+
+        Items reserved for `lease_input_items` are never handed out, so chunks can also be leased while the task is processed locally (e.g. by other replicas stealing work from the tail of the input queue, see `app.tasks.stealing`).
+        Chunk-leased items are skipped by `lease_input_items` in turn.
+        """
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        expires_at = now + lease_seconds
+        # take the write lock right away so that the same items are not leased to several nodes at once
+        self._conn.execute("BEGIN IMMEDIATE")
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM input_chunk_leases WHERE expires_at <= ?", (now,)
+            )
+            reserved_until = self._conn.execute(
+                "SELECT COALESCE(MAX(value), 0) FROM task_meta WHERE key = 'reserved_until'"
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"""
+                SELECT _id, data FROM task_items
+                WHERE status = 'inputs' AND _id > ? AND _id NOT IN (SELECT item_id FROM input_chunk_leases)
+                ORDER BY _id {"DESC" if newest_first else "ASC"} LIMIT ?
+                """,
+                (reserved_until, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "INSERT INTO input_chunk_leases (item_id, lease_id, holder, expires_at) VALUES (?, ?, ?, ?)",
+                [(row_id, lease_id, holder, expires_at) for row_id, _ in rows],
+            )
+        if not rows:
+            return None
+        return InputChunkLease(
+            id=lease_id,
+            holder=holder,
+            items=[
+                LeasedInputItem(
+                    id=row_id, data=_deserialize(serialized), serialized=serialized
+                )
+                for row_id, serialized in rows
+            ],
+            expires_at=expires_at,
+        )
+
+    def renew_input_chunk_lease(
+        self, lease_id: str, lease_seconds: float
+    ) -> float | None:
+        """
+        Extends the given chunk lease by `lease_seconds` (from now) and returns the new expiry time.
+
+        Expired leases can be renewed as long as their items have not been handed out again. Returns `None` if the lease does not hold any items (anymore).
+        """
+        expires_at = time.time() + lease_seconds
+        with self._conn:
+            renewed_count = self._conn.execute(
+                "UPDATE input_chunk_leases SET expires_at = ? WHERE lease_id = ?",
+                (expires_at, lease_id),
+            ).rowcount
+        return expires_at if renewed_count else None
+
+    def record_input_chunk_outcomes(self, outcomes: Sequence[tuple[int, QueueType]]):
+        """
+        Records the outcomes of input items (by ID) that were processed by another node and removes them from their chunk leases.
+
+        Outcomes are recorded even if the lease of an item has expired in the meantime (the first reported outcome of an item wins).
+        """
+        with self._conn:
+            count_deltas = self._move_to_outcome_queues(outcomes)
+            self._conn.executemany(
+                "DELETE FROM input_chunk_leases WHERE item_id = ?",
+                [(item_id,) for item_id, _ in outcomes],
+            )
+        self._apply_count_deltas(count_deltas)
+
+    def release_input_chunk(self, lease_id: str):
+        """
+        Releases the given chunk lease. Its items whose outcome has not been reported can be handed out again right away.
+        """
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM input_chunk_leases WHERE lease_id = ?", (lease_id,)
+            )
+
+    def get_input_statuses(self, inputs: Sequence[Any]) -> list[QueueType | None]:
+        """
+        Returns the queue each of the given input items is currently in (`None` for items that are not in any queue).
+        """
+        serialized_inputs = [_serialize(item) for item in inputs]
+        statuses: dict[bytes, QueueType] = {}
+        # stay below SQLite's limit for the number of query parameters
+        for i in range(0, len(serialized_inputs), 500):
+            chunk = serialized_inputs[i : i + 500]
+            statuses.update(
+                self._conn.execute(
+                    f"SELECT data, status FROM task_items WHERE data IN ({','.join('?' for _ in chunk)})",
+                    chunk,
+                ).fetchall()
             )
-            conn.commit()
-            return cursor.rowcount
+        return [statuses.get(data) for data in serialized_inputs]
+
+    def remove_inputs(self, inputs: Sequence[Any]) -> int:
+        """
+        Removes the given input items from the input queue (items that are not in the input queue are skipped) and returns the number of removed items.
+        """
+        serialized_inputs = [_serialize(item) for item in inputs]
+        removed_count = 0
+        with self._conn:
+            # stay below SQLite's limit for the number of query parameters
+            for i in range(0, len(serialized_inputs), 500):
+                chunk = serialized_inputs[i : i + 500]
+                removed_count += self._conn.execute(
+                    f"DELETE FROM task_items WHERE status = 'inputs' AND data IN ({','.join('?' for _ in chunk)})",
+                    chunk,
+                ).rowcount
+            count_deltas: dict[QueueType, int] = {"inputs": -removed_count}
+            _update_counts(self._conn, count_deltas)
+        self._apply_count_deltas(count_deltas)
+        return removed_count
+
+    async def process_leased_input_item(
+        self,
+        processing_fn: Callable[[Any], Awaitable[Any]],
+        item: LeasedInputItem,
+        on_success: QueueItemProcessingSuccessCallback,
+        on_no_data_returned: QueueItemProcessingNoDataReturnedCallback,
+        on_non_fatal_error: QueueItemProcessingNonFatalErrorCallback,
+    ) -> list[tuple[LeasedInputItem, QueueType]]:
+        """
+        Processes a leased input item and determines its outcome, but does NOT record it (see `process_next_input_item` for details on processing and `record_outcomes` for recording).
+
+        Returns:
+            A list containing the item and the queue it should be moved to.
+        """
+        try:
+            res = await processing_fn(item.data)
+            if res is None:
+                await on_no_data_returned(item.data)
+                return [(item, "inputs-without-output")]
+            await on_success(item.data, res)
+            return [(item, "successes")]
+        except NonFatalProcessingError as e:
+            await on_non_fatal_error(item.data, e)
+            return [(item, "failures")]
+
+    async def process_leased_input_item_chunk(
+        self,
+        processing_fn: Callable[[Sequence[Any]], Awaitable[Sequence[Any]]],
+        items: Sequence[LeasedInputItem],
+        on_success: QueueItemProcessingSuccessCallback,
+        on_no_data_returned: QueueItemProcessingNoDataReturnedCallback,
+        on_non_fatal_error: QueueItemProcessingNonFatalErrorCallback,
+    ) -> list[tuple[LeasedInputItem, QueueType]]:
+        """
+        Processes a chunk of leased input items and determines their outcomes, but does NOT record them (see `process_next_input_item_chunk` for details on processing and `record_outcomes` for recording).
+
+        Returns:
+            A list containing each item and the queue it should be moved to.
+        """
+        inputs = [item.data for item in items]
+        outcomes: list[tuple[LeasedInputItem, QueueType]] = []
+        try:
+            outputs = await processing_fn(inputs)
+            if outputs is None:
+                for item in items:
+                    await on_no_data_returned(item.data)
+                    outcomes.append((item, "inputs-without-output"))
+                return outcomes
+            if len(outputs) != len(inputs):
+                raise InvalidInputsError(
+                    f"Processing function returned {len(outputs)} items (expected {len(inputs)})."
+                )
+            for item, output in zip(items, outputs):
+                if output is None:
+                    await on_no_data_returned(item.data)
+                    outcomes.append((item, "inputs-without-output"))
+                else:
+                    await on_success(item.data, output)
+                    outcomes.append((item, "successes"))
+            return outcomes
+        except NonFatalProcessingError as e:
+            outcomes = []
+            for item in items:
+                await on_non_fatal_error(item.data, e)
+                outcomes.append((item, "failures"))
+            return outcomes
 
     async def process_next_input_item(
         self,
@@ -315,6 +870,9 @@ class TaskQueueItemManager:
 
         If the processing function raises a NonFatalProcessingError, the input item is added to the failures queue and the provided `on_non_fatal_error` callback function is called.
         If the processing function raises any other exception, it is re-raised so that it can be handled appropriately by the caller and any related ongoing processes can exit cleanly.
+        In that case, the input item stays in the input queue.
+
+        The input item is leased while it is processed, so it is safe to call this method from several concurrent workers.
 
         Args:
             processing_fn: The processing function to apply to the input item.
@@ -324,31 +882,26 @@ class TaskQueueItemManager:
 
         Raises:
             Exception: If an unexpected (i.e. fatal, and therefore NOT NonFatalProcessingError) error occurs during processing.
-            EmptyQueueError: If the input queue is empty and no items are available for processing.
+            EmptyQueueError: If there are no (unleased) items in the input queue that are available for processing.
         """
-        if self._input_q.empty():
+        leased = self.lease_input_items(1)
+        if not leased:
             raise EmptyQueueError(
                 "No items in the input queue. Cannot process next item."
             )
-        item = self._input_q.get()
 
         try:
-            res = await processing_fn(item)
-            if res is None:
-                await on_no_data_returned(item)
-                self._in_without_out_q.put(item)
-            else:
-                await on_success(item, res)
-                self._successes_q.put(item)
-        except NonFatalProcessingError as e:
-            await on_non_fatal_error(item, e)
-            self._failure_q.put(item)
-        except Exception as e:
-            self._undo_input_removals()
-            raise
+            outcomes = await self.process_leased_input_item(
+                processing_fn,
+                leased[0],
+                on_success=on_success,
+                on_no_data_returned=on_no_data_returned,
+                on_non_fatal_error=on_non_fatal_error,
+            )
+            self.record_outcomes(outcomes)
         finally:
-            # persist the removal from the input queue
-            self._input_q.task_done()
+            # no-op if the outcome was recorded; otherwise the item stays in the input queue
+            self.release_leases(leased)
 
     async def process_next_input_item_chunk(
         self,
@@ -370,6 +923,7 @@ class TaskQueueItemManager:
 
         If the processing function raises a NonFatalProcessingError, each input item is added to the failures queue and the provided `on_non_fatal_error` callback function is called.
         If the processing function raises any other kind of exception that is not handled appropriately to be converted to a NonFatalProcessingError, it is re-raised so that it can be handled appropriately by the caller and any related ongoing processes can exit cleanly.
+        In that case, all input items of the chunk stay in the input queue.
 
         Args:
             processing_fn: The processing function to apply to the input items.
@@ -381,48 +935,29 @@ class TaskQueueItemManager:
 
         Raises:
             Exception: If an unexpected (i.e. fatal, and therefore NOT NonFatalProcessingError) error occurs during processing.
-            EmptyQueueError: If the input queue is empty and no items are available for processing.
+            EmptyQueueError: If there are no (unleased) items in the input queue that are available for processing.
             ValueError: If the chunk size is less than 2.
         """
         if chunk_size < 2:
             raise ValueError("Chunk size must be greater than 1.")
-        inputs: list = []
-        while not self._input_q.empty() and len(inputs) < chunk_size:
-            item = self._input_q.get()
-            inputs.append(item)
-        if not inputs:
+        leased = self.lease_input_items(chunk_size)
+        if not leased:
             raise EmptyQueueError(
                 "No items in the input queue. Cannot process next item."
             )
 
         try:
-            outputs = await processing_fn(inputs)
-            if outputs is None:
-                for item in inputs:
-                    await on_no_data_returned(item)
-                    self._in_without_out_q.put(item)
-            else:
-                if len(outputs) != len(inputs):
-                    raise InvalidInputsError(
-                        f"Processing function returned {len(outputs)} items (expected {len(inputs)})."
-                    )
-                for input_item, output in zip(inputs, outputs):
-                    if output is None:
-                        await on_no_data_returned(input_item)
-                        self._in_without_out_q.put(input_item)
-                    else:
-                        await on_success(input_item, output)
-                        self._successes_q.put(input_item)
-        except NonFatalProcessingError as e:
-            for input_item in inputs:
-                await on_non_fatal_error(input_item, e)
-                self._failure_q.put(input_item)
-        except Exception:
-            self._undo_input_removals()
-            raise
+            outcomes = await self.process_leased_input_item_chunk(
+                processing_fn,
+                leased,
+                on_success=on_success,
+                on_no_data_returned=on_no_data_returned,
+                on_non_fatal_error=on_non_fatal_error,
+            )
+            self.record_outcomes(outcomes)
         finally:
-            # persist the removals from the input queue
-            self._input_q.task_done()
+            # no-op if the outcomes were recorded; otherwise the items stay in the input queue
+            self.release_leases(leased)
 
     def add_inputs(
         self,
@@ -430,32 +965,77 @@ class TaskQueueItemManager:
     ):
         """
         Add new inputs to the given task.
+
+        Inputs that are already in the input queue are ignored. Inputs that have already been processed are moved back to the end of the input queue (i.e. they are processed again and their previous outcome is discarded).
         """
-        for item in inputs:
-            self._input_q.put(item)
+        now = time.time()
+        serialized_inputs = [_serialize(item) for item in inputs]
+        count_deltas: dict[QueueType, int] = {}
+        with self._conn:
+            for queue_type in _queue_types:
+                if queue_type == "inputs":
+                    continue
+                count_deltas[queue_type] = -self._conn.executemany(
+                    "DELETE FROM task_items WHERE data = ? AND status = ?",
+                    [(data, queue_type) for data in serialized_inputs],
+                ).rowcount
+            count_deltas["inputs"] = self._conn.executemany(
+                "INSERT OR IGNORE INTO task_items (data, status, timestamp) VALUES (?, 'inputs', ?)",
+                [(data, now) for data in serialized_inputs],
+            ).rowcount
+            _update_counts(self._conn, count_deltas)
+        self._apply_count_deltas(count_deltas)
 
     @property
     def task_id(self) -> int:
         return self._task_id
 
+    def _count(self, queue_type: QueueType) -> int:
+        self._refresh_counts()
+        return self._counts[queue_type]
+
+    def _refresh_counts(self):
+        """
+        Reloads the in-memory mirror of the item counts if another connection has written to the DB since it was last loaded.
+
+        This only requires a single pragma query, so counts can be read frequently (e.g. for progress logging).
+        """
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._counts = {queue_type: 0 for queue_type in _queue_types}
+        for queue_type, count in self._conn.execute(
+            "SELECT status, count FROM task_item_counts"
+        ):
+            self._counts[queue_type] = count
+        self._data_version = data_version
+
+    def _apply_count_deltas(self, count_deltas: dict[QueueType, int]):
+        # only called after the respective changes were committed by this instance (which does not change `data_version`)
+        for queue_type, delta in count_deltas.items():
+            self._counts[queue_type] += delta
+
     @property
     def remaining_input_count(self) -> int:
-        return self._input_q.size
+        """
+        The number of items in the input queue (including any that are currently leased).
+        """
+        return self._count("inputs")
 
     @property
     def success_count(self) -> int:
         """
         The number of items that have been processed successfully (i.e. number of items for which output has been written to the output file).
         """
-        return self._successes_q.size
+        return self._count("successes")
 
     @property
     def failure_count(self) -> int:
-        return self._failure_q.size
+        return self._count("failures")
 
     @property
     def inputs_without_output_count(self) -> int:
-        return self._in_without_out_q.size
+        return self._count("inputs-without-output")
 
     def __enter__(self):
         """
@@ -464,9 +1044,7 @@ class TaskQueueItemManager:
         return self
 
     def close(self):
-        self._input_q.close()
-        self._failure_q.close()
-        self._in_without_out_q.close()
+        self._conn.close()
 
     def __exit__(self, exc_type, exc_value, traceback):
         """
@@ -0,0 +1,193 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import heapq
+from itertools import count
+from logging import Logger
+import math
+
+from app.config import app_logger, settings
+from app.db.models import DataFetchingTask
+from app.tasks.processing import TaskProcessor
+from app.utils.fair_share import FairShareSemaphore
+
+
+@dataclass
+class TaskSchedulingParams:
+    """
+    Determines when a task is started by the `TaskScheduler` and which share of the fetch budget of its data source it gets.
+    """
+
+    data_source: str
+
+    weight: float = 1
+    """
+    The share of the fetch budget relative to other tasks with the same priority and deadline.
+    """
+
+    priority: int = 0
+    """
+    Tasks with higher priority are started first and get fetch slots before tasks with lower priority.
+    """
+
+    deadline: datetime | None = None
+    """
+    Among tasks with the same priority, tasks with nearer deadlines are started first and get fetch slots first.
+    """
+
+    @property
+    def rank(self) -> tuple[int, float]:
+        return (
+            -self.priority,
+            self.deadline.timestamp() if self.deadline is not None else math.inf,
+        )
+
+
+class TaskScheduler:
+    """
+    Coordinates the tasks processed on this node.
+
+    - admission: at most `max_running_tasks` tasks are processed at the same time; other tasks wait until they are admitted (by priority, deadline and weight, otherwise in the order they were started).
+      Running tasks with lower priority do not count against this limit for a waiting task, as they yield their fetch slots to it anyway, so urgent tasks are started right away.
+    - fetch budget: the running tasks of a data source share a limited number of concurrent fetches (see `FairShareSemaphore`), according to their priorities, deadlines and weights.
+      Whenever a task finishes or is paused, its share is reallocated to the remaining tasks.
+    """
+
+    def __init__(
+        self,
+        max_running_tasks: int,
+        max_concurrent_fetches: dict[str, int],
+        logger: Logger,
+    ):
+        if max_running_tasks < 1:
+            raise ValueError("Maximum number of running tasks must be at least 1.")
+        self._max_running_tasks = max_running_tasks
+        self._logger = logger
+
+        self._fetch_slots = {
+            data_source: FairShareSemaphore(capacity)
+            for data_source, capacity in max_concurrent_fetches.items()
+        }
+        """
+        The fetch budget of each data source whose concurrent fetches are limited.
+        """
+
+        self._running: dict[int, int] = {}
+        """
+        The IDs of the tasks that have been admitted and are being processed, with their priorities.
+        """
+
+        self._waiting: list[
+            tuple[tuple[int, float, float, int], int, asyncio.Future[None]]
+        ] = []
+        """
+        A heap of tasks waiting to be admitted, as (admission order, task ID, future resolved on admission).
+        """
+
+        self._seq = count()
+
+    @property
+    def running_task_ids(self) -> set[int]:
+        return set(self._running)
+
+    @property
+    def waiting_task_ids(self) -> list[int]:
+        return [task_id for _, task_id, _ in sorted(self._waiting)]
+
+    async def run(self, processor: TaskProcessor, params: TaskSchedulingParams):
+        """
+        Processes the task of the given processor once it is admitted, with its share of the data source's fetch budget.
+        """
+        task_id = processor.task_id
+        if task_id in self._running or task_id in self.waiting_task_ids:
+            raise ValueError(f"Task with ID {task_id} is already scheduled!")
+        await self._admit(task_id, params)
+        fetch_slots = self._fetch_slots.get(params.data_source)
+        try:
+            if fetch_slots is not None:
+                fetch_slots.register(
+                    task_id,
+                    weight=params.weight,
+                    priority=params.priority,
+                    deadline=params.deadline,
+                )
+                processor.set_fetch_slots(fetch_slots)
+                self._log_shares(params.data_source)
+            await processor.run()
+        finally:
+            if fetch_slots is not None:
+                processor.set_fetch_slots(None)
+                fetch_slots.unregister(task_id)
+                self._log_shares(params.data_source)
+            self._running.pop(task_id, None)
+            self._admit_waiting()
+
+    async def _admit(self, task_id: int, params: TaskSchedulingParams):
+        admitted = asyncio.get_running_loop().create_future()
+        order = (*params.rank, -params.weight, next(self._seq))
+        heapq.heappush(self._waiting, (order, task_id, admitted))
+        self._admit_waiting()
+        if not admitted.done():
+            self._logger.info(
+                f"Task with ID {task_id} is waiting to be started ({len(self._running)} tasks running)"
+            )
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            if admitted.done() and not admitted.cancelled():
+                self._running.pop(task_id, None)
+                self._admit_waiting()
+            else:
+                self._waiting = [w for w in self._waiting if w[2] is not admitted]
+                heapq.heapify(self._waiting)
+            raise
+
+    def _admit_waiting(self):
+        while self._waiting:
+            (neg_priority, *_), task_id, admitted = self._waiting[0]
+            if admitted.done():
+                heapq.heappop(self._waiting)
+                continue
+            # running tasks with lower priority yield their fetch slots to this one, so they do not count
+            competing = sum(
+                1 for priority in self._running.values() if priority >= -neg_priority
+            )
+            if competing >= self._max_running_tasks:
+                # all other waiting tasks have the same or a lower priority
+                return
+            heapq.heappop(self._waiting)
+            self._running[task_id] = -neg_priority
+            admitted.set_result(None)
+            self._logger.info(f"Task with ID {task_id} is started")
+
+    def _log_shares(self, data_source: str):
+        fetch_slots = self._fetch_slots[data_source]
+        shares = ", ".join(
+            f"task {task_id}: {share:.1f}"
+            for task_id, share in fetch_slots.shares().items()
+        )
+        self._logger.info(
+            f"Shares of the {fetch_slots.capacity} concurrent fetches for {data_source}: {shares or '-'}"
+        )
+
+
+def get_scheduling_params(db_task: DataFetchingTask) -> TaskSchedulingParams:
+    deadline = db_task.deadline
+    if deadline is not None and deadline.tzinfo is None:
+        # deadlines are stored in UTC
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    return TaskSchedulingParams(
+        data_source=db_task.data_source,
+        weight=settings.task_scheduler_task_weights.get(
+            f"{db_task.data_source}/{db_task.task_type}", 1
+        ),
+        priority=db_task.priority,
+        deadline=deadline,
+    )
+
+
+task_scheduler = TaskScheduler(
+    max_running_tasks=settings.task_scheduler_max_running_tasks,
+    max_concurrent_fetches=settings.task_scheduler_max_concurrent_fetches,
+    logger=app_logger,
+)
@@ -0,0 +1,397 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from logging import Logger
+import os
+import sqlite3
+import time
+from typing import Sequence
+
+from sqlalchemy import select
+
+from app.config import DB_DIR, TASK_PROGRESS_DB_DIR, app_logger, settings
+from app.db import sessionmanager
+from app.db.models import DataFetchingTask
+from app.tasks import task_processors
+from app.tasks.distribution import (
+    DistributedTaskModel,
+    InputChunkItemModel,
+    InputChunkLeaseModel,
+    InputChunkReport,
+    InputChunkReportResult,
+    InputChunkTaskNotFoundError,
+    InputChunkWorker,
+    to_distributed_task_model,
+)
+from app.tasks.queue_item_management import TaskQueueItemManager
+
+
+@dataclass
+class StealableTask:
+    """
+    A task of some replica published on the `WorkStealingBoard`.
+    """
+
+    board_id: int
+    """
+    Identifies the task on the board (unique across replicas, unlike task IDs).
+    """
+
+    replica_id: str
+    progress_db_dir: str
+    """
+    The directory of the task progress DB of the task (see `TaskQueueItemManager`).
+    """
+
+    task: DistributedTaskModel
+    """
+    The task (with the ID it has on its replica).
+    """
+
+    remaining_input_count: int
+    """
+    The number of input items of the task that had not been processed when it was published.
+    """
+
+
+class WorkStealingBoard:
+    """
+    An SQLite DB shared by all replicas on a host, on which each replica publishes the tasks it is currently working on, so that idle replicas can steal inputs of them.
+
+    Every replica updates its tasks regularly (see `publish`); tasks of replicas that have not done so for a while are not returned by `get_tasks`.
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+
+    def publish(
+        self,
+        replica_id: str,
+        progress_db_dir: str,
+        tasks: Sequence[tuple[DistributedTaskModel, int]],
+    ):
+        """
+        Publishes the given tasks of the replica (with the number of their remaining input items), replacing the ones it published before.
+        """
+        conn = self._get_conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "UPDATE stealable_tasks SET active = 0 WHERE replica_id = ?",
+                (replica_id,),
+            )
+            # keeps the board ID of tasks that were published before
+            conn.executemany(
+                """
+                INSERT INTO stealable_tasks (replica_id, task_id, progress_db_dir, task, remaining_input_count, heartbeat_at, active)
+                VALUES (?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT (replica_id, task_id) DO UPDATE SET
+                  progress_db_dir = excluded.progress_db_dir,
+                  task = excluded.task,
+                  remaining_input_count = excluded.remaining_input_count,
+                  heartbeat_at = excluded.heartbeat_at,
+                  active = 1
+                """,
+                [
+                    (
+                        replica_id,
+                        task.id,
+                        progress_db_dir,
+                        task.model_dump_json(),
+                        remaining_input_count,
+                        now,
+                    )
+                    for task, remaining_input_count in tasks
+                ],
+            )
+
+    def get_tasks(
+        self, exclude_replica_id: str, heartbeat_timeout_seconds: float
+    ) -> list[StealableTask]:
+        """
+        Returns the tasks published by other replicas that are still alive, most urgent first (and the ones with the most remaining inputs among equally urgent ones).
+        """
+        tasks = [
+            self._to_stealable_task(row)
+            for row in self._get_conn().execute(
+                "SELECT id, replica_id, progress_db_dir, task, remaining_input_count FROM stealable_tasks WHERE active = 1 AND replica_id != ? AND heartbeat_at > ?",
+                (exclude_replica_id, time.time() - heartbeat_timeout_seconds),
+            )
+        ]
+        # deadlines are compared as datetimes, which is easier in Python than in SQL (the task is stored as JSON)
+        tasks.sort(
+            key=lambda t: (
+                -t.task.priority,
+                t.task.deadline is None,
+                t.task.deadline.timestamp() if t.task.deadline is not None else 0,
+                -t.remaining_input_count,
+            )
+        )
+        return tasks
+
+    def get_task(self, board_id: int) -> StealableTask | None:
+        """
+        Returns the task with the given board ID, even if it is not published anymore (e.g. to report outcomes of inputs stolen before).
+        """
+        row = (
+            self._get_conn()
+            .execute(
+                "SELECT id, replica_id, progress_db_dir, task, remaining_input_count FROM stealable_tasks WHERE id = ?",
+                (board_id,),
+            )
+            .fetchone()
+        )
+        return self._to_stealable_task(row) if row is not None else None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _to_stealable_task(self, row: tuple) -> StealableTask:
+        board_id, replica_id, progress_db_dir, task, remaining_input_count = row
+        return StealableTask(
+            board_id=board_id,
+            replica_id=replica_id,
+            progress_db_dir=progress_db_dir,
+            task=DistributedTaskModel.model_validate_json(task),
+            remaining_input_count=remaining_input_count,
+        )
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+            conn = sqlite3.connect(self._db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS stealable_tasks (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      replica_id TEXT NOT NULL,
+                      task_id INTEGER NOT NULL,
+                      progress_db_dir TEXT NOT NULL,
+                      task TEXT NOT NULL,
+                      remaining_input_count INTEGER NOT NULL,
+                      heartbeat_at FLOAT NOT NULL,
+                      active INTEGER NOT NULL,
+                      UNIQUE (replica_id, task_id)
+                    )
+                    """
+                )
+            self._conn = conn
+        return self._conn
+
+
+class ReplicaInputChunkSource:
+    """
+    Leases chunks of input items of the tasks other replicas published on the `WorkStealingBoard` (an `InputChunkSource`).
+
+    Leases, outcomes and renewals are written directly to the task progress DBs of the other replicas. Chunks are taken from the tail of the input queue, which the replica owning the task gets to last (see `TaskQueueItemManager.lease_input_chunk`).
+    The tasks are identified by their board IDs.
+    """
+
+    def __init__(
+        self,
+        board: WorkStealingBoard,
+        replica_id: str,
+        lease_seconds: float,
+        heartbeat_timeout_seconds: float,
+    ):
+        self._board = board
+        self._replica_id = replica_id
+        self._lease_seconds = lease_seconds
+        self._heartbeat_timeout_seconds = heartbeat_timeout_seconds
+
+    @property
+    def name(self) -> str:
+        return "other replicas"
+
+    async def lease(self, holder: str, size: int) -> InputChunkLeaseModel | None:
+        for stealable_task in self._board.get_tasks(
+            self._replica_id, self._heartbeat_timeout_seconds
+        ):
+            with self._open_queue_item_manager(stealable_task) as q:
+                lease = q.lease_input_chunk(
+                    holder, size, self._lease_seconds, newest_first=True
+                )
+            if lease is None:
+                continue
+            app_logger.info(
+                f"Stole {len(lease.items)} inputs of task {stealable_task.task.id} of replica {stealable_task.replica_id} (lease {lease.id})"
+            )
+            return InputChunkLeaseModel(
+                lease_id=lease.id,
+                task=stealable_task.task.model_copy(
+                    update={"id": stealable_task.board_id}
+                ),
+                items=[
+                    InputChunkItemModel(id=item.id, data=item.data)
+                    for item in lease.items
+                ],
+                expires_at=datetime.fromtimestamp(lease.expires_at, tz=timezone.utc),
+            )
+        return None
+
+    async def report(
+        self, task_id: int, lease_id: str, report: InputChunkReport
+    ) -> InputChunkReportResult:
+        stealable_task = self._get_task(task_id)
+        # the replica owning the task marks it as done once all of its inputs have an outcome
+        with self._open_queue_item_manager(stealable_task) as q:
+            q.record_input_chunk_outcomes(
+                [(outcome.id, outcome.outcome) for outcome in report.outcomes]
+            )
+            expires_at = (
+                q.renew_input_chunk_lease(lease_id, self._lease_seconds)
+                if report.renew
+                else None
+            )
+        return InputChunkReportResult(
+            expires_at=(
+                datetime.fromtimestamp(expires_at, tz=timezone.utc)
+                if expires_at is not None
+                else None
+            )
+        )
+
+    async def release(self, task_id: int, lease_id: str):
+        stealable_task = self._get_task(task_id)
+        with self._open_queue_item_manager(stealable_task) as q:
+            q.release_input_chunk(lease_id)
+
+    async def close(self):
+        self._board.close()
+
+    def _get_task(self, board_id: int) -> StealableTask:
+        stealable_task = self._board.get_task(board_id)
+        if stealable_task is None:
+            raise InputChunkTaskNotFoundError(
+                f"Task {board_id} is not on the work stealing board"
+            )
+        return stealable_task
+
+    def _open_queue_item_manager(
+        self, stealable_task: StealableTask
+    ) -> TaskQueueItemManager:
+        return TaskQueueItemManager(
+            task_id=stealable_task.task.id, db_dir=stealable_task.progress_db_dir
+        )
+
+
+class WorkStealer:
+    """
+    Shares the work of this replica with the other replicas on the same host (see `work_stealing_enabled` setting).
+
+    Every `report_interval_seconds`, the pending and running tasks of this replica are published on the `WorkStealingBoard`.
+    While this replica has no tasks of its own to work on, it steals chunks of input items of the tasks published by other replicas and processes them in local tasks (see `InputChunkWorker`).
+    Inputs stolen from a task are not stolen back, as the local tasks processing them are never published.
+    """
+
+    def __init__(
+        self,
+        board: WorkStealingBoard,
+        replica_id: str,
+        state_db_path: str,
+        chunk_size: int,
+        lease_seconds: float,
+        report_interval_seconds: float,
+        heartbeat_timeout_seconds: float,
+        logger: Logger = app_logger,
+    ):
+        self._board = board
+        self._replica_id = replica_id
+        self._report_interval_seconds = report_interval_seconds
+        self._logger = logger
+
+        self._chunk_worker = InputChunkWorker(
+            source=ReplicaInputChunkSource(
+                board, replica_id, lease_seconds, heartbeat_timeout_seconds
+            ),
+            holder=replica_id,
+            state_db_path=state_db_path,
+            chunk_size=chunk_size,
+            report_interval_seconds=report_interval_seconds,
+            should_lease=self._is_idle,
+            logger=logger,
+        )
+
+        self._loop_task: asyncio.Task | None = None
+
+    def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+        self._chunk_worker.start()
+
+    async def close(self):
+        await self._chunk_worker.close()
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        # nothing of this replica can be stolen while it is not running anyway
+        self._board.publish(self._replica_id, os.path.abspath(TASK_PROGRESS_DB_DIR), [])
+        self._board.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._publish_tasks()
+            except Exception:
+                self._logger.exception("Failed to publish tasks for work stealing")
+            await asyncio.sleep(self._report_interval_seconds)
+
+    async def _publish_tasks(self):
+        local_task_ids = self._chunk_worker.local_task_ids
+        task_ids = [
+            task_id for task_id in task_processors if task_id not in local_task_ids
+        ]
+        async with sessionmanager.session() as db_session:
+            db_tasks = (
+                await db_session.scalars(
+                    select(DataFetchingTask).where(
+                        DataFetchingTask.id.in_(task_ids),
+                        DataFetchingTask.status.in_(["pending", "running"]),
+                    )
+                )
+            ).all()
+        tasks: list[tuple[DistributedTaskModel, int]] = []
+        for db_task in db_tasks:
+            with TaskQueueItemManager(
+                task_id=db_task.id, db_dir=TASK_PROGRESS_DB_DIR
+            ) as q:
+                tasks.append(
+                    (to_distributed_task_model(db_task), q.remaining_input_count)
+                )
+        self._board.publish(
+            self._replica_id, os.path.abspath(TASK_PROGRESS_DB_DIR), tasks
+        )
+
+    def _is_idle(self) -> bool:
+        """
+        Whether this replica only works on inputs stolen from other replicas.
+        """
+        local_task_ids = self._chunk_worker.local_task_ids
+        return all(task_id in local_task_ids for task_id in task_processors)
+
+
+def _create_work_stealer() -> WorkStealer | None:
+    if not settings.work_stealing_enabled:
+        return None
+    if settings.replica_id is None:
+        raise ValueError("replica_id must be set if work_stealing_enabled is true")
+    return WorkStealer(
+        board=WorkStealingBoard(settings.work_stealing_board_path),
+        replica_id=settings.replica_id,
+        state_db_path=f"{DB_DIR}/stolen_input_chunks.db",
+        chunk_size=settings.task_distribution_chunk_size,
+        lease_seconds=settings.task_distribution_lease_seconds,
+        report_interval_seconds=settings.task_distribution_report_interval_seconds,
+        heartbeat_timeout_seconds=settings.work_stealing_heartbeat_timeout_seconds,
+    )
+
+
+work_stealer = _create_work_stealer()
+"""
+Shares work with the other replicas on the same host if work stealing is enabled (`None` otherwise).
+"""
@@ -0,0 +1,419 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import os
+import tempfile
+from aiohttp import ClientResponseError, web
+from aiohttp.test_utils import TestServer
+from fastapi import FastAPI
+import httpx
+import pytest
+
+from app.api.routers.distribution import router as distribution_router
+from app.db import DatabaseSessionManager, get_db_session
+from app.db.models import DataFetchingTask
+import app.tasks.distribution as distribution
+from app.tasks.distribution import (
+    CoordinatorClient,
+    DistributedTaskModel,
+    InputChunkItemModel,
+    InputChunkItemOutcomeModel,
+    InputChunkLeaseModel,
+    InputChunkReport,
+    InputChunkReportResult,
+    InputChunkTaskNotFoundError,
+    InputChunkWorker,
+)
+from app.tasks.queue_item_management import TaskQueueItemManager
+from app.utils.http import HTTPSessionManager
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+async def create_task(
+    sessionmanager: DatabaseSessionManager, inputs: list[int], status="pending"
+) -> int:
+    async with sessionmanager.session() as db_session:
+        db_task = DataFetchingTask(
+            data_source="dummy-api",
+            task_type="throw-above-threshold",
+            params={"threshold": 1000},
+            status=status,
+            priority=0,
+        )
+        db_session.add(db_task)
+        await db_session.commit()
+    with TaskQueueItemManager(
+        task_id=db_task.id, db_dir=distribution.TASK_PROGRESS_DB_DIR
+    ) as q:
+        q.add_inputs(inputs)
+    return db_task.id
+
+
+async def get_status(sessionmanager: DatabaseSessionManager, task_id: int) -> str:
+    async with sessionmanager.session() as db_session:
+        db_task = await db_session.get(DataFetchingTask, task_id)
+        assert db_task is not None
+        return db_task.status
+
+
+@pytest.mark.asyncio
+async def test_distribution_endpoints(db):
+    app = FastAPI()
+    app.include_router(distribution_router)
+
+    async def get_test_db_session():
+        async with db.session() as db_session:
+            yield db_session
+
+    app.dependency_overrides[get_db_session] = get_test_db_session
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://coordinator"
+    ) as client:
+
+        async def lease(size: int) -> httpx.Response:
+            return await client.post(
+                "/distribution/leases", json={"holder": "worker-1", "size": size}
+            )
+
+        # nothing to lease
+        assert (await lease(10)).status_code == 204
+
+        task_id = await create_task(db, [i + 1 for i in range(5)])
+        response = await lease(3)
+        assert response.status_code == 200
+        first = InputChunkLeaseModel.model_validate(response.json())
+        assert first.task.id == task_id
+        assert [item.data for item in first.items] == [1, 2, 3]
+        assert await get_status(db, task_id) == "running"
+        second = InputChunkLeaseModel.model_validate((await lease(10)).json())
+        assert [item.data for item in second.items] == [4, 5]
+        # all inputs are leased
+        assert (await lease(10)).status_code == 204
+
+        response = await client.post(
+            f"/distribution/tasks/{task_id}/leases/{first.lease_id}/outcomes",
+            json={
+                "outcomes": [
+                    {"id": item.id, "outcome": "successes"} for item in first.items[:2]
+                ]
+            },
+        )
+        assert response.status_code == 200
+        expires_at = InputChunkReportResult.model_validate(response.json()).expires_at
+        # the lease was renewed
+        assert expires_at is not None and expires_at > datetime.now(timezone.utc)
+
+        response = await client.delete(
+            f"/distribution/tasks/{task_id}/leases/{second.lease_id}"
+        )
+        assert response.status_code == 204
+        # the items of the released lease are handed out again right away
+        third = InputChunkLeaseModel.model_validate((await lease(10)).json())
+        assert [item.data for item in third.items] == [4, 5]
+
+        response = await client.post(
+            f"/distribution/tasks/{task_id + 1}/leases/{first.lease_id}/outcomes",
+            json={"outcomes": []},
+        )
+        assert response.status_code == 404
+        response = await client.delete(
+            f"/distribution/tasks/{task_id + 1}/leases/{first.lease_id}"
+        )
+        assert response.status_code == 404
+
+        # the task is done once the last outcome is reported
+        for lease_model, items in [(first, first.items[2:]), (third, third.items)]:
+            response = await client.post(
+                f"/distribution/tasks/{task_id}/leases/{lease_model.lease_id}/outcomes",
+                json={
+                    "outcomes": [
+                        {"id": item.id, "outcome": "failures"} for item in items
+                    ],
+                    "renew": False,
+                },
+            )
+            assert response.json() == {"expires_at": None}
+        assert await get_status(db, task_id) == "done"
+        with TaskQueueItemManager(
+            task_id=task_id, db_dir=distribution.TASK_PROGRESS_DB_DIR
+        ) as q:
+            counts = q.queue_item_counts
+        assert (counts.successes, counts.failures, counts.remaining) == (2, 3, 0)
+
+
+def to_lease_json(lease_id: str, task_id: int, items: list[int]) -> dict:
+    return InputChunkLeaseModel(
+        lease_id=lease_id,
+        task=DistributedTaskModel(
+            id=task_id,
+            data_source="dummy-api",
+            task_type="throw-above-threshold",
+            params={"threshold": 1000},
+            priority=0,
+            deadline=None,
+        ),
+        items=[InputChunkItemModel(id=item, data=item) for item in items],
+        expires_at=datetime.now(timezone.utc) + timedelta(minutes=5),
+    ).model_dump(mode="json")
+
+
+@pytest.mark.asyncio
+async def test_coordinator_client():
+    requests: list[tuple[str, str, dict | None]] = []
+    leases = [None, to_lease_json("lease-1", 7, [1, 2])]
+
+    async def handle_lease(request: web.Request):
+        requests.append(("POST", request.path, await request.json()))
+        lease = leases.pop(0)
+        if lease is None:
+            return web.Response(status=204)
+        return web.json_response(lease)
+
+    async def handle_report(request: web.Request):
+        requests.append(("POST", request.path, await request.json()))
+        if request.match_info["task_id"] != "7":
+            return web.json_response({"detail": "Task not found"}, status=404)
+        if request.match_info["lease_id"] == "broken":
+            return web.json_response({"detail": "Internal error"}, status=500)
+        return web.json_response({"expires_at": None})
+
+    async def handle_release(request: web.Request):
+        requests.append(("DELETE", request.path, None))
+        if request.match_info["task_id"] != "7":
+            return web.json_response({"detail": "Task not found"}, status=404)
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post("/distribution/leases", handle_lease)
+    app.router.add_post(
+        "/distribution/tasks/{task_id}/leases/{lease_id}/outcomes", handle_report
+    )
+    app.router.add_delete(
+        "/distribution/tasks/{task_id}/leases/{lease_id}", handle_release
+    )
+    async with TestServer(app) as server:
+        client = CoordinatorClient(f"{server.make_url('/')}", HTTPSessionManager())
+        # no inputs left to lease
+        assert await client.lease("worker-1", 10) is None
+        lease = await client.lease("worker-1", 10)
+        assert lease is not None
+        assert lease.task.id == 7
+        assert [item.data for item in lease.items] == [1, 2]
+        assert requests[0] == (
+            "POST",
+            "/distribution/leases",
+            {"holder": "worker-1", "size": 10},
+        )
+
+        report = InputChunkReport(
+            outcomes=[InputChunkItemOutcomeModel(id=1, outcome="successes")]
+        )
+        result = await client.report(7, "lease-1", report)
+        assert result.expires_at is None
+        assert requests[-1] == (
+            "POST",
+            "/distribution/tasks/7/leases/lease-1/outcomes",
+            {"outcomes": [{"id": 1, "outcome": "successes"}], "renew": True},
+        )
+        await client.release(7, "lease-1")
+        assert requests[-1] == ("DELETE", "/distribution/tasks/7/leases/lease-1", None)
+
+        # deleted tasks are distinguished from other errors
+        with pytest.raises(InputChunkTaskNotFoundError):
+            await client.report(8, "lease-2", report)
+        with pytest.raises(InputChunkTaskNotFoundError):
+            await client.release(8, "lease-2")
+        with pytest.raises(ClientResponseError):
+            await client.report(7, "broken", report)
+        await client.close()
+
+
+class StubInputChunkSource:
+    """
+    Hands out the given leases (one per `lease` call) and records reports and releases.
+    """
+
+    def __init__(self, leases: list[InputChunkLeaseModel]):
+        self.leases = leases
+        self.reports: list[tuple[int, str, InputChunkReport]] = []
+        self.released: list[tuple[int, str]] = []
+
+        self.expired_lease_ids: set[str] = set()
+        self.deleted_task_ids: set[int] = set()
+        self.failing_lease_ids: set[str] = set()
+
+    @property
+    def name(self) -> str:
+        return "stub"
+
+    async def lease(self, holder: str, size: int) -> InputChunkLeaseModel | None:
+        return self.leases.pop(0) if self.leases else None
+
+    async def report(
+        self, task_id: int, lease_id: str, report: InputChunkReport
+    ) -> InputChunkReportResult:
+        if task_id in self.deleted_task_ids:
+            raise InputChunkTaskNotFoundError(f"Task {task_id} not found")
+        if lease_id in self.failing_lease_ids:
+            raise RuntimeError("Unexpected response")
+        self.reports.append((task_id, lease_id, report))
+        if lease_id in self.expired_lease_ids or not report.renew:
+            return InputChunkReportResult(expires_at=None)
+        return InputChunkReportResult(
+            expires_at=datetime.now(timezone.utc) + timedelta(minutes=5)
+        )
+
+    async def release(self, task_id: int, lease_id: str):
+        if task_id in self.deleted_task_ids:
+            raise InputChunkTaskNotFoundError(f"Task {task_id} not found")
+        self.released.append((task_id, lease_id))
+
+    async def close(self):
+        pass
+
+
+def create_lease(lease_id: str, task_id: int, items: list[int]):
+    return InputChunkLeaseModel.model_validate(to_lease_json(lease_id, task_id, items))
+
+
+def create_worker(source: StubInputChunkSource, temp_dir: str) -> InputChunkWorker:
+    return InputChunkWorker(
+        source=source,
+        holder="worker-1",
+        state_db_path=os.path.join(temp_dir, "leases.db"),
+        chunk_size=3,
+        report_interval_seconds=1,
+    )
+
+
+def get_local_queue(local_task_id: int) -> TaskQueueItemManager:
+    return TaskQueueItemManager(
+        task_id=local_task_id, db_dir=distribution.TASK_PROGRESS_DB_DIR
+    )
+
+
+def held_item_ids(worker: InputChunkWorker) -> list[int]:
+    return [
+        row[0]
+        for row in worker._get_conn().execute(
+            "SELECT item_id FROM held_lease_items ORDER BY item_id"
+        )
+    ]
+
+
+@pytest.mark.asyncio
+async def test_input_chunk_worker_processes_leased_inputs_in_local_tasks(
+    db, temp_dir, started_local_task_ids
+):
+    source = StubInputChunkSource(
+        [create_lease("lease-1", 7, [1, 2, 3]), create_lease("lease-2", 7, [4, 5])]
+    )
+    worker = create_worker(source, temp_dir)
+
+    await worker._lease_if_needed()
+    [local_task_id] = worker.local_task_ids
+    await asyncio.sleep(0)
+    assert started_local_task_ids == [local_task_id]
+    assert await get_status(db, local_task_id) == "pending"
+    with get_local_queue(local_task_id) as q:
+        assert q.remaining_input_count == 3
+        # enough items are held already
+        await worker._lease_if_needed()
+        assert len(source.leases) == 1
+
+        # the local task processes some of the items
+        q.record_outcomes(
+            [(item, "successes") for item in q.lease_input_items(1)]
+            + [(item, "failures") for item in q.lease_input_items(1)]
+        )
+    await worker._report_outcomes()
+    [(task_id, lease_id, report)] = source.reports
+    assert (task_id, lease_id, report.renew) == (7, "lease-1", True)
+    assert [(o.id, o.outcome) for o in report.outcomes] == [
+        (1, "successes"),
+        (2, "failures"),
+    ]
+    assert held_item_ids(worker) == [3]
+
+    # inputs of the same task are added to the same local task
+    await worker._lease_if_needed()
+    assert worker.local_task_ids == {local_task_id}
+    assert held_item_ids(worker) == [3, 4, 5]
+    with get_local_queue(local_task_id) as q:
+        assert q.remaining_input_count == 3
+    await worker.close()
+
+
+@pytest.mark.asyncio
+async def test_input_chunk_worker_drops_leases_it_cannot_hold(
+    db, temp_dir, started_local_task_ids
+):
+    source = StubInputChunkSource(
+        [
+            create_lease("lease-1", 7, [1, 2]),
+            create_lease("lease-2", 7, [3, 4]),
+            create_lease("lease-3", 8, [5, 6]),
+            create_lease("lease-4", 9, [7, 8]),
+        ]
+    )
+    worker = create_worker(source, temp_dir)
+    worker._chunk_size = 100
+    for _ in range(4):
+        await worker._lease_if_needed()
+    assert len(worker.local_task_ids) == 3
+    local_task_ids = {
+        remote_task_id: worker._get_local_task_id(remote_task_id)
+        for remote_task_id in [7, 8, 9]
+    }
+
+    source.expired_lease_ids.add("lease-1")
+    source.failing_lease_ids.add("lease-2")
+    source.deleted_task_ids.add(8)
+    await worker._report_outcomes()
+    # one lease that cannot be reported does not hold up the others
+    assert [lease_id for _, lease_id, _ in source.reports] == ["lease-1", "lease-4"]
+    assert held_item_ids(worker) == [3, 4, 7, 8]
+    # the unprocessed items of the expired lease and the lease of the deleted task were removed from the local tasks, so they are not processed (again)
+    with get_local_queue(local_task_ids[7]) as q:
+        assert q.get_input_statuses([1, 2, 3, 4]) == [None, None, "inputs", "inputs"]
+    with get_local_queue(local_task_ids[8]) as q:
+        assert q.remaining_input_count == 0
+
+    # leases of paused local tasks are released
+    async with db.session() as db_session:
+        db_task = await db_session.get(DataFetchingTask, local_task_ids[9])
+        assert db_task is not None
+        db_task.status = "paused"
+        await db_session.commit()
+    source.reports.clear()
+    await worker._report_outcomes()
+    assert [(lease_id, report.renew) for _, lease_id, report in source.reports] == [
+        ("lease-4", False)
+    ]
+    assert source.released == [(9, "lease-4")]
+    assert held_item_ids(worker) == [3, 4]
+    with get_local_queue(local_task_ids[9]) as q:
+        assert q.remaining_input_count == 0
+
+    # leases of the paused task are released right away (also removing items from earlier leases that are still in the local task)
+    with get_local_queue(local_task_ids[9]) as q:
+        q.add_inputs([9])
+    source.leases.append(create_lease("lease-5", 9, [9, 10]))
+    await worker._lease_if_needed()
+    assert source.released[-1] == (9, "lease-5")
+    assert held_item_ids(worker) == [3, 4]
+    with get_local_queue(local_task_ids[9]) as q:
+        assert q.remaining_input_count == 0
+
+    # held items of tasks without a local task (e.g. because the state DB was edited) are released
+    with worker._get_conn() as conn:
+        conn.execute("DELETE FROM mirrored_tasks WHERE remote_task_id = 7")
+    source.failing_lease_ids.clear()
+    await worker._report_outcomes()
+    assert source.released[-1] == (7, "lease-2")
+    assert held_item_ids(worker) == []
+    await worker.close()
@@ -0,0 +1,365 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import pytest
+import zstandard as zstd
+
+import app.tasks
+import app.tasks.processing as processing
+from app.config import settings
+from app.db.models import DataFetchingTask
+from app.tasks.common import NonFatalProcessingError
+from app.tasks.processing import (
+    SequentialTaskProcessor,
+    StreamingTaskProcessor,
+    TaskProcessor,
+)
+from app.tasks.queue_item_management import TaskQueueItemManager
+from app.tasks.uploads import OutputUploader
+from app.utils.fair_share import FairShareSemaphore
+from app.utils.zstd import decompress_available_bytes, decompress_bytes
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+async def fetch(item: int):
+    return {"id": item}
+
+
+def create_processor(
+    tmp: str, fetch_fn=fetch, **kwargs
+) -> SequentialTaskProcessor[int]:
+    return SequentialTaskProcessor(
+        server_ip="127.0.0.1",
+        task_id=1,
+        outputs_s3_prefix="test",
+        outputs_local_storage_dir=tmp,
+        queue_item_manager=TaskQueueItemManager(db_dir=tmp, task_id=1),
+        output_uploader=OutputUploader(manifest_path=f"{tmp}/pending_uploads.db"),
+        logger=logging.getLogger("test"),
+        fetch_fn=fetch_fn,
+        **kwargs,
+    )
+
+
+def test_output_file_recovery_after_crash(temp_dir):
+    processor = create_processor(temp_dir)
+    item_man = processor._queue_item_manager
+    item_man.add_inputs([i + 1 for i in range(10)])
+    items = item_man.lease_input_items(4)
+
+    # first frame is complete and its outcomes are recorded
+    processor._write_batch(
+        [{"id": item.data} for item in items[:2]],
+        [(item, "successes") for item in items[:2]],
+    )
+    item_man.record_outcomes(
+        [(item, "successes") for item in items[:2]],
+        output_checkpoint=processor._end_output_frame(),
+    )
+    # second frame is not finished: one journaled batch, followed by output that did not make it into the journal
+    processor._write_batch([{"id": items[2].data}], [(items[2], "successes")])
+    processor._output_writer.write(b'{"id": 4}\n')
+    processor._output_writer.flush(zstd.FLUSH_BLOCK)
+    processor.close()
+
+    processor = create_processor(temp_dir)
+    processor._recover_output_file()
+    counts = processor.queue_item_counts
+    assert counts.successes == 3
+    assert counts.remaining == 7
+
+    with open(processor._output_fp, "rb") as f:
+        outputs = [json.loads(line) for line in decompress_bytes(f.read()).splitlines()]
+    assert [output["id"] for output in outputs] == [1, 2, 3]
+    assert processor._queue_item_manager.output_checkpoint.uncompressed_offset == sum(
+        len(json.dumps(output)) + 1 for output in outputs
+    )
+    processor.close()
+
+
+async def fetch_pages(item: int):
+    if item == 2:
+        return
+    for page in range(2):
+        if item == 3 and page == 1:
+            raise NonFatalProcessingError("second page not found")
+        yield [{"id": item * 100 + page * 10 + i} for i in range(3)]
+
+
+@pytest.mark.asyncio
+async def test_streaming_processor_yields_records_page_by_page(temp_dir):
+    processor = StreamingTaskProcessor(
+        server_ip="127.0.0.1",
+        task_id=1,
+        outputs_s3_prefix="test",
+        outputs_local_storage_dir=temp_dir,
+        queue_item_manager=TaskQueueItemManager(db_dir=temp_dir, task_id=1),
+        output_uploader=OutputUploader(manifest_path=f"{temp_dir}/pending_uploads.db"),
+        logger=logging.getLogger("test"),
+        fetch_fn=fetch_pages,
+    )
+    processor._queue_item_manager.add_inputs([1, 2, 3])
+
+    parts = [
+        part async for part in processor._fetch_stream(processor._lease_input_items())
+    ]
+    # one part per page, the outcome is only determined after the last page
+    assert [len(part.outputs) for part in parts] == [3, 3, 0]
+    assert [part.outcomes for part in parts[:2]] == [[], []]
+    assert parts[2].outcomes[0][1] == "successes"
+    assert parts[1].outputs[0]["parent_id"] == 1
+    assert parts[1].outputs[0]["data"] == {"id": 110}
+
+    fetched = await processor._fetch(processor._lease_input_items())
+    assert fetched.outputs == []
+    assert fetched.outcomes[0][1] == "inputs-without-output"
+
+    fetched = await processor._fetch(processor._lease_input_items())
+    # records of pages fetched before a non-fatal error are still written
+    assert [output["data"]["id"] for output in fetched.outputs] == [300, 301, 302]
+    assert fetched.outcomes[0][1] == "failures"
+    processor.close()
+
+
+async def wait_until(condition, timeout: float = 2):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_processing_pipeline_back_pressure_releases_fetch_slots(temp_dir):
+    fetched_items: list[int] = []
+
+    async def counting_fetch(item: int):
+        fetched_items.append(item)
+        return {"id": item}
+
+    processor = create_processor(temp_dir, fetch_fn=counting_fetch, concurrency=2)
+    processor._stage_queue_size = 1
+    fetch_slots = FairShareSemaphore(2)
+    fetch_slots.register(1)
+    processor.set_fetch_slots(fetch_slots)
+    processor._queue_item_manager.add_inputs([i + 1 for i in range(50)])
+
+    # writing to disk is stuck
+    writes_unblocked = threading.Event()
+    write_batch = processor._write_batch
+
+    def blocked_write_batch(*args):
+        writes_unblocked.wait()
+        return write_batch(*args)
+
+    processor._write_batch = blocked_write_batch  # type: ignore
+    processing = asyncio.create_task(processor._process_inputs(None))  # type: ignore
+    try:
+        # the workers wait for the write stage without holding fetch slots
+        await wait_until(lambda: len(fetched_items) >= 4)
+        await wait_until(lambda: fetch_slots.in_use(1) == 0)
+        fetched_count = len(fetched_items)
+        await asyncio.sleep(0.1)
+        # items being written + queued + one per worker waiting to queue its item
+        assert len(fetched_items) == fetched_count <= 2 + 1 + 2
+        assert processor.queue_item_counts.successes == 0
+    finally:
+        writes_unblocked.set()
+    await asyncio.wait_for(processing, timeout=5)
+    assert processor.queue_item_counts.successes == 50
+    assert sorted(fetched_items) == [i + 1 for i in range(50)]
+    processor.close()
+
+
+@pytest.mark.asyncio
+async def test_processing_pipeline_records_outcomes_after_outputs_are_written(
+    temp_dir,
+):
+    processor = create_processor(temp_dir, concurrency=3, commit_group_size=4)
+    item_man = processor._queue_item_manager
+    item_man.add_inputs([i + 1 for i in range(30)])
+    record_outcomes = item_man.record_outcomes
+    recorded_items: list[int] = []
+
+    def checking_record_outcomes(outcomes, output_checkpoint=None):
+        with open(processor._output_fp, "rb") as f:
+            written = decompress_available_bytes(f.read())
+        written_ids = {json.loads(line)["id"] for line in written.splitlines()}
+        # the outputs of all items whose outcomes are recorded are in the output file already
+        assert {item.data for item, _ in outcomes} <= written_ids
+        assert output_checkpoint is not None
+        recorded_items.extend(item.data for item, _ in outcomes)
+        record_outcomes(outcomes, output_checkpoint=output_checkpoint)
+
+    item_man.record_outcomes = checking_record_outcomes  # type: ignore
+    await processor._process_inputs(None)  # type: ignore
+    assert sorted(recorded_items) == [i + 1 for i in range(30)]
+    assert processor.queue_item_counts.remaining == 0
+    processor.close()
+
+
+@pytest.mark.asyncio
+async def test_processing_pipeline_stops_all_stages_on_fatal_fetch_error(temp_dir):
+    async def failing_fetch(item: int):
+        if item == 5:
+            raise RuntimeError("fatal")
+        await asyncio.sleep(0.001)
+        return {"id": item}
+
+    processor = create_processor(temp_dir, fetch_fn=failing_fetch, concurrency=2)
+    item_man = processor._queue_item_manager
+    item_man.add_inputs([i + 1 for i in range(20)])
+    tasks_before = asyncio.all_tasks()
+
+    with pytest.raises(RuntimeError, match="fatal"):
+        await processor._process_inputs(None)  # type: ignore
+
+    # no stage or worker is left running
+    assert asyncio.all_tasks() == tasks_before
+    counts = item_man.queue_item_counts
+    # items fetched before the error were still written and committed, all others stay in the input queue
+    assert counts.successes + counts.remaining == 20
+    assert item_man.get_input_statuses([5]) == ["inputs"]
+    with open(processor._output_fp, "rb") as f:
+        written = decompress_available_bytes(f.read())
+    assert len(written.splitlines()) == counts.successes
+    # no item is still leased
+    assert len(item_man.lease_input_items(20)) == counts.remaining
+    processor.close()
+
+
+@pytest.mark.asyncio
+async def test_processing_pipeline_stops_all_stages_on_write_error(temp_dir):
+    processor = create_processor(temp_dir, concurrency=2)
+    item_man = processor._queue_item_manager
+    item_man.add_inputs([i + 1 for i in range(20)])
+
+    def failing_write_batch(*args):
+        raise OSError("disk full")
+
+    processor._write_batch = failing_write_batch  # type: ignore
+    tasks_before = asyncio.all_tasks()
+
+    with pytest.raises(OSError, match="disk full"):
+        await asyncio.wait_for(processor._process_inputs(None), timeout=5)  # type: ignore
+
+    assert asyncio.all_tasks() == tasks_before
+    # nothing was written, so no outcome was recorded and all items can be leased again
+    assert item_man.queue_item_counts.remaining == 20
+    assert len(item_man.lease_input_items(20)) == 20
+    processor.close()
+
+
+@pytest.mark.asyncio
+async def test_processing_pipeline_stops_on_write_error_while_fetch_queue_is_full(
+    temp_dir,
+):
+    processor = create_processor(temp_dir, concurrency=4)
+    processor._stage_queue_size = 1
+    item_man = processor._queue_item_manager
+    item_man.add_inputs([i + 1 for i in range(199)])
+    write_batch = processor._write_batch
+    write_count = 0
+
+    def failing_write_batch(*args):
+        nonlocal write_count
+        write_count += 1
+        if write_count == 2:
+            raise OSError("disk full")
+        return write_batch(*args)
+
+    processor._write_batch = failing_write_batch  # type: ignore
+    tasks_before = asyncio.all_tasks()
+
+    # the fetch stage does not wait for the stopped write stage to make room for the end of the fetched items
+    with pytest.raises(OSError, match="disk full"):
+        await asyncio.wait_for(processor._process_inputs(None), timeout=5)  # type: ignore
+
+    assert asyncio.all_tasks() == tasks_before
+    assert len(item_man.lease_input_items(199)) == item_man.queue_item_counts.remaining
+    processor.close()
+
+
+@pytest.mark.asyncio
+async def test_legacy_output_file_is_compressed_without_blocking_event_loop(
+    temp_dir, monkeypatch
+):
+    processor = create_processor(temp_dir)
+    item_man = processor._queue_item_manager
+    item_man.add_inputs([1, 2, 3])
+    items = item_man.lease_input_items(3)
+    item_man.release_all_leases()
+    lines = [json.dumps({"id": item.data}).encode() + b"\n" for item in items]
+    with open(processor._legacy_output_fp, "wb") as f:
+        f.write(b"".join(lines))
+    with open(processor._journal_fp, "w") as f:
+        f.write(
+            json.dumps(
+                {
+                    "seq": 1,
+                    "offset": len(lines[0]) + len(lines[1]),
+                    "outcomes": [[item.id, "successes"] for item in items[:2]],
+                }
+            )
+            + "\n"
+        )
+
+    compressing_threads: list[threading.Thread] = []
+    compress_file = processing.compress_file
+
+    def recording_compress_file(**kwargs):
+        compressing_threads.append(threading.current_thread())
+        return compress_file(**kwargs)
+
+    monkeypatch.setattr(processing, "compress_file", recording_compress_file)
+    await processor._recover_legacy_output_file()
+
+    # compressed in a separate thread
+    [compressing_thread] = compressing_threads
+    assert compressing_thread is not threading.main_thread()
+    assert not os.path.exists(processor._legacy_output_fp)
+    assert item_man.queue_item_counts.successes == 2
+    [upload] = processor._output_uploader.pending_uploads(1)
+    with open(upload.local_path, "rb") as f:
+        assert decompress_bytes(f.read()) == b"".join(lines)
+    processor.close()
+
+
+def test_fetch_concurrency_is_configurable_per_task_type(temp_dir, monkeypatch):
+    monkeypatch.setattr(app.tasks, "TASK_PROGRESS_DB_DIR", temp_dir)
+    monkeypatch.setattr(app.tasks, "TASK_OUTPUT_DIR", temp_dir)
+    monkeypatch.setattr(
+        settings, "task_fetch_concurrency", {"dummy-api/throw-above-threshold": 3}
+    )
+    created: list[TaskProcessor] = []
+    for task_id, task_type, params in [
+        (1, "throw-above-threshold", {"threshold": 1000}),
+        (2, "flaky", {"flakiness": 0.1}),
+    ]:
+        db_task = DataFetchingTask(
+            data_source="dummy-api",
+            task_type=task_type,
+            params=params,
+            status="pending",
+            priority=0,
+        )
+        db_task.id = task_id
+        created.append(
+            app.tasks._create_processor(
+                db_task,
+                output_uploader=OutputUploader(
+                    manifest_path=f"{temp_dir}/pending_uploads.db"
+                ),
+            )
+        )
+
+    # task types that are not configured use the default of their fetch function
+    assert [processor._concurrency for processor in created] == [3, 8]
+    for processor in created:
+        processor.close()
@@ -0,0 +1,269 @@
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import pytest
+
+import app.tasks.progress as progress_module
+from app.tasks import task_processors
+from app.tasks.progress import TaskProgressRegistry
+from app.tasks.progress.public_models import (
+    TaskOutputUploadModel,
+    TaskProgressUpdateModel,
+)
+from app.tasks.queue_item_management import QueueItemCounts, TaskQueueItemManager
+from app.tasks.uploads import OutputFileUpload, OutputUploader
+
+
+@pytest.fixture
+def temp_db_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+@pytest.mark.asyncio
+async def test_progress_registry_reads_idle_task_dbs(temp_db_dir):
+    registry = TaskProgressRegistry(task_progress_db_dir=temp_db_dir, max_open_dbs=1)
+
+    item_man = TaskQueueItemManager(db_dir=temp_db_dir, task_id=1)
+    item_man.add_inputs([i + 1 for i in range(10)])
+    item_man.record_outcomes(
+        [(item, "successes") for item in item_man.lease_input_items(3)]
+    )
+
+    progress = await registry.get_progress(1)
+    assert progress.success_count == 3
+    assert progress.remaining_count == 7
+
+    # cached connections see changes made by other connections
+    item_man.record_outcomes(
+        [(item, "failures") for item in item_man.lease_input_items(2)]
+    )
+    progress = await registry.get_progress(1)
+    assert progress.failure_count == 2
+    assert progress.remaining_count == 5
+
+    # tasks without a progress DB (yet) have no progress
+    progress = await registry.get_progress(2)
+    assert progress.remaining_count == 0
+
+    other_item_man = TaskQueueItemManager(db_dir=temp_db_dir, task_id=3)
+    other_item_man.add_inputs([1])
+    assert (await registry.get_progress(3)).remaining_count == 1
+    # least recently used connection was closed
+    assert list(registry._connections) == [3]
+
+    registry.close()
+    item_man.close()
+    other_item_man.close()
+
+
+@pytest.mark.asyncio
+async def test_progress_registry_progress_of_several_tasks(temp_db_dir):
+    registry = TaskProgressRegistry(task_progress_db_dir=temp_db_dir, max_open_dbs=2)
+
+    item_mans = [
+        TaskQueueItemManager(db_dir=temp_db_dir, task_id=task_id)
+        for task_id in range(1, 6)
+    ]
+    for i, item_man in enumerate(item_mans):
+        item_man.add_inputs([j + 1 for j in range(i + 1)])
+
+    progress = await registry.get_progress_of_tasks([5, 1, 3, 42], max_concurrency=2)
+    assert [p.task_id for p in progress] == [5, 1, 3, 42]
+    assert [p.remaining_count for p in progress] == [5, 1, 3, 0]
+    assert len(registry._connections) == 2
+
+    registry.close()
+    for item_man in item_mans:
+        item_man.close()
+
+
+@pytest.mark.asyncio
+async def test_progress_registry_migrates_legacy_task_dbs_once(
+    temp_db_dir, monkeypatch
+):
+    # task progress DBs created by older versions stored each queue in a separate table
+    with sqlite3.connect(os.path.join(temp_db_dir, "1.db")) as conn:
+        conn.execute(
+            "CREATE TABLE unique_queue_inputs (_id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB, timestamp FLOAT)"
+        )
+        conn.executemany(
+            "INSERT INTO unique_queue_inputs (data, timestamp) VALUES (?, ?)",
+            [(json.dumps(item).encode("utf-8"), 1700000000.0) for item in [1, 2]],
+        )
+    conn.close()
+    item_man = TaskQueueItemManager(db_dir=temp_db_dir, task_id=2)
+    item_man.add_inputs([1])
+
+    opened_db_paths: list[str] = []
+    open_task_progress_db = progress_module.open_task_progress_db
+
+    def tracking_open_task_progress_db(db_path: str):
+        opened_db_paths.append(db_path)
+        return open_task_progress_db(db_path)
+
+    monkeypatch.setattr(
+        progress_module, "open_task_progress_db", tracking_open_task_progress_db
+    )
+    registry = TaskProgressRegistry(task_progress_db_dir=temp_db_dir, max_open_dbs=1)
+    # the connections are evicted from the cache every time
+    for _ in range(2):
+        assert (await registry.get_progress(1)).remaining_count == 2
+        assert (await registry.get_progress(2)).remaining_count == 1
+    # only the legacy DB was opened for writing, and only once
+    assert opened_db_paths == [os.path.join(temp_db_dir, "1.db")]
+
+    registry.close()
+    item_man.close()
+
+
+class FakeProcessor:
+    def __init__(self, remaining: int):
+        self.queue_item_counts = QueueItemCounts(
+            remaining=remaining, successes=0, failures=0, inputs_without_output=0
+        )
+        self.estimated_completion_at = None
+        self.bytes_written = 0
+        self.output_file_size_bytes = 0
+
+    def process(self, count: int):
+        self.queue_item_counts.remaining -= count
+        self.queue_item_counts.successes += count
+        self.bytes_written += count * 10
+
+
+@pytest.fixture
+def upload_listeners(temp_db_dir, monkeypatch):
+    uploader = OutputUploader(manifest_path=f"{temp_db_dir}/pending_uploads.db")
+    monkeypatch.setattr(progress_module, "output_uploader", uploader)
+    return uploader._upload_listeners
+
+
+async def next_event(
+    stream, timeout: float = 1
+) -> tuple[float, TaskProgressUpdateModel | TaskOutputUploadModel]:
+    event = await asyncio.wait_for(anext(stream), timeout=timeout)
+    return time.monotonic(), event
+
+
+@pytest.mark.asyncio
+async def test_progress_stream_coalesces_updates_and_suppresses_unchanged_snapshots(
+    temp_db_dir, monkeypatch, upload_listeners
+):
+    registry = TaskProgressRegistry(task_progress_db_dir=temp_db_dir)
+    processor = FakeProcessor(remaining=100)
+    monkeypatch.setitem(task_processors, 1, processor)
+
+    async def process_continuously():
+        while True:
+            processor.process(1)
+            await asyncio.sleep(0.005)
+
+    stream = registry.stream_progress(1, interval_seconds=0.1, max_silence_seconds=10)
+    processing = asyncio.create_task(process_continuously())
+    try:
+        events = [await next_event(stream) for _ in range(4)]
+    finally:
+        processing.cancel()
+    # many changes between two snapshots result in a single update
+    times = [t for t, _ in events]
+    assert all(b - a >= 0.09 for a, b in zip(times, times[1:]))
+    updates = [event for _, event in events]
+    assert all(isinstance(update, TaskProgressUpdateModel) for update in updates)
+    assert all(update.is_processing for update in updates)  # type: ignore
+    assert updates[0].items_per_second is None  # type: ignore
+    assert updates[-1].items_per_second > 0  # type: ignore
+    assert updates[-1].bytes_written > updates[0].bytes_written  # type: ignore
+
+    # progress stopped changing: nothing is sent until the stream would be silent for too long
+    await next_event(stream)
+    with pytest.raises(asyncio.TimeoutError):
+        await next_event(stream, timeout=0.5)
+    await stream.aclose()
+    assert upload_listeners == {}
+
+
+@pytest.mark.asyncio
+async def test_progress_stream_keep_alive_and_uploads(
+    temp_db_dir, monkeypatch, upload_listeners
+):
+    registry = TaskProgressRegistry(task_progress_db_dir=temp_db_dir)
+    monkeypatch.setitem(task_processors, 1, FakeProcessor(remaining=100))
+    stream = registry.stream_progress(1, interval_seconds=0.02, max_silence_seconds=0.2)
+
+    await next_event(stream)
+    # the first snapshot with throughput information
+    first_at, first = await next_event(stream)
+    assert first.items_per_second == 0  # type: ignore
+    # the progress did not change, but the snapshot is sent again so that the connection is kept alive
+    second_at, second = await next_event(stream)
+    assert 0.18 <= second_at - first_at < 0.5
+    assert second.model_dump(exclude={"observed_at"}) == first.model_dump(
+        exclude={"observed_at"}
+    )
+
+    # uploads are sent right away
+    upload = OutputFileUpload(
+        s3_key="tasks/1/outputs/1.jsonl.zst",
+        s3_bucket="bucket",
+        s3_endpoint_url="http://localhost:9000",
+        size_bytes=1234,
+        uploaded_at=datetime.now(timezone.utc),
+    )
+    for listener in upload_listeners[1]:
+        listener.put_nowait(upload)
+    upload_at, event = await next_event(stream)
+    assert upload_at - second_at < 0.15
+    assert isinstance(event, TaskOutputUploadModel)
+    assert event.task_id == 1
+    assert event.s3_key == upload.s3_key
+    assert event.size_bytes == 1234
+    # an upload counts as a sign of life, too
+    keep_alive_at, _ = await next_event(stream)
+    assert keep_alive_at - upload_at >= 0.18
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_progress_stream_follows_processor_starting_and_stopping(
+    temp_db_dir, monkeypatch, upload_listeners
+):
+    registry = TaskProgressRegistry(task_progress_db_dir=temp_db_dir)
+    item_man = TaskQueueItemManager(db_dir=temp_db_dir, task_id=1)
+    item_man.add_inputs([i + 1 for i in range(10)])
+    stream = registry.stream_progress(1, interval_seconds=0.02, max_silence_seconds=10)
+
+    # not being processed: progress is read from the task progress DB
+    _, update = await next_event(stream)
+    assert isinstance(update, TaskProgressUpdateModel)
+    assert not update.is_processing
+    assert update.remaining_count == 10
+    assert update.bytes_written is None
+
+    processor = FakeProcessor(remaining=10)
+    processor.process(2)
+    monkeypatch.setitem(task_processors, 1, processor)
+    _, update = await next_event(stream)
+    assert isinstance(update, TaskProgressUpdateModel)
+    assert update.is_processing
+    assert update.success_count == 2
+    assert update.bytes_written == 20
+
+    item_man.record_outcomes(
+        [(item, "successes") for item in item_man.lease_input_items(10)]
+    )
+    del task_processors[1]
+    _, update = await next_event(stream)
+    assert isinstance(update, TaskProgressUpdateModel)
+    assert not update.is_processing
+    assert update.items_per_second is None
+    assert update.success_count == 10
+    assert update.remaining_count == 0
+
+    await stream.aclose()
+    registry.close()
+    item_man.close()
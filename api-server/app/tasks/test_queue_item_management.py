@@ -1,3 +1,7 @@
+import asyncio
+import json
+import os
+import sqlite3
 import tempfile
 from typing import Sequence
 import pytest
@@ -5,6 +9,8 @@ from dateutil import parser
 from datetime import datetime, timezone
 
 from app.tasks.queue_item_management import (
+    EmptyQueueError,
+    OutputCheckpoint,
     QueueItemData,
     TaskQueueItemManager,
     NonFatalProcessingError,
@@ -151,3 +157,296 @@ async def test_task_queue_processing_batched(temp_db_dir):
 
     remaining_res = item_man.get_queue_items("inputs")
     assert_queue_items_query_items_plausible(remaining_res.items, [7])
+
+
+@pytest.mark.asyncio
+async def test_task_queue_processing_concurrent_workers(temp_db_dir):
+    item_man = TaskQueueItemManager(
+        db_dir=temp_db_dir,
+        task_id=1,
+    )
+
+    item_man.add_inputs([i + 1 for i in range(20)])
+
+    in_flight: set[int] = set()
+    max_in_flight = 0
+
+    async def dummy_slow_processing_fn(x: int) -> str | None:
+        nonlocal max_in_flight
+        # every item must only be handed out to a single worker
+        assert x not in in_flight
+        in_flight.add(x)
+        max_in_flight = max(max_in_flight, len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.discard(x)
+        if x == 15:
+            raise TestFatalError("Dummy fatal error")
+        if x % 5 == 0:
+            return None
+        if x % 7 == 0:
+            raise NonFatalProcessingError("Non-fatal dummy error")
+        return f"Processed {x}"
+
+    async def work():
+        while True:
+            try:
+                await item_man.process_next_input_item(
+                    dummy_slow_processing_fn,
+                    on_success=handle_success,
+                    on_no_data_returned=handle_no_data,
+                    on_non_fatal_error=handle_error,
+                )
+            except EmptyQueueError:
+                return
+
+    with pytest.raises(TestFatalError):
+        await asyncio.gather(*[work() for _ in range(4)])
+
+    assert max_in_flight > 1
+
+    # let the remaining workers finish their leased items
+    await asyncio.sleep(0.1)
+
+    counts = item_man.queue_item_counts
+    print(counts)
+
+    # the item that caused the fatal error stays in the input queue
+    remaining_res = item_man.get_queue_items("inputs", limit=20)
+    assert 15 in [item.data for item in remaining_res.items]
+    assert (
+        counts.successes
+        + counts.failures
+        + counts.inputs_without_output
+        + counts.remaining
+        == 20
+    )
+
+
+def test_task_queue_recording_outcomes_with_output_checkpoint(temp_db_dir):
+    item_man = TaskQueueItemManager(
+        db_dir=temp_db_dir,
+        task_id=1,
+    )
+
+    item_man.add_inputs([i + 1 for i in range(10)])
+    assert item_man.output_checkpoint == OutputCheckpoint(seq=0, offset=0)
+
+    leased = item_man.lease_input_items(4)
+    assert [item.data for item in leased] == [1, 2, 3, 4]
+    # leased items are not handed out twice
+    assert [item.data for item in item_man.lease_input_items(2)] == [5, 6]
+
+    item_man.release_leases(leased[2:])
+    assert [item.data for item in item_man.lease_input_items(3)] == [3, 4, 7]
+
+    item_man.record_outcomes(
+        [(leased[0], "successes"), (leased[1], "failures")],
+        output_checkpoint=OutputCheckpoint(seq=3, offset=1234),
+    )
+    assert item_man.output_checkpoint == OutputCheckpoint(seq=3, offset=1234)
+    assert item_man.remaining_input_count == 8
+    assert item_man.success_count == 1
+    assert item_man.failure_count == 1
+    assert [item.data for item in item_man.get_input_items([1, 2, 3])] == [3]
+
+    item_man.close()
+
+    # the checkpoint survives a restart
+    item_man = TaskQueueItemManager(
+        db_dir=temp_db_dir,
+        task_id=1,
+    )
+    assert item_man.output_checkpoint == OutputCheckpoint(seq=3, offset=1234)
+    item_man.close()
+
+
+def test_task_queue_migration_of_legacy_queue_tables(temp_db_dir):
+    # task progress DBs created by older versions stored each queue in a separate `persist-queue` table
+    with sqlite3.connect(os.path.join(temp_db_dir, "1.db")) as conn:
+        for table_name, items in [
+            ("unique_queue_inputs", [4, 5, 6]),
+            ("queue_successes", [1, 2]),
+            ("queue_failures", [3]),
+            ("queue_inputs_without_output", []),
+        ]:
+            conn.execute(
+                f"CREATE TABLE {table_name} (_id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB, timestamp FLOAT)"
+            )
+            conn.executemany(
+                f"INSERT INTO {table_name} (data, timestamp) VALUES (?, ?)",
+                [(json.dumps(item).encode("utf-8"), 1700000000.0) for item in items],
+            )
+    conn.close()
+
+    item_man = TaskQueueItemManager(
+        db_dir=temp_db_dir,
+        task_id=1,
+    )
+    counts = item_man.queue_item_counts
+    assert counts.remaining == 3
+    assert counts.successes == 2
+    assert counts.failures == 1
+    assert counts.inputs_without_output == 0
+    assert [item.data for item in item_man.lease_input_items(3)] == [4, 5, 6]
+
+    # inputs that are still pending are ignored, processed ones are queued again
+    item_man.release_all_leases()
+    item_man.add_inputs([3, 4, 7])
+    remaining_res = item_man.get_queue_items("inputs", limit=10)
+    assert [item.data for item in remaining_res.items] == [4, 5, 6, 3, 7]
+    assert item_man.failure_count == 0
+    item_man.close()
+
+    with sqlite3.connect(os.path.join(temp_db_dir, "1.db")) as conn:
+        tables = {
+            row[0]
+            for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        }
+    conn.close()
+    assert "unique_queue_inputs" not in tables
+    assert "queue_successes" not in tables
+
+
+def test_task_queue_counts_maintained_across_connections(temp_db_dir):
+    processor_item_man = TaskQueueItemManager(
+        db_dir=temp_db_dir,
+        task_id=1,
+    )
+    # e.g. the one used by the API for adding inputs while the task is processed
+    other_item_man = TaskQueueItemManager(
+        db_dir=temp_db_dir,
+        task_id=1,
+    )
+
+    processor_item_man.add_inputs([i + 1 for i in range(10)])
+    assert other_item_man.remaining_input_count == 10
+
+    leased = processor_item_man.lease_input_items(4)
+    processor_item_man.record_outcomes(
+        [
+            (leased[0], "successes"),
+            (leased[1], "successes"),
+            (leased[2], "failures"),
+            (leased[3], "inputs-without-output"),
+        ]
+    )
+    other_item_man.add_inputs([3, 11, 12])
+    other_item_man.remove_queue_items([leased[0].id], "successes")
+
+    for item_man in [processor_item_man, other_item_man]:
+        counts = item_man.queue_item_counts
+        assert counts.remaining == 9
+        assert counts.successes == 1
+        assert counts.failures == 0
+        assert counts.inputs_without_output == 1
+
+    with sqlite3.connect(os.path.join(temp_db_dir, "1.db")) as conn:
+        actual_counts = dict(
+            conn.execute("SELECT status, COUNT(*) FROM task_items GROUP BY status")
+        )
+    conn.close()
+    assert actual_counts == {"inputs": 9, "successes": 1, "inputs-without-output": 1}
+
+    processor_item_man.close()
+    other_item_man.close()
+
+
+def test_task_queue_leasing_input_chunks_to_other_nodes(temp_db_dir):
+    item_man = TaskQueueItemManager(db_dir=temp_db_dir, task_id=1)
+    item_man.add_inputs([i + 1 for i in range(10)])
+
+    lease_a = item_man.lease_input_chunk("node-a", 4, lease_seconds=60)
+    lease_b = item_man.lease_input_chunk("node-b", 4, lease_seconds=0)
+    assert lease_a is not None and lease_b is not None
+    assert [item.data for item in lease_a.items] == [1, 2, 3, 4]
+    # leased items are not handed out twice
+    assert [item.data for item in lease_b.items] == [5, 6, 7, 8]
+
+    item_man.record_input_chunk_outcomes(
+        [(lease_a.items[0].id, "successes"), (lease_a.items[1].id, "failures")]
+    )
+    assert item_man.queue_item_counts.model_dump() == {
+        "remaining": 8,
+        "successes": 1,
+        "failures": 1,
+        "inputs_without_output": 0,
+    }
+
+    # items of expired leases (without an outcome) are handed out again
+    lease_c = item_man.lease_input_chunk("node-c", 10, lease_seconds=60)
+    assert lease_c is not None
+    assert [item.data for item in lease_c.items] == [5, 6, 7, 8, 9, 10]
+    assert item_man.renew_input_chunk_lease(lease_b.id, lease_seconds=60) is None
+    assert item_man.renew_input_chunk_lease(lease_a.id, lease_seconds=60) is not None
+    assert item_man.lease_input_chunk("node-b", 4, lease_seconds=60) is None
+
+    # outcomes reported for items of an expired lease are recorded anyway
+    item_man.record_input_chunk_outcomes([(lease_b.items[0].id, "successes")])
+    assert item_man.success_count == 2
+    assert item_man.get_input_statuses([5, 6, 11]) == ["successes", "inputs", None]
+
+    item_man.release_input_chunk(lease_a.id)
+    lease_d = item_man.lease_input_chunk("node-b", 10, lease_seconds=60)
+    assert lease_d is not None
+    assert [item.data for item in lease_d.items] == [3, 4]
+    item_man.close()
+
+
+def test_task_queue_stealing_input_chunks_while_processing_locally(temp_db_dir):
+    owner_item_man = TaskQueueItemManager(
+        db_dir=temp_db_dir, task_id=1, input_reservation_size=3
+    )
+    owner_item_man.add_inputs([i + 1 for i in range(10)])
+    thief_item_man = TaskQueueItemManager(db_dir=temp_db_dir, task_id=1)
+
+    leased = owner_item_man.lease_input_items(2)
+    assert [item.data for item in leased] == [1, 2]
+
+    # items reserved for the owner are not stolen, other ones are stolen from the tail
+    lease_a = thief_item_man.lease_input_chunk(
+        "replica-b", 3, lease_seconds=60, newest_first=True
+    )
+    assert lease_a is not None
+    assert [item.data for item in lease_a.items] == [10, 9, 8]
+    lease_b = thief_item_man.lease_input_chunk(
+        "replica-c", 10, lease_seconds=0, newest_first=True
+    )
+    assert lease_b is not None
+    assert [item.data for item in lease_b.items] == [7, 6]
+
+    # the owner skips stolen items (unless their lease has expired)
+    leased = owner_item_man.lease_input_items(10)
+    assert [item.data for item in leased] == [3, 4, 5, 6, 7]
+    assert (
+        thief_item_man.lease_input_chunk(
+            "replica-c", 10, lease_seconds=60, newest_first=True
+        )
+        is None
+    )
+
+    # the reservation is dropped once the owner stops processing
+    owner_item_man.release_all_leases()
+    lease_c = thief_item_man.lease_input_chunk(
+        "replica-c", 10, lease_seconds=60, newest_first=True
+    )
+    assert lease_c is not None
+    assert [item.data for item in lease_c.items] == [7, 6, 5, 4, 3, 2, 1]
+    owner_item_man.close()
+    thief_item_man.close()
+
+
+def test_remove_inputs(temp_db_dir):
+    item_man = TaskQueueItemManager(db_dir=temp_db_dir, task_id=1)
+    item_man.add_inputs([{"id": i} for i in range(5)])
+    item_man.record_outcomes(
+        [(item, "successes") for item in item_man.lease_input_items(1)]
+    )
+    # items that are not in the input queue (anymore) are skipped
+    assert item_man.remove_inputs([{"id": 0}, {"id": 1}, {"id": 3}, {"id": 42}]) == 2
+    counts = item_man.queue_item_counts
+    assert (counts.remaining, counts.successes) == (2, 1)
+    assert [item.data for item in item_man.lease_input_items(5)] == [
+        {"id": 2},
+        {"id": 4},
+    ]
+    item_man.close()
@@ -0,0 +1,164 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import logging
+import pytest
+
+from app.tasks.scheduling import TaskScheduler, TaskSchedulingParams
+from app.utils.fair_share import FairShareSemaphore
+
+
+class FakeProcessor:
+    def __init__(self, task_id: int):
+        self.task_id = task_id
+        self.started = asyncio.Event()
+        self.finish = asyncio.Event()
+        self.fetch_slots: FairShareSemaphore | None = None
+
+    def set_fetch_slots(self, fetch_slots: FairShareSemaphore | None):
+        self.fetch_slots = fetch_slots
+
+    async def run(self):
+        self.started.set()
+        await self.finish.wait()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_admits_tasks_by_weight_and_shares_fetch_budget():
+    scheduler = TaskScheduler(
+        max_running_tasks=2,
+        max_concurrent_fetches={"spotify-api": 4},
+        logger=logging.getLogger("test"),
+    )
+    processors = {task_id: FakeProcessor(task_id) for task_id in range(1, 5)}
+    runs = {
+        1: scheduler.run(processors[1], TaskSchedulingParams("spotify-api")),
+        2: scheduler.run(processors[2], TaskSchedulingParams("spotify-api", weight=3)),
+        3: scheduler.run(processors[3], TaskSchedulingParams("dummy-api")),
+        4: scheduler.run(processors[4], TaskSchedulingParams("dummy-api", weight=2)),
+    }
+    runs = {task_id: asyncio.create_task(run) for task_id, run in runs.items()}
+    await asyncio.sleep(0.01)
+    assert scheduler.running_task_ids == {1, 2}
+    # tasks with higher weight are started first
+    assert scheduler.waiting_task_ids == [4, 3]
+    with pytest.raises(ValueError):
+        await scheduler.run(processors[3], TaskSchedulingParams("dummy-api"))
+
+    fetch_slots = processors[1].fetch_slots
+    assert fetch_slots is not None and fetch_slots is processors[2].fetch_slots
+    assert fetch_slots.shares() == {1: 1, 2: 3}
+
+    async def fetch(task_id: int):
+        while True:
+            async with fetch_slots.slot(task_id):
+                await asyncio.sleep(0.005)
+
+    workers = [asyncio.create_task(fetch(task_id)) for task_id in [1, 2] * 4]
+    await asyncio.sleep(0.05)
+    assert (fetch_slots.in_use(1), fetch_slots.in_use(2)) == (1, 3)
+
+    # the share of a finished task is reallocated to the remaining ones
+    processors[2].finish.set()
+    await runs[2]
+    await asyncio.sleep(0.05)
+    assert fetch_slots.shares() == {1: 4}
+    assert fetch_slots.in_use(1) == 4
+    assert processors[4].started.is_set() and not processors[3].started.is_set()
+    # data sources without a limit do not share a fetch budget
+    assert processors[4].fetch_slots is None
+
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    for processor in processors.values():
+        processor.finish.set()
+    await asyncio.gather(*runs.values())
+    assert scheduler.running_task_ids == set()
+
+
+class SlotHolder:
+    """
+    Acquires a fetch slot on behalf of a task and holds it until `release` is set.
+    """
+
+    def __init__(self, fetch_slots: FairShareSemaphore, task_id: int):
+        self.acquired = asyncio.Event()
+        self.release = asyncio.Event()
+        self._task = asyncio.create_task(self._hold(fetch_slots, task_id))
+
+    async def _hold(self, fetch_slots: FairShareSemaphore, task_id: int):
+        async with fetch_slots.slot(task_id):
+            self.acquired.set()
+            await self.release.wait()
+
+    async def close(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_prefers_tasks_with_higher_priority_and_nearer_deadline():
+    scheduler = TaskScheduler(
+        max_running_tasks=1,
+        max_concurrent_fetches={"spotify-api": 2},
+        logger=logging.getLogger("test"),
+    )
+    processors = {task_id: FakeProcessor(task_id) for task_id in range(1, 5)}
+    now = datetime.now(timezone.utc)
+    params = {
+        1: TaskSchedulingParams("spotify-api"),
+        2: TaskSchedulingParams("spotify-api", priority=1),
+        3: TaskSchedulingParams(
+            "spotify-api", priority=1, deadline=now + timedelta(hours=2)
+        ),
+        4: TaskSchedulingParams(
+            "spotify-api", priority=1, deadline=now + timedelta(hours=1)
+        ),
+    }
+    runs: dict[int, asyncio.Task] = {}
+    holders: list[SlotHolder] = []
+    try:
+        runs[1] = asyncio.create_task(scheduler.run(processors[1], params[1]))
+        await asyncio.wait_for(processors[1].started.wait(), timeout=1)
+        fetch_slots = processors[1].fetch_slots
+        assert fetch_slots is not None
+
+        holders += [SlotHolder(fetch_slots, 1) for _ in range(2)]
+        for holder in holders:
+            await asyncio.wait_for(holder.acquired.wait(), timeout=1)
+        assert fetch_slots.in_use(1) == 2
+
+        runs[2] = asyncio.create_task(scheduler.run(processors[2], params[2]))
+        await asyncio.wait_for(processors[2].started.wait(), timeout=1)
+        # running tasks with lower priority do not keep urgent tasks from being started
+        assert scheduler.running_task_ids == {1, 2}
+        assert fetch_slots.shares() == {1: 0, 2: 2}
+
+        # both tasks wait for a slot, the one that is freed goes to the urgent task
+        waiting_holder_1 = SlotHolder(fetch_slots, 1)
+        waiting_holder_2 = SlotHolder(fetch_slots, 2)
+        holders += [waiting_holder_1, waiting_holder_2]
+        await asyncio.sleep(0)
+        holders[0].release.set()
+        await asyncio.wait_for(waiting_holder_2.acquired.wait(), timeout=1)
+        assert not waiting_holder_1.acquired.is_set()
+        assert (fetch_slots.in_use(1), fetch_slots.in_use(2)) == (1, 1)
+
+        for task_id in [3, 4]:
+            runs[task_id] = asyncio.create_task(
+                scheduler.run(processors[task_id], params[task_id])
+            )
+        await asyncio.sleep(0)
+        assert scheduler.waiting_task_ids == [4, 3]
+
+        for holder in holders:
+            await holder.close()
+        processors[2].finish.set()
+        await runs[2]
+        assert scheduler.running_task_ids == {1, 4}
+    finally:
+        for holder in holders:
+            await holder.close()
+        for processor in processors.values():
+            processor.finish.set()
+        await asyncio.gather(*runs.values(), return_exceptions=True)
@@ -0,0 +1,266 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import os
+import tempfile
+import pytest
+
+import app.tasks.distribution as distribution
+from app.db.models import DataFetchingTask
+from app.tasks import task_processors
+from app.tasks.distribution import (
+    DistributedTaskModel,
+    InputChunkItemOutcomeModel,
+    InputChunkReport,
+    InputChunkTaskNotFoundError,
+    InputChunkWorker,
+)
+from app.tasks.queue_item_management import TaskQueueItemManager
+from app.tasks.stealing import (
+    ReplicaInputChunkSource,
+    WorkStealer,
+    WorkStealingBoard,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+def create_task_model(
+    task_id: int, priority: int = 0, deadline: datetime | None = None
+) -> DistributedTaskModel:
+    return DistributedTaskModel(
+        id=task_id,
+        data_source="dummy-api",
+        task_type="throw-above-threshold",
+        params={"threshold": 1000},
+        priority=priority,
+        deadline=deadline,
+    )
+
+
+def test_work_stealing_board_publishes_tasks_of_live_replicas(temp_dir):
+    board = WorkStealingBoard(os.path.join(temp_dir, "board", "board.db"))
+    in_an_hour = datetime.now(timezone.utc) + timedelta(hours=1)
+    board.publish(
+        "replica-a",
+        "/data/a/progress",
+        [(create_task_model(1), 10), (create_task_model(2, deadline=in_an_hour), 5)],
+    )
+    board.publish(
+        "replica-b",
+        "/data/b/progress",
+        [(create_task_model(1), 20), (create_task_model(2, priority=1), 1)],
+    )
+
+    # most urgent first, the ones with the most remaining inputs among equally urgent ones
+    tasks = board.get_tasks("replica-c", heartbeat_timeout_seconds=60)
+    assert [(t.replica_id, t.task.id) for t in tasks] == [
+        ("replica-b", 2),
+        ("replica-a", 2),
+        ("replica-b", 1),
+        ("replica-a", 1),
+    ]
+    assert tasks[1].progress_db_dir == "/data/a/progress"
+    assert tasks[1].task.deadline == in_an_hour
+    # tasks of the replica itself are not returned
+    tasks = board.get_tasks("replica-a", heartbeat_timeout_seconds=60)
+    assert {t.replica_id for t in tasks} == {"replica-b"}
+
+    # republishing replaces the tasks of a replica, but keeps their board IDs
+    board_id = next(t.board_id for t in tasks if t.task.id == 1)
+    board.publish("replica-b", "/data/b/progress", [(create_task_model(1), 15)])
+    [task] = board.get_tasks("replica-a", heartbeat_timeout_seconds=60)
+    assert (task.board_id, task.remaining_input_count) == (board_id, 15)
+    # tasks that are not published anymore can still be looked up (e.g. to report outcomes)
+    assert board.get_task(board_id - 1) is not None
+    assert board.get_task(board_id + 100) is None
+    board.close()
+
+
+@pytest.mark.asyncio
+async def test_work_stealing_board_ignores_replicas_without_heartbeat(temp_dir):
+    board = WorkStealingBoard(os.path.join(temp_dir, "board.db"))
+    board.publish("replica-a", "/data/a/progress", [(create_task_model(1), 10)])
+    await asyncio.sleep(0.1)
+    board.publish("replica-b", "/data/b/progress", [(create_task_model(1), 10)])
+
+    tasks = board.get_tasks("replica-c", heartbeat_timeout_seconds=0.05)
+    assert [t.replica_id for t in tasks] == ["replica-b"]
+    # a replica is back once it publishes its tasks again
+    board.publish("replica-a", "/data/a/progress", [(create_task_model(1), 10)])
+    tasks = board.get_tasks("replica-c", heartbeat_timeout_seconds=0.05)
+    assert {t.replica_id for t in tasks} == {"replica-a", "replica-b"}
+    board.close()
+
+
+@pytest.mark.asyncio
+async def test_replica_input_chunk_source_reports_into_owner_progress_db(temp_dir):
+    owner_progress_db_dir = os.path.join(temp_dir, "owner")
+    os.makedirs(owner_progress_db_dir)
+    owner_item_man = TaskQueueItemManager(db_dir=owner_progress_db_dir, task_id=1)
+    owner_item_man.add_inputs([i + 1 for i in range(10)])
+    board = WorkStealingBoard(os.path.join(temp_dir, "board.db"))
+    board.publish("replica-a", owner_progress_db_dir, [(create_task_model(1), 10)])
+    source = ReplicaInputChunkSource(
+        board, "replica-b", lease_seconds=60, heartbeat_timeout_seconds=60
+    )
+
+    lease = await source.lease("replica-b", 3)
+    assert lease is not None
+    [published] = board.get_tasks("replica-b", heartbeat_timeout_seconds=60)
+    # the task is identified by its board ID
+    assert lease.task.id == published.board_id
+    # inputs are stolen from the tail of the input queue
+    assert [item.data for item in lease.items] == [10, 9, 8]
+    # the owner does not process stolen inputs
+    assert [item.data for item in owner_item_man.lease_input_items(10)] == [
+        i + 1 for i in range(7)
+    ]
+    owner_item_man.release_all_leases()
+
+    result = await source.report(
+        lease.task.id,
+        lease.lease_id,
+        InputChunkReport(
+            outcomes=[
+                InputChunkItemOutcomeModel(id=lease.items[0].id, outcome="successes"),
+                InputChunkItemOutcomeModel(id=lease.items[1].id, outcome="failures"),
+            ]
+        ),
+    )
+    assert result.expires_at is not None
+    counts = owner_item_man.queue_item_counts
+    assert (counts.successes, counts.failures, counts.remaining) == (1, 1, 8)
+
+    # released inputs go back to the owner
+    await source.release(lease.task.id, lease.lease_id)
+    assert 8 in [item.data for item in owner_item_man.lease_input_items(10)]
+    owner_item_man.release_all_leases()
+
+    with pytest.raises(InputChunkTaskNotFoundError):
+        await source.report(
+            lease.task.id + 100, lease.lease_id, InputChunkReport(outcomes=[])
+        )
+    # a replica does not steal from itself
+    own_source = ReplicaInputChunkSource(
+        board, "replica-a", lease_seconds=60, heartbeat_timeout_seconds=60
+    )
+    assert await own_source.lease("replica-a", 3) is None
+    await source.close()
+    owner_item_man.close()
+
+
+@pytest.mark.asyncio
+async def test_stolen_inputs_are_processed_in_local_task(
+    db, temp_dir, started_local_task_ids
+):
+    owner_progress_db_dir = os.path.join(temp_dir, "owner")
+    os.makedirs(owner_progress_db_dir)
+    owner_item_man = TaskQueueItemManager(db_dir=owner_progress_db_dir, task_id=1)
+    owner_item_man.add_inputs([i + 1 for i in range(10)])
+    board = WorkStealingBoard(os.path.join(temp_dir, "board.db"))
+    board.publish("replica-a", owner_progress_db_dir, [(create_task_model(1), 10)])
+    worker = InputChunkWorker(
+        source=ReplicaInputChunkSource(
+            board, "replica-b", lease_seconds=60, heartbeat_timeout_seconds=60
+        ),
+        holder="replica-b",
+        state_db_path=os.path.join(temp_dir, "stolen_input_chunks.db"),
+        chunk_size=4,
+        report_interval_seconds=1,
+    )
+
+    await worker._lease_if_needed()
+    [local_task_id] = worker.local_task_ids
+    async with db.session() as db_session:
+        local_task = await db_session.get(DataFetchingTask, local_task_id)
+        assert local_task is not None
+        assert (local_task.data_source, local_task.params) == (
+            "dummy-api",
+            {"threshold": 1000},
+        )
+    # the stolen inputs are processed in the progress DB of the thief, outcomes are reported into the one of the owner
+    thief_item_man = TaskQueueItemManager(
+        db_dir=distribution.TASK_PROGRESS_DB_DIR, task_id=local_task_id
+    )
+    leased = thief_item_man.lease_input_items(10)
+    assert [item.data for item in leased] == [10, 9, 8, 7]
+    thief_item_man.record_outcomes([(item, "successes") for item in leased])
+
+    await worker._report_outcomes()
+    counts = owner_item_man.queue_item_counts
+    assert (counts.successes, counts.remaining) == (4, 6)
+    assert owner_item_man.get_input_statuses([7, 8, 9, 10]) == ["successes"] * 4
+    # the owner processes the remaining inputs
+    assert [item.data for item in owner_item_man.lease_input_items(10)] == [
+        i + 1 for i in range(6)
+    ]
+
+    await worker.close()
+    thief_item_man.close()
+    owner_item_man.close()
+
+
+@pytest.mark.asyncio
+async def test_work_stealer_publishes_own_tasks_only(
+    db, temp_dir, monkeypatch, started_local_task_ids
+):
+    task_ids: list[int] = []
+    async with db.session() as db_session:
+        for status in ["running", "pending", "paused"]:
+            db_task = DataFetchingTask(
+                data_source="dummy-api",
+                task_type="throw-above-threshold",
+                params={"threshold": 1000},
+                status=status,
+                priority=0,
+            )
+            db_session.add(db_task)
+            await db_session.commit()
+            task_ids.append(db_task.id)
+    for i, task_id in enumerate(task_ids):
+        with TaskQueueItemManager(
+            db_dir=distribution.TASK_PROGRESS_DB_DIR, task_id=task_id
+        ) as q:
+            q.add_inputs([j + 1 for j in range(i + 1)])
+    board = WorkStealingBoard(os.path.join(temp_dir, "board.db"))
+    stealer = WorkStealer(
+        board=board,
+        replica_id="replica-a",
+        state_db_path=os.path.join(temp_dir, "stolen_input_chunks.db"),
+        chunk_size=4,
+        lease_seconds=60,
+        report_interval_seconds=1,
+        heartbeat_timeout_seconds=60,
+    )
+    assert stealer._is_idle()
+
+    # the paused task is not processed, so nothing of it can be stolen
+    for task_id in task_ids:
+        monkeypatch.setitem(task_processors, task_id, object())
+    await stealer._publish_tasks()
+    tasks = board.get_tasks("replica-b", heartbeat_timeout_seconds=60)
+    assert [(t.task.id, t.remaining_input_count) for t in tasks] == [
+        (task_ids[1], 2),
+        (task_ids[0], 1),
+    ]
+    assert tasks[0].progress_db_dir == os.path.abspath(
+        distribution.TASK_PROGRESS_DB_DIR
+    )
+    assert not stealer._is_idle()
+
+    # local tasks processing stolen inputs are not published (so inputs are not stolen back)
+    with stealer._chunk_worker._get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO mirrored_tasks (remote_task_id, local_task_id) VALUES (?, ?)",
+            [(100 + task_id, task_id) for task_id in task_ids],
+        )
+    await stealer._publish_tasks()
+    assert board.get_tasks("replica-b", heartbeat_timeout_seconds=60) == []
+    # this replica only works on stolen inputs
+    assert stealer._is_idle()
+    await stealer._chunk_worker.close()
+    board.close()
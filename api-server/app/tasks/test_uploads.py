@@ -0,0 +1,121 @@
+import asyncio
+import os
+import tempfile
+import pytest
+
+import app.tasks.uploads as uploads
+from app.tasks.uploads import OutputUploadFailedError, OutputUploader
+from app.utils.s3 import MultipartUploadState
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+@pytest.mark.asyncio
+async def test_output_uploader_retries_and_resumes_pending_uploads(
+    temp_dir, monkeypatch
+):
+    attempted_keys: list[str] = []
+
+    async def failing_upload_file(
+        local_path: str,
+        s3_key: str,
+        multipart_upload: MultipartUploadState,
+        on_multipart_upload_created,
+        on_part_uploaded,
+        **kwargs,
+    ):
+        attempted_keys.append(s3_key)
+        if multipart_upload.upload_id is None:
+            multipart_upload.upload_id = f"upload-{s3_key}"
+            multipart_upload.part_size_bytes = 1
+            on_multipart_upload_created(multipart_upload)
+        multipart_upload.completed_parts[1] = "etag-1"
+        on_part_uploaded(multipart_upload, 1)
+        raise ConnectionError("S3 is not reachable")
+
+    monkeypatch.setattr(uploads, "upload_file", failing_upload_file)
+
+    manifest_path = f"{temp_dir}/pending_uploads.db"
+    uploader = OutputUploader(manifest_path=manifest_path, max_concurrent_uploads=2)
+    uploader.start()
+    for i in range(2):
+        local_path = f"{temp_dir}/1.{i}.jsonl.zst"
+        uploader.add(task_id=1, local_path=local_path, s3_key=f"outputs/{i}")
+        with open(local_path, "wb") as f:
+            f.write(b"data")
+    # added, but never moved to its path (as if the server stopped in between)
+    uploader.add(task_id=2, local_path=f"{temp_dir}/2.0.jsonl.zst", s3_key="other")
+
+    await asyncio.sleep(0.1)
+    await uploader.close()
+    # failed uploads are not retried right away
+    assert sorted(attempted_keys) == ["outputs/0", "outputs/1"]
+
+    attempted_keys.clear()
+    uploader = OutputUploader(manifest_path=manifest_path)
+    uploader.start()
+    pending = uploader.pending_uploads(1)
+    assert [upload.s3_key for upload in pending] == ["outputs/0", "outputs/1"]
+    assert all(upload.attempts == 1 for upload in pending)
+    # interrupted multipart uploads are resumed
+    assert [upload.multipart_upload for upload in pending] == [
+        MultipartUploadState(
+            upload_id=f"upload-outputs/{i}",
+            part_size_bytes=1,
+            completed_parts={1: "etag-1"},
+        )
+        for i in range(2)
+    ]
+    assert uploader.pending_uploads(2) == []
+    await asyncio.sleep(0.1)
+    await uploader.close()
+    assert sorted(attempted_keys) == ["outputs/0", "outputs/1"]
+    assert all(os.path.exists(upload.local_path) for upload in pending)
+
+
+@pytest.mark.asyncio
+async def test_output_uploader_gives_up_after_max_attempts(temp_dir, monkeypatch):
+    attempts = 0
+
+    async def failing_upload_file(local_path: str, s3_key: str, **kwargs):
+        nonlocal attempts
+        attempts += 1
+        raise PermissionError("Access denied")
+
+    monkeypatch.setattr(uploads, "upload_file", failing_upload_file)
+
+    manifest_path = f"{temp_dir}/pending_uploads.db"
+    uploader = OutputUploader(
+        manifest_path=manifest_path, max_retry_delay_seconds=0.01, max_attempts=3
+    )
+    uploader.start()
+    local_path = f"{temp_dir}/1.0.jsonl.zst"
+    uploader.add(task_id=1, local_path=local_path, s3_key="outputs/0")
+    with open(local_path, "wb") as f:
+        f.write(b"data")
+
+    # the task waiting for the upload fails instead of waiting forever
+    with pytest.raises(OutputUploadFailedError):
+        await asyncio.wait_for(uploader.wait_for_uploads(1), timeout=5)
+    assert attempts == 3
+    assert uploader.pending_uploads(1) == []
+    assert [upload.local_path for upload in uploader.failed_uploads(1)] == [local_path]
+    # also when waiting again later
+    with pytest.raises(OutputUploadFailedError):
+        await asyncio.wait_for(uploader.wait_for_uploads(1), timeout=1)
+    await asyncio.sleep(0.05)
+    assert attempts == 3
+    await uploader.close()
+    assert os.path.exists(local_path)
+
+    # given up uploads are retried after a restart
+    uploader = OutputUploader(manifest_path=manifest_path)
+    uploader.start()
+    [pending] = uploader.pending_uploads(1)
+    assert (pending.local_path, pending.attempts) == (local_path, 0)
+    assert uploader.failed_uploads(1) == []
+    await uploader.close()
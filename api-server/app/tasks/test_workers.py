@@ -0,0 +1,363 @@
+import asyncio
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+import os
+import sys
+import tempfile
+import pytest
+
+import app
+import app.tasks
+import app.tasks.uploads as uploads
+import app.tasks.workers as workers
+from app.db.models import DataFetchingTask
+from app.tasks.queue_item_management import QueueItemCounts, TaskQueueItemManager
+from app.tasks.uploads import OutputUploadFailedError, OutputUploader
+from app.tasks.workers import (
+    RemoteTaskProcessor,
+    TaskProcessorStats,
+    TaskWorkerPool,
+    WorkerOutputUploader,
+    WorkerProcessExitedError,
+)
+from app.utils.fair_share import FairShareSemaphore
+from app.utils.spotify_api.client import UnexpectedResponseCodeError
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+@pytest.mark.asyncio
+async def test_worker_output_uploader_hands_off_uploads_to_api_process(
+    temp_dir, monkeypatch
+):
+    attempted_keys: list[str] = []
+
+    async def failing_upload_file(local_path: str, s3_key: str, **kwargs):
+        attempted_keys.append(s3_key)
+        raise ConnectionError("S3 is not reachable")
+
+    monkeypatch.setattr(uploads, "upload_file", failing_upload_file)
+
+    manifest_path = f"{temp_dir}/pending_uploads.db"
+    uploader = OutputUploader(manifest_path=manifest_path)
+    uploader.start()
+    worker_uploader = WorkerOutputUploader(
+        manifest_path=manifest_path, on_upload_added=uploader.load
+    )
+
+    local_path = f"{temp_dir}/1.0.jsonl.zst"
+    worker_uploader.add(task_id=1, local_path=local_path, s3_key="outputs/0")
+    with open(local_path, "wb") as f:
+        f.write(b"data")
+    # the API process is notified only after the file was moved to its path
+    assert uploader.pending_uploads(1) == []
+
+    await asyncio.sleep(0.1)
+    assert attempted_keys == ["outputs/0"]
+    assert [upload.s3_key for upload in uploader.pending_uploads(1)] == ["outputs/0"]
+    # the worker sees the state of the upload in the manifest
+    pending = worker_uploader.pending_uploads(1)
+    assert [(upload.s3_key, upload.attempts) for upload in pending] == [
+        ("outputs/0", 1)
+    ]
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(worker_uploader.wait_for_uploads(1), timeout=0.05)
+
+    await uploader.close()
+    await worker_uploader.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_output_uploader_fails_once_upload_is_given_up_on(
+    temp_dir, monkeypatch
+):
+    async def failing_upload_file(local_path: str, s3_key: str, **kwargs):
+        raise PermissionError("Access denied")
+
+    monkeypatch.setattr(uploads, "upload_file", failing_upload_file)
+
+    manifest_path = f"{temp_dir}/pending_uploads.db"
+    uploader = OutputUploader(
+        manifest_path=manifest_path, max_retry_delay_seconds=0.01, max_attempts=2
+    )
+    uploader.start()
+    worker_uploader = WorkerOutputUploader(
+        manifest_path=manifest_path,
+        on_upload_added=uploader.load,
+        poll_interval_seconds=0.01,
+    )
+    local_path = f"{temp_dir}/1.0.jsonl.zst"
+    worker_uploader.add(task_id=1, local_path=local_path, s3_key="outputs/0")
+    with open(local_path, "wb") as f:
+        f.write(b"data")
+
+    with pytest.raises(OutputUploadFailedError):
+        await asyncio.wait_for(worker_uploader.wait_for_uploads(1), timeout=5)
+    assert worker_uploader.pending_uploads(1) == []
+    assert [upload.attempts for upload in worker_uploader.failed_uploads(1)] == [2]
+
+    await uploader.close()
+    await worker_uploader.close()
+
+
+def create_stats(successes: int, remaining: int) -> TaskProcessorStats:
+    return TaskProcessorStats(
+        queue_item_counts=QueueItemCounts(
+            remaining=remaining,
+            successes=successes,
+            failures=0,
+            inputs_without_output=0,
+        ),
+        bytes_written=successes * 100,
+        output_file_size_bytes=0,
+        estimated_completion_at=None,
+    )
+
+
+def fake_worker_process(conn: Connection):
+    """
+    Stands in for `run_worker_process`: processes a task by making one Spotify API request (via the API process, holding a fetch slot acquired by the API process if the task uses them) until the task is paused.
+    """
+    held_slots: set[int] = set()
+    while True:
+        match conn.recv():
+            case ("run", task_id, pause_requested, use_fetch_slots):
+                # see `test_task_worker_pool_fails_tasks_of_exited_workers`
+                if str(task_id) == os.environ.get("CRASHING_TASK_ID"):
+                    os._exit(1)
+                if pause_requested:
+                    conn.send(("done", task_id, None))
+                    continue
+                conn.send(("progress", task_id, create_stats(0, 10)))
+                if use_fetch_slots:
+                    # the task ID is used as request ID
+                    conn.send(("acquire_slot", task_id, task_id))
+                    continue
+                conn.send(
+                    ("spotify_api_request", task_id, "tracks", {"ids": str(task_id)})
+                )
+            case ("slot_granted", task_id):
+                held_slots.add(task_id)
+                conn.send(
+                    ("spotify_api_request", task_id, "tracks", {"ids": str(task_id)})
+                )
+            case ("spotify_api_response", task_id, data, error):
+                if error is not None:
+                    conn.send(("done", task_id, f"{type(error).__name__}: {error}"))
+                    continue
+                successes = len(data["tracks"])
+                conn.send(
+                    ("progress", task_id, create_stats(successes, 10 - successes))
+                )
+            case ("pause", task_id):
+                if task_id in held_slots:
+                    held_slots.remove(task_id)
+                    conn.send(("release_slot", task_id))
+                conn.send(("done", task_id, None))
+            case ("shutdown",):
+                return
+
+
+class FakeSpotifyAPIClient:
+    def __init__(self):
+        self.requests: list[tuple[str, dict | None]] = []
+
+    async def make_request(self, endpoint_path: str, params: dict | None = None):
+        self.requests.append((endpoint_path, params))
+        if endpoint_path == "missing":
+            raise UnexpectedResponseCodeError("not found", status_code=404)
+        return {"tracks": [{"id": i} for i in range(3)]}
+
+
+async def wait_until(condition, timeout: float = 10):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+async def create_task(db) -> int:
+    async with db.session() as db_session:
+        db_task = DataFetchingTask(
+            data_source="dummy-api",
+            task_type="throw-above-threshold",
+            params={"threshold": 1000},
+            status="running",
+            priority=0,
+        )
+        db_session.add(db_task)
+        await db_session.commit()
+        return db_task.id
+
+
+@pytest.fixture
+def worker_pool(db, monkeypatch):
+    monkeypatch.setattr(workers, "run_worker_process", fake_worker_process)
+    # worker processes inherit the import path; pytest adds the directories of tests in `app/utils` to it, where e.g. `nodriver.py` would shadow the nodriver package
+    app_dir = os.path.dirname(os.path.abspath(app.__file__))
+    monkeypatch.setattr(
+        sys,
+        "path",
+        [p for p in sys.path if not os.path.abspath(p or ".").startswith(app_dir)],
+    )
+    spotify_api_client = FakeSpotifyAPIClient()
+    pool = TaskWorkerPool(worker_count=1, spotify_api_client=spotify_api_client)  # type: ignore
+    return pool, spotify_api_client
+
+
+@pytest.mark.asyncio
+async def test_task_worker_pool_runs_pauses_and_resumes_tasks(db, worker_pool):
+    pool, spotify_api_client = worker_pool
+    task_id = await create_task(db)
+    with TaskQueueItemManager(
+        db_dir=workers.TASK_PROGRESS_DB_DIR, task_id=task_id
+    ) as q:
+        q.add_inputs([i + 1 for i in range(10)])
+    pool.start()
+    try:
+        processor = RemoteTaskProcessor(task_id, pool)
+        # the progress is known before the task is processed
+        assert processor.queue_item_counts.remaining == 10
+
+        fetch_slots = FairShareSemaphore(1)
+        fetch_slots.register(task_id)
+        processor.set_fetch_slots(fetch_slots)
+        run = asyncio.create_task(processor.run())
+        # progress snapshots are sent by the worker, the Spotify API requests of the worker are made by the API process
+        await wait_until(lambda: processor.queue_item_counts.successes == 3)
+        assert processor.queue_item_counts.remaining == 7
+        assert processor.bytes_written == 300
+        assert spotify_api_client.requests == [("tracks", {"ids": str(task_id)})]
+        # the fetch slot used by the worker is held by the API process
+        assert fetch_slots.in_use(task_id) == 1
+        assert not run.done()
+
+        processor.pause()
+        await asyncio.wait_for(run, timeout=10)
+        await wait_until(lambda: fetch_slots.in_use(task_id) == 0)
+
+        # resumed, without fetch slots this time
+        processor = RemoteTaskProcessor(task_id, pool)
+        run = asyncio.create_task(processor.run())
+        await wait_until(lambda: len(spotify_api_client.requests) == 2)
+        assert fetch_slots.in_use(task_id) == 0
+        processor.pause()
+        await asyncio.wait_for(run, timeout=10)
+
+        # pausing before the task is processed
+        processor = RemoteTaskProcessor(task_id, pool)
+        processor.pause()
+        await asyncio.wait_for(processor.run(), timeout=10)
+        assert len(spotify_api_client.requests) == 2
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_task_worker_pool_fails_tasks_of_exited_workers(
+    db, worker_pool, monkeypatch
+):
+    pool, _ = worker_pool
+    crashing_task_id = await create_task(db)
+    # inherited by the worker processes
+    monkeypatch.setenv("CRASHING_TASK_ID", str(crashing_task_id))
+    pool.start()
+    try:
+        crashed_worker = pool._workers[0]
+        with pytest.raises(WorkerProcessExitedError):
+            await asyncio.wait_for(
+                RemoteTaskProcessor(crashing_task_id, pool).run(), timeout=10
+            )
+        async with db.session() as db_session:
+            db_task = await db_session.get(DataFetchingTask, crashing_task_id)
+            assert db_task is not None
+            assert db_task.status == "error"
+
+        # the worker is restarted for the next task
+        task_id = await create_task(db)
+        processor = RemoteTaskProcessor(task_id, pool)
+        run = asyncio.create_task(processor.run())
+        await wait_until(lambda: processor.queue_item_counts.successes == 3)
+        assert pool._workers[0] is not crashed_worker
+        processor.pause()
+        await asyncio.wait_for(run, timeout=10)
+    finally:
+        await pool.close()
+
+
+class RequestingProcessor:
+    """
+    Stands in for the task processor created in a worker process; makes Spotify API requests while it runs.
+    """
+
+    def __init__(self):
+        self.responses: list = []
+        self.queue_item_counts = QueueItemCounts(
+            remaining=0, successes=0, failures=0, inputs_without_output=0
+        )
+        self.bytes_written = 0
+        self.output_file_size_bytes = 0
+        self.estimated_completion_at = None
+        self.closed = False
+
+    def set_fetch_slots(self, fetch_slots):
+        pass
+
+    def pause(self):
+        pass
+
+    async def run(self):
+        self.responses.append(
+            await workers.spotify_api_client.make_request("tracks", {"ids": "1"})
+        )
+        try:
+            await workers.spotify_api_client.make_request("missing")
+        except UnexpectedResponseCodeError as e:
+            self.responses.append(e.status_code)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_worker_process_forwards_spotify_api_requests(db, temp_dir, monkeypatch):
+    processor = RequestingProcessor()
+    monkeypatch.setattr(
+        app.tasks, "_create_processor", lambda db_task, output_uploader: processor
+    )
+    monkeypatch.setattr(workers, "TASK_OUTPUT_DIR", temp_dir)
+    task_id = await create_task(db)
+    conn, worker_conn = Pipe()
+    serving = asyncio.create_task(workers._serve(worker_conn))
+
+    async def receive() -> tuple:
+        while True:
+            message = await asyncio.wait_for(asyncio.to_thread(conn.recv), timeout=10)
+            if message[0] != "progress":
+                return message
+
+    spotify_api_client = FakeSpotifyAPIClient()
+    conn.send(("run", task_id, False, False))
+    for _ in range(2):
+        message = await receive()
+        assert message[0] == "spotify_api_request"
+        _, request_id, endpoint_path, params = message
+        try:
+            data = await spotify_api_client.make_request(endpoint_path, params)
+        except Exception as e:
+            conn.send(("spotify_api_response", request_id, None, e))
+        else:
+            conn.send(("spotify_api_response", request_id, data, None))
+    assert await receive() == ("done", task_id, None)
+    # the requests were made by the client of the "API process", errors are passed on as they are
+    assert spotify_api_client.requests == [("tracks", {"ids": "1"}), ("missing", None)]
+    assert processor.responses == [{"tracks": [{"id": i} for i in range(3)]}, 404]
+    assert processor.closed
+
+    conn.send(("shutdown",))
+    await asyncio.wait_for(serving, timeout=10)
+    assert workers.spotify_api_client._forward_request is None
+    conn.close()
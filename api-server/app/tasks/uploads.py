@@ -0,0 +1,516 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from logging import Logger
+import os
+import random
+import sqlite3
+import time
+
+from sqlalchemy import select
+
+from app.config import TASK_OUTPUT_DIR, app_logger, settings
+from app.db import sessionmanager
+from app.db.models import DataFetchingTask, S3FileUpload
+from app.utils.s3 import MultipartUploadState, upload_file
+
+
+@dataclass
+class PendingOutputUpload:
+    """
+    An output file that was handed off to the `OutputUploader` and has not been uploaded to S3 yet.
+    """
+
+    id: int
+    """
+    The ID of the upload in the upload manifest.
+    """
+
+    task_id: int
+
+    local_path: str
+
+    s3_key: str
+
+    attempts: int = 0
+    """
+    The number of failed attempts to upload the file so far.
+    """
+
+    next_attempt_at: float = 0
+    """
+    The (UNIX) time before which the upload should not be attempted (again).
+    """
+
+    multipart_upload: MultipartUploadState = field(
+        default_factory=MultipartUploadState
+    )
+    """
+    The state of the multipart upload of the file (if it is uploaded in parts), which allows resuming an interrupted upload.
+    """
+
+
+class OutputUploadFailedError(Exception):
+    """
+    Raised when waiting for the uploads of a task if uploading one of its output files was given up on (see `OutputUploader.wait_for_uploads`).
+    """
+
+
+@dataclass
+class OutputFileUpload:
+    """
+    Information about an output file that was uploaded to S3 (passed to upload listeners, see `OutputUploader.add_upload_listener`).
+    """
+
+    s3_key: str
+    s3_bucket: str
+    s3_endpoint_url: str
+    size_bytes: int
+    uploaded_at: datetime
+
+
+class OutputUploader:
+    """
+    Uploads the output files of all tasks processed on this server to S3 in the background, so that task processors can start writing to a new output file right away.
+
+    Pending uploads are stored in a manifest (a small SQLite DB) and picked up again after a restart. Failed uploads are retried with exponential backoff, and at most `max_concurrent_uploads` files are uploaded at the same time.
+    After `max_attempts` failed attempts, an upload is given up on until the next restart (the file is kept), which makes the task waiting for it fail.
+    An `S3FileUpload` is added to the respective task only once a file has been uploaded successfully; the local file is deleted afterwards.
+    """
+
+    def __init__(
+        self,
+        manifest_path: str,
+        max_concurrent_uploads: int = 2,
+        max_retry_delay_seconds: float = 300,
+        max_attempts: int = 10,
+        logger: Logger = app_logger,
+    ):
+        if max_concurrent_uploads < 1:
+            raise ValueError("Max. concurrent uploads must be at least 1.")
+        if max_attempts < 1:
+            raise ValueError("Max. attempts must be at least 1.")
+
+        self._manifest_path = manifest_path
+        """
+        The path to the SQLite DB that stores the pending uploads.
+        """
+
+        self._max_concurrent_uploads = max_concurrent_uploads
+
+        self._max_retry_delay_seconds = max_retry_delay_seconds
+        """
+        The maximum time (in seconds) to wait before retrying a failed upload (the delay doubles with every failed attempt up to this value).
+        """
+
+        self._max_attempts = max_attempts
+        """
+        The number of failed attempts after which an upload is given up on (until the next restart).
+        """
+
+        self._logger = logger
+
+        self._conn: sqlite3.Connection | None = None
+        """
+        The connection to the upload manifest (opened on first use).
+        """
+
+        self._pending: dict[int, PendingOutputUpload] = {}
+        """
+        All pending uploads (mirroring the upload manifest), keyed by their ID.
+        """
+
+        self._failed: dict[int, PendingOutputUpload] = {}
+        """
+        The uploads that were given up on after `max_attempts` failed attempts, keyed by their ID.
+        """
+
+        self._in_progress: set[int] = set()
+        """
+        The IDs of the pending uploads that are currently being uploaded.
+        """
+
+        self._workers: list[asyncio.Task] = []
+
+        self._wakeup = asyncio.Event()
+        """
+        Set whenever a new upload is added, so idle workers pick it up.
+        """
+
+        self._uploads_changed = asyncio.Condition()
+        """
+        Notified whenever a pending upload was completed or given up on (see `wait_for_uploads`).
+        """
+
+        self._upload_listeners: dict[int, set[asyncio.Queue[OutputFileUpload]]] = {}
+        """
+        Queues that each upload of an output file of a task is published to, keyed by task ID (see `add_upload_listener`).
+        """
+
+    def start(self):
+        """
+        Loads the pending uploads from the upload manifest and starts uploading them in the background. Uploads that were given up on before are retried.
+        """
+        conn = self._get_conn()
+        with conn:
+            retried = conn.execute(
+                "UPDATE pending_uploads SET failed = 0, attempts = 0 WHERE failed = 1"
+            ).rowcount
+        if retried:
+            self._logger.info(
+                f"Retrying {retried} output uploads that were given up on"
+            )
+        rows = conn.execute(
+            "SELECT id, task_id, local_path, s3_key, attempts, multipart_upload_id, part_size_bytes FROM pending_uploads ORDER BY id"
+        ).fetchall()
+        completed_parts: dict[int, dict[int, str]] = {}
+        for upload_id, part_number, etag in conn.execute(
+            "SELECT upload_id, part_number, etag FROM uploaded_parts"
+        ):
+            completed_parts.setdefault(upload_id, {})[part_number] = etag
+        for (
+            upload_id,
+            task_id,
+            local_path,
+            s3_key,
+            attempts,
+            multipart_upload_id,
+            part_size_bytes,
+        ) in rows:
+            if not os.path.exists(local_path):
+                # the server stopped before the file was moved to the path it was added with
+                self._logger.warning(
+                    f"Dropping pending upload of {local_path} for task {task_id}: file does not exist"
+                )
+                self._delete_from_manifest(upload_id)
+                continue
+            self._pending[upload_id] = PendingOutputUpload(
+                id=upload_id,
+                task_id=task_id,
+                local_path=local_path,
+                s3_key=s3_key,
+                attempts=attempts,
+                multipart_upload=MultipartUploadState(
+                    upload_id=multipart_upload_id,
+                    part_size_bytes=part_size_bytes,
+                    completed_parts=completed_parts.get(upload_id, {}),
+                ),
+            )
+        if self._pending:
+            self._logger.info(f"Resuming {len(self._pending)} pending output uploads")
+
+        self._workers = [
+            asyncio.create_task(self._run_worker())
+            for _ in range(self._max_concurrent_uploads)
+        ]
+
+    async def close(self):
+        """
+        Stops uploading. Uploads that were not completed stay in the upload manifest and are resumed after the next `start()`.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add(self, task_id: int, local_path: str, s3_key: str) -> PendingOutputUpload:
+        """
+        Adds the file at `local_path` to the pending uploads (in the upload manifest first, so it is picked up again after a restart).
+
+        The file may be moved to `local_path` right after calling this (without awaiting anything in between); if the server stops before, the upload is dropped on the next `start()`.
+        """
+        conn = self._get_conn()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO pending_uploads (task_id, local_path, s3_key, attempts) VALUES (?, ?, ?, 0)",
+                (task_id, local_path, s3_key),
+            )
+        assert cursor.lastrowid is not None
+        upload = PendingOutputUpload(
+            id=cursor.lastrowid, task_id=task_id, local_path=local_path, s3_key=s3_key
+        )
+        self._pending[upload.id] = upload
+        self._wakeup.set()
+        return upload
+
+    def load(self, upload_id: int):
+        """
+        Picks up an upload that another process added to the upload manifest (see `WorkerOutputUploader`).
+        """
+        if upload_id in self._pending:
+            return
+        row = (
+            self._get_conn()
+            .execute(
+                "SELECT task_id, local_path, s3_key, attempts FROM pending_uploads WHERE id = ?",
+                (upload_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            self._logger.warning(f"Upload with ID {upload_id} not found in manifest")
+            return
+        task_id, local_path, s3_key, attempts = row
+        self._pending[upload_id] = PendingOutputUpload(
+            id=upload_id,
+            task_id=task_id,
+            local_path=local_path,
+            s3_key=s3_key,
+            attempts=attempts,
+        )
+        self._wakeup.set()
+
+    def pending_uploads(self, task_id: int) -> list[PendingOutputUpload]:
+        return [upload for upload in self._pending.values() if upload.task_id == task_id]
+
+    def failed_uploads(self, task_id: int) -> list[PendingOutputUpload]:
+        """
+        The uploads of the given task that were given up on (see `max_attempts`).
+        """
+        return [upload for upload in self._failed.values() if upload.task_id == task_id]
+
+    async def wait_for_uploads(self, task_id: int):
+        """
+        Waits until all pending uploads of the given task have been uploaded.
+
+        Raises an `OutputUploadFailedError` as soon as an upload of the task was given up on (also if that happened before).
+        """
+        async with self._uploads_changed:
+            await self._uploads_changed.wait_for(
+                lambda: not self.pending_uploads(task_id)
+                or bool(self.failed_uploads(task_id))
+            )
+        self._raise_if_uploads_failed(task_id)
+
+    def add_upload_listener(
+        self, task_id: int, listener: asyncio.Queue[OutputFileUpload]
+    ):
+        """
+        Registers a queue that every output file of the given task uploaded from now on is put into. If the queue is full, the upload is not put into it.
+        """
+        self._upload_listeners.setdefault(task_id, set()).add(listener)
+
+    def remove_upload_listener(
+        self, task_id: int, listener: asyncio.Queue[OutputFileUpload]
+    ):
+        listeners = self._upload_listeners.get(task_id)
+        if listeners is None:
+            return
+        listeners.discard(listener)
+        if not listeners:
+            del self._upload_listeners[task_id]
+
+    def _raise_if_uploads_failed(self, task_id: int):
+        failed = self.failed_uploads(task_id)
+        if failed:
+            raise OutputUploadFailedError(
+                f"Gave up uploading {len(failed)} output file(s) of task {task_id}: {', '.join(upload.local_path for upload in failed)}"
+            )
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self._manifest_path)
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS pending_uploads (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      task_id INTEGER NOT NULL,
+                      local_path TEXT NOT NULL,
+                      s3_key TEXT NOT NULL,
+                      attempts INTEGER NOT NULL,
+                      multipart_upload_id TEXT,
+                      part_size_bytes INTEGER,
+                      failed INTEGER NOT NULL DEFAULT 0
+                    )
+                    """
+                )
+                columns = {
+                    row[1]
+                    for row in conn.execute("PRAGMA table_info(pending_uploads)")
+                }
+                # manifests created by older versions do not track multipart uploads and failed uploads yet
+                for column, column_type in [
+                    ("multipart_upload_id", "TEXT"),
+                    ("part_size_bytes", "INTEGER"),
+                    ("failed", "INTEGER NOT NULL DEFAULT 0"),
+                ]:
+                    if column not in columns:
+                        conn.execute(
+                            f"ALTER TABLE pending_uploads ADD COLUMN {column} {column_type}"
+                        )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS uploaded_parts (
+                      upload_id INTEGER NOT NULL,
+                      part_number INTEGER NOT NULL,
+                      etag TEXT NOT NULL,
+                      PRIMARY KEY (upload_id, part_number)
+                    )
+                    """
+                )
+            self._conn = conn
+        return self._conn
+
+    def _delete_from_manifest(self, upload_id: int):
+        conn = self._get_conn()
+        with conn:
+            conn.execute("DELETE FROM uploaded_parts WHERE upload_id = ?", (upload_id,))
+            conn.execute("DELETE FROM pending_uploads WHERE id = ?", (upload_id,))
+
+    def _store_multipart_upload(
+        self, upload: PendingOutputUpload, state: MultipartUploadState
+    ):
+        conn = self._get_conn()
+        with conn:
+            # parts of a previous multipart upload of the same file cannot be reused
+            conn.execute("DELETE FROM uploaded_parts WHERE upload_id = ?", (upload.id,))
+            conn.execute(
+                "UPDATE pending_uploads SET multipart_upload_id = ?, part_size_bytes = ? WHERE id = ?",
+                (state.upload_id, state.part_size_bytes, upload.id),
+            )
+
+    def _store_uploaded_part(
+        self, upload: PendingOutputUpload, state: MultipartUploadState, part_number: int
+    ):
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploaded_parts (upload_id, part_number, etag) VALUES (?, ?, ?)",
+                (upload.id, part_number, state.completed_parts[part_number]),
+            )
+
+    def _next_due_upload(self) -> PendingOutputUpload | None:
+        now = time.time()
+        for upload in self._pending.values():
+            if upload.id not in self._in_progress and upload.next_attempt_at <= now:
+                return upload
+        return None
+
+    async def _run_worker(self):
+        while True:
+            upload = self._next_due_upload()
+            if upload is None:
+                retry_times = [
+                    pending.next_attempt_at
+                    for pending in self._pending.values()
+                    if pending.id not in self._in_progress
+                ]
+                timeout = (
+                    max(0.0, min(retry_times) - time.time()) if retry_times else None
+                )
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except TimeoutError:
+                    pass
+                continue
+
+            self._in_progress.add(upload.id)
+            try:
+                await self._upload(upload)
+            except Exception:
+                upload.attempts += 1
+                if upload.attempts >= self._max_attempts:
+                    await self._give_up(upload)
+                    continue
+                # exponential backoff with jitter, so uploads that failed together are not retried at the same time
+                delay = min(
+                    self._max_retry_delay_seconds, 2**upload.attempts
+                ) * random.uniform(0.5, 1)
+                upload.next_attempt_at = time.time() + delay
+                conn = self._get_conn()
+                with conn:
+                    conn.execute(
+                        "UPDATE pending_uploads SET attempts = ? WHERE id = ?",
+                        (upload.attempts, upload.id),
+                    )
+                self._logger.exception(
+                    f"Failed to upload {upload.local_path} for task {upload.task_id} (attempt {upload.attempts}), retrying in {delay:.0f}s"
+                )
+            finally:
+                self._in_progress.discard(upload.id)
+
+    async def _give_up(self, upload: PendingOutputUpload):
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                "UPDATE pending_uploads SET attempts = ?, failed = 1 WHERE id = ?",
+                (upload.attempts, upload.id),
+            )
+        del self._pending[upload.id]
+        self._failed[upload.id] = upload
+        self._logger.exception(
+            f"Failed to upload {upload.local_path} for task {upload.task_id} (attempt {upload.attempts}), giving up until the next restart"
+        )
+        async with self._uploads_changed:
+            self._uploads_changed.notify_all()
+
+    async def _upload(self, upload: PendingOutputUpload):
+        size_bytes = os.path.getsize(upload.local_path)
+        upload_meta = await upload_file(
+            local_path=upload.local_path,
+            s3_key=upload.s3_key,
+            multipart_upload=upload.multipart_upload,
+            on_multipart_upload_created=lambda state: self._store_multipart_upload(
+                upload, state
+            ),
+            on_part_uploaded=lambda state, part_number: self._store_uploaded_part(
+                upload, state, part_number
+            ),
+        )
+
+        async with sessionmanager.session() as db_session:
+            db_task = await db_session.get(DataFetchingTask, upload.task_id)
+            # the upload may already have been recorded if the server stopped before it was removed from the manifest
+            already_recorded = await db_session.scalar(
+                select(S3FileUpload.id).where(
+                    S3FileUpload.task_id == upload.task_id,
+                    S3FileUpload.s3_key == upload_meta.s3_key,
+                )
+            )
+            if db_task is None:
+                self._logger.warning(
+                    f"Uploaded {upload.local_path} to S3, but task {upload.task_id} does not exist (anymore)"
+                )
+            elif already_recorded is None:
+                file_upload = S3FileUpload(
+                    s3_key=upload_meta.s3_key,
+                    s3_bucket=upload_meta.s3_bucket,
+                    s3_endpoint_url=upload_meta.s3_endpoint_url,
+                    size_bytes=size_bytes,
+                )
+                file_upload.task_id = upload.task_id
+                db_session.add(file_upload)
+                await db_session.commit()
+
+        self._delete_from_manifest(upload.id)
+        del self._pending[upload.id]
+        os.remove(upload.local_path)
+        self._logger.info(
+            f"Uploaded output file of task {upload.task_id} to S3. endpoint: {upload_meta.s3_endpoint_url}, bucket: {upload_meta.s3_bucket}, key: {upload_meta.s3_key})"
+        )
+
+        uploaded = OutputFileUpload(
+            s3_key=upload_meta.s3_key,
+            s3_bucket=upload_meta.s3_bucket,
+            s3_endpoint_url=upload_meta.s3_endpoint_url,
+            size_bytes=size_bytes,
+            uploaded_at=datetime.now(timezone.utc),
+        )
+        for listener in self._upload_listeners.get(upload.task_id, ()):
+            if not listener.full():
+                listener.put_nowait(uploaded)
+        async with self._uploads_changed:
+            self._uploads_changed.notify_all()
+
+
+output_uploader = OutputUploader(
+    manifest_path=f"{TASK_OUTPUT_DIR}/pending_uploads.db",
+    max_concurrent_uploads=settings.task_output_upload_concurrency,
+    max_retry_delay_seconds=settings.task_output_upload_max_retry_delay_seconds,
+    max_attempts=settings.task_output_upload_max_attempts,
+)
@@ -0,0 +1,667 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import count
+from logging import Logger
+import multiprocessing
+from multiprocessing.connection import Connection
+import pickle
+import threading
+from typing import Any, Callable
+
+from sqlalchemy import select
+
+from app.api_clients import spotify_api_client
+from app.config import TASK_OUTPUT_DIR, TASK_PROGRESS_DB_DIR, app_logger, settings
+from app.db import sessionmanager
+from app.db.models import DataFetchingTask
+from app.tasks.processing import FetchSlots, TaskProcessor
+from app.tasks.queue_item_management import QueueItemCounts, TaskQueueItemManager
+from app.tasks.uploads import OutputUploader, PendingOutputUpload, output_uploader
+from app.utils.spotify_api import SpotifyAPIClient
+
+# Messages are tuples whose first element is the message type.
+# API process -> worker process:
+#   ("run", task_id, pause_requested, use_fetch_slots), ("pause", task_id), ("slot_granted", request_id),
+#   ("spotify_api_response", request_id, response data or None, exception or None), ("shutdown",)
+# worker process -> API process:
+#   ("progress", task_id, TaskProcessorStats), ("done", task_id, error message or None),
+#   ("acquire_slot", task_id, request_id), ("release_slot", request_id), ("upload_added", upload_id),
+#   ("spotify_api_request", request_id, endpoint_path, params), ("cancel_spotify_api_request", request_id)
+
+
+class WorkerProcessExitedError(Exception):
+    """
+    Raised when the worker process a task was processed in exited before the task was done.
+    """
+
+
+@dataclass
+class TaskProcessorStats:
+    """
+    A snapshot of the progress of a task processor running in a worker process, sent to the API process regularly.
+    """
+
+    queue_item_counts: QueueItemCounts
+    bytes_written: int
+    output_file_size_bytes: int
+    estimated_completion_at: datetime | None
+
+
+class RemoteTaskProcessor:
+    """
+    Stands in for the `TaskProcessor` of a task that is processed in one of the worker processes of a `TaskWorkerPool`,
+    so that the task can be scheduled, paused and queried for progress in the API process just like a task processed in the API process itself.
+    """
+
+    def __init__(self, task_id: int, worker_pool: "TaskWorkerPool"):
+        self._task_id = task_id
+        self._worker_pool = worker_pool
+
+        with TaskQueueItemManager(task_id=task_id, db_dir=TASK_PROGRESS_DB_DIR) as q:
+            initial_counts = q.queue_item_counts
+        self._stats = TaskProcessorStats(
+            queue_item_counts=initial_counts,
+            bytes_written=0,
+            output_file_size_bytes=0,
+            estimated_completion_at=None,
+        )
+        """
+        The latest progress snapshot received from the worker process.
+        """
+
+        self._pause_requested = False
+
+        self._fetch_slots: FetchSlots | None = None
+
+        self._worker: "_TaskWorker | None" = None
+        """
+        The worker the task is processed in (if it is being processed).
+        """
+
+    @property
+    def task_id(self) -> int:
+        return self._task_id
+
+    @property
+    def queue_item_counts(self) -> QueueItemCounts:
+        return self._stats.queue_item_counts
+
+    @property
+    def bytes_written(self) -> int:
+        return self._stats.bytes_written
+
+    @property
+    def output_file_size_bytes(self) -> int:
+        return self._stats.output_file_size_bytes
+
+    @property
+    def estimated_completion_at(self) -> datetime | None:
+        return self._stats.estimated_completion_at
+
+    def set_fetch_slots(self, fetch_slots: FetchSlots | None):
+        self._fetch_slots = fetch_slots
+
+    def close(self):
+        # the actual task processor is closed by the worker process once it is done
+        pass
+
+    def pause(self):
+        self._pause_requested = True
+        if self._worker is not None:
+            self._worker.send(("pause", self._task_id))
+
+    async def run(self):
+        """
+        Processes the task in one of the worker processes and waits until it is done (or paused).
+        """
+        await self._worker_pool.run(self)
+
+
+class _TaskWorker:
+    """
+    One worker process of a `TaskWorkerPool`, together with the connection to it.
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        fetch_slots_getter: Callable[[int], FetchSlots | None],
+        spotify_api_client: SpotifyAPIClient,
+        logger: Logger,
+    ):
+        self.worker_id = worker_id
+        self._get_fetch_slots = fetch_slots_getter
+        self._spotify_api_client = spotify_api_client
+        self._logger = logger
+        self._conn, child_conn = multiprocessing.Pipe()
+        # spawn instead of fork, so that the worker does not inherit the event loop, open files and connections of the API process
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=run_worker_process,
+            args=(child_conn,),
+            name=f"task-worker-{worker_id}",
+            daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+
+        self.tasks: dict[int, RemoteTaskProcessor] = {}
+        """
+        The tasks that are being processed in this worker, keyed by task ID.
+        """
+
+        self._done: dict[int, asyncio.Future[None]] = {}
+        """
+        Resolved when the respective task is done (or paused).
+        """
+
+        self._slot_holders: dict[int, asyncio.Task] = {}
+        """
+        Tasks that acquire and hold fetch slots on behalf of the task processors in the worker, keyed by request ID.
+        """
+
+        self._spotify_api_requests: dict[int, asyncio.Task] = {}
+        """
+        Tasks that make Spotify API requests on behalf of the task processors in the worker, keyed by request ID.
+        """
+
+        self._reader = asyncio.create_task(self._read_messages())
+
+    @property
+    def is_alive(self) -> bool:
+        return not self._reader.done()
+
+    def send(self, message: tuple):
+        try:
+            self._conn.send(message)
+        except (OSError, ValueError):
+            # the worker exited, which is handled by the reader
+            pass
+
+    async def run(self, processor: RemoteTaskProcessor):
+        task_id = processor.task_id
+        done = asyncio.get_running_loop().create_future()
+        self._done[task_id] = done
+        self.tasks[task_id] = processor
+        processor._worker = self
+        self.send(
+            (
+                "run",
+                task_id,
+                processor._pause_requested,
+                processor._fetch_slots is not None,
+            )
+        )
+        try:
+            await done
+        finally:
+            processor._worker = None
+            del self.tasks[task_id]
+            del self._done[task_id]
+
+    async def close(self, timeout_seconds: float):
+        """
+        Stops the worker process. Tasks that are still being processed are interrupted (like when the API process stops) and resumed after the next restart.
+        """
+        self.send(("shutdown",))
+        await asyncio.to_thread(self._process.join, timeout_seconds)
+        if self._process.is_alive():
+            self._logger.warning(f"Terminating task worker {self.worker_id}")
+            self._process.terminate()
+            await asyncio.to_thread(self._process.join)
+        self._reader.cancel()
+        await asyncio.gather(self._reader, return_exceptions=True)
+        self._conn.close()
+
+    async def _read_messages(self):
+        try:
+            await _receive_messages(
+                self._conn,
+                self._handle_message,
+                thread_name=f"task-worker-{self.worker_id}-receiver",
+            )
+        finally:
+            for holder in self._slot_holders.values():
+                holder.cancel()
+            for request in self._spotify_api_requests.values():
+                request.cancel()
+            for task_id, done in self._done.items():
+                if not done.done():
+                    done.set_exception(
+                        WorkerProcessExitedError(
+                            f"Worker process {self.worker_id} exited while processing task {task_id}"
+                        )
+                    )
+
+    def _handle_message(self, message: tuple):
+        match message:
+            case ("progress", task_id, stats):
+                if task_id in self.tasks:
+                    self.tasks[task_id]._stats = stats
+            case ("done", task_id, error):
+                done = self._done.get(task_id)
+                if done is not None and not done.done():
+                    if error is None:
+                        done.set_result(None)
+                    else:
+                        done.set_exception(RuntimeError(error))
+            case ("acquire_slot", task_id, request_id):
+                self._slot_holders[request_id] = asyncio.create_task(
+                    self._hold_slot(task_id, request_id)
+                )
+            case ("release_slot", request_id):
+                holder = self._slot_holders.pop(request_id, None)
+                if holder is not None:
+                    holder.cancel()
+            case ("upload_added", upload_id):
+                output_uploader.load(upload_id)
+            case ("spotify_api_request", request_id, endpoint_path, params):
+                self._spotify_api_requests[request_id] = asyncio.create_task(
+                    self._make_spotify_api_request(request_id, endpoint_path, params)
+                )
+            case ("cancel_spotify_api_request", request_id):
+                request = self._spotify_api_requests.pop(request_id, None)
+                if request is not None:
+                    request.cancel()
+            case _:
+                self._logger.warning(
+                    f"Unexpected message from task worker {self.worker_id}: {message}"
+                )
+
+    async def _hold_slot(self, task_id: int, request_id: int):
+        fetch_slots = self._get_fetch_slots(task_id)
+        if fetch_slots is None:
+            self.send(("slot_granted", request_id))
+            return
+        try:
+            async with fetch_slots.slot(task_id):
+                self.send(("slot_granted", request_id))
+                # held until the worker releases the slot (which cancels this)
+                await asyncio.Event().wait()
+        except ValueError:
+            # the task was unregistered in the meantime (it is finishing or being paused)
+            self.send(("slot_granted", request_id))
+
+    async def _make_spotify_api_request(
+        self, request_id: int, endpoint_path: str, params: dict | None
+    ):
+        try:
+            data = await self._spotify_api_client.make_request(endpoint_path, params)
+        except Exception as e:
+            self.send(("spotify_api_response", request_id, None, _to_picklable(e)))
+        else:
+            self.send(("spotify_api_response", request_id, data, None))
+        finally:
+            self._spotify_api_requests.pop(request_id, None)
+
+
+class TaskWorkerPool:
+    """
+    Processes tasks in a pool of worker processes, so that CPU-heavy work (e.g. JSON serialization, compression and validation of outputs) of different tasks is spread over all cores.
+
+    The API process stays in charge of scheduling (see `TaskScheduler`), fetch budgets, Spotify API requests and uploads:
+    - each task is represented by a `RemoteTaskProcessor` in the API process; pause requests are forwarded to the worker and progress snapshots are sent back regularly
+    - fetch slots are acquired in the API process on behalf of the task processors in the workers
+    - Spotify API requests of the workers are made by the `SpotifyAPIClient` of the API process, so the rate limits, credentials and request meta are shared by all processes (see `SpotifyAPIClient.forward_requests`)
+    - output files handed off by the workers are uploaded by the `OutputUploader` of the API process
+
+    Worker processes that exit unexpectedly are restarted; the tasks they were processing fail with a `WorkerProcessExitedError`.
+    """
+
+    def __init__(
+        self,
+        worker_count: int,
+        spotify_api_client: SpotifyAPIClient,
+        logger: Logger = app_logger,
+    ):
+        if worker_count < 1:
+            raise ValueError("Worker count must be at least 1.")
+        self._worker_count = worker_count
+        self._spotify_api_client = spotify_api_client
+        self._logger = logger
+        self._workers: list[_TaskWorker] = []
+        self._closing = False
+        self._processors: dict[int, RemoteTaskProcessor] = {}
+        """
+        The tasks that are being processed by the pool, keyed by task ID.
+        """
+
+    def start(self):
+        self._workers = [
+            self._start_worker(worker_id) for worker_id in range(self._worker_count)
+        ]
+        self._logger.info(f"Started {self._worker_count} task worker processes")
+
+    async def close(self, timeout_seconds: float = 10):
+        self._closing = True
+        workers, self._workers = self._workers, []
+        await asyncio.gather(*(worker.close(timeout_seconds) for worker in workers))
+
+    async def run(self, processor: RemoteTaskProcessor):
+        """
+        Processes the task of the given processor in the worker that is processing the fewest tasks.
+        """
+        worker = self._get_worker()
+        self._processors[processor.task_id] = processor
+        try:
+            await worker.run(processor)
+        except WorkerProcessExitedError:
+            if not self._closing:
+                await self._mark_as_failed(processor.task_id)
+            raise
+        finally:
+            del self._processors[processor.task_id]
+
+    def _get_worker(self) -> _TaskWorker:
+        if not self._workers:
+            raise RuntimeError("Task worker pool is not running")
+        for i, worker in enumerate(self._workers):
+            if not worker.is_alive:
+                self._logger.warning(
+                    f"Task worker {worker.worker_id} exited unexpectedly, restarting it"
+                )
+                self._workers[i] = self._start_worker(worker.worker_id)
+        return min(self._workers, key=lambda worker: len(worker.tasks))
+
+    def _start_worker(self, worker_id: int) -> _TaskWorker:
+        return _TaskWorker(
+            worker_id,
+            fetch_slots_getter=self._get_fetch_slots,
+            spotify_api_client=self._spotify_api_client,
+            logger=self._logger,
+        )
+
+    def _get_fetch_slots(self, task_id: int) -> FetchSlots | None:
+        processor = self._processors.get(task_id)
+        return processor._fetch_slots if processor is not None else None
+
+    async def _mark_as_failed(self, task_id: int):
+        # the task processor in the worker process did not get the chance to update the status itself
+        async with sessionmanager.session() as db_session:
+            db_task = await db_session.get(DataFetchingTask, task_id)
+            if db_task is not None:
+                db_task.status = "error"
+                await db_session.commit()
+
+
+class WorkerOutputUploader(OutputUploader):
+    """
+    Used by task processors in worker processes instead of the `OutputUploader`: output files are added to the upload manifest of the API process's `OutputUploader`, which uploads them.
+    """
+
+    def __init__(
+        self,
+        manifest_path: str,
+        on_upload_added: Callable[[int], None],
+        poll_interval_seconds: float = 1,
+    ):
+        super().__init__(manifest_path)
+        self._on_upload_added = on_upload_added
+        self._poll_interval_seconds = poll_interval_seconds
+
+    def add(self, task_id: int, local_path: str, s3_key: str) -> PendingOutputUpload:
+        upload = super().add(task_id, local_path, s3_key)
+        # the upload is done by the API process, which is notified once the file has been moved to `local_path` (see `OutputUploader.add`)
+        del self._pending[upload.id]
+        asyncio.get_running_loop().call_soon(self._on_upload_added, upload.id)
+        return upload
+
+    def pending_uploads(self, task_id: int) -> list[PendingOutputUpload]:
+        return self._get_uploads(task_id, failed=False)
+
+    def failed_uploads(self, task_id: int) -> list[PendingOutputUpload]:
+        return self._get_uploads(task_id, failed=True)
+
+    async def wait_for_uploads(self, task_id: int):
+        while self.pending_uploads(task_id):
+            self._raise_if_uploads_failed(task_id)
+            await asyncio.sleep(self._poll_interval_seconds)
+        self._raise_if_uploads_failed(task_id)
+
+    def _get_uploads(self, task_id: int, failed: bool) -> list[PendingOutputUpload]:
+        rows = (
+            self._get_conn()
+            .execute(
+                "SELECT id, local_path, s3_key, attempts FROM pending_uploads WHERE task_id = ? AND failed = ?",
+                (task_id, int(failed)),
+            )
+            .fetchall()
+        )
+        return [
+            PendingOutputUpload(
+                id=upload_id,
+                task_id=task_id,
+                local_path=local_path,
+                s3_key=s3_key,
+                attempts=attempts,
+            )
+            for upload_id, local_path, s3_key, attempts in rows
+        ]
+
+
+class _WorkerFetchSlots:
+    """
+    Fetch slots of a task processor in a worker process, acquired by the API process (see `_TaskWorker._hold_slot`).
+    """
+
+    def __init__(self, send: Callable[[tuple], None]):
+        self._send = send
+        self._request_ids = count()
+        self._granted: dict[int, asyncio.Future[None]] = {}
+
+    def on_granted(self, request_id: int):
+        granted = self._granted.get(request_id)
+        if granted is not None and not granted.done():
+            granted.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, consumer: int):
+        request_id = next(self._request_ids)
+        granted = asyncio.get_running_loop().create_future()
+        self._granted[request_id] = granted
+        self._send(("acquire_slot", consumer, request_id))
+        try:
+            await granted
+            yield
+        finally:
+            del self._granted[request_id]
+            # also cancels the request if the slot was not granted yet
+            self._send(("release_slot", request_id))
+
+
+class _WorkerSpotifyAPIRequests:
+    """
+    Forwards the Spotify API requests of the task processors in a worker process to the API process, which makes them (see `_TaskWorker._make_spotify_api_request`).
+    """
+
+    def __init__(self, send: Callable[[tuple], None]):
+        self._send = send
+        self._request_ids = count()
+        self._responses: dict[int, asyncio.Future[dict]] = {}
+
+    def on_response(self, request_id: int, data: dict | None, error: Exception | None):
+        response = self._responses.get(request_id)
+        if response is None or response.done():
+            return
+        if error is not None:
+            response.set_exception(error)
+        else:
+            response.set_result(data)  # type: ignore
+
+    async def request(self, endpoint_path: str, params: dict | None) -> dict:
+        request_id = next(self._request_ids)
+        response = asyncio.get_running_loop().create_future()
+        self._responses[request_id] = response
+        self._send(("spotify_api_request", request_id, endpoint_path, params))
+        try:
+            return await response
+        except asyncio.CancelledError:
+            self._send(("cancel_spotify_api_request", request_id))
+            raise
+        finally:
+            del self._responses[request_id]
+
+
+def _receive_messages(
+    conn: Connection, handle_message: Callable[[Any], None], thread_name: str
+) -> asyncio.Future[None]:
+    """
+    Receives the messages sent over `conn` in a dedicated thread and calls `handle_message` with each of them in the event loop (in the order they were sent).
+    Unlike receiving them via `asyncio.to_thread`, this does not keep a thread of the default executor (which is also used for file operations) busy while waiting for messages.
+
+    Returns a future that is resolved once the other side closed the connection.
+    """
+    loop = asyncio.get_running_loop()
+    closed = loop.create_future()
+
+    def on_closed():
+        if not closed.done():
+            closed.set_result(None)
+
+    def receive():
+        try:
+            while True:
+                message = conn.recv()
+                loop.call_soon_threadsafe(handle_message, message)
+        except (EOFError, OSError):
+            try:
+                loop.call_soon_threadsafe(on_closed)
+            except RuntimeError:
+                # the event loop is closed already
+                pass
+        except RuntimeError:
+            # the event loop is closed already
+            pass
+
+    # a daemon thread, so it does not keep the process alive if the connection is not closed by the other side
+    threading.Thread(target=receive, name=thread_name, daemon=True).start()
+    return closed
+
+
+def _to_picklable(e: Exception) -> Exception:
+    """
+    Returns the given exception if it can be sent to another process, or a `RuntimeError` describing it otherwise.
+    """
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+
+
+def run_worker_process(conn: Connection):
+    """
+    The entry point of a worker process of a `TaskWorkerPool`.
+    """
+    asyncio.run(_serve(conn))
+
+
+async def _serve(conn: Connection):
+    # imported here as app.tasks imports this module
+    from app.tasks import _create_processor
+
+    def send(message: tuple):
+        conn.send(message)
+
+    uploader = WorkerOutputUploader(
+        manifest_path=f"{TASK_OUTPUT_DIR}/pending_uploads.db",
+        on_upload_added=lambda upload_id: send(("upload_added", upload_id)),
+    )
+    fetch_slots = _WorkerFetchSlots(send)
+    spotify_api_requests = _WorkerSpotifyAPIRequests(send)
+    processors: dict[int, TaskProcessor] = {}
+    runs: dict[int, asyncio.Task] = {}
+
+    async def run(task_id: int, pause_requested: bool, use_fetch_slots: bool):
+        error = None
+        try:
+            async with sessionmanager.session() as db_session:
+                db_task = await db_session.scalar(
+                    select(DataFetchingTask).where(DataFetchingTask.id == task_id)
+                )
+            if db_task is None:
+                raise ValueError(f"Task with ID {task_id} does not exist!")
+            processor = _create_processor(db_task, output_uploader=uploader)
+            processors[task_id] = processor
+            if use_fetch_slots:
+                processor.set_fetch_slots(fetch_slots)
+            if pause_requested:
+                processor.pause()
+            await processor.run()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            processor = processors.pop(task_id, None)
+            if processor is not None:
+                send(("progress", task_id, _get_stats(processor)))
+                processor.close()
+            del runs[task_id]
+        send(("done", task_id, error))
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(settings.task_worker_progress_interval_ms / 1000)
+            for task_id, processor in processors.items():
+                send(("progress", task_id, _get_stats(processor)))
+
+    shutdown = asyncio.Event()
+
+    def handle_message(message: Any):
+        match message:
+            case ("run", task_id, pause_requested, use_fetch_slots):
+                runs[task_id] = asyncio.create_task(
+                    run(task_id, pause_requested, use_fetch_slots)
+                )
+            case ("pause", task_id):
+                if task_id in processors:
+                    processors[task_id].pause()
+            case ("slot_granted", request_id):
+                fetch_slots.on_granted(request_id)
+            case ("spotify_api_response", request_id, data, error):
+                spotify_api_requests.on_response(request_id, data, error)
+            case ("shutdown",):
+                shutdown.set()
+
+    # the rate limits, credentials and request meta of the Spotify API client are managed by the API process, which makes all requests
+    spotify_api_client.forward_requests(spotify_api_requests.request)
+    progress_reporter = asyncio.create_task(report_progress())
+    connection_closed = _receive_messages(
+        conn, handle_message, thread_name="task-worker-receiver"
+    )
+    # the API process exited
+    connection_closed.add_done_callback(lambda _: shutdown.set())
+    try:
+        await shutdown.wait()
+    finally:
+        progress_reporter.cancel()
+        pending_runs = list(runs.values())
+        for task in pending_runs:
+            task.cancel()
+        await asyncio.gather(progress_reporter, *pending_runs, return_exceptions=True)
+        spotify_api_client.forward_requests(None)
+        if sessionmanager._engine is not None:
+            await sessionmanager.close()
+        conn.close()
+
+
+def _get_stats(processor: TaskProcessor) -> TaskProcessorStats:
+    return TaskProcessorStats(
+        queue_item_counts=processor.queue_item_counts,
+        bytes_written=processor.bytes_written,
+        output_file_size_bytes=processor.output_file_size_bytes,
+        estimated_completion_at=processor.estimated_completion_at,
+    )
+
+
+task_worker_pool = (
+    TaskWorkerPool(
+        worker_count=settings.task_worker_processes,
+        spotify_api_client=spotify_api_client,
+    )
+    if settings.task_worker_processes > 0
+    else None
+)
+"""
+The pool of worker processes tasks are processed in (`None` if tasks are processed in the API process, see `task_worker_processes` setting).
+"""
@@ -0,0 +1,136 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+import math
+from typing import Hashable
+
+
+class FairShareSemaphore:
+    """
+    A semaphore whose slots are shared by several consumers (e.g. tasks) according to their priorities, deadlines and weights.
+
+    While slots are contended, each free slot goes to a waiting consumer with the highest priority and, among those, the nearest deadline (consumers without a deadline come last).
+    Among equally ranked consumers, the slot goes to the one with the lowest number of slots in use relative to its weight, so that each of them gets (at least) its weighted share of the slots.
+    Slots that a consumer does not need are used by the others.
+    Shares are reallocated automatically whenever consumers are registered or unregistered.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1.")
+        self._capacity = capacity
+        self._used = 0
+        self._weights: dict[Hashable, float] = {}
+        self._ranks: dict[Hashable, tuple[int, float]] = {}
+        """
+        The rank of each consumer as (negative priority, deadline timestamp), lower ranks come first.
+        """
+        self._in_use: dict[Hashable, int] = {}
+        self._waiters: dict[Hashable, deque[asyncio.Future[None]]] = {}
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def register(
+        self,
+        consumer: Hashable,
+        weight: float = 1,
+        priority: int = 0,
+        deadline: datetime | None = None,
+    ):
+        if weight <= 0:
+            raise ValueError("Weight must be greater than 0.")
+        self._weights[consumer] = weight
+        self._ranks[consumer] = (
+            -priority,
+            deadline.timestamp() if deadline is not None else math.inf,
+        )
+        self._in_use.setdefault(consumer, 0)
+        self._waiters.setdefault(consumer, deque())
+
+    def unregister(self, consumer: Hashable):
+        """
+        Removes the consumer. Slots it still holds are returned as soon as they are released.
+        """
+        self._weights.pop(consumer, None)
+        self._ranks.pop(consumer, None)
+        for waiter in self._waiters.pop(consumer, ()):
+            waiter.cancel()
+        if not self._in_use.get(consumer):
+            self._in_use.pop(consumer, None)
+
+    def shares(self) -> dict[Hashable, float]:
+        """
+        The number of slots each registered consumer is entitled to while all of them are busy (consumers that are not ranked first get none).
+        """
+        if not self._ranks:
+            return {}
+        top_rank = min(self._ranks.values())
+        total_weight = sum(
+            weight
+            for consumer, weight in self._weights.items()
+            if self._ranks[consumer] == top_rank
+        )
+        return {
+            consumer: (
+                self._capacity * weight / total_weight
+                if self._ranks[consumer] == top_rank
+                else 0
+            )
+            for consumer, weight in self._weights.items()
+        }
+
+    def in_use(self, consumer: Hashable) -> int:
+        return self._in_use.get(consumer, 0)
+
+    @asynccontextmanager
+    async def slot(self, consumer: Hashable):
+        """
+        Holds one slot on behalf of the given (registered) consumer while the context is active.
+        """
+        await self._acquire(consumer)
+        try:
+            yield
+        finally:
+            self._release(consumer)
+
+    async def _acquire(self, consumer: Hashable):
+        if consumer not in self._weights:
+            raise ValueError(f"Consumer {consumer} is not registered.")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[consumer].append(waiter)
+        self._grant()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was granted right before the waiting coroutine was cancelled
+                self._release(consumer)
+            elif waiter in self._waiters.get(consumer, ()):
+                self._waiters[consumer].remove(waiter)
+            raise
+
+    def _release(self, consumer: Hashable):
+        self._used -= 1
+        self._in_use[consumer] -= 1
+        if not self._in_use[consumer] and consumer not in self._weights:
+            del self._in_use[consumer]
+        self._grant()
+
+    def _grant(self):
+        while self._used < self._capacity:
+            waiting = [consumer for consumer, w in self._waiters.items() if w]
+            if not waiting:
+                return
+            consumer = min(
+                waiting,
+                key=lambda c: (*self._ranks[c], self._in_use[c] / self._weights[c]),
+            )
+            waiter = self._waiters[consumer].popleft()
+            if waiter.done():
+                continue
+            self._used += 1
+            self._in_use[consumer] += 1
+            waiter.set_result(None)
@@ -0,0 +1,61 @@
+import asyncio
+import aiohttp
+
+
+class HTTPSessionManager:
+    """
+    Provides a long-lived `aiohttp.ClientSession`, so that requests reuse open (keep-alive) connections and cached DNS lookups instead of creating a new session (and connections) for every request.
+
+    The session is created on first use (or via `start()`) and has to be closed via `close()`.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_connections_per_host: int = 0,
+        dns_cache_ttl_seconds: int = 300,
+        keepalive_timeout_seconds: float = 30,
+    ):
+        self._max_connections = max_connections
+        """
+        The maximum number of connections the session keeps open at the same time (0 for no limit).
+        """
+
+        self._max_connections_per_host = max_connections_per_host
+        """
+        The maximum number of connections the session keeps open to the same host at the same time (0 for no limit).
+        """
+
+        self._dns_cache_ttl_seconds = dns_cache_ttl_seconds
+        """
+        For how long (in seconds) resolved host names are cached.
+        """
+
+        self._keepalive_timeout_seconds = keepalive_timeout_seconds
+        """
+        For how long (in seconds) idle connections are kept open for reuse.
+        """
+
+        self._session: aiohttp.ClientSession | None = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        await self.get_session()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            async with self._lock:
+                if self._session is None or self._session.closed:
+                    connector = aiohttp.TCPConnector(
+                        limit=self._max_connections,
+                        limit_per_host=self._max_connections_per_host,
+                        ttl_dns_cache=self._dns_cache_ttl_seconds,
+                        keepalive_timeout=self._keepalive_timeout_seconds,
+                    )
+                    self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
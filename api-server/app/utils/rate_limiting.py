@@ -0,0 +1,319 @@
+import asyncio
+import json
+from logging import Logger
+import os
+import time
+from pydantic import BaseModel, Field
+
+
+class RateLimit(BaseModel):
+    requests_per_minute: float = Field(gt=0)
+    """
+    The number of requests that may be made per minute on average.
+    """
+
+    burst: int = Field(default=1, ge=1)
+    """
+    The number of requests that may be made at once (after no requests were made for a while) before requests are spaced out according to `requests_per_minute`.
+    """
+
+    @property
+    def seconds_per_request(self) -> float:
+        return 60 / self.requests_per_minute
+
+
+class TokenBucket:
+    """
+    An async token bucket: it holds up to `burst` tokens and is refilled at the rate specified by the `RateLimit`. Each request takes one token.
+
+    Callers that have to wait for a token are served in the order they called `acquire()` (each caller reserves the next free token right away, so concurrent callers never overshoot the limit).
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+
+        self._tokens = float(limit.burst)
+        """
+        The number of tokens currently available. Negative if tokens have been reserved by callers that are waiting for them.
+        """
+
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.limit.burst),
+            self._tokens + (now - self._updated_at) / self.limit.seconds_per_request,
+        )
+        self._updated_at = now
+
+    def time_until_available(self) -> float:
+        """
+        Returns the time (in seconds) until a token would be available if one was reserved now (without reserving it).
+        """
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) * self.limit.seconds_per_request
+
+    def reserve(self) -> float:
+        """
+        Reserves the next free token and returns the time (in seconds) until it is available.
+        """
+        self._refill()
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0
+        return -self._tokens * self.limit.seconds_per_request
+
+    def set_limit(self, limit: RateLimit):
+        """
+        Changes the rate the bucket is refilled at (tokens that are already reserved are kept).
+        """
+        self._refill()
+        self.limit = limit
+        self._tokens = min(float(limit.burst), self._tokens)
+
+    def pause(self, seconds: float):
+        """
+        Makes sure that no further token is available within the next `seconds` seconds (callers that already reserved a token are not delayed).
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds / self.limit.seconds_per_request
+
+    @property
+    def is_idle(self) -> bool:
+        """
+        Whether the bucket is full, i.e. dropping it would not allow any request that it would not allow itself.
+        """
+        self._refill()
+        return self._tokens >= self.limit.burst
+
+    def release(self):
+        """
+        Returns a reserved token that is not going to be used (e.g. because the caller waiting for it was cancelled).
+        """
+        self._refill()
+        self._tokens = min(float(self.limit.burst), self._tokens + 1)
+
+    async def acquire(self) -> float:
+        """
+        Waits until a token is available and takes it. Returns the time (in seconds) the caller had to wait.
+        """
+        wait_seconds = self.reserve()
+        if wait_seconds > 0:
+            try:
+                await asyncio.sleep(wait_seconds)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+        return wait_seconds
+
+
+class RateLimiter:
+    """
+    Rate limits requests to the endpoints of an API, with one `TokenBucket` per combination of endpoint and key (e.g. the credentials a request is made with).
+
+    Endpoints that do not have a limit in `endpoint_limits` use `default_limit`.
+    """
+
+    def __init__(
+        self,
+        default_limit: RateLimit,
+        endpoint_limits: dict[str, RateLimit] | None = None,
+    ):
+        self._default_limit = default_limit
+        self._endpoint_limits = endpoint_limits or {}
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+
+    def get_limit(self, endpoint: str) -> RateLimit:
+        return self._endpoint_limits.get(endpoint, self._default_limit)
+
+    def set_limit(self, endpoint: str, limit: RateLimit):
+        self._endpoint_limits[endpoint] = limit
+        for (bucket_endpoint, _), bucket in self._buckets.items():
+            if bucket_endpoint == endpoint:
+                bucket.set_limit(limit)
+
+    def get_bucket(self, endpoint: str, key: str) -> TokenBucket:
+        bucket = self._buckets.get((endpoint, key))
+        if bucket is None:
+            bucket = TokenBucket(self.get_limit(endpoint))
+            self._buckets[(endpoint, key)] = bucket
+        return bucket
+
+    def time_until_available(self, endpoint: str, key: str) -> float:
+        """
+        Returns the time (in seconds) a request to `endpoint` made with `key` right now would have to wait.
+        """
+        bucket = self._buckets.get((endpoint, key))
+        if bucket is None:
+            return 0
+        return bucket.time_until_available()
+
+    async def acquire(self, endpoint: str, key: str) -> float:
+        """
+        Waits until a request to `endpoint` may be made with `key`. Returns the time (in seconds) the caller had to wait.
+        """
+        return await self.get_bucket(endpoint, key).acquire()
+
+    def record_success(self, endpoint: str, key: str):
+        """
+        Call this whenever a request to `endpoint` made with `key` succeeded.
+        """
+        pass
+
+    def record_rate_limited(
+        self, endpoint: str, key: str, retry_after_seconds: float | None = None
+    ):
+        """
+        Call this whenever a request to `endpoint` made with `key` was rejected because of rate limiting. No further requests to `endpoint` are allowed with `key` for `retry_after_seconds`.
+        """
+        if retry_after_seconds:
+            self.get_bucket(endpoint, key).pause(retry_after_seconds)
+
+    def remove_key(self, key: str):
+        """
+        Drops the token buckets of `key` (e.g. once the credentials it refers to are not used anymore). Buckets that still have to delay requests (e.g. because the API asked to retry later) are kept, in case `key` is used again.
+        """
+        for bucket_key in [
+            bucket_key
+            for bucket_key, bucket in self._buckets.items()
+            if bucket_key[1] == key and bucket.is_idle
+        ]:
+            del self._buckets[bucket_key]
+
+    def close(self):
+        """
+        Call this once the rate limiter is not used anymore.
+        """
+        pass
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    A `RateLimiter` that adapts the rate of each endpoint to the rate the API accepts (additive increase, multiplicative decrease):
+    while requests to an endpoint succeed, its rate increases by `increase_per_minute` requests per minute every minute (no matter with how many keys requests are made to it). Whenever a request is rejected because of rate limiting, the rate is multiplied by `decrease_factor`.
+
+    The configured limits are used as the initial rates. Learned rates are stored in a JSON file at `state_path` and used instead of the configured limits after a restart.
+    """
+
+    def __init__(
+        self,
+        default_limit: RateLimit,
+        state_path: str,
+        logger: Logger,
+        endpoint_limits: dict[str, RateLimit] | None = None,
+        min_requests_per_minute: float = 1,
+        max_requests_per_minute: float = 60,
+        increase_per_minute: float = 1,
+        decrease_factor: float = 0.5,
+        decrease_cooldown_seconds: float = 5,
+        save_interval_seconds: float = 60,
+    ):
+        super().__init__(default_limit, dict(endpoint_limits or {}))
+        if not 0 < decrease_factor < 1:
+            raise ValueError("Decrease factor must be between 0 and 1.")
+        self._state_path = state_path
+        self._logger = logger
+        self._min_requests_per_minute = min_requests_per_minute
+        self._max_requests_per_minute = max_requests_per_minute
+        self._increase_per_minute = increase_per_minute
+        self._decrease_factor = decrease_factor
+
+        self._decrease_cooldown_seconds = decrease_cooldown_seconds
+        """
+        The minimum time (in seconds) between two decreases of the rate of an endpoint, so that requests that were already sent when the first one was rejected do not decrease the rate again.
+        """
+
+        self._decreased_at: dict[str, float] = {}
+        self._save_interval_seconds = save_interval_seconds
+        """
+        The minimum time (in seconds) between saving rates that increased. Decreased rates are saved right away.
+        """
+
+        self._saved_at = time.monotonic()
+        self._unsaved_changes = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._state_path):
+            return
+        try:
+            with open(self._state_path) as f:
+                rates: dict[str, float] = json.load(f)
+        except (OSError, ValueError):
+            self._logger.exception(
+                f"Could not load learned rate limits from {self._state_path}, using the configured limits"
+            )
+            return
+        for endpoint, requests_per_minute in rates.items():
+            self._set_rate(endpoint, requests_per_minute)
+        self._logger.info(f"Loaded learned rate limits: {rates}")
+
+    def save(self):
+        rates = {
+            endpoint: limit.requests_per_minute
+            for endpoint, limit in self._endpoint_limits.items()
+        }
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(rates, f)
+        os.replace(tmp_path, self._state_path)
+        self._saved_at = time.monotonic()
+        self._unsaved_changes = False
+
+    def _set_rate(self, endpoint: str, requests_per_minute: float):
+        requests_per_minute = min(
+            self._max_requests_per_minute,
+            max(self._min_requests_per_minute, requests_per_minute),
+        )
+        self.set_limit(
+            endpoint,
+            RateLimit(
+                requests_per_minute=requests_per_minute,
+                burst=self.get_limit(endpoint).burst,
+            ),
+        )
+        self._unsaved_changes = True
+
+    def record_success(self, endpoint: str, key: str):
+        requests_per_minute = self.get_limit(endpoint).requests_per_minute
+        if requests_per_minute >= self._max_requests_per_minute:
+            return
+        # the rate applies to each key, so requests are made with all keys in use at that rate
+        key_count = max(
+            1,
+            sum(
+                1 for bucket_endpoint, _ in self._buckets if bucket_endpoint == endpoint
+            ),
+        )
+        # at the current rate, this adds up to `increase_per_minute` per minute
+        self._set_rate(
+            endpoint,
+            requests_per_minute
+            + self._increase_per_minute / (requests_per_minute * key_count),
+        )
+        if time.monotonic() - self._saved_at >= self._save_interval_seconds:
+            self.save()
+
+    def record_rate_limited(
+        self, endpoint: str, key: str, retry_after_seconds: float | None = None
+    ):
+        super().record_rate_limited(endpoint, key, retry_after_seconds)
+        now = time.monotonic()
+        if now - self._decreased_at.get(endpoint, -float("inf")) < (
+            self._decrease_cooldown_seconds
+        ):
+            return
+        self._decreased_at[endpoint] = now
+        requests_per_minute = self.get_limit(endpoint).requests_per_minute
+        self._set_rate(endpoint, requests_per_minute * self._decrease_factor)
+        self._logger.info(
+            f"Decreased rate of {endpoint} endpoint from {requests_per_minute:.2f} to {self.get_limit(endpoint).requests_per_minute:.2f} requests per minute"
+        )
+        self.save()
+
+    def close(self):
+        if self._unsaved_changes:
+            self.save()
@@ -1,6 +1,12 @@
+import asyncio
 import os
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable
 import aioboto3
+from aiobotocore.config import AioConfig
+from botocore.exceptions import ClientError
 from pydantic import BaseModel
 
 from app.config import settings
@@ -10,6 +16,11 @@ S3_BUCKET = settings.s3_bucket
 S3_KEY_ID = settings.s3_key_id
 S3_SECRET = settings.s3_secret
 
+S3_MIN_PART_SIZE_BYTES = 5 * 1024 * 1024
+"""
+The minimum size of each part of a multipart upload except the last one (enforced by S3).
+"""
+
 session = aioboto3.Session(aws_access_key_id=S3_KEY_ID, aws_secret_access_key=S3_SECRET)
 
 
@@ -25,27 +36,224 @@ async def s3_client():
         yield s3
 
 
+class S3ClientManager:
+    """
+    Provides a long-lived S3 client, so that uploads share a connection pool instead of creating a new client (and connections) for every file.
+
+    The client is created on first use and has to be closed via `close()`.
+    """
+
+    def __init__(
+        self,
+        session: aioboto3.Session,
+        endpoint_url: str,
+        max_pool_connections: int = 10,
+    ):
+        self._session = session
+        self._endpoint_url = endpoint_url
+
+        self._max_pool_connections = max_pool_connections
+        """
+        The maximum number of connections the client keeps open (should be at least the number of parts that may be uploaded concurrently).
+        """
+
+        self._client: Any = None
+        self._exit_stack: AsyncExitStack | None = None
+        self._lock = asyncio.Lock()
+
+    async def get_client(self):
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    exit_stack = AsyncExitStack()
+                    self._client = await exit_stack.enter_async_context(
+                        self._session.client(
+                            "s3",
+                            endpoint_url=self._endpoint_url,
+                            config=AioConfig(
+                                max_pool_connections=self._max_pool_connections
+                            ),
+                        )
+                    )
+                    self._exit_stack = exit_stack
+        return self._client
+
+    async def close(self):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+        self._client = None
+        self._exit_stack = None
+
+
+s3_client_manager = S3ClientManager(
+    session,
+    S3_ENDPOINT_URL,
+    max_pool_connections=settings.task_output_upload_concurrency
+    * settings.s3_upload_max_concurrent_parts,
+)
+
+
 class UploadMeta(BaseModel):
     s3_key: str
     s3_bucket: str
     s3_endpoint_url: str
 
 
+@dataclass
+class MultipartUploadState:
+    """
+    The state of a multipart upload. Passing it to `upload_file` again (e.g. after a restart) resumes the upload instead of sending all parts again.
+    """
+
+    upload_id: str | None = None
+    """
+    The ID of the multipart upload (`None` if it was not created yet).
+    """
+
+    part_size_bytes: int | None = None
+    """
+    The part size the upload was created with (parts uploaded so far can only be reused with the same part size).
+    """
+
+    completed_parts: dict[int, str] = field(default_factory=dict)
+    """
+    The ETags of the parts that were uploaded successfully, keyed by part number.
+    """
+
+
 async def upload_file(
-    local_path: str, s3_key: str, remove_after_upload=False
+    local_path: str,
+    s3_key: str,
+    remove_after_upload=False,
+    part_size_bytes: int = settings.s3_upload_part_size_bytes,
+    max_concurrent_parts: int = settings.s3_upload_max_concurrent_parts,
+    multipart_upload: MultipartUploadState | None = None,
+    on_multipart_upload_created: (
+        Callable[[MultipartUploadState], None] | None
+    ) = None,
+    on_part_uploaded: Callable[[MultipartUploadState, int], None] | None = None,
 ) -> UploadMeta:
     """
-    Uploads a local file to S3.
+    Uploads a local file to S3, using the shared S3 client (see `S3ClientManager`).
+
+    Files larger than `part_size_bytes` are uploaded in parts, `max_concurrent_parts` of them at the same time. Only the parts that are currently uploaded are kept in memory.
+    The state of the multipart upload is tracked in `multipart_upload` (if provided), and the callbacks are called whenever it changes, so that it can be persisted. If the upload fails, it is not aborted, so it can be resumed by passing the same state again.
 
     :param local_path: The path to the local file
     :param s3_key: The S3 key under which the file should be uploaded
     :return: The S3 key under which the file was uploaded
     """
-    async with s3_service() as s3:
-        bucket = await s3.Bucket(S3_BUCKET)
-        await bucket.upload_file(local_path, s3_key)
-        if remove_after_upload:
-            os.remove(local_path)
-        return UploadMeta(
-            s3_key=s3_key, s3_bucket=S3_BUCKET, s3_endpoint_url=S3_ENDPOINT_URL
+    client = await s3_client_manager.get_client()
+    size_bytes = os.path.getsize(local_path)
+    if multipart_upload is None:
+        multipart_upload = MultipartUploadState()
+
+    if multipart_upload.upload_id is None and size_bytes <= part_size_bytes:
+        with open(local_path, "rb") as f:
+            data = await asyncio.to_thread(f.read)
+        await client.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=data)
+    else:
+        upload_parts = partial(
+            _upload_parts,
+            client,
+            local_path,
+            s3_key,
+            size_bytes,
+            part_size_bytes,
+            max_concurrent_parts,
+            multipart_upload,
+            on_multipart_upload_created,
+            on_part_uploaded,
         )
+        try:
+            await upload_parts()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+                raise
+            # the upload was aborted or expired in the meantime, so all parts have to be uploaded again
+            multipart_upload.upload_id = None
+            multipart_upload.completed_parts.clear()
+            await upload_parts()
+
+    if remove_after_upload:
+        os.remove(local_path)
+    return UploadMeta(
+        s3_key=s3_key, s3_bucket=S3_BUCKET, s3_endpoint_url=S3_ENDPOINT_URL
+    )
+
+
+async def _upload_parts(
+    client,
+    local_path: str,
+    s3_key: str,
+    size_bytes: int,
+    part_size_bytes: int,
+    max_concurrent_parts: int,
+    state: MultipartUploadState,
+    on_multipart_upload_created: Callable[[MultipartUploadState], None] | None,
+    on_part_uploaded: Callable[[MultipartUploadState, int], None] | None,
+):
+    if state.upload_id is None:
+        if part_size_bytes < S3_MIN_PART_SIZE_BYTES:
+            raise ValueError(
+                f"Part size must be at least {S3_MIN_PART_SIZE_BYTES} bytes."
+            )
+        response = await client.create_multipart_upload(Bucket=S3_BUCKET, Key=s3_key)
+        state.upload_id = response["UploadId"]
+        state.part_size_bytes = part_size_bytes
+        state.completed_parts.clear()
+        if on_multipart_upload_created is not None:
+            on_multipart_upload_created(state)
+    upload_id = state.upload_id
+    part_size_bytes = state.part_size_bytes or part_size_bytes
+
+    part_count = max(1, -(-size_bytes // part_size_bytes))
+    remaining_parts = [
+        part_number
+        for part_number in range(1, part_count + 1)
+        if part_number not in state.completed_parts
+    ]
+
+    def read_part(part_number: int) -> bytes:
+        with open(local_path, "rb") as f:
+            f.seek((part_number - 1) * part_size_bytes)
+            return f.read(part_size_bytes)
+
+    async def upload_parts():
+        while remaining_parts:
+            part_number = remaining_parts.pop(0)
+            data = await asyncio.to_thread(read_part, part_number)
+            response = await client.upload_part(
+                Bucket=S3_BUCKET,
+                Key=s3_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data,
+            )
+            state.completed_parts[part_number] = response["ETag"]
+            if on_part_uploaded is not None:
+                on_part_uploaded(state, part_number)
+
+    workers = [
+        asyncio.create_task(upload_parts())
+        for _ in range(min(max_concurrent_parts, len(remaining_parts)))
+    ]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+    await client.complete_multipart_upload(
+        Bucket=S3_BUCKET,
+        Key=s3_key,
+        UploadId=upload_id,
+        MultipartUpload={
+            "Parts": [
+                {"PartNumber": part_number, "ETag": etag}
+                for part_number, etag in sorted(state.completed_parts.items())
+            ]
+        },
+    )
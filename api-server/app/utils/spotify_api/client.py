@@ -1,17 +1,33 @@
+import asyncio
 from dataclasses import dataclass
-import random
+from collections import deque
+from functools import partial
 from pydantic import validate_call
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Literal, Optional, Sequence, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Literal,
+    Optional,
+    Sequence,
+    Union,
+)
 from logging import Logger
 import aiohttp
 from asyncio import sleep
+import os
 
-from app.config import PUBLIC_IP
+from app.config import DB_DIR, PUBLIC_IP, settings
+from app.utils.http import HTTPSessionManager
+from app.utils.rate_limiting import AdaptiveRateLimiter, RateLimiter
+from app.utils.spotify_api.credential_pool import PooledCredentials
 from app.utils.spotify_api.models import SpotifyAPICredentials
 from app.utils.spotify_api.request_meta import (
+    RequestMetaReporter,
     SpotifyAPIRequestMeta,
-    report_request_meta,
 )
 from app.utils.spotify_api.helpers import get_list_data_from_response, remove_spotify_id
 from app.utils.spotify_api.token_manager import SpotifyAPIAccessTokenManager
@@ -29,6 +45,10 @@ class APIBlockException(Exception):
         self.message = message
         self.blocked_until = blocked_until
 
+    def __reduce__(self):
+        # by default, only `message` would be passed to `__init__` when unpickling (e.g. when passed from the API process to a worker process)
+        return (type(self), (self.message, self.blocked_until))
+
 
 @dataclass
 class SuccessResult:
@@ -96,6 +116,9 @@ class UnexpectedResponseCodeError(Exception):
         self.message = message
         self.status_code = status_code
 
+    def __reduce__(self):
+        return (type(self), (self.message, self.status_code))
+
 
 class UnexpectedResponseDataError(Exception):
     pass
@@ -117,90 +140,166 @@ class ServiceUnavailableError(Exception):
     pass
 
 
-class SpotifyAPIClient:
-    """
-    A custom Spotify API client that fetches data from the Spotify API using provided credentials.
-    """
-
-    _last_request_per_endpoint: Dict[str, datetime] = {}
-    _timeouts_per_endpoint: Dict[str, float] = {
-        "search": 15,
-        "playlist": 15,
-    }
-    """
-    Timeout between requests for specific endpoints, in seconds (e.g. value of 15 means 60/15 = 4 requests per minute)
-    
-    Values here have been chosen based on experience with the respective API endpoints.
-    Any values not listed here will use `_default_timeout`.
-    """
-    _default_timeout: float = 5
-    """
-    The default timeout between requests for endpoints not listed in `_timeouts_per_endpoint`, in seconds.
-    """
+type SpotifyAPIRequestForwarder = Callable[[str, dict | None], Awaitable[dict]]
+"""
+Makes a request to an endpoint of the Spotify API (given the endpoint path and the query parameters) on behalf of a `SpotifyAPIClient` and returns the response data (see `SpotifyAPIClient.forward_requests`).
+"""
 
-    _last_credentials_producing_429: SpotifyAPICredentials | None = None
-    """
-    Credentials that were used right before switching to new credentials due to receiving a 429 Too Many Requests response from the Spotify API.
-    Only != None after receiving a 429 response, up until MINIMUM_NON_429_REQUESTS_AFTER_BLOCK requests with non-429 response have been made with the new credentials.
-    """
-    _non_429_requests_made_since_block: int = 0
-    """
-    A non-negative integer specifying the number of requests made since the last time the credentials were blocked
-    Only relevant _previously_blocked_credentials is not None
-    """
 
-    _credentials: SpotifyAPICredentials | None = None
-    _requests_made_with_current_credentials: int = 0
-    _max_requests_with_current_credentials: int = random.randint(2000, 3000)
+class SpotifyAPIClient:
     """
-    A non-negative integer specifying the maximum number of requests that can be made with the current credentials before they are swapped out for new ones.
+    A custom Spotify API client that fetches data from the Spotify API using provided credentials.
 
-    This should preferrably be a not too big, random number, so that it shouldn't be as likely to get blocked by Spotify (assumption: the more regular things look, the more likely we are to get blocked).
+    The client uses several sets of credentials (fetched from the credentials API) at the same time, each with its own access token and rate budget, and dispatches every request to the set that can make it soonest.
     """
 
     def __init__(
         self,
         credentials_api_url: str,
         logger: Logger,
+        http_session_manager: HTTPSessionManager | None = None,
+        request_meta_reporter: RequestMetaReporter | None = None,
+        rate_limiter: RateLimiter | None = None,
+        credential_pool_size: int = 1,
+        max_concurrent_pages: int = 8,
     ):
         self.logger = logger
         self._credentials_api_url = credentials_api_url
-        self._token_manager = SpotifyAPIAccessTokenManager(self.get_credentials)
+        self._http_session_manager = http_session_manager or HTTPSessionManager()
+        """
+        Provides the HTTP session (and connection pool) shared by all requests the client makes (to the Spotify API as well as the credentials API).
+        """
+        self._max_concurrent_pages = max_concurrent_pages
+        """
+        The maximum number of pages of a paginated response (e.g. the tracks of a playlist) that are fetched at the same time.
+        """
+        if credential_pool_size < 1:
+            raise ValueError("Credential pool size must be at least 1.")
+        self._credential_pool: list[PooledCredentials] = []
+        """
+        The sets of credentials the client uses at the same time.
+        """
+        for _ in range(credential_pool_size):
+            pooled = PooledCredentials()
+            pooled.token_manager = SpotifyAPIAccessTokenManager(
+                partial(self._get_credentials, pooled),
+                self._http_session_manager,
+                logger=logger,
+            )
+            self._credential_pool.append(pooled)
+        self._request_meta_reporter = request_meta_reporter or RequestMetaReporter(
+            credentials_api_url=credentials_api_url,
+            http_session_manager=self._http_session_manager,
+            spool_path=os.path.join(DB_DIR, "spotify_request_meta_spool.db"),
+            logger=logger,
+        )
+        """
+        Reports the metadata of all requests to the Spotify API to the credentials API in the background.
+        """
+        if rate_limiter is None:
+            if settings.spotify_api_adaptive_rate_limits:
+                rate_limiter = AdaptiveRateLimiter(
+                    default_limit=settings.spotify_api_default_rate_limit,
+                    endpoint_limits=settings.spotify_api_endpoint_rate_limits,
+                    state_path=os.path.join(DB_DIR, "spotify_api_rate_limits.json"),
+                    logger=logger,
+                    min_requests_per_minute=settings.spotify_api_min_requests_per_minute,
+                    max_requests_per_minute=settings.spotify_api_max_requests_per_minute,
+                    increase_per_minute=settings.spotify_api_rate_increase_per_minute,
+                    decrease_factor=settings.spotify_api_rate_decrease_factor,
+                )
+            else:
+                rate_limiter = RateLimiter(
+                    default_limit=settings.spotify_api_default_rate_limit,
+                    endpoint_limits=settings.spotify_api_endpoint_rate_limits,
+                )
+        self._rate_limiter = rate_limiter
+        """
+        Limits the rate of requests to each endpoint per set of credentials (see `Settings.spotify_api_endpoint_rate_limits`).
+        """
+
+        self._forward_request: SpotifyAPIRequestForwarder | None = None
+        """
+        If set, requests are not made by this client, but forwarded to another client (see `forward_requests`).
+        """
+
+    async def start(self):
+        """
+        Opens the client's HTTP session and starts reporting request meta. Call this on application startup (otherwise, request meta is only reported when the client is closed).
+        """
+        await self._http_session_manager.start()
+        self._request_meta_reporter.start()
+
+    async def close(self):
+        """
+        Reports any remaining request meta (or spools it if that fails), then closes the client's HTTP session and all connections that are kept open.
+        """
+        for pooled in self._credential_pool:
+            await pooled.token_manager.close()
+        await self._request_meta_reporter.close()
+        await self._http_session_manager.close()
+        self._rate_limiter.close()
+
+    def forward_requests(self, forward_request: SpotifyAPIRequestForwarder | None):
+        """
+        Makes the client forward all requests to `forward_request` instead of making them itself (or stop doing so if `None` is passed).
+
+        Used in the worker processes of a `TaskWorkerPool`: their requests are made by the client of the API process (see `make_request`), so that the rate limits, credentials and request meta of all processes are managed in one place. A forwarding client does not have to be started.
+        """
+        self._forward_request = forward_request
+
+    async def make_request(
+        self, endpoint_path: str, params: Optional[dict] = None
+    ) -> dict:
+        """
+        Makes a request to the given endpoint of the Spotify API and returns the response data (e.g. on behalf of a client that forwards its requests, see `forward_requests`).
+        """
+        return await self._make_request(endpoint_path, params)
 
     def _get_endpoint_name(self, endpoint_path: str) -> str:
         # for endpoints like /artists/{id}/albums, we cannot use the endpoint name as is
         # because it contains the artist ID, which is unique for each artist
         # and the "/" would create problems when accessing the credentials endpoint to get the credentials
-        return remove_spotify_id(endpoint_path.replace("/", ".")).replace("..", ".")
+        return (
+            remove_spotify_id(endpoint_path.replace("/", "."))
+            .replace("..", ".")
+            .strip(".")
+        )
 
-    async def get_credentials(self) -> SpotifyAPICredentials:
-        if (
-            self._credentials
-            and not self._requests_made_with_current_credentials
-            >= self._max_requests_with_current_credentials
-        ):
-            return self._credentials
+    async def _get_credentials(
+        self, pooled: PooledCredentials
+    ) -> SpotifyAPICredentials:
+        if pooled.credentials is not None and not pooled.needs_new_credentials:
+            return pooled.credentials
+
+        async with pooled.lock:
+            # another request may have fetched new credentials in the meantime
+            if pooled.credentials is not None and not pooled.needs_new_credentials:
+                return pooled.credentials
+            previous_credentials = pooled.credentials
+            credentials = await self._fetch_credentials()
+            if previous_credentials is not None:
+                self._rate_limiter.remove_key(previous_credentials.client_id)
+            pooled.set_credentials(credentials)
+            self.logger.info(
+                f"Got new Spotify API credentials (client ID: {credentials.client_id}). Will swap after {pooled.max_requests} requests."
+            )
+            return credentials
 
+    async def _fetch_credentials(self) -> SpotifyAPICredentials:
         url = f"{self._credentials_api_url}/spotify/account"
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    if not isinstance(data, dict):
-                        raise CredentialFetchingError(
-                            f"Could not fetch Spotify API credentials: expected response to be a dictionary, but got: {data}"
-                        )
-                    self._credentials = SpotifyAPICredentials(**data)
-                    self._token_manager.invalidate_access_token()
-                    self._requests_made_with_current_credentials = 0
-                    self._max_requests_with_current_credentials = random.randint(
-                        2000, 3000
+            session = await self._http_session_manager.get_session()
+            async with session.get(url) as response:
+                response.raise_for_status()
+                data = await response.json()
+                if not isinstance(data, dict):
+                    raise CredentialFetchingError(
+                        f"Could not fetch Spotify API credentials: expected response to be a dictionary, but got: {data}"
                     )
-                    self.logger.info(
-                        f"Got new Spotify API credentials (client ID: {self._credentials.client_id}). Will swap after {self._max_requests_with_current_credentials} requests."
-                    )
-                    return self._credentials
+                return SpotifyAPICredentials(**data)
+        except CredentialFetchingError:
+            raise
         except aiohttp.ClientResponseError as e:
             raise CredentialFetchingError(
                 f"Could not fetch Spotify API credentials: {e.status} - {e.message}"
@@ -210,6 +309,23 @@ class SpotifyAPIClient:
                 f"Unexpected error while fetching Spotify API credentials: {e}"
             ) from e
 
+    def _choose_credentials(self, endpoint_name: str) -> PooledCredentials:
+        """
+        Returns the set of credentials that can make a request to the given endpoint soonest (the one with the fewest requests made if there is a tie).
+        """
+
+        def wait_seconds(pooled: PooledCredentials) -> float:
+            if pooled.credentials is None:
+                return 0
+            return self._rate_limiter.time_until_available(
+                endpoint_name, pooled.credentials.client_id
+            )
+
+        return min(
+            self._credential_pool,
+            key=lambda pooled: (wait_seconds(pooled), pooled.requests_made),
+        )
+
     async def _make_request(
         self,
         endpoint_path: str,
@@ -218,141 +334,145 @@ class SpotifyAPIClient:
         attempt_number=1,
     ) -> dict:
         """
-        Make a request to the Spotify API using the credentials the client was initialized with.
+        Make a request to the Spotify API using one of the sets of credentials in the client's credential pool.
         """
+        if self._forward_request is not None:
+            return await self._forward_request(endpoint_path, params)
+
         endpoint_name = self._get_endpoint_name(endpoint_path)
 
         self.logger.debug(f"Making request to {endpoint_name} endpoint...")
 
-        headers = {"Authorization": f"Bearer {await self._token_manager.access_token}"}
-        params = params or {}
-
-        timeout = self._get_request_timeout(endpoint_name)
-        if timeout:
+        pooled = self._choose_credentials(endpoint_name)
+        credentials = await self._get_credentials(pooled)
+        waited_seconds = await self._rate_limiter.acquire(
+            endpoint_name, credentials.client_id
+        )
+        if waited_seconds:
             self.logger.debug(
-                f"Waiting {timeout} seconds before making request to {endpoint_name} endpoint..."
+                f"Waited {waited_seconds:.2f} seconds before making request to {endpoint_name} endpoint"
             )
-            await sleep(timeout)
+
+        headers = {"Authorization": f"Bearer {await pooled.token_manager.access_token}"}
+        params = params or {}
 
         sent_at = datetime.now(timezone.utc)
-        self._last_request_per_endpoint[endpoint_name] = sent_at
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.spotify.com/v1/{endpoint_path}",
-                headers=headers,
-                params=params,
-            ) as response:
-                received_at = datetime.now(timezone.utc)
-                req_meta = SpotifyAPIRequestMeta(
-                    url=str(response.url),
-                    ip=PUBLIC_IP,
-                    status_code=response.status,
-                    sent_at=sent_at,
-                    received_at=received_at,
-                    credentials=await self.get_credentials(),
-                )
 
-                res = await self._parse_response(response, req_meta, endpoint_name)
-                try:
-                    await report_request_meta(req_meta)
-                except Exception as e:
-                    if req_meta.status_code != 200:
-                        raise e
-                    self.logger.warning(
-                        f"Failed to report metadata for request to {endpoint_name} endpoint with 200 status code: {e}"
+        session = await self._http_session_manager.get_session()
+        async with session.get(
+            f"https://api.spotify.com/v1/{endpoint_path}",
+            headers=headers,
+            params=params,
+        ) as response:
+            received_at = datetime.now(timezone.utc)
+            req_meta = SpotifyAPIRequestMeta(
+                url=str(response.url),
+                ip=PUBLIC_IP,
+                status_code=response.status,
+                sent_at=sent_at,
+                received_at=received_at,
+                credentials=credentials,
+            )
+
+            res = await self._parse_response(response, req_meta, endpoint_name)
+            # reported in the background; request meta of non-200 responses is spooled to disk right away, so it is not lost
+            self._request_meta_reporter.report(req_meta)
+
+            pooled.requests_made += 1
+            if pooled.last_credentials_producing_429 and response.status != 429:
+                pooled.non_429_requests_made_since_block += 1
+
+            if (
+                pooled.non_429_requests_made_since_block
+                >= PROBABLY_NOT_ACTUALLY_BLOCKED_THRESHOLD
+            ):
+                self.logger.info(
+                    f"Assuming that credentials {pooled.last_credentials_producing_429} are not blocked anymore after {pooled.non_429_requests_made_since_block} non-429 requests."
+                )
+                pooled.last_credentials_producing_429 = None
+                pooled.non_429_requests_made_since_block = 0
+
+            if res.status == "success":
+                self._rate_limiter.record_success(endpoint_name, credentials.client_id)
+                data = res.data
+                if not isinstance(data, dict):
+                    raise UnexpectedResponseDataError(
+                        f"Expected response data from endpoint {endpoint_name} to be a dictionary, but got: {data}"
                     )
+                return data
 
-                self._requests_made_with_current_credentials += 1
-                if self._last_credentials_producing_429 and response.status != 429:
-                    self._non_429_requests_made_since_block += 1
+            elif res.status == "credentials_expired":
+                self.logger.info(
+                    f"Access token for endpoint {endpoint_name} expired. Invalidating currently stored access token and retrying..."
+                )
+                pooled.token_manager.invalidate_access_token()
+                return await self._make_request(endpoint_path, params)
 
+            elif res.status == "credentials_blocked":
+                self.logger.error(
+                    f"API credentials for endpoint {endpoint_name} are blocked: {res.error_msg}"
+                )
                 if (
-                    self._non_429_requests_made_since_block
-                    >= PROBABLY_NOT_ACTUALLY_BLOCKED_THRESHOLD
+                    pooled.last_credentials_producing_429
+                    and pooled.non_429_requests_made_since_block
+                    < PROBABLY_NOT_ACTUALLY_BLOCKED_THRESHOLD
                 ):
-                    self.logger.info(
-                        f"Assuming that credentials {self._last_credentials_producing_429} are not blocked anymore after {self._non_429_requests_made_since_block} non-429 requests."
-                    )
-                    self._last_credentials_producing_429 = None
-                    self._non_429_requests_made_since_block = 0
-
-                if res.status == "success":
-                    data = res.data
-                    if not isinstance(data, dict):
-                        raise UnexpectedResponseDataError(
-                            f"Expected response data from endpoint {endpoint_name} to be a dictionary, but got: {data}"
-                        )
-                    return data
-
-                elif res.status == "credentials_expired":
-                    self.logger.info(
-                        f"Access token for endpoint {endpoint_name} expired. Invalidating currently stored access token and retrying..."
+                    raise APIBlockException(
+                        message=f"Got another 429 response after {pooled.non_429_requests_made_since_block} non-429 responses with credentials (refreshed due to earlier 429) -> "
+                        + res.error_msg,
+                        blocked_until=res.blocked_until,
                     )
-                    self._token_manager.invalidate_access_token()
-                    return await self._make_request(endpoint_path, params)
 
-                elif res.status == "credentials_blocked":
-                    self.logger.error(
-                        f"API credentials for endpoint {endpoint_name} are blocked: {res.error_msg}"
-                    )
-                    if (
-                        self._last_credentials_producing_429
-                        and self._non_429_requests_made_since_block
-                        < PROBABLY_NOT_ACTUALLY_BLOCKED_THRESHOLD
-                    ):
-                        raise APIBlockException(
-                            message=f"Got another 429 response after {self._non_429_requests_made_since_block} non-429 responses with credentials (refreshed due to earlier 429) -> "
-                            + res.error_msg,
-                            blocked_until=res.blocked_until,
-                        )
-
-                    self._last_credentials_producing_429 = self._credentials
-                    self._non_429_requests_made_since_block = 0
-
-                    # make sure credentials and associated access token are not used anymore
-                    self._credentials = None  # this will trigger a new credentials fetch on the next request
-                    self._token_manager.invalidate_access_token()
-
-                    # retry the request with new credentials
-                    return await self._make_request(endpoint_path, params)
-
-                elif res.status == "not_found":
-                    self.logger.warning(res.msg)
-                    raise NotFoundError(res.msg)
-
-                elif res.status == "bad_gateway":
-                    self.logger.warning(res.msg)
-
-                    if attempt_number >= MAX_502_ATTEMPTS:
-                        raise ServiceUnavailableError(
-                            f"Request to {endpoint_name} endpoint failed with 502 Bad Gateway error after {MAX_502_ATTEMPTS} attempts."
-                        )
-
-                    timeout = (
-                        self._get_request_timeout(endpoint_name)
-                        or self._default_timeout
-                    )
-                    sleep_time = timeout * attempt_number
-                    self.logger.info(
-                        f"Retrying request to {endpoint_name} endpoint in {sleep_time:.2f} seconds (attempt {attempt_number + 1} of {MAX_502_ATTEMPTS})..."
-                    )
-                    await sleep(timeout**attempt_number)
+                self._rate_limiter.record_rate_limited(
+                    endpoint_name, credentials.client_id, res.retry_after
+                )
 
-                    return await self._make_request(
-                        endpoint_path, params=params, attempt_number=attempt_number + 1
-                    )
+                pooled.last_credentials_producing_429 = credentials
+                pooled.non_429_requests_made_since_block = 0
+
+                # make sure credentials and associated access token are not used anymore
+                # (only if no other request swapped them already; this will trigger a new credentials fetch on the next request)
+                if pooled.credentials is credentials:
+                    pooled.discard_credentials()
 
-                elif res.status == "unexpected-error":
-                    self.logger.error(res.msg)
-                    raise UnexpectedResponseCodeError(
-                        message=f"Unexpected response from Spotify API: {res.msg}",
-                        status_code=res.status_code,
+                # retry the request with new credentials
+                return await self._make_request(endpoint_path, params)
+
+            elif res.status == "not_found":
+                self.logger.warning(res.msg)
+                raise NotFoundError(res.msg)
+
+            elif res.status == "bad_gateway":
+                self.logger.warning(res.msg)
+
+                if attempt_number >= MAX_502_ATTEMPTS:
+                    raise ServiceUnavailableError(
+                        f"Request to {endpoint_name} endpoint failed with 502 Bad Gateway error after {MAX_502_ATTEMPTS} attempts."
                     )
 
-                else:
-                    # static type checkers aren't smart enough to understand that the above conditions cover all possible cases, so we need this as well
-                    raise Exception("Got impossible result")
+                timeout = self._rate_limiter.get_limit(
+                    endpoint_name
+                ).seconds_per_request
+                sleep_time = timeout * attempt_number
+                self.logger.info(
+                    f"Retrying request to {endpoint_name} endpoint in {sleep_time:.2f} seconds (attempt {attempt_number + 1} of {MAX_502_ATTEMPTS})..."
+                )
+                await sleep(timeout**attempt_number)
+
+                return await self._make_request(
+                    endpoint_path, params=params, attempt_number=attempt_number + 1
+                )
+
+            elif res.status == "unexpected-error":
+                self.logger.error(res.msg)
+                raise UnexpectedResponseCodeError(
+                    message=f"Unexpected response from Spotify API: {res.msg}",
+                    status_code=res.status_code,
+                )
+
+            else:
+                # static type checkers aren't smart enough to understand that the above conditions cover all possible cases, so we need this as well
+                raise Exception("Got impossible result")
 
     async def _parse_response(
         self,
@@ -372,11 +492,13 @@ class SpotifyAPIClient:
         """
         if response.status == 429:
             blocked_until: datetime | None = None
+            retry_after_seconds: int | None = None
             retry_after = response.headers.get("Retry-After")
             error_msg = f"Got HTTP error response with code 429 (Too Many Requests) and response body: {await response.text()}"
             if retry_after:
                 try:
                     retry_after = int(retry_after)
+                    retry_after_seconds = retry_after
                     blocked_until = req_meta.received_at + timedelta(
                         seconds=retry_after
                     )
@@ -384,7 +506,9 @@ class SpotifyAPIClient:
                 except ValueError:
                     error_msg = f"Got HTTP error response with code 429 (Too Many Requests) and RETRY-AFTER header value: {retry_after} -> '{endpoint_name}' is blocked."
             return CredentialsBlockedResult(
-                error_msg=error_msg, blocked_until=blocked_until
+                error_msg=error_msg,
+                retry_after=retry_after_seconds,
+                blocked_until=blocked_until,
             )
         elif response.status == 401:
             return CredentialsExpiredResult()
@@ -405,19 +529,100 @@ class SpotifyAPIClient:
         data = await response.json()
         return SuccessResult(data=data)
 
-    def _get_request_timeout(self, endpoint: str) -> float | None:
-        last_relevant_request_at = self._last_request_per_endpoint.get(endpoint)
-        if not last_relevant_request_at:
-            return None
-        earliest_time_for_next_request = last_relevant_request_at + timedelta(
-            seconds=self._timeouts_per_endpoint.get(endpoint, self._default_timeout)
+    async def _fetch_all_pages(
+        self,
+        first_page: dict,
+        fetch_page: Callable[[int], Awaitable[tuple[list, bool]]],
+        limit: int,
+        semaphore: asyncio.Semaphore | None = None,
+        max_offset: int | None = None,
+    ) -> list:
+        """
+        Returns the items of the first page of a paginated response (a Spotify API paging object) followed by the items of all remaining pages, fetched with `fetch_page(offset)` (see `_iter_pages`).
+        """
+        items = []
+        async for page_items in self._iter_pages(
+            first_page, fetch_page, limit, semaphore=semaphore, max_offset=max_offset
+        ):
+            items.extend(page_items)
+        return items
+
+    async def _iter_pages(
+        self,
+        first_page: dict,
+        fetch_page: Callable[[int], Awaitable[tuple[list, bool]]],
+        limit: int,
+        semaphore: asyncio.Semaphore | None = None,
+        max_offset: int | None = None,
+    ) -> AsyncIterator[list]:
+        """
+        Yields the items of the first page of a paginated response (a Spotify API paging object), then the items of each remaining page (fetched with `fetch_page(offset)`) in order.
+
+        As the first page contains the total number of items, the remaining pages are requested concurrently (at most `max_concurrent_pages` at the same time, or fewer if `semaphore` allows fewer).
+        At most `max_concurrent_pages` pages are requested ahead of the page that is yielded next, so pages that have not been consumed yet do not pile up in memory.
+        Pages starting after `max_offset` (if set) are not fetched.
+        """
+        yield list(first_page["items"])
+        if first_page.get("next") is None:
+            return
+
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_concurrent_pages)
+
+        async def fetch(offset: int):
+            async with semaphore:
+                return await fetch_page(offset)
+
+        offset = first_page.get("offset", 0) + first_page.get(
+            "limit", len(first_page["items"])
         )
-        seconds_to_wait = (
-            earliest_time_for_next_request - datetime.now(timezone.utc)
-        ).total_seconds()
-        if seconds_to_wait < 0:
-            return None
-        return seconds_to_wait
+        total = first_page.get("total")
+        offsets = (
+            [
+                page_offset
+                for page_offset in range(offset, total, limit)
+                if max_offset is None or page_offset <= max_offset
+            ]
+            if isinstance(total, int)
+            else []
+        )
+        has_more = True
+        in_flight: deque[asyncio.Task[tuple[list, bool]]] = deque()
+        try:
+            for page_offset in offsets:
+                if len(in_flight) >= self._max_concurrent_pages:
+                    page_items, has_more = await in_flight.popleft()
+                    yield page_items
+                in_flight.append(asyncio.ensure_future(fetch(page_offset)))
+            while in_flight:
+                page_items, has_more = await in_flight.popleft()
+                yield page_items
+        finally:
+            # only relevant if fetching a page failed or the caller stopped iterating early
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        if offsets:
+            offset = offsets[-1] + limit
+
+        # more items may have been added since the first page was fetched (or the total was not known), so continue page by page
+        while has_more and (max_offset is None or offset <= max_offset):
+            page_items, has_more = await fetch(offset)
+            yield page_items
+            offset += limit
+
+    async def _gather_or_cancel[T](self, coros: Sequence[Awaitable[T]]) -> list[T]:
+        """
+        Like `asyncio.gather`, but cancels all other coroutines as soon as one of them fails.
+        """
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
 
     @validate_call
     async def tracks(self, track_ids: Sequence[str], region: Optional[str] = None):
@@ -444,6 +649,30 @@ class SpotifyAPIClient:
         include_compilations=True,
         include_appears_on=True,
     ):
+        raw = await self._artist_albums_raw_page(
+            artist_id,
+            offset=offset,
+            limit=limit,
+            region=region,
+            include_albums=include_albums,
+            include_singles=include_singles,
+            include_compilations=include_compilations,
+            include_appears_on=include_appears_on,
+        )
+        albums = get_list_data_from_response(raw, "items")
+        return albums, raw["next"] != None
+
+    async def _artist_albums_raw_page(
+        self,
+        artist_id: str,
+        offset: int,
+        limit: int,
+        region: Optional[str],
+        include_albums: bool,
+        include_singles: bool,
+        include_compilations: bool,
+        include_appears_on: bool,
+    ) -> dict:
         include_groups: list[str] = []
         if include_albums:
             include_groups.append("album")
@@ -463,8 +692,7 @@ class SpotifyAPIClient:
                 "market": region,
             },
         )
-        albums = get_list_data_from_response(raw, "items")
-        return albums, raw["next"] != None
+        return raw
 
     @validate_call
     async def artist_albums(
@@ -477,22 +705,65 @@ class SpotifyAPIClient:
         region: Optional[str] = None,
         max_offset: int | None = None,
     ):
+        """
+        Fetches all albums of the given artist. If `max_offset` is set, pages starting after `max_offset` are not fetched.
+        """
         albums: list[Optional[Dict]] = []
-        next_page = True
-        offset = 0
-        while (max_offset and max_offset < offset) or next_page:
-            page, next_page = await self.artist_albums_page(
+        async for page in self.artist_album_pages(
+            artist_id,
+            include_albums=include_albums,
+            include_singles=include_singles,
+            include_compilations=include_compilations,
+            include_appears_on=include_appears_on,
+            region=region,
+            max_offset=max_offset,
+        ):
+            albums.extend(page)
+        return albums
+
+    async def artist_album_pages(
+        self,
+        artist_id: str,
+        include_albums: bool,
+        include_singles: bool,
+        include_compilations: bool,
+        include_appears_on: bool,
+        region: Optional[str] = None,
+        max_offset: int | None = None,
+    ) -> AsyncIterator[list[Optional[Dict]]]:
+        """
+        Like `artist_albums`, but yields the albums page by page as they arrive instead of collecting all of them first.
+        """
+        limit = 50
+
+        async def fetch_page(offset: int):
+            return await self.artist_albums_page(
                 artist_id,
                 offset,
+                limit=limit,
                 include_albums=include_albums,
                 include_singles=include_singles,
                 include_compilations=include_compilations,
                 include_appears_on=include_appears_on,
                 region=region,
             )
-            albums.extend(page)
-            offset += len(page)
-        return albums
+
+        first_page = await self._artist_albums_raw_page(
+            artist_id,
+            offset=0,
+            limit=limit,
+            region=region,
+            include_albums=include_albums,
+            include_singles=include_singles,
+            include_compilations=include_compilations,
+            include_appears_on=include_appears_on,
+        )
+        # raises if the items of the first page are not valid (the other pages are validated in `artist_albums_page`)
+        get_list_data_from_response(first_page, "items")
+        async for page in self._iter_pages(
+            first_page, fetch_page, limit=limit, max_offset=max_offset
+        ):
+            yield page
 
     @validate_call
     async def albums(self, album_ids: Sequence[str], region: Optional[str] = None):
@@ -506,24 +777,26 @@ class SpotifyAPIClient:
         # instead of just that first page with the pagination info (e.g. `next`, `offset`, `total`, etc.),
         # we would like to have the full list of tracks for each album under the `tracks` key
         # To achieve this, we need to fetch the full list of tracks w/ pagination and finally replace the `tracks` key in each album with that full list
-        for album in albums:
-            # skip over album IDs that returned no results
-            if album is None:
-                continue
-            tracks_page = album["tracks"]
-            tracks = tracks_page["items"]
-            more_tracks_to_fetch = tracks_page["next"] != None
-            offset = 0
+        # the remaining pages of all albums are fetched concurrently, sharing one limit for the number of pages fetched at the same time
+        pages_semaphore = asyncio.Semaphore(self._max_concurrent_pages)
+
+        async def fetch_tracks(album: dict):
             limit = 50  # up to 50 tracks can be returned per page
-            while more_tracks_to_fetch:
-                offset += limit
-                tracks_in_page, more_tracks_to_fetch = await self.album_tracks_page(
+
+            async def fetch_page(offset: int):
+                return await self.album_tracks_page(
                     album["id"], offset=offset, limit=limit, region=region
                 )
-                tracks.extend(tracks_in_page)
 
             # replace the original content of the `tracks` key with the full list of tracks
-            album["tracks"] = tracks
+            album["tracks"] = await self._fetch_all_pages(
+                album["tracks"], fetch_page, limit=limit, semaphore=pages_semaphore
+            )
+
+        # skip over album IDs that returned no results
+        await self._gather_or_cancel(
+            [fetch_tracks(album) for album in albums if album is not None]
+        )
 
         return albums
 
@@ -560,24 +833,41 @@ class SpotifyAPIClient:
         ), f"Expected playlist to be a dictionary, but got: {raw}"
 
         # tracks are returned in pages of 100, so we need to fetch all pages to get all tracks
-        tracks_page = raw["tracks"]
-        # store the first page of tracks; we will extend this as needed
-        tracks = tracks_page["items"]
-        more_tracks_to_fetch = tracks_page["next"] != None
         limit = 100  # up to 100 tracks can be returned per page
-        offset = 0
-        while more_tracks_to_fetch:
-            offset += limit
-            tracks_in_page, more_tracks_to_fetch = await self.playlist_tracks_page(
+
+        async def fetch_page(offset: int):
+            return await self.playlist_tracks_page(
                 playlist_id, offset=offset, limit=limit
             )
-            tracks.extend(tracks_in_page)
 
         # replace the original content of the `tracks` key with the full list of tracks
-        raw["tracks"] = tracks
+        raw["tracks"] = await self._fetch_all_pages(
+            raw["tracks"], fetch_page, limit=limit
+        )
 
         return raw
 
+    async def playlist_track_pages(
+        self, playlist_id: str
+    ) -> AsyncIterator[list[Optional[Dict]]]:
+        """
+        Yields the tracks of the given playlist page by page as they arrive, instead of collecting all of them first (as `playlist` does). The other playlist metadata is not fetched.
+        """
+        limit = 100  # up to 100 tracks can be returned per page
+
+        async def fetch_page(offset: int):
+            return await self.playlist_tracks_page(
+                playlist_id, offset=offset, limit=limit
+            )
+
+        first_page = await self._make_request(
+            f"playlists/{playlist_id}/tracks", params={"offset": 0, "limit": limit}
+        )
+        # raises if the items of the first page are not valid (the other pages are validated in `playlist_tracks_page`)
+        get_list_data_from_response(first_page, "items")
+        async for page in self._iter_pages(first_page, fetch_page, limit=limit):
+            yield page
+
     @validate_call
     async def search_tracks_for_isrc(
         self, isrc: str, region: Optional[str] = None, offset: int = 0
@@ -0,0 +1,72 @@
+import asyncio
+from dataclasses import dataclass, field
+import random
+
+from app.utils.spotify_api.models import SpotifyAPICredentials
+from app.utils.spotify_api.token_manager import SpotifyAPIAccessTokenManager
+
+
+def _random_max_requests() -> int:
+    return random.randint(2000, 3000)
+
+
+@dataclass(eq=False)
+class PooledCredentials:
+    """
+    One of the sets of credentials the Spotify API client uses at the same time (see `SpotifyAPIClient`). Each set has its own access token and rate budget.
+
+    Whenever the credentials are swapped out (after `max_requests` requests or after a 429 response), new credentials are fetched from the credentials API for this set.
+    """
+
+    token_manager: SpotifyAPIAccessTokenManager = field(init=False)
+
+    credentials: SpotifyAPICredentials | None = None
+    """
+    The credentials currently in use (`None` if new credentials have to be fetched before the next request).
+    """
+
+    requests_made: int = 0
+    """
+    The number of requests made with the current credentials.
+    """
+
+    max_requests: int = field(default_factory=_random_max_requests)
+    """
+    A non-negative integer specifying the maximum number of requests that can be made with the current credentials before they are swapped out for new ones.
+
+    This should preferrably be a not too big, random number, so that it shouldn't be as likely to get blocked by Spotify (assumption: the more regular things look, the more likely we are to get blocked).
+    """
+
+    last_credentials_producing_429: SpotifyAPICredentials | None = None
+    """
+    Credentials that were used right before switching to new credentials due to receiving a 429 Too Many Requests response from the Spotify API.
+    Only != None after receiving a 429 response, up until PROBABLY_NOT_ACTUALLY_BLOCKED_THRESHOLD requests with non-429 response have been made with the new credentials.
+    """
+
+    non_429_requests_made_since_block: int = 0
+    """
+    A non-negative integer specifying the number of requests made since the last time the credentials were blocked
+    Only relevant if last_credentials_producing_429 is not None
+    """
+
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    """
+    Held while new credentials are fetched, so that concurrent requests do not fetch credentials for the same set more than once.
+    """
+
+    @property
+    def needs_new_credentials(self) -> bool:
+        return self.credentials is None or self.requests_made >= self.max_requests
+
+    def set_credentials(self, credentials: SpotifyAPICredentials):
+        self.credentials = credentials
+        self.token_manager.invalidate_access_token()
+        self.requests_made = 0
+        self.max_requests = _random_max_requests()
+
+    def discard_credentials(self):
+        """
+        Makes sure that the current credentials and the associated access token are not used anymore (new credentials are fetched before the next request).
+        """
+        self.credentials = None
+        self.token_manager.invalidate_access_token()
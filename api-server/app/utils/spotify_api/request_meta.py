@@ -1,17 +1,17 @@
+import asyncio
 from asyncio import sleep
+from dataclasses import dataclass
 from datetime import datetime
+from logging import Logger
+import random
+import sqlite3
 from pydantic import BaseModel
 import aiohttp
 
-from app.config import settings
+from app.config import app_logger, settings
+from app.utils.http import HTTPSessionManager
 from app.utils.spotify_api.models import SpotifyAPICredentials
 
-MAX_RETRIES = 4
-"""
-The maximum number of retries for reporting request meta if the initial attempt fails for any reason.
-"""
-
-
 class SpotifyAPIRequestMeta(BaseModel):
     url: str
     status_code: int
@@ -23,41 +23,284 @@ class SpotifyAPIRequestMeta(BaseModel):
 
 async def _make_request_meta_reporting_request(
     meta: SpotifyAPIRequestMeta,
+    session: aiohttp.ClientSession,
+    credentials_api_url: str = settings.credentials_api_url,
 ):
-    url = f"{settings.credentials_api_url}/spotify/request-meta"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, json=meta.model_dump(mode="json")) as response:
-                response.raise_for_status()
-        except aiohttp.ClientResponseError as e:
-            raise RuntimeError(
-                f"Failed to report request meta: {e.status} - {e.message}"
-            ) from e
-        except Exception as e:
-            raise RuntimeError(
-                f"Unexpected error while reporting request meta: {e}"
-            ) from e
-
-
-async def report_request_meta(request_meta: SpotifyAPIRequestMeta):
-    meta = SpotifyAPIRequestMeta(
-        url=request_meta.url,
-        status_code=request_meta.status_code,
-        sent_at=request_meta.sent_at,
-        received_at=request_meta.received_at,
-        ip=request_meta.ip,
-        credentials=request_meta.credentials,
-    )
-    failed_attempts = 0
-    while failed_attempts < MAX_RETRIES:
+    url = f"{credentials_api_url}/spotify/request-meta"
+    try:
+        async with session.post(url, json=meta.model_dump(mode="json")) as response:
+            response.raise_for_status()
+    except aiohttp.ClientResponseError as e:
+        raise RuntimeError(
+            f"Failed to report request meta: {e.status} - {e.message}"
+        ) from e
+    except Exception as e:
+        raise RuntimeError(f"Unexpected error while reporting request meta: {e}") from e
+
+
+BULK_ENDPOINT_UNSUPPORTED_STATUS_CODES = {404, 405, 501}
+"""
+Status codes returned by credentials APIs that do not provide the bulk request meta endpoint (yet). Request meta is then reported item by item instead.
+"""
+
+
+@dataclass(eq=False)
+class _QueuedRequestMeta:
+    meta: SpotifyAPIRequestMeta
+
+    spool_id: int | None = None
+    """
+    The ID of the request meta in the spool (`None` if it is only kept in memory).
+    """
+
+
+class RequestMetaReporter:
+    """
+    Reports the metadata of requests to the Spotify API to the credentials API in the background, so that requests do not have to wait for the credentials API.
+
+    Request meta is collected in a bounded in-memory buffer and sent in batches to the bulk endpoint of the credentials API (falling back to reporting each item individually if the bulk endpoint is not available).
+    Request meta that has to be delivered (any request that did not succeed) as well as request meta that does not fit into the buffer or could not be sent is stored in a spool (a small SQLite DB) right away; the spool is sent again after a restart.
+    Failed batches are retried with exponential backoff until they are delivered.
+    """
+
+    def __init__(
+        self,
+        credentials_api_url: str,
+        http_session_manager: HTTPSessionManager,
+        spool_path: str,
+        batch_size: int = 100,
+        max_buffered: int = 1000,
+        flush_interval_seconds: float = 1,
+        max_retry_delay_seconds: float = 60,
+        logger: Logger = app_logger,
+    ):
+        if batch_size < 1:
+            raise ValueError("Batch size must be at least 1.")
+
+        self._credentials_api_url = credentials_api_url
+        self._http_session_manager = http_session_manager
+
+        self._spool_path = spool_path
+        """
+        The path to the SQLite DB that stores request meta that has not been reported yet.
+        """
+
+        self._batch_size = batch_size
+        """
+        The maximum number of request meta items sent to the credentials API at once.
+        """
+
+        self._max_buffered = max_buffered
+        """
+        The maximum number of request meta items kept in memory. Any further request meta is stored in the spool until it is sent.
+        """
+
+        self._flush_interval_seconds = flush_interval_seconds
+        """
+        The maximum time (in seconds) request meta is kept in the buffer before it is sent (if there are less than `batch_size` items).
+        """
+
+        self._max_retry_delay_seconds = max_retry_delay_seconds
+        self._logger = logger
+
+        self._conn: sqlite3.Connection | None = None
+        """
+        The connection to the spool (opened on first use).
+        """
+
+        self._buffer: list[SpotifyAPIRequestMeta] = []
+        """
+        Request meta that is not stored in the spool, in the order it was reported.
+        """
+
+        self._spooled_count = 0
+        """
+        The number of request meta items in the spool.
+        """
+
+        self._bulk_endpoint_available = True
+
+        self._worker: asyncio.Task | None = None
+
+        self._wakeup = asyncio.Event()
+        """
+        Set once a full batch of request meta is waiting to be sent.
+        """
+
+    def start(self):
+        """
+        Starts reporting request meta in the background (including request meta left in the spool from previous runs).
+        """
+        conn = self._get_conn()
+        (self._spooled_count,) = conn.execute(
+            "SELECT COUNT(*) FROM request_meta"
+        ).fetchone()
+        if self._spooled_count:
+            self._logger.info(
+                f"Reporting {self._spooled_count} spooled request meta items"
+            )
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self, timeout_seconds: float = 10):
+        """
+        Stops reporting in the background and tries to send all request meta that has not been reported yet (for at most `timeout_seconds`).
+        Anything that could not be sent is stored in the spool and reported after the next `start()`.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
         try:
-            await _make_request_meta_reporting_request(meta)
+            await asyncio.wait_for(self._flush(), timeout_seconds)
+        except Exception:
+            self._logger.exception(
+                f"Failed to report {self.pending_count} request meta items before shutting down, keeping them in the spool"
+            )
+        self._spool(self._buffer)
+        self._buffer = []
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @property
+    def pending_count(self) -> int:
+        """
+        The number of request meta items that have not been reported yet.
+        """
+        return len(self._buffer) + self._spooled_count
+
+    def report(self, meta: SpotifyAPIRequestMeta):
+        """
+        Queues request meta for reporting. Request meta of requests that did not succeed is stored in the spool before this returns, so it is reported even if the server stops before it could be sent.
+        """
+        if meta.status_code != 200 or len(self._buffer) >= self._max_buffered:
+            self._spool([meta])
+        else:
+            self._buffer.append(meta)
+        if self.pending_count >= self._batch_size:
+            self._wakeup.set()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self._spool_path)
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS request_meta (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      data TEXT NOT NULL
+                    )
+                    """)
+            self._conn = conn
+        return self._conn
+
+    def _spool(self, metas: list[SpotifyAPIRequestMeta]):
+        if not metas:
+            return
+        conn = self._get_conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO request_meta (data) VALUES (?)",
+                [(meta.model_dump_json(),) for meta in metas],
+            )
+        self._spooled_count += len(metas)
+
+    def _remove_from_spool(self, items: list[_QueuedRequestMeta]):
+        spool_ids = [(item.spool_id,) for item in items if item.spool_id is not None]
+        if not spool_ids:
             return
-        except RuntimeError as e:
-            failed_attempts += 1
-            if failed_attempts >= MAX_RETRIES:
-                raise RuntimeError(
-                    f"Failed to report request meta after {MAX_RETRIES} attempts: {e}"
-                ) from e
-            # Exponential backoff before retrying
-            await sleep(2**failed_attempts)
+        conn = self._get_conn()
+        with conn:
+            conn.executemany("DELETE FROM request_meta WHERE id = ?", spool_ids)
+        self._spooled_count -= len(spool_ids)
+
+    def _next_batch(self) -> list[_QueuedRequestMeta]:
+        """
+        Returns the next batch of request meta to send (spooled request meta first). Request meta taken from the buffer is removed from it.
+        """
+        batch = [
+            _QueuedRequestMeta(
+                meta=SpotifyAPIRequestMeta.model_validate_json(data), spool_id=spool_id
+            )
+            for spool_id, data in self._get_conn().execute(
+                "SELECT id, data FROM request_meta ORDER BY id LIMIT ?",
+                (self._batch_size,),
+            )
+        ]
+        buffered = self._buffer[: self._batch_size - len(batch)]
+        del self._buffer[: len(buffered)]
+        batch.extend(_QueuedRequestMeta(meta=meta) for meta in buffered)
+        return batch
+
+    async def _run(self):
+        failed_attempts = 0
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self._flush_interval_seconds
+                )
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._flush()
+                failed_attempts = 0
+            except Exception:
+                failed_attempts += 1
+                # exponential backoff with jitter
+                delay = min(
+                    self._max_retry_delay_seconds, 2**failed_attempts
+                ) * random.uniform(0.5, 1)
+                self._logger.exception(
+                    f"Failed to report request meta ({self.pending_count} items pending, attempt {failed_attempts}), retrying in {delay:.0f}s"
+                )
+                await sleep(delay)
+
+    async def _flush(self):
+        """
+        Sends all pending request meta in batches. If sending fails, request meta taken from the buffer that was not delivered is stored in the spool.
+        """
+        while batch := self._next_batch():
+            delivered: list[_QueuedRequestMeta] = []
+            try:
+                await self._send_batch(batch, delivered)
+            except BaseException:
+                self._remove_from_spool(delivered)
+                self._spool(
+                    [
+                        item.meta
+                        for item in batch
+                        if item.spool_id is None and item not in delivered
+                    ]
+                )
+                raise
+            self._remove_from_spool(batch)
+
+    async def _send_batch(
+        self, batch: list[_QueuedRequestMeta], delivered: list[_QueuedRequestMeta]
+    ):
+        session = await self._http_session_manager.get_session()
+        if self._bulk_endpoint_available:
+            url = f"{self._credentials_api_url}/spotify/request-meta/bulk"
+            try:
+                async with session.post(
+                    url, json=[item.meta.model_dump(mode="json") for item in batch]
+                ) as response:
+                    response.raise_for_status()
+                delivered.extend(batch)
+                return
+            except aiohttp.ClientResponseError as e:
+                if e.status not in BULK_ENDPOINT_UNSUPPORTED_STATUS_CODES:
+                    raise RuntimeError(
+                        f"Failed to report request meta: {e.status} - {e.message}"
+                    ) from e
+                self._logger.warning(
+                    f"Credentials API does not support reporting request meta in bulk ({e.status}), reporting request meta item by item"
+                )
+                self._bulk_endpoint_available = False
+
+        for item in batch:
+            await _make_request_meta_reporting_request(
+                item.meta, session, self._credentials_api_url
+            )
+            delivered.append(item)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import tempfile
+import pytest
+
+from app.utils.http import HTTPSessionManager
+from app.utils.rate_limiting import RateLimit, RateLimiter
+from app.utils.spotify_api.client import SpotifyAPIClient
+from app.utils.spotify_api.models import SpotifyAPICredentials
+from app.utils.spotify_api.request_meta import RequestMetaReporter
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+@pytest.mark.asyncio
+async def test_client_dispatches_requests_across_credential_pool(temp_dir):
+    http_session_manager = HTTPSessionManager()
+    client = SpotifyAPIClient(
+        credentials_api_url="http://localhost",
+        logger=logging.getLogger("test"),
+        http_session_manager=http_session_manager,
+        request_meta_reporter=RequestMetaReporter(
+            credentials_api_url="http://localhost",
+            http_session_manager=http_session_manager,
+            spool_path=f"{temp_dir}/spool.db",
+        ),
+        rate_limiter=RateLimiter(default_limit=RateLimit(requests_per_minute=1)),
+        credential_pool_size=2,
+    )
+    fetched = 0
+
+    async def fetch_credentials():
+        nonlocal fetched
+        fetched += 1
+        await asyncio.sleep(0.01)
+        return SpotifyAPICredentials(client_id=f"client-{fetched}", client_secret="")
+
+    client._fetch_credentials = fetch_credentials
+
+    pooled_credentials = []
+    for _ in range(2):
+        pooled = client._choose_credentials("tracks")
+        # concurrent requests with the same set of credentials fetch credentials only once
+        credentials = await asyncio.gather(
+            *(client._get_credentials(pooled) for _ in range(3))
+        )
+        assert len({c.client_id for c in credentials}) == 1
+        # uses up the rate budget of these credentials, so the other set is chosen next
+        await client._rate_limiter.acquire("tracks", credentials[0].client_id)
+        pooled_credentials.append(pooled)
+
+    assert fetched == 2
+    assert pooled_credentials[0] is not pooled_credentials[1]
+    # other endpoints have their own budget
+    assert client._choose_credentials("artists") is pooled_credentials[0]
+
+
+@pytest.mark.asyncio
+async def test_playlist_pages_are_fetched_concurrently_in_order(temp_dir):
+    http_session_manager = HTTPSessionManager()
+    client = SpotifyAPIClient(
+        credentials_api_url="http://localhost",
+        logger=logging.getLogger("test"),
+        http_session_manager=http_session_manager,
+        request_meta_reporter=RequestMetaReporter(
+            credentials_api_url="http://localhost",
+            http_session_manager=http_session_manager,
+            spool_path=f"{temp_dir}/spool.db",
+        ),
+        max_concurrent_pages=3,
+    )
+    total = 950
+    playlist_id = "37i9dQZF1DXcBWIGoYBM5M"
+    concurrent_requests = 0
+    max_concurrent_requests = 0
+
+    def tracks_page(offset: int, limit: int):
+        return {
+            "items": [{"id": i} for i in range(offset, min(offset + limit, total))],
+            "offset": offset,
+            "limit": limit,
+            "total": total,
+            "next": "next" if offset + limit < total else None,
+        }
+
+    async def make_request(endpoint_path: str, params: dict | None = None):
+        nonlocal concurrent_requests, max_concurrent_requests
+        concurrent_requests += 1
+        max_concurrent_requests = max(max_concurrent_requests, concurrent_requests)
+        # later pages arrive first
+        await asyncio.sleep(0.01 * (10 - (params or {}).get("offset", 0) // 100))
+        concurrent_requests -= 1
+        if endpoint_path == f"playlists/{playlist_id}":
+            return {"id": playlist_id, "tracks": tracks_page(0, 100)}
+        assert params is not None
+        return tracks_page(params["offset"], params["limit"])
+
+    client._make_request = make_request
+
+    playlist = await client.playlist(playlist_id)
+    assert [track["id"] for track in playlist["tracks"]] == list(range(total))
+    assert max_concurrent_requests == 3
@@ -0,0 +1,99 @@
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.utils.http import HTTPSessionManager
+from app.utils.spotify_api.models import SpotifyAPICredentials
+from app.utils.spotify_api.request_meta import (
+    RequestMetaReporter,
+    SpotifyAPIRequestMeta,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+def create_meta(i: int, status_code: int = 200) -> SpotifyAPIRequestMeta:
+    now = datetime.now(timezone.utc)
+    return SpotifyAPIRequestMeta(
+        url=f"https://api.spotify.com/v1/tracks/{i}",
+        status_code=status_code,
+        sent_at=now,
+        received_at=now,
+        ip="127.0.0.1",
+        credentials=SpotifyAPICredentials(client_id="id", client_secret="secret"),
+    )
+
+
+def spooled_count(spool_path: str) -> int:
+    with sqlite3.connect(spool_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM request_meta").fetchone()[0]
+
+
+@pytest.mark.asyncio
+async def test_request_meta_is_spooled_and_reported_after_restart(temp_dir):
+    reported_urls: list[str] = []
+    bulk_requests = 0
+    available = False
+
+    async def report(request: web.Request):
+        if not available:
+            return web.Response(status=503)
+        reported_urls.append((await request.json())["url"])
+        return web.Response()
+
+    async def report_bulk(request: web.Request):
+        nonlocal bulk_requests
+        bulk_requests += 1
+        return web.Response(status=404)
+
+    app = web.Application()
+    app.router.add_post("/spotify/request-meta", report)
+    app.router.add_post("/spotify/request-meta/bulk", report_bulk)
+    spool_path = f"{temp_dir}/spool.db"
+
+    async with TestServer(app) as server:
+        url = str(server.make_url("")).rstrip("/")
+        http_session_manager = HTTPSessionManager()
+
+        reporter = RequestMetaReporter(
+            credentials_api_url=url,
+            http_session_manager=http_session_manager,
+            spool_path=spool_path,
+            batch_size=2,
+            flush_interval_seconds=60,
+        )
+        reporter.report(create_meta(0))
+        # must be on disk right away
+        reporter.report(create_meta(1, status_code=429))
+        assert spooled_count(spool_path) == 1
+        # the credentials API is not available, so everything ends up in the spool
+        await reporter.close(timeout_seconds=1)
+        assert spooled_count(spool_path) == 2
+        assert reported_urls == []
+
+        available = True
+        reporter = RequestMetaReporter(
+            credentials_api_url=url,
+            http_session_manager=http_session_manager,
+            spool_path=spool_path,
+            batch_size=2,
+            flush_interval_seconds=60,
+        )
+        reporter.start()
+        reporter.report(create_meta(2))
+        await reporter.close()
+        await http_session_manager.close()
+
+    # each reporter falls back to reporting item by item once the bulk endpoint turns out to be missing
+    assert bulk_requests == 2
+    assert sorted(reported_urls) == [
+        f"https://api.spotify.com/v1/tracks/{i}" for i in range(3)
+    ]
+    assert spooled_count(spool_path) == 0
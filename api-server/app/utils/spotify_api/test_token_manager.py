@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from app.utils.http import HTTPSessionManager
+from app.utils.spotify_api.models import SpotifyAPICredentials
+from app.utils.spotify_api.token_manager import SpotifyAPIAccessTokenManager
+
+
+async def get_credentials():
+    return SpotifyAPICredentials(client_id="id", client_secret="secret")
+
+
+@pytest.mark.asyncio
+async def test_access_token_is_fetched_once_and_refreshed_in_background():
+    token_manager = SpotifyAPIAccessTokenManager(get_credentials, HTTPSessionManager())
+    fetched = 0
+
+    async def fetch_access_token(generation: int) -> str:
+        nonlocal fetched
+        fetched += 1
+        await asyncio.sleep(0.01)
+        token = f"token-{fetched}"
+        token_manager._token = token
+        # expires soon enough to be refreshed in the background on the next access
+        token_manager._token_expires_at = datetime.now(timezone.utc) + timedelta(
+            seconds=120
+        )
+        return token
+
+    token_manager._fetch_access_token = fetch_access_token
+
+    tokens = await asyncio.gather(*(token_manager.access_token for _ in range(10)))
+    assert tokens == ["token-1"] * 10
+    assert fetched == 1
+
+    # still valid, so it is returned right away while a new one is fetched
+    assert await token_manager.access_token == "token-1"
+    assert await token_manager.access_token == "token-1"
+    await asyncio.sleep(0.05)
+    assert fetched == 2
+    assert token_manager._token == "token-2"
+    await token_manager.close()
@@ -1,22 +1,56 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 from base64 import b64encode
+from logging import Logger
 from typing import Awaitable, Callable
+from app.utils.http import HTTPSessionManager
 from app.utils.spotify_api.models import SpotifyAPICredentials
-import aiohttp
+
+TOKEN_EXPIRY_MARGIN = timedelta(seconds=60)
+"""
+Access tokens are not used anymore if they expire within this time.
+"""
+
+PROACTIVE_REFRESH_MARGIN = timedelta(seconds=300)
+"""
+If the access token is used within this time before it expires, a new one is fetched in the background (so that requests do not have to wait for it once the current one expires).
+"""
 
 
 class SpotifyAPIAccessTokenManager:
     """
     Makes sure that the access token for the Spotify API is always up-to-date and valid.
+
+    Only one access token is fetched at a time: callers that need a new token while one is being fetched wait for (and share) the result.
     """
 
     _token: str | None = None
     _token_expires_at: datetime = datetime.now(timezone.utc)
 
     def __init__(
-        self, credential_getter: Callable[[], Awaitable[SpotifyAPICredentials]]
+        self,
+        credential_getter: Callable[[], Awaitable[SpotifyAPICredentials]],
+        http_session_manager: HTTPSessionManager,
+        logger: Logger | None = None,
     ):
         self._get_credentials = credential_getter
+        self._http_session_manager = http_session_manager
+        self._logger = logger
+
+        self._refresh_task: asyncio.Task[str] | None = None
+        """
+        The task fetching a new access token (if one is being fetched).
+        """
+
+        self._generation = 0
+        """
+        Incremented whenever the access token is invalidated, so that tokens fetched before are not stored.
+        """
+
+        self._refresh_generation = 0
+        """
+        The value of `_generation` when `_refresh_task` was started.
+        """
 
     def invalidate_access_token(self):
         """
@@ -25,6 +59,16 @@ class SpotifyAPIAccessTokenManager:
         """
         self._token = None
         self._token_expires_at = datetime.now(timezone.utc)
+        self._generation += 1
+
+    async def close(self):
+        """
+        Stops fetching an access token in the background (if one is being fetched).
+        """
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
 
     @property
     async def access_token(self) -> str:
@@ -32,11 +76,35 @@ class SpotifyAPIAccessTokenManager:
         Get an access token from the Spotify API using the specified client ID and secret
         (i.e. with the ['client credentials' flow](https://developer.spotify.com/documentation/web-api/tutorials/client-credentials-flow)).
         """
-        if self._token and self._token_expires_at > (
-            datetime.now(timezone.utc) + timedelta(seconds=60)
-        ):
+        now = datetime.now(timezone.utc)
+        if self._token and self._token_expires_at > now + TOKEN_EXPIRY_MARGIN:
+            if self._token_expires_at <= now + PROACTIVE_REFRESH_MARGIN:
+                self._start_refresh()
             return self._token
 
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task[str]:
+        if (
+            self._refresh_task is None
+            or self._refresh_task.done()
+            or self._refresh_generation != self._generation
+        ):
+            self._refresh_generation = self._generation
+            self._refresh_task = asyncio.create_task(
+                self._fetch_access_token(self._generation)
+            )
+            self._refresh_task.add_done_callback(self._on_refresh_done)
+        return self._refresh_task
+
+    def _on_refresh_done(self, task: asyncio.Task[str]):
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None and self._logger is not None:
+            self._logger.warning(f"Failed to fetch Spotify API access token: {e}")
+
+    async def _fetch_access_token(self, generation: int) -> str:
         url: str = "https://accounts.spotify.com/api/token"
         creds = await self._get_credentials()
         headers: dict = {
@@ -44,17 +112,19 @@ class SpotifyAPIAccessTokenManager:
             "Authorization": f"Basic {b64encode(f'{creds.client_id}:{creds.client_secret}'.encode()).decode()}",
         }
         data: dict = {"grant_type": "client_credentials"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, data=data) as response:
-                response.raise_for_status()
-                resp_json = await response.json()
-                token = resp_json["access_token"]
-                expires_in = resp_json["expires_in"]
-                assert isinstance(
-                    token, str
-                ), f"Expected access token to be a string, but got: {token}"
+        session = await self._http_session_manager.get_session()
+        async with session.post(url, headers=headers, data=data) as response:
+            response.raise_for_status()
+            resp_json = await response.json()
+            token = resp_json["access_token"]
+            expires_in = resp_json["expires_in"]
+            assert isinstance(
+                token, str
+            ), f"Expected access token to be a string, but got: {token}"
+            # the token may have been invalidated (e.g. because the credentials were swapped) while it was fetched
+            if generation == self._generation:
                 self._token = token
                 self._token_expires_at = datetime.now(timezone.utc) + timedelta(
                     seconds=expires_in
                 )
-                return token
+            return token
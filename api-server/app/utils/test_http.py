@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+
+from app.utils.http import HTTPSessionManager
+
+
+@pytest.mark.asyncio
+async def test_http_session_manager_reuses_session():
+    manager = HTTPSessionManager()
+    sessions = await asyncio.gather(*[manager.get_session() for _ in range(5)])
+    # concurrent callers get the same session
+    assert all(session is sessions[0] for session in sessions)
+    assert await manager.get_session() is sessions[0]
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_http_session_manager_recreates_closed_session():
+    manager = HTTPSessionManager()
+    session = await manager.get_session()
+    await session.close()
+    new_session = await manager.get_session()
+    assert new_session is not session and not new_session.closed
+
+    await manager.close()
+    assert new_session.closed
+    # a new session is created after the manager was closed as well
+    reopened_session = await manager.get_session()
+    assert reopened_session is not new_session and not reopened_session.closed
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_http_session_manager_close_is_idempotent():
+    manager = HTTPSessionManager()
+    # closing a manager that never created a session does nothing
+    await manager.close()
+    await manager.start()
+    session = await manager.get_session()
+    await manager.close()
+    await manager.close()
+    assert session.closed
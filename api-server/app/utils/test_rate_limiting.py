@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+import pytest
+
+from app.utils.rate_limiting import AdaptiveRateLimiter, RateLimit, RateLimiter
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_allows_burst_then_spaces_out_requests_in_order():
+    limiter = RateLimiter(
+        default_limit=RateLimit(requests_per_minute=6000),
+        endpoint_limits={"search": RateLimit(requests_per_minute=1200, burst=3)},
+    )
+    started_at = time.monotonic()
+    acquired: list[tuple[int, float]] = []
+
+    async def acquire(i: int):
+        await limiter.acquire("search", "client-1")
+        acquired.append((i, time.monotonic() - started_at))
+
+    await asyncio.gather(*(acquire(i) for i in range(7)))
+
+    # requests acquire tokens in the order they asked for them
+    assert [i for i, _ in acquired] == list(range(7))
+    # the first 3 requests do not have to wait, the others are spaced out by 50ms
+    assert acquired[2][1] < 0.03
+    assert 0.19 <= acquired[6][1] < 0.3
+
+    # other credentials and endpoints have their own buckets
+    started_at = time.monotonic()
+    await limiter.acquire("search", "client-2")
+    await limiter.acquire("tracks", "client-1")
+    assert time.monotonic() - started_at < 0.03
+
+
+def test_adaptive_rate_limiter_learns_and_persists_rates(tmp_path):
+    state_path = str(tmp_path / "rates.json")
+    logger = logging.getLogger("test")
+
+    def create_limiter():
+        return AdaptiveRateLimiter(
+            default_limit=RateLimit(requests_per_minute=10),
+            state_path=state_path,
+            logger=logger,
+            max_requests_per_minute=12,
+            increase_per_minute=10,
+        )
+
+    limiter = create_limiter()
+    for _ in range(5):
+        limiter.record_success("tracks", "client-1")
+    # +10 requests per minute per minute at 10+ requests per minute -> +1 per success, capped at the maximum
+    assert limiter.get_limit("tracks").requests_per_minute == 12
+
+    limiter.record_rate_limited("tracks", "client-1", retry_after_seconds=30)
+    # requests that were in flight when the first one was rejected do not decrease the rate again
+    limiter.record_rate_limited("tracks", "client-1", retry_after_seconds=30)
+    assert limiter.get_limit("tracks").requests_per_minute == 6
+    assert limiter.get_bucket("tracks", "client-1").reserve() > 29
+    # the bucket has to delay requests, so it is kept even if the credentials are swapped
+    limiter.remove_key("client-1")
+    assert limiter.get_bucket("tracks", "client-1").reserve() > 29
+    limiter.close()
+
+    limiter = create_limiter()
+    assert limiter.get_limit("tracks").requests_per_minute == 6
+    assert limiter.get_limit("albums").requests_per_minute == 10
+
+
+def test_adaptive_rate_limiter_increase_does_not_depend_on_number_of_keys(tmp_path):
+    limiter = AdaptiveRateLimiter(
+        default_limit=RateLimit(requests_per_minute=10),
+        state_path=str(tmp_path / "rates.json"),
+        logger=logging.getLogger("test"),
+        increase_per_minute=10,
+    )
+    limiter.get_bucket("tracks", "client-1")
+    limiter.get_bucket("tracks", "client-2")
+    # with two keys, twice as many requests succeed per minute at the same rate
+    for _ in range(2):
+        limiter.record_success("tracks", "client-1")
+    assert limiter.get_limit("tracks").requests_per_minute == pytest.approx(
+        11, rel=0.01
+    )
+    limiter.close()
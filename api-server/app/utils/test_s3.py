@@ -0,0 +1,103 @@
+import os
+import socket
+import tempfile
+import aioboto3
+import boto3
+import pytest
+from moto.server import ThreadedMotoServer
+
+import app.utils.s3 as s3
+from app.utils.s3 import MultipartUploadState, S3ClientManager, upload_file
+
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def s3_endpoint_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_client_manager(s3_endpoint_url, monkeypatch):
+    credentials = dict(aws_access_key_id="test", aws_secret_access_key="test")
+    boto3.client(
+        "s3", endpoint_url=s3_endpoint_url, region_name="us-east-1", **credentials
+    ).create_bucket(Bucket="test-bucket")
+    manager = S3ClientManager(
+        aioboto3.Session(region_name="us-east-1", **credentials), s3_endpoint_url
+    )
+    monkeypatch.setattr(s3, "S3_BUCKET", "test-bucket")
+    monkeypatch.setattr(s3, "s3_client_manager", manager)
+    return manager
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+async def download(manager: S3ClientManager, s3_key: str) -> bytes:
+    client = await manager.get_client()
+    response = await client.get_object(Bucket="test-bucket", Key=s3_key)
+    async with response["Body"] as body:
+        return await body.read()
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_is_resumed(s3_client_manager, temp_dir):
+    local_path = f"{temp_dir}/data.bin"
+    data = os.urandom(3 * PART_SIZE + 1000)
+    with open(local_path, "wb") as f:
+        f.write(data)
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt_after_two_parts(state: MultipartUploadState, part_number: int):
+        if len(state.completed_parts) == 2:
+            raise Interrupted()
+
+    state = MultipartUploadState()
+    with pytest.raises(Interrupted):
+        await upload_file(
+            local_path,
+            "data.bin",
+            part_size_bytes=PART_SIZE,
+            max_concurrent_parts=1,
+            multipart_upload=state,
+            on_part_uploaded=interrupt_after_two_parts,
+        )
+    assert state.upload_id is not None
+    assert sorted(state.completed_parts) == [1, 2]
+
+    # e.g. after a restart, with the state restored from wherever it was persisted
+    resumed_state = MultipartUploadState(
+        upload_id=state.upload_id,
+        part_size_bytes=state.part_size_bytes,
+        completed_parts=dict(state.completed_parts),
+    )
+    uploaded_parts: list[int] = []
+    await upload_file(
+        local_path,
+        "data.bin",
+        multipart_upload=resumed_state,
+        on_part_uploaded=lambda _, part_number: uploaded_parts.append(part_number),
+    )
+    assert sorted(uploaded_parts) == [3, 4]
+    assert await download(s3_client_manager, "data.bin") == data
+
+    # small files are uploaded in a single request
+    with open(local_path, "wb") as f:
+        f.write(b"small")
+    await upload_file(local_path, "small.bin", remove_after_upload=True)
+    assert await download(s3_client_manager, "small.bin") == b"small"
+    assert not os.path.exists(local_path)
+
+    await s3_client_manager.close()
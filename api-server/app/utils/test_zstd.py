@@ -0,0 +1,101 @@
+import os
+import random
+import pytest
+import zstandard as zstd
+
+from app.utils.zstd import (
+    _STREAM_CHUNK_SIZE,
+    compress_file,
+    create_stream_writer,
+    decompress_available_bytes,
+    decompress_bytes,
+    decompress_file,
+)
+
+
+def _create_test_data(size: int) -> bytes:
+    # partly compressible, like JSON lines with varying values
+    rng = random.Random(42)
+    lines: list[bytes] = []
+    total = 0
+    while total < size:
+        line = f'{{"id": {rng.randrange(10**9)}, "name": "item-{rng.random()}"}}\n'.encode()
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)[:size]
+
+
+@pytest.mark.parametrize("threads", [0, 2])
+def test_compress_file_round_trip_of_file_larger_than_chunk_size(tmp_path, threads):
+    data = _create_test_data(3 * _STREAM_CHUNK_SIZE + 123)
+    input_path = str(tmp_path / "outputs.jsonl")
+    with open(input_path, "wb") as f:
+        f.write(data)
+
+    compressed_path = compress_file(input_path, threads=threads, remove_input_file=True)
+    assert compressed_path == f"{input_path}.zst"
+    assert not os.path.exists(input_path)
+    with open(compressed_path, "rb") as f:
+        compressed = f.read()
+    assert len(compressed) < len(data)
+    # a single frame with content size and checksum
+    params = zstd.get_frame_parameters(compressed)
+    assert params.content_size == len(data)
+    assert params.has_checksum
+
+    assert decompress_file(compressed_path) == input_path
+    with open(input_path, "rb") as f:
+        assert f.read() == data
+
+
+def test_decompress_file_verifies_checksum(tmp_path):
+    input_path = str(tmp_path / "outputs.jsonl")
+    with open(input_path, "wb") as f:
+        f.write(_create_test_data(1000))
+    compressed_path = compress_file(input_path)
+    with open(compressed_path, "r+b") as f:
+        # the checksum is stored in the last 4 bytes of the frame
+        f.seek(-1, os.SEEK_END)
+        last_byte = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last_byte[0] ^ 0xFF]))
+
+    with pytest.raises(zstd.ZstdError):
+        decompress_file(compressed_path, str(tmp_path / "decompressed.jsonl"))
+
+
+def test_decompress_file_with_several_frames(tmp_path):
+    parts = [_create_test_data(size) for size in [10, 2 * _STREAM_CHUNK_SIZE, 500]]
+    compressed_path = str(tmp_path / "outputs.jsonl.zst")
+    with open(compressed_path, "wb") as f:
+        # frames written by the task processors do not include their content size
+        writer = create_stream_writer(f)
+        for part in parts:
+            writer.write(part)
+            writer.flush(zstd.FLUSH_FRAME)
+        writer.close()
+
+    decompressed_path = decompress_file(compressed_path)
+    assert decompressed_path == str(tmp_path / "outputs.jsonl")
+    with open(decompressed_path, "rb") as f:
+        assert f.read() == b"".join(parts)
+
+
+def test_decompress_bytes_raises_on_corrupt_or_truncated_data():
+    parts = [_create_test_data(size) for size in [10, 3 * 128 * 1024]]
+    cctx = zstd.ZstdCompressor(write_checksum=True)
+    compressed = b"".join(cctx.compress(part) for part in parts)
+    assert decompress_bytes(compressed) == b"".join(parts)
+    assert decompress_bytes(b"") == b""
+
+    truncated = compressed[:-1000]
+    with pytest.raises(zstd.ZstdError):
+        decompress_bytes(truncated)
+    corrupt = compressed[:-1] + bytes([compressed[-1] ^ 0xFF])
+    with pytest.raises(zstd.ZstdError):
+        decompress_bytes(corrupt)
+    with pytest.raises(zstd.ZstdError):
+        decompress_bytes(b"not compressed")
+
+    # whatever can be decompressed is returned by the lenient variant
+    assert decompress_available_bytes(truncated).startswith(parts[0])
@@ -1,5 +1,16 @@
 import zstandard as zstd
 import os
+from typing import BinaryIO
+
+_STREAM_CHUNK_SIZE = 1024 * 1024
+"""
+The size of the chunks that files are read and written in when (de)compressing them.
+"""
+
+_DECOMPRESSION_CHUNK_SIZE = 64 * 1024
+"""
+The size of the chunks that data is fed to the decompressor in by `decompress_available_bytes` (data decompressed from a chunk is lost if the chunk contains invalid data).
+"""
 
 
 def compress_file(
@@ -7,18 +18,32 @@ def compress_file(
     output_file_path: str | None = None,
     compression_level=3,
     remove_input_file=False,
+    threads=0,
 ):
+    """
+    Compresses the given file into a single zstd frame (including the content size and a checksum).
+
+    The file is compressed in chunks, so memory usage does not depend on the size of the file. If `threads` is not 0, compression is spread across that many threads (`-1` uses one thread per CPU core).
+    """
     if output_file_path is None:
         output_file_path = input_file_path + ".zst"
 
-    with open(input_file_path, "rb") as input_file:
-        data = input_file.read()
-
-    cctx = zstd.ZstdCompressor(level=compression_level)
-    compressed_data = cctx.compress(data)
-
-    with open(output_file_path, "wb") as output_file:
-        output_file.write(compressed_data)
+    cctx = zstd.ZstdCompressor(
+        level=compression_level,
+        write_checksum=True,
+        write_content_size=True,
+        threads=threads,
+    )
+    with open(input_file_path, "rb") as input_file, open(
+        output_file_path, "wb"
+    ) as output_file:
+        cctx.copy_stream(
+            input_file,
+            output_file,
+            size=os.fstat(input_file.fileno()).st_size,
+            read_size=_STREAM_CHUNK_SIZE,
+            write_size=_STREAM_CHUNK_SIZE,
+        )
     if remove_input_file:
         os.remove(input_file_path)
 
@@ -26,20 +51,71 @@ def compress_file(
 
 
 def decompress_file(input_file_path, output_file_path=None):
+    """
+    Decompresses the given zstd file (which may consist of several frames) in chunks, so memory usage does not depend on the size of the file. Checksums are verified for frames that include them.
+    """
     if output_file_path is None:
         output_file_path = input_file_path.replace(".zst", "").replace(".zstd", "")
 
-    # Read the compressed data from the input file
-    with open(input_file_path, "rb") as input_file:
-        compressed_data = input_file.read()
-
-    decompressed_data = decompress_bytes(compressed_data)
+    dctx = zstd.ZstdDecompressor()
+    with open(input_file_path, "rb") as input_file, open(
+        output_file_path, "wb"
+    ) as output_file:
+        dctx.copy_stream(
+            input_file,
+            output_file,
+            read_size=_STREAM_CHUNK_SIZE,
+            write_size=_STREAM_CHUNK_SIZE,
+        )
 
-    # Write the decompressed data to the output file
-    with open(output_file_path, "wb") as output_file:
-        output_file.write(decompressed_data)
+    return output_file_path
 
 
 def decompress_bytes(data: bytes) -> bytes:
-    dctx = zstd.ZstdDecompressor()
-    return dctx.decompress(data)
+    """
+    Decompresses the given zstd data. The data may consist of several frames (as written by `create_stream_writer`), which need not include their content size.
+
+    Raises a `zstd.ZstdError` if the data is corrupt or ends with an incomplete frame (use `decompress_available_bytes` to decompress as much of such data as possible).
+    """
+    chunks: list[bytes] = []
+    while data:
+        dobj = zstd.ZstdDecompressor().decompressobj()
+        chunks.append(dobj.decompress(data))
+        if not dobj.eof:
+            raise zstd.ZstdError("data ends with an incomplete frame")
+        # the rest of the data may contain further frames
+        data = dobj.unused_data
+    return b"".join(chunks)
+
+
+def decompress_available_bytes(data: bytes) -> bytes:
+    """
+    Decompresses as much of the given zstd data as possible: frames that are incomplete (e.g. because the file they were read from was not written completely) are decompressed up to the last complete block, and anything after data that cannot be decompressed is ignored.
+    """
+    chunks: list[bytes] = []
+    dobj = zstd.ZstdDecompressor().decompressobj()
+    view = memoryview(data)
+    # data is fed in chunks so that whatever was decompressed before running into invalid data is kept
+    while view:
+        chunk, view = view[:_DECOMPRESSION_CHUNK_SIZE], view[_DECOMPRESSION_CHUNK_SIZE:]
+        try:
+            chunks.append(dobj.decompress(chunk))
+        except zstd.ZstdError:
+            break
+        if dobj.eof:
+            # the frame is complete, the rest of the data may contain further frames
+            view = memoryview(dobj.unused_data + bytes(view))
+            dobj = zstd.ZstdDecompressor().decompressobj()
+    return b"".join(chunks)
+
+
+def create_stream_writer(
+    file: BinaryIO, compression_level=3
+) -> zstd.ZstdCompressionWriter:
+    """
+    Creates a writer that compresses everything written to it and writes the result to the given file (which is not closed together with the writer).
+
+    Data is only written to the file once a block is complete, unless `flush()` is called: `flush(zstd.FLUSH_BLOCK)` writes everything that was written to the writer so far in a way that it can be decompressed even if the frame is never finished, while `flush(zstd.FLUSH_FRAME)` finishes the current frame (the next write starts a new one).
+    """
+    cctx = zstd.ZstdCompressor(level=compression_level, write_checksum=True)
+    return cctx.stream_writer(file, closefd=False)